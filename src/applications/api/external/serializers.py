@@ -1,14 +1,17 @@
 # -*- coding: utf-8 -*-
 from urllib.parse import urlunsplit
 
+from django.db import transaction
 from rest_framework import serializers
 
 from applications.api.external.utils import ConfirmationHMAC
 from applications.api.project.serializers import ProjectRelatedSerializer
 from applications.api.testing.serializers import TestSuiteRelatedSerializer
+from applications.api.testing.serializers import TestReportStatusSerializer
 from applications.organization.utils import get_current_organization
 from applications.project.models import Project
 from applications.testing.models import TestSuite, TestReport
+from applications.testing.tasks import import_test_report_task
 from applications.testing.tools import SpecFlow
 from applications.vcs.models import Commit
 
@@ -94,7 +97,7 @@ class ImportReportSerializer(serializers.Serializer):
             commit_sha = commit_sha[:commit_sha.rfind(';')]
         return commit_sha
 
-    def save(self, request):
+    def save(self, request, asynchronous=False):
         token = request.META.get('HTTP_TOKEN', None)
         organization = ConfirmationHMAC.from_key(token)
 
@@ -110,6 +113,8 @@ class ImportReportSerializer(serializers.Serializer):
         try:
             commit = Commit.objects.get(project_id=project, sha=commit_sha)
         except (Commit.DoesNotExist, Commit.MultipleObjectsReturned) as e:
+            if asynchronous:
+                raise serializers.ValidationError({'commit': ['{}'.format(e)]})
             return {'error': 'XMLError: {}'.format(e)}
 
         utils = SpecFlow.ImportUtils(
@@ -118,8 +123,16 @@ class ImportReportSerializer(serializers.Serializer):
             data=dict(project=project, test_suite=test_suite, commit=commit),
             user_id=organization.owner.organization_user.user.id,
             test_run_name=test_run_name,
-            host=urlunsplit((request.scheme, request.get_host(), '/test-runs/', None, None))
+            host=urlunsplit((request.scheme, request.get_host(), '/test-runs/', None, None)),
+            # Report imported later is stored whole, the worker streams it when it is big.
+            streaming=False if asynchronous else None
         )
+
+        if asynchronous:
+            test_report_id = utils.test_report.id
+            transaction.on_commit(lambda: import_test_report_task.delay(test_report_id))
+            return utils.test_report
+
         result = utils.import_xml_tests()
         return result
 
@@ -159,6 +172,19 @@ class PrioritizedTestsSerializer(serializers.Serializer):
     name = serializers.CharField(max_length=4096)
 
 
+class PrioritizedTestScoreSerializer(serializers.Serializer):
+    name = serializers.CharField(max_length=4096)
+    score = serializers.FloatField()
+
+
+class PrioritizationSerializer(serializers.Serializer):
+    high = serializers.ListField(child=serializers.CharField(max_length=4096))
+    medium = serializers.ListField(child=serializers.CharField(max_length=4096))
+    low = serializers.ListField(child=serializers.CharField(max_length=4096))
+    unassigned = serializers.ListField(child=serializers.CharField(max_length=4096))
+    scores = PrioritizedTestScoreSerializer(many=True)
+
+
 class OutputTestSuiteSerializer(serializers.Serializer):
     new_defects = serializers.IntegerField(default=0)
     flaky_defects = serializers.IntegerField(default=0)
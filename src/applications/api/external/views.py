@@ -22,7 +22,8 @@ from applications.organization.models import Organization
 from applications.organization.utils import get_current_organization
 from applications.vcs.models import Branch
 
-from applications.testing.selectors import Priority, prioritized_test_list
+from applications.testing.selectors import Priority, prioritized_test_list, calculate_prioritization, \
+    get_test_display_names
 
 from .permissions import IsAuthenticatedToken
 from .serializers import *
@@ -50,6 +51,7 @@ class ExternalAPIViewSet(MultiSerializerViewSetMixin, viewsets.GenericViewSet):
     queryset_action = {
         'commit_risk_view': Commit.objects.all(),
         'prioritized_tests_view': Test.objects.all(),
+        'prioritization_view': Test.objects.all(),
         'output_test_run_view': TestRun.objects.all(),
     }
 
@@ -57,6 +59,7 @@ class ExternalAPIViewSet(MultiSerializerViewSetMixin, viewsets.GenericViewSet):
     serializer_action_classes = {
         'import_view': ImportReportSerializer,
         'prioritized_tests_view': PrioritizedTestsSerializer,
+        'prioritization_view': PrioritizationSerializer,
         'output_test_run_view': OutputTestSuiteSerializer,
     }
 
@@ -108,6 +111,34 @@ class ExternalAPIViewSet(MultiSerializerViewSetMixin, viewsets.GenericViewSet):
         # except Exception as e:
         #     raise APIException(e)
 
+    @action(methods=['POST', ], detail=False, url_path=r'import-async')
+    def import_async_view(self, request, *args, **kwargs):
+        try:
+            serializer = ImportReportSerializer(data=request.data, context={'request': request})
+            serializer.is_valid(raise_exception=True)
+
+            test_report = serializer.save(self.request, asynchronous=True)
+            report_serializer = TestReportStatusSerializer(test_report)
+            return Response(data=report_serializer.data, status=status.HTTP_202_ACCEPTED)
+
+        except Organization.DoesNotExist:
+            raise APIException("Organization matching query does not exist.")
+        except Project.DoesNotExist:
+            raise APIException("Project matching query does not exist.")
+        except TestSuite.DoesNotExist:
+            raise APIException("TestSuite matching query does not exist.")
+
+    @action(methods=['GET', ], detail=False, url_path=r'import-status/(?P<test_report_pk>[0-9]+)')
+    def import_status_view(self, request, test_report_pk=None, *args, **kwargs):
+        token = self.request.META.get('HTTP_TOKEN', None)
+        organization = ConfirmationHMAC.from_key(token)
+        test_report = TestReport.objects.filter(project__organization=organization, pk=test_report_pk).first()
+        if test_report is None:
+            raise NotFound("TestReport matching query does not exist.")
+
+        report_serializer = TestReportStatusSerializer(test_report)
+        return Response(data=report_serializer.data, status=status.HTTP_200_OK)
+
     class ParamsPrioritizationTestSerializer(serializers.Serializer):
         name_type = serializers.CharField(required=True)
 
@@ -261,6 +292,34 @@ class ExternalAPIViewSet(MultiSerializerViewSetMixin, viewsets.GenericViewSet):
         except Exception as exc:
             raise APIException(code="500", detail=exc.args)
 
+    @action(methods=['GET', ], detail=False, url_path=r"prioritized-tests/all")
+    def prioritization_view(self, request, *args, **kwargs):
+        """
+        All priority tiers and scores of tests from one computation, 'priority' and 'percent' aren't used.
+        """
+        kwargs['context'] = self.get_serializer_context()
+        query_params = request.query_params.copy()
+        query_params.setdefault('priority', Priority.HIGH)
+        params_serializer = self.ParamsPrioritizationTestSerializer(data=query_params, **kwargs)
+        params_serializer.is_valid(raise_exception=True)
+        params = params_serializer.validated_data
+
+        try:
+            prioritization = calculate_prioritization(params=params)
+            test_ids = set(test_id for test_id, _ in prioritization['scores'])
+            for tier in ['high', 'medium', 'low', 'unassigned']:
+                test_ids.update(prioritization[tier])
+            names = get_test_display_names(Test.objects.filter(id__in=test_ids), params=params)
+
+            result = {tier: [names[test_id] for test_id in prioritization[tier]]
+                      for tier in ['high', 'medium', 'low', 'unassigned']}
+            result['scores'] = [{'name': names[test_id], 'score': score}
+                                for test_id, score in prioritization['scores']]
+            serializer = PrioritizationSerializer(result)
+            return Response(serializer.data, status=status.HTTP_200_OK)
+        except Exception as exc:
+            raise APIException(code="500", detail=exc.args)
+
     @action(methods=['GET', ], detail=False, url_path=r'output')  # TODO: rename url path
     def output_test_run_view(self, request, *args, **kwargs):
         queryset = self.get_queryset()
@@ -20,8 +20,8 @@ from datetime import timedelta, date
 
 from applications.api.common.views import MultiSerializerViewSetMixin
 from applications.project.permissions import IsOwnerOrReadOnly
-from applications.vcs.utils.analysis import calculate_user_analysis, calculate_user_analysis_by_range, avg_per_range, \
-    calculate_similar_by_commit
+from applications.vcs.utils.analysis import calculate_user_analysis, calculate_user_analysis_by_range, \
+    calculate_team_analysis, avg_per_range, calculate_similar_by_commit
 from applications.vcs.utils.bugspots import Bugspots
 
 from applications.testing.models import *
@@ -35,7 +35,8 @@ from rest_framework.permissions import IsAuthenticated
 from applications.api.external.permissions import IsAuthenticatedToken
 
 # from applications.ml.network import MLPredictor
-from applications.testing.selectors import Priority, prioritized_test_list, test_run_report_list
+from applications.testing.selectors import Priority, prioritized_test_list, test_run_report_list, \
+    get_commit_range_list
 
 
 def get_object_or_404(queryset, *filter_args, **filter_kwargs):
@@ -2085,88 +2086,66 @@ class TestReportModelViewSet(MultiSerializerViewSetMixin, viewsets.ReadOnlyModel
         serializer = self.get_serializer(queryset, many=True)
         return Response(serializer.data)
 
-    def get_group_flaky_tests_queryset(self, queryset):
-        extra_filters = dict()
-
-        newest_test_run = TestRun.objects.filter(
-            id__in=set(list(queryset.values_list('test_runs__id', flat=True)))).order_by('-created').first()
-
+    def get_current_status_filters(self):
+        if 'current_status' not in self.request.query_params:
+            return dict()
+        value = self.request.query_params['current_status']
+        value = [x.lstrip().rstrip() for x in value.split(u',')]
+        if TestRunResult.STATUS_SKIPPED in value:
+            value.extend([TestRunResult.STATUS_PENDING, TestRunResult.STATUS_NOT_RUN])
+        lookup_expr = LOOKUP_SEP.join(['current_status', 'in'])
+        return {lookup_expr: value}
+
+    def get_newest_test_run(self, queryset):
         if 'test_run' in self.request.query_params:
             value = self.request.query_params['test_run']
             try:
-                newest_test_run = TestRun.objects.get(id=value)
+                return TestRun.objects.get(id=value)
             except TestRun.DoesNotExist:
                 raise APIException('TestRun not found!')
+        return TestRun.objects.filter(id__in=queryset.values('test_runs')).order_by('-created').first()
 
-        if 'current_status' in self.request.query_params:
-            value = self.request.query_params['current_status']
-            value = [x.lstrip().rstrip() for x in value.split(u',')]
-            if TestRunResult.STATUS_SKIPPED in value:
-                value.extend([TestRunResult.STATUS_PENDING, TestRunResult.STATUS_NOT_RUN])
-            lookup_expr = LOOKUP_SEP.join(['current_status', 'in'])
-            extra_filters = {lookup_expr: value}
-
-        queryset_subquery = (
-            TestRunResult
-            .objects
-            .filter(
-                test_id=models.OuterRef('id'),
-                test_run=newest_test_run
-            )
-            .order_by('-created')
-            .values('status')[:1]
-        )
-
-        queryset = queryset.annotate(current_status=models.Subquery(queryset_subquery))
+    def annotate_current_status(self, queryset, test_run):
+        """ Current status of tests is their newest result in 'test_run'. """
+        current_results = TestRunCurrentResult.objects.filter(test_run=test_run, test=models.OuterRef('id'))
+        return queryset.annotate(current_status=models.Subquery(current_results.values('status')[:1]))
 
-        flaky_test_passed_test_run_result_queryset = queryset.filter(
-            models.Q(current_status=TestRunResult.STATUS_PASS) &
-            models.Q(associated_defects__type__in=[Defect.TYPE_FLAKY, Defect.TYPE_ENVIRONMENTAL]) &
-            models.Q(associated_defects__created_by_test_run=newest_test_run)
-        )
+    def annotate_newest_status(self, queryset):
+        """ Current status of tests is their newest result in any test run of the queryset. """
+        current_results = TestRunCurrentResult.objects.filter(
+            test_run__in=queryset.values('test_runs'), test=models.OuterRef('id')).order_by('-created')
+        return queryset.annotate(current_status=models.Subquery(current_results.values('status')[:1]))
 
-        flaky_test_failed_test_run_result_queryset = queryset.filter(
+    def get_group_flaky_tests_queryset(self, queryset):
+        newest_test_run = self.get_newest_test_run(queryset)
+        if newest_test_run is None:
+            return queryset.none()
+
+        queryset = self.annotate_current_status(queryset, newest_test_run)
+
+        flaky_defects = Defect.objects.filter(associated_tests=models.OuterRef('id'),
+                                              type__in=[Defect.TYPE_FLAKY, Defect.TYPE_ENVIRONMENTAL])
+        queryset = queryset.alias(
+            has_flaky_defect=models.Exists(flaky_defects.filter(created_by_test_run=newest_test_run)),
+            has_previous_flaky_defect=models.Exists(
+                flaky_defects.filter(created_by_test_run=newest_test_run.previous_test_run)),
+        ).filter(
             models.Q(
-                models.Q(current_status=TestRunResult.STATUS_FAIL) &
-                models.Q(associated_defects__type__in=[Defect.TYPE_FLAKY, Defect.TYPE_ENVIRONMENTAL]) &
-                models.Q(associated_defects__created_by_test_run=newest_test_run)
-            )
-            | models.Q(
-                models.Q(current_status=TestRunResult.STATUS_FAIL) &
-                models.Q(associated_defects__type__in=[Defect.TYPE_FLAKY, Defect.TYPE_ENVIRONMENTAL]) &
-                models.Q(associated_defects__created_by_test_run=newest_test_run.previous_test_run)
+                has_flaky_defect=True,
+                current_status__in=[TestRunResult.STATUS_PASS, TestRunResult.STATUS_FAIL,
+                                    TestRunResult.STATUS_BROKEN, TestRunResult.STATUS_PENDING,
+                                    TestRunResult.STATUS_NOT_RUN, TestRunResult.STATUS_SKIPPED]
             )
+            | models.Q(has_previous_flaky_defect=True, current_status=TestRunResult.STATUS_FAIL)
         )
 
-        flaky_test_broken_test_run_result_queryset = queryset.filter(
-            models.Q(current_status=TestRunResult.STATUS_BROKEN) &
-            models.Q(associated_defects__type__in=[Defect.TYPE_FLAKY, Defect.TYPE_ENVIRONMENTAL]) &
-            models.Q(associated_defects__created_by_test_run=newest_test_run)
-        )
-
-        flaky_test_not_run_test_run_result_queryset = queryset.filter(
-            models.Q(current_status__in=[TestRunResult.STATUS_PENDING, TestRunResult.STATUS_NOT_RUN,
-                                                          TestRunResult.STATUS_SKIPPED]) &
-            models.Q(associated_defects__type__in=[Defect.TYPE_FLAKY, Defect.TYPE_ENVIRONMENTAL]) &
-            models.Q(associated_defects__created_by_test_run=newest_test_run)
-        )
-
-        queryset = (
-            flaky_test_passed_test_run_result_queryset
-            | flaky_test_failed_test_run_result_queryset
-            | flaky_test_broken_test_run_result_queryset
-            | flaky_test_not_run_test_run_result_queryset
-        )
-
-        queryset = queryset.filter(
-            **extra_filters
-        )
+        queryset = queryset.filter(**self.get_current_status_filters())
         return queryset
 
     @action(methods=['GET', ], detail=False, url_path=r'group/flaky')
     def group_flaky_tests(self, request, *args, **kwargs):
         queryset = self.filter_queryset(self.get_queryset())
-        queryset = self.get_group_flaky_tests_queryset(queryset).distinct()
+        queryset = self.get_group_flaky_tests_queryset(queryset)
         page = self.paginate_queryset(queryset)
         if page is not None:
             serializer = self.get_serializer(page, many=True)
@@ -2175,37 +2154,18 @@ class TestReportModelViewSet(MultiSerializerViewSetMixin, viewsets.ReadOnlyModel
         return Response(serializer.data)
 
     def get_group_invalid_tests_queryset(self, queryset):
-        extra_filters = dict()
-        if 'current_status' in self.request.query_params:
-            value = self.request.query_params['current_status']
-            value = [x.lstrip().rstrip() for x in value.split(u',')]
-            if TestRunResult.STATUS_SKIPPED in value:
-                value.extend([TestRunResult.STATUS_PENDING, TestRunResult.STATUS_NOT_RUN])
-            lookup_expr = LOOKUP_SEP.join(['current_status', 'in'])
-            extra_filters = {lookup_expr: value}
-
-        queryset_subquery = (
-            TestRunResult
-            .objects
-            .filter(
-                test_id=models.OuterRef('id'),
-                test_run__id__in=set(list(queryset.values_list('test_runs__id', flat=True)))
-            )
-            .order_by('-created')
-            .values('status')[:1]
-        )
-        queryset = queryset.annotate(current_status=models.Subquery(queryset_subquery))
-        queryset = queryset.filter(**extra_filters)
-        queryset = queryset.filter(
-            models.Q(associated_defects__type=Defect.TYPE_INVALID_TEST) &
-            ~models.Q(associated_defects__status=Defect.STATUS_CLOSED)
-        )
+        queryset = self.annotate_newest_status(queryset)
+        queryset = queryset.filter(**self.get_current_status_filters())
+        queryset = queryset.filter(models.Exists(
+            Defect.objects.filter(associated_tests=models.OuterRef('id'), type=Defect.TYPE_INVALID_TEST)
+            .exclude(status=Defect.STATUS_CLOSED)
+        ))
         return queryset
 
     @action(methods=['GET', ], detail=False, url_path=r'group/invalid')
     def group_invalid_tests(self, request, *args, **kwargs):
         queryset = self.filter_queryset(self.get_queryset())
-        queryset = self.get_group_invalid_tests_queryset(queryset).distinct()
+        queryset = self.get_group_invalid_tests_queryset(queryset)
         page = self.paginate_queryset(queryset)
         if page is not None:
             serializer = self.get_serializer(page, many=True)
@@ -2214,37 +2174,19 @@ class TestReportModelViewSet(MultiSerializerViewSetMixin, viewsets.ReadOnlyModel
         return Response(serializer.data)
 
     def get_group_open_defect_tests_queryset(self, queryset):
-        extra_filters = dict()
-        if 'current_status' in self.request.query_params:
-            value = self.request.query_params['current_status']
-            value = [x.lstrip().rstrip() for x in value.split(u',')]
-            if TestRunResult.STATUS_SKIPPED in value:
-                value.extend([TestRunResult.STATUS_PENDING, TestRunResult.STATUS_NOT_RUN])
-            lookup_expr = LOOKUP_SEP.join(['current_status', 'in'])
-            extra_filters = {lookup_expr: value}
-
-        queryset_subquery = (
-            TestRunResult
-            .objects
-            .filter(
-                test_id=models.OuterRef('id'),
-                test_run__id__in=set(list(queryset.values_list('test_runs__id', flat=True)))
-            )
-            .order_by('-created')
-            .values('status')[:1]
-        )
-        queryset = queryset.annotate(current_status=models.Subquery(queryset_subquery))
-        queryset = queryset.filter(**extra_filters)
-        queryset = queryset.filter(
-            models.Q(associated_defects__type__in=[Defect.TYPE_PROJECT, Defect.TYPE_LOCAL]) &
-            ~models.Q(associated_defects__status__in=[Defect.STATUS_NEW, Defect.STATUS_CLOSED, Defect.STATUS_READY])
-        )
+        queryset = self.annotate_newest_status(queryset)
+        queryset = queryset.filter(**self.get_current_status_filters())
+        queryset = queryset.filter(models.Exists(
+            Defect.objects.filter(associated_tests=models.OuterRef('id'),
+                                  type__in=[Defect.TYPE_PROJECT, Defect.TYPE_LOCAL])
+            .exclude(status__in=[Defect.STATUS_NEW, Defect.STATUS_CLOSED, Defect.STATUS_READY])
+        ))
         return queryset
 
     @action(methods=['GET', ], detail=False, url_path=r'group/open-defect')
     def group_open_defect_tests(self, request, *args, **kwargs):
         queryset = self.filter_queryset(self.get_queryset())
-        queryset = self.get_group_open_defect_tests_queryset(queryset).distinct()
+        queryset = self.get_group_open_defect_tests_queryset(queryset)
         page = self.paginate_queryset(queryset)
         if page is not None:
             serializer = self.get_serializer(page, many=True)
@@ -2253,37 +2195,18 @@ class TestReportModelViewSet(MultiSerializerViewSetMixin, viewsets.ReadOnlyModel
         return Response(serializer.data)
 
     def get_group_ready_tests_queryset(self, queryset):
-        extra_filters = dict()
-        if 'current_status' in self.request.query_params:
-            value = self.request.query_params['current_status']
-            value = [x.lstrip().rstrip() for x in value.split(u',')]
-            if TestRunResult.STATUS_SKIPPED in value:
-                value.extend([TestRunResult.STATUS_PENDING, TestRunResult.STATUS_NOT_RUN])
-            lookup_expr = LOOKUP_SEP.join(['current_status', 'in'])
-            extra_filters = {lookup_expr: value}
-
-        queryset_subquery = (
-            TestRunResult
-                .objects
-                .filter(
-                test_id=models.OuterRef('id'),
-                test_run__id__in=set(list(queryset.values_list('test_runs__id', flat=True)))
-            )
-                .order_by('-created')
-                .values('status')[:1]
-        )
-        queryset = queryset.annotate(current_status=models.Subquery(queryset_subquery))
-        queryset = queryset.filter(**extra_filters)
-        queryset = queryset.filter(
-            models.Q(associated_defects__type=Defect.TYPE_PROJECT) &
-            models.Q(associated_defects__status=Defect.STATUS_READY)
-        )
+        queryset = self.annotate_newest_status(queryset)
+        queryset = queryset.filter(**self.get_current_status_filters())
+        queryset = queryset.filter(models.Exists(
+            Defect.objects.filter(associated_tests=models.OuterRef('id'), type=Defect.TYPE_PROJECT,
+                                  status=Defect.STATUS_READY)
+        ))
         return queryset
 
     @action(methods=['GET', ], detail=False, url_path=r'group/ready-defect')
     def group_ready_defect_tests(self, request, *args, **kwargs):
         queryset = self.filter_queryset(self.get_queryset())
-        queryset = self.get_group_ready_tests_queryset(queryset).distinct()
+        queryset = self.get_group_ready_tests_queryset(queryset)
         page = self.paginate_queryset(queryset)
         if page is not None:
             serializer = self.get_serializer(page, many=True)
@@ -2292,43 +2215,20 @@ class TestReportModelViewSet(MultiSerializerViewSetMixin, viewsets.ReadOnlyModel
         return Response(serializer.data)
 
     def get_group_passed_tests_queryset(self, queryset):
-        extra_filters = dict()
-        if 'current_status' in self.request.query_params:
-            value = self.request.query_params['current_status']
-            value = [x.lstrip().rstrip() for x in value.split(u',')]
-            if TestRunResult.STATUS_SKIPPED in value:
-                value.extend([TestRunResult.STATUS_PENDING, TestRunResult.STATUS_NOT_RUN])
-            lookup_expr = LOOKUP_SEP.join(['current_status', 'in'])
-            extra_filters = {lookup_expr: value}
-
-        newest_test_run = TestRun.objects.filter(
-            id__in=set(list(queryset.values_list('test_runs__id', flat=True)))).order_by('-created').first()
-
-        if 'test_run' in self.request.query_params:
-            value = self.request.query_params['test_run']
-            try:
-                newest_test_run = TestRun.objects.get(id=value)
-            except TestRun.DoesNotExist:
-                raise APIException('TestRun not found!')
-
-        newest_current_test_run_results = TestRunResult.objects.filter(test_run=newest_test_run, test=models.OuterRef('id')).order_by('-created')
-
-        queryset = queryset.annotate(
-            current_status=models.Subquery(newest_current_test_run_results.values('status')[:1])
-        )
-        queryset = queryset.filter(**extra_filters)
+        queryset = self.annotate_current_status(queryset, self.get_newest_test_run(queryset))
+        queryset = queryset.filter(**self.get_current_status_filters())
         queryset = queryset.exclude(
-            models.Q(id__in=set(list(self.get_group_flaky_tests_queryset(queryset).values_list('id', flat=True)))) |
-            models.Q(id__in=set(list(self.get_group_invalid_tests_queryset(queryset).values_list('id', flat=True)))) |
-            models.Q(id__in=set(list(self.get_group_open_defect_tests_queryset(queryset).values_list('id', flat=True)))) |
-            models.Q(id__in=set(list(self.get_group_ready_tests_queryset(queryset).values_list('id', flat=True))))
+            models.Q(id__in=self.get_group_flaky_tests_queryset(queryset).values('id')) |
+            models.Q(id__in=self.get_group_invalid_tests_queryset(queryset).values('id')) |
+            models.Q(id__in=self.get_group_open_defect_tests_queryset(queryset).values('id')) |
+            models.Q(id__in=self.get_group_ready_tests_queryset(queryset).values('id'))
         )
         return queryset
 
     @action(methods=['GET', ], detail=False, url_path=r'group/passed')
     def group_passed_tests(self, request, *args, **kwargs):
         queryset = self.filter_queryset(self.get_queryset())
-        queryset = self.get_group_passed_tests_queryset(queryset).distinct()
+        queryset = self.get_group_passed_tests_queryset(queryset)
         page = self.paginate_queryset(queryset)
         if page is not None:
             serializer = self.get_serializer(page, many=True)
@@ -2574,18 +2474,8 @@ WHERE
         :param exclusive: boolean
         :return: instance of py:obj:`Commit`
         """
-        if first_commit.timestamp < second_commit.timestamp:
-            ancestor = first_commit
-            descendant = second_commit
-        else:
-            ancestor = second_commit
-            descendant = first_commit
-
-        if exclusive:
-            query = Q(timestamp__gte=ancestor.timestamp, timestamp__lt=descendant.timestamp)
-        else:
-            query = Q(timestamp__gte=ancestor.timestamp, timestamp__lte=descendant.timestamp)
-        return target_branch.commits.filter(query).values_list('id', flat=True)
+        return get_commit_range_list(target_branch=target_branch, first_commit=first_commit,
+                                     second_commit=second_commit, exclusive=exclusive)
 
     def _get_commit_list_from_request(self):
         """
@@ -3727,33 +3617,25 @@ class AnalysisViewSet(MultiSerializerViewSetMixin, viewsets.GenericViewSet):
                 max_output = 0
                 max_commits = 0
 
+                usernames = [author.get('name') for author in authors_unique_list if author.get('name', None)]
+                users_analysis = calculate_team_analysis(queryset=queryset, usernames=usernames,
+                                                         timestamp__range=timestamp_expr)
+                last_commits = dict(Commit.objects.annotate(
+                    author_name=KeyTextTransform('name', 'author')
+                ).filter(author_name__in=usernames).values('author_name').annotate(
+                    last_timestamp=models.Max('timestamp')
+                ).values_list('author_name', 'last_timestamp'))
+
                 for author in authors_unique_list:
+                    if not author.get('name', None):
+                        continue
 
                     user = {
                         'username': author.get('name'),
                         'email': author.get('email'),
-                        'output': 0,
-                        'commits': 0,
-                        'defects': 0,
-                        'rework': 0
                     }
-                    if not author.get('name', None):
-                        continue
-
-                    user_queryset = queryset.filter(author__name=author.get('name'))
-
-                    queryset_defects = user_queryset.exclude(caused_defects__isnull=True)
-
-                    user['output'] = avg_per_range(user_queryset.values('output', 'timestamp'), 'output',
-                                                   timestamp_expr.get('timestamp__range'))
-                    user['commits'] = avg_per_range(user_queryset.values('id', 'timestamp'), 'commits',
-                                                    timestamp_expr.get('timestamp__range'))
-                    user['rework'] = avg_per_range(user_queryset.values('rework', 'timestamp'), 'rework',
-                                                   timestamp_expr.get('timestamp__range'))
-                    user['defects'] = float(
-                        queryset_defects.count()) / user_queryset.count() * 100 if user_queryset.count() > 0 else 0
-                    user['timestamp_last_commit'] = Commit.objects.filter(author__name=author.get('name')).order_by(
-                        'timestamp').last().timestamp
+                    user.update(users_analysis[author.get('name')])
+                    user['timestamp_last_commit'] = last_commits.get(author.get('name'))
                     max_output = user['output'] if user['output'] > max_output else max_output
                     max_commits = user['commits'] if user['commits'] > max_commits else max_commits
                     result.append(user)
@@ -8,6 +8,7 @@ from applications.allauth.account.serializers import UserRelatedSerializer
 from applications.api.vcs.serializers import *
 from applications.integration.ssh_v2.utils import prioritize_task
 from applications.testing.models import *
+from applications.testing.tasks import import_test_report_task
 from applications.testing.tools import SpecFlow
 from .stop_words import stop_words
 from .wordinflector import WordInflector
@@ -601,7 +602,7 @@ class TestAssociateSerializer(DynamicFieldsModelSerializer, PredictedSearchTestM
 
 class ImportTestingReportSerializer(serializers.Serializer):
 
-    def save(self, request):
+    def save(self, request, asynchronous=False):
         user = request.user
 
         validated_data = self.validated_data
@@ -613,20 +614,29 @@ class ImportTestingReportSerializer(serializers.Serializer):
         type = validated_data['type']
         test_run_name = validated_data.get('test_run_name', "")
 
-        commits_sha = [commit.sha]
-        try:
-            prioritize_task(commits_sha=commits_sha)
-        except Exception as exc:
-            logging.exception(f"Error with 'prioritize_task'", exc_info=True)
-        
+        if not asynchronous:
+            commits_sha = [commit.sha]
+            try:
+                prioritize_task(commits_sha=commits_sha)
+            except Exception as exc:
+                logging.exception(f"Error with 'prioritize_task'", exc_info=True)
+
         utils = SpecFlow.ImportUtils(
             type_xml=type,
             file_obj=file,
             data=dict(project=project, test_suite=test_suite, commit=commit),
             user_id=user.id,
             test_run_name=test_run_name,
-            host=urlunsplit((request.scheme, request.get_host(), '/test-runs/', None, None))
+            host=urlunsplit((request.scheme, request.get_host(), '/test-runs/', None, None)),
+            # Report imported later is stored whole, the worker streams it when it is big.
+            streaming=False if asynchronous else None
         )
+
+        if asynchronous:
+            test_report_id = utils.test_report.id
+            transaction.on_commit(lambda: import_test_report_task.delay(test_report_id))
+            return utils.test_report
+
         result = utils.import_xml_tests()
         return result
 
@@ -653,5 +663,15 @@ class OutputImportSerializer(serializers.Serializer):
     report_url = serializers.CharField(default=str())
 
 
+class TestReportStatusSerializer(serializers.ModelSerializer):
+    # Output of the import (including test_run_id) or the import error, as stored by the importer.
+    result = serializers.JSONField(read_only=True)
+
+    class Meta(object):
+        model = TestReport
+        fields = ('id', 'project', 'test_suite', 'commit_sha', 'test_run_name', 'name', 'format', 'status',
+                  'result', 'created', 'updated')
+
+
 class ImportDefectsSerializer(serializers.Serializer):
     project_id = serializers.SerializerMethodField()
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from unittest import mock
+
+from django.core.cache import cache
+
+from applications.api.common.tests import ApiBaseTestClass
+from applications.testing.models import Test
+from applications.testing.selectors import SCORE_WEIGHTS, calculate_score, common_elements, get_test_tokens, \
+    get_tokens_from_list, number_common_elements
+from applications.vcs.models import Commit, File, FileChange
+
+
+def calculate_score_per_test(test_queryset, commit):
+    """ Scores counted test by test as they were before the token index. """
+    commit_tokens = [
+        get_tokens_from_list(commit.areas.values_list('name', flat=True)),
+        get_tokens_from_list(commit.files.values_list('full_filename', flat=True)),
+        get_tokens_from_list([x.full_filename for x in commit.files.all() if not x.is_leaf_node()]),
+        get_tokens_from_list([x for x in commit.areas.values_list('dependencies__name', flat=True) if x]),
+        get_tokens_from_list([commit.message]),
+    ]
+    commit_tokens.append(common_elements(commit_tokens[0], commit_tokens[1]))
+    commit_tokens.append(common_elements(commit_tokens[5], [commit.message]))
+
+    result = dict()
+    for test in test_queryset.distinct('name'):
+        test_tokens = [get_tokens_from_list([value]) for value in [test.name, test.class_name, test.area.name]]
+        test_tokens.append(common_elements(common_elements(test_tokens[0], test_tokens[1]), test_tokens[2]))
+
+        result[test.id] = sum(weight * number_common_elements(tokens, other_tokens)
+                              for tokens, weights in zip(test_tokens, SCORE_WEIGHTS)
+                              for other_tokens, weight in zip(commit_tokens, weights))
+    return dict(sorted(result.items(), key=lambda item: item[1], reverse=True))
+
+
+class CalculateScoreTestCase(ApiBaseTestClass):
+    def setUp(self):
+        self.setup_db()
+        cache.clear()
+
+        checkout = self.create_area_model_object('CheckoutService')
+        payment = self.create_area_model_object('PaymentGateway')
+        checkout.dependencies.add(payment)
+        other = self.create_area_model_object('Reporting')
+
+        self.commit = Commit.objects.create(project=self.project, sha='a' * 40, display_id='a' * 7,
+                                            message='Fix checkout payment rounding')
+        self.commit.areas.add(checkout)
+
+        folder = File.objects.create(project=self.project, filename='checkout', full_filename='checkout')
+        for filename in ['payment_service.py', 'basket.py']:
+            file = File.objects.create(project=self.project, parent=folder, filename=filename,
+                                       full_filename='checkout/' + filename)
+            FileChange.objects.create(commit=self.commit, file=file)
+        FileChange.objects.create(commit=self.commit, file=folder)
+
+        for name, class_name, area in [
+            ('test_checkout_payment', 'CheckoutPaymentTests', checkout),
+            ('test_basket_totals', 'BasketTests', checkout),
+            ('test_gateway_timeout', 'PaymentGatewayTests', payment),
+            ('test_monthly_report', 'ReportTests', other),
+            ('test_rounding', 'CheckoutServiceTests', checkout),
+            ('test_empty', '', other),
+        ]:
+            self.create_test_model_object(name, class_name=class_name, area=area)
+
+    def test_same_scores_as_per_test_scoring(self):
+        queryset = Test.objects.filter(project=self.project)
+        expected = calculate_score_per_test(queryset, self.commit)
+
+        result = calculate_score(queryset, self.commit.id)
+
+        self.assertEqual(list(result.items()), list(expected.items()))
+        self.assertGreater(max(result.values()), 0)
+
+    def test_test_tokens_cached(self):
+        test = Test.objects.get(name='test_checkout_payment')
+        tests = [(test.id, test.name, test.class_name, test.area.name)]
+
+        tokens = get_test_tokens(tests)
+        self.assertEqual(tokens[test.id][0], get_tokens_from_list([test.name]))
+
+        with mock.patch('applications.testing.selectors.get_tokens_from_list') as get_tokens:
+            self.assertEqual(get_test_tokens(tests), tokens)
+        get_tokens.assert_not_called()
+
+        renamed = [(test.id, 'test_refund', test.class_name, None)]
+        self.assertEqual(get_test_tokens(renamed)[test.id], (['test', 'refund'], tokens[test.id][1], []))
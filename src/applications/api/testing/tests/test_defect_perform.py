@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from unittest import mock
+
+from django.core.files.base import ContentFile
+
+from applications.api.common.tests import ApiBaseTestClass
+from applications.project.models import Project
+from applications.testing.models import Defect, TestSuite
+from applications.testing.tools import SpecFlow
+from applications.vcs.models import Commit
+
+
+FAILED_REPORT = b"""<?xml version="1.0" encoding="UTF-8"?>
+<testsuites>
+    <testsuite name="suite.first" tests="5">
+        <testcase name="test_pass" classname="First" time="0.5"/>
+        <testcase name="test_fail" classname="First" time="1.5">
+            <failure message="expected 1" type="AssertionError">Traceback</failure>
+        </testcase>
+        <testcase name="test_shared_one" classname="First" time="1">
+            <failure message="shared" type="AssertionError">Traceback</failure>
+        </testcase>
+        <testcase name="test_shared_two" classname="First" time="1">
+            <failure message="shared" type="AssertionError">Traceback</failure>
+        </testcase>
+        <testcase name="test_no_message" classname="First" time="1">
+            <failure type="AssertionError">Traceback</failure>
+        </testcase>
+    </testsuite>
+    <testsuite name="suite.second" tests="1">
+        <testcase name="test_error" classname="Second" time="2">
+            <error message="boom" type="RuntimeError">Stacktrace</error>
+        </testcase>
+    </testsuite>
+</testsuites>
+"""
+
+PASSED_REPORT = b"""<?xml version="1.0" encoding="UTF-8"?>
+<testsuites>
+    <testsuite name="suite.first" tests="5">
+        <testcase name="test_pass" classname="First" time="0.5"/>
+        <testcase name="test_fail" classname="First" time="1.5"/>
+        <testcase name="test_shared_one" classname="First" time="1"/>
+        <testcase name="test_shared_two" classname="First" time="1">
+            <failure message="shared" type="AssertionError">Traceback</failure>
+        </testcase>
+        <testcase name="test_no_message" classname="First" time="1"/>
+    </testsuite>
+    <testsuite name="suite.second" tests="1">
+        <testcase name="test_error" classname="Second" time="2"/>
+    </testsuite>
+</testsuites>
+"""
+
+
+def perform_each(test_run, test_run_results, **kwargs):
+    for test_run_result in test_run_results:
+        Defect.perform(test_run_result)
+    return True
+
+
+@mock.patch('applications.testing.models.add_caused_by_commits_task', mock.MagicMock())
+@mock.patch('applications.testing.models.add_closed_by_commits_task', mock.MagicMock())
+@mock.patch('applications.testing.tools.SpecFlow.update_materialized_view', mock.MagicMock())
+class DefectPerformBulkTestCase(ApiBaseTestClass):
+    def setUp(self):
+        self.setup_db()
+
+    def import_reports(self, project, reports):
+        test_suite = TestSuite.objects.create(name='defects', project=project)
+        commit = Commit.objects.create(project=project, sha='a' * 40, display_id='a' * 7)
+
+        for index, report in enumerate(reports):
+            SpecFlow.ImportUtils(
+                type_xml=SpecFlow.TYPE_JUNIT,
+                file_obj=ContentFile(report, name='report.xml'),
+                data=dict(project=project, test_suite=test_suite, commit=commit),
+                user_id=self.user.id,
+                test_run_name='run {}'.format(index),
+                host='http://localhost/test-runs/'
+            ).import_xml_tests()
+
+    @staticmethod
+    def defects_summary(project):
+        summary = list()
+        for defect in Defect.objects.filter(project=project).order_by('id'):
+            summary.append((
+                defect.reason, defect.type, defect.status, defect.close_type, defect.original_defect is not None,
+                sorted(defect.associated_tests.values_list('name', flat=True)),
+                defect.found_test_run_results.count(), defect.found_test_runs.count(),
+                defect.caused_by_test_run_results.count(), defect.reopen_test_run_results.count(),
+                defect.closed_test.name if defect.closed_test else None,
+            ))
+        return summary
+
+    def assertSameOutcome(self, reports):
+        expected_project = Project.objects.create(organization=self.organization, name='expected')
+        with mock.patch.object(Defect, 'perform_bulk', side_effect=perform_each):
+            self.import_reports(expected_project, reports)
+
+        self.import_reports(self.project, reports)
+
+        expected = self.defects_summary(expected_project)
+        self.assertTrue(expected)
+        self.assertEqual(self.defects_summary(self.project), expected)
+        return expected
+
+    def test_create_defects(self):
+        summary = self.assertSameOutcome([FAILED_REPORT])
+
+        self.assertEqual(len(summary), 4)
+        self.assertEqual(summary[0][0], 'expected 1')
+        self.assertEqual(summary[1][5], ['test_shared_one', 'test_shared_two'])
+
+    def test_continue_defects(self):
+        self.assertSameOutcome([FAILED_REPORT, FAILED_REPORT])
+
+    def test_close_and_reopen_defects(self):
+        summary = self.assertSameOutcome([FAILED_REPORT, PASSED_REPORT, FAILED_REPORT])
+
+        self.assertIn(Defect.STATUS_CLOSED, [defect[2] for defect in summary])
+        self.assertTrue(any(defect[4] for defect in summary))
+
+
+@mock.patch('applications.testing.models.add_caused_by_commits_task', mock.MagicMock())
+@mock.patch('applications.testing.models.add_closed_by_commits_task', mock.MagicMock())
+@mock.patch('applications.testing.tools.SpecFlow.update_materialized_view', mock.MagicMock())
+class DefectCommitAncestryTestCase(ApiBaseTestClass):
+    def setUp(self):
+        self.setup_db()
+
+    def setup_defect(self):
+        # c0 <- c1 <- c2 <- c3, c0 <- m0 <- m1 <- c3
+        self.commits = dict()
+        for name in ['c0', 'c1', 'c2', 'm0', 'm1', 'c3']:
+            self.commits[name] = Commit.objects.create(project=self.project, sha=name * 20, display_id=name)
+        for child, parents in [('c1', ['c0']), ('c2', ['c1']), ('m0', ['c0']), ('m1', ['m0']), ('c3', ['c2', 'm1'])]:
+            for index, parent in enumerate(parents):
+                self.commits[child].add_parent(self.commits[parent], index)
+
+        self.import_report('c1', PASSED_REPORT)
+        self.import_report('c3', FAILED_REPORT)
+        return Defect.objects.get(project=self.project, reason='expected 1')
+
+    def import_report(self, commit, report):
+        SpecFlow.ImportUtils(
+            type_xml=SpecFlow.TYPE_JUNIT,
+            file_obj=ContentFile(report, name='report.xml'),
+            data=dict(project=self.project, test_suite=self.test_suite, commit=self.commits[commit]),
+            user_id=self.user.id,
+            test_run_name='',
+            host='http://localhost/test-runs/'
+        ).import_xml_tests()
+
+    def commit_names(self, queryset):
+        return sorted(queryset.values_list('display_id', flat=True))
+
+    def test_caused_by_commits_stop_at_passed_tests(self):
+        defect = self.setup_defect()
+        defect.add_caused_by_commits(self.commits['c3'], self.test_suite)
+        self.assertEqual(self.commit_names(defect.caused_by_commits.all()), ['c0', 'c2', 'c3', 'm0', 'm1'])
+
+        # Existing links are not duplicated.
+        defect.add_caused_by_commits(self.commits['c3'], self.test_suite)
+        self.assertEqual(defect.caused_by_commits.count(), 5)
+
+    def test_caused_by_commits_max_recursion_depth(self):
+        defect = self.setup_defect()
+        defect.add_caused_by_commits(self.commits['c3'], self.test_suite, max_recursion_depth=2)
+        self.assertEqual(self.commit_names(defect.caused_by_commits.all()), ['c2', 'c3', 'm1'])
+
+    def test_closed_by_commits_stop_at_failed_tests(self):
+        defect = self.setup_defect()
+        defect.add_closed_by_commits(self.commits['c3'], self.test_suite)
+        self.assertEqual(self.commit_names(defect.closed_by_commits.all()), ['c0', 'c1', 'c2', 'c3', 'm0', 'm1'])
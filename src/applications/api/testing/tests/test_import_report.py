@@ -0,0 +1,283 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from unittest import mock
+
+import xmltodict
+from django.core.files.base import ContentFile
+from django.test import TestCase
+
+from applications.api.common.tests import ApiBaseTestClass
+from applications.testing.models import TestReport, TestRun, TestRunMaterializedModel, TestRunResult
+from applications.testing.tasks import import_test_report_task, update_materialized_view
+from applications.testing.tools import SpecFlow
+from applications.vcs.models import Commit
+
+
+JUNIT_REPORT = b"""<?xml version="1.0" encoding="UTF-8"?>
+<testsuites>
+    <testsuite name="suite.first" tests="3">
+        <testcase name="test_pass" classname="First" time="0.5"/>
+        <testcase name="test_fail" classname="First" time="1.5">
+            <failure message="expected 1" type="AssertionError">Traceback</failure>
+        </testcase>
+        <testcase name="test_skip" classname="First" time="0">
+            <skipped/>
+        </testcase>
+    </testsuite>
+    <testsuite name="suite.second" tests="2">
+        <testcase name="test_error" classname="Second" time="2">
+            <error message="boom" type="RuntimeError">Stacktrace</error>
+        </testcase>
+        <testcase name="test_pass" classname="Second" time="0.25">
+            <system-out>output</system-out>
+        </testcase>
+    </testsuite>
+</testsuites>
+"""
+
+TRX_REPORT = b"""<?xml version="1.0" encoding="UTF-8"?>
+<TestRun id="1" xmlns="http://microsoft.com/schemas/VisualStudio/TeamTest/2010">
+    <ResultSummary outcome="Failed">
+        <Counters total="2" executed="2" passed="1" failed="1" error="0" timeout="0" inconclusive="0"/>
+    </ResultSummary>
+    <TestDefinitions>
+        <UnitTest name="TestPass" id="t1"><TestMethod className="Sample.Tests, Sample" name="TestPass"/></UnitTest>
+        <UnitTest name="TestFail" id="t2"><TestMethod className="Sample.Tests, Sample" name="TestFail"/></UnitTest>
+    </TestDefinitions>
+    <Results>
+        <UnitTestResult testId="t1" testName="TestPass" outcome="Passed" duration="00:00:01.5000000"/>
+        <UnitTestResult testId="t2" testName="TestFail" outcome="Failed" duration="00:00:00.2500000">
+            <Output><ErrorInfo><Message>expected 1</Message><StackTrace>at Sample.Tests</StackTrace></ErrorInfo></Output>
+        </UnitTestResult>
+    </Results>
+</TestRun>
+"""
+
+
+class TransformReportTestCase(TestCase):
+    def test_trx_to_junit(self):
+        junit = xmltodict.parse(SpecFlow.transform_report(SpecFlow.TYPE_TRX, TRX_REPORT))
+
+        test_cases = junit['testsuites']['testsuite']['testcase']
+        self.assertEqual([(x['@classname'], x['@name']) for x in test_cases],
+                         [('Sample.Tests', 'TestPass'), ('Sample.Tests', 'TestFail')])
+        self.assertEqual(float(test_cases[0]['@time']), 1.5)
+        self.assertEqual(test_cases[1]['failure']['@message'], 'expected 1')
+
+    def test_stylesheet_compiled_once(self):
+        self.assertIs(SpecFlow.get_xslt('mstest-to-junit.xsl'), SpecFlow.get_xslt('mstest-to-junit.xsl'))
+
+
+@mock.patch('applications.testing.models.add_caused_by_commits_task', mock.MagicMock())
+@mock.patch('applications.testing.models.add_closed_by_commits_task', mock.MagicMock())
+@mock.patch('applications.testing.tools.SpecFlow.update_materialized_view', mock.MagicMock())
+class ImportReportStreamingTestCase(ApiBaseTestClass):
+    def setUp(self):
+        self.setup_db()
+
+    def import_report(self, sha, **kwargs):
+        commit = Commit.objects.create(project=self.project, sha=sha, display_id=sha[:7])
+        utils = SpecFlow.ImportUtils(
+            type_xml=SpecFlow.TYPE_JUNIT,
+            file_obj=ContentFile(JUNIT_REPORT, name='report.xml'),
+            data=dict(project=self.project, test_suite=self.test_suite, commit=commit),
+            user_id=self.user.id,
+            test_run_name='',
+            host='http://localhost/test-runs/',
+            **kwargs
+        )
+        return utils.import_xml_tests()
+
+    @staticmethod
+    def results_summary(test_run_id):
+        return sorted(TestRunResult.objects.filter(test_run_id=test_run_id).values_list(
+            'area_name', 'test_name', 'status', 'failure_message', 'execution_time', 'log'))
+
+    def test_streaming_matches_in_memory_import(self):
+        in_memory = self.import_report('a' * 40, streaming=False)
+        streaming = self.import_report('b' * 40, streaming=True, batch_size=2)
+
+        self.assertEqual(self.results_summary(in_memory['test_run_id']),
+                         self.results_summary(streaming['test_run_id']))
+        for key in ('failed_tests', 'broken_tests', 'passed_tests', 'skipped_tests'):
+            self.assertEqual(in_memory[key], streaming[key])
+
+    def test_streaming_fills_denormalized_fields(self):
+        result = self.import_report('c' * 40, streaming=True)
+
+        test_run_results = TestRunResult.objects.filter(test_run_id=result['test_run_id'])
+        self.assertEqual(test_run_results.count(), 5)
+        for test_run_result in test_run_results:
+            self.assertEqual(test_run_result.project_name, self.project.name)
+            self.assertEqual(test_run_result.test_suite_name, self.test_suite.name)
+            self.assertEqual(test_run_result.test_name, test_run_result.test.name)
+            self.assertEqual(test_run_result.commit_display_id, 'c' * 7)
+
+    def test_streaming_invalid_xml(self):
+        commit = Commit.objects.create(project=self.project, sha='d' * 40, display_id='d' * 7)
+        test_runs_count = TestRun.objects.count()
+        # Report broken after the results of the first testsuite were written.
+        utils = SpecFlow.ImportUtils(
+            type_xml=SpecFlow.TYPE_JUNIT,
+            file_obj=ContentFile(JUNIT_REPORT[:JUNIT_REPORT.rfind(b'<testcase')], name='report.xml'),
+            data=dict(project=self.project, test_suite=self.test_suite, commit=commit),
+            user_id=self.user.id,
+            test_run_name='',
+            host='http://localhost/test-runs/',
+            streaming=True,
+            batch_size=1
+        )
+        self.assertEqual(utils.import_xml_tests(), {'error': 'XML Parse error.'})
+
+        self.assertEqual(TestRun.objects.count(), test_runs_count)
+        self.assertFalse(TestRunResult.objects.filter(commit=commit).exists())
+
+    def test_streaming_stored_report(self):
+        in_memory = self.import_report('e' * 40, streaming=False)
+
+        commit = Commit.objects.create(project=self.project, sha='f' * 40, display_id='f' * 7)
+        test_report = SpecFlow.ImportUtils(
+            type_xml=SpecFlow.TYPE_JUNIT,
+            file_obj=ContentFile(JUNIT_REPORT, name='report.xml'),
+            data=dict(project=self.project, test_suite=self.test_suite, commit=commit),
+            user_id=self.user.id,
+            test_run_name='',
+            host='http://localhost/test-runs/',
+            streaming=False
+        ).test_report
+        streaming = SpecFlow.ImportUtils.from_test_report(test_report, streaming=True, batch_size=2).import_xml_tests()
+
+        self.assertEqual(self.results_summary(in_memory['test_run_id']),
+                         self.results_summary(streaming['test_run_id']))
+
+
+@mock.patch('applications.integration.ssh_v2.utils.prioritize_task', mock.MagicMock())
+@mock.patch('applications.testing.models.add_caused_by_commits_task', mock.MagicMock())
+@mock.patch('applications.testing.models.add_closed_by_commits_task', mock.MagicMock())
+@mock.patch('applications.testing.tools.SpecFlow.update_materialized_view', mock.MagicMock())
+class ImportReportAsyncTestCase(ApiBaseTestClass):
+    def setUp(self):
+        self.setup_db()
+
+    def test_import_from_stored_report(self):
+        commit = Commit.objects.create(project=self.project, sha='e' * 40, display_id='e' * 7)
+        utils = SpecFlow.ImportUtils(
+            type_xml=SpecFlow.TYPE_JUNIT,
+            file_obj=ContentFile(JUNIT_REPORT, name='report.xml'),
+            data=dict(project=self.project, test_suite=self.test_suite, commit=commit),
+            user_id=self.user.id,
+            test_run_name='',
+            host='http://localhost/test-runs/'
+        )
+        self.assertEqual(utils.test_report.status, TestReport.Status.PENDING)
+
+        result = import_test_report_task.apply(args=(utils.test_report.id,)).get()
+
+        test_report = TestReport.objects.get(id=utils.test_report.id)
+        self.assertEqual(test_report.status, TestReport.Status.SUCCESS)
+        self.assertEqual(test_report.result, result)
+        self.assertEqual(result['failed_tests'], 1)
+        self.assertEqual(result['report_url'], 'http://localhost/test-runs/{}'.format(result['test_run_id']))
+
+        # Already processed reports are not imported twice.
+        self.assertFalse(import_test_report_task.apply(args=(utils.test_report.id,)).get())
+
+    @mock.patch('applications.api.testing.serializers.import_test_report_task')
+    def test_import_async_queued_on_commit(self, import_test_report_task_mock):
+        commit = Commit.objects.create(project=self.project, sha='d' * 40, display_id='d' * 7)
+        self.client.force_authenticate(user=self.user)
+
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            response = self.client.post('/api/test-run-results/import-async/', data={
+                'project': self.project.id, 'test_suite': self.test_suite.id, 'commit': commit.id,
+                'type': SpecFlow.TYPE_JUNIT, 'file': ContentFile(JUNIT_REPORT, name='report.xml')
+            }, format='multipart')
+            import_test_report_task_mock.delay.assert_not_called()
+
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(len(callbacks), 1)
+        import_test_report_task_mock.delay.assert_called_once_with(response.data['id'])
+
+    def test_processing_report_not_imported(self):
+        commit = Commit.objects.create(project=self.project, sha='c' * 40, display_id='c' * 7)
+        utils = SpecFlow.ImportUtils(
+            type_xml=SpecFlow.TYPE_JUNIT,
+            file_obj=ContentFile(JUNIT_REPORT, name='report.xml'),
+            data=dict(project=self.project, test_suite=self.test_suite, commit=commit),
+            user_id=self.user.id,
+            test_run_name='',
+            host='http://localhost/test-runs/'
+        )
+        TestReport.objects.filter(id=utils.test_report.id).update(status=TestReport.Status.PROCESSING)
+
+        self.assertFalse(import_test_report_task.apply(args=(utils.test_report.id,)).get())
+        self.assertEqual(TestReport.objects.get(id=utils.test_report.id).status, TestReport.Status.PROCESSING)
+
+
+@mock.patch('applications.testing.models.add_caused_by_commits_task', mock.MagicMock())
+@mock.patch('applications.testing.models.add_closed_by_commits_task', mock.MagicMock())
+@mock.patch('applications.testing.tools.SpecFlow.update_materialized_view')
+class TestRunStatisticTestCase(ApiBaseTestClass):
+    def setUp(self):
+        self.setup_db()
+
+    def import_report(self):
+        commit = Commit.objects.create(project=self.project, sha='f' * 40, display_id='f' * 7)
+        return SpecFlow.ImportUtils(
+            type_xml=SpecFlow.TYPE_JUNIT,
+            file_obj=ContentFile(JUNIT_REPORT, name='report.xml'),
+            data=dict(project=self.project, test_suite=self.test_suite, commit=commit),
+            user_id=self.user.id,
+            test_run_name='',
+            host='http://localhost/test-runs/'
+        ).import_xml_tests()
+
+    @staticmethod
+    def statistic(test_run_id):
+        return TestRunMaterializedModel.objects.filter(test_run_id=test_run_id).values(
+            'tests_count', 'passed_tests_count', 'skipped_tests_count', 'failed_tests_count',
+            'broken_tests_count', 'not_run_tests_count', 'execution_time').first()
+
+    def test_import_updates_only_its_test_run(self, update_materialized_view_mock):
+        result = self.import_report()
+        update_materialized_view_mock.delay.assert_called_once_with(test_run_ids=[result['test_run_id']])
+
+        update_materialized_view(test_run_ids=[result['test_run_id']])
+        self.assertEqual(self.statistic(result['test_run_id']), {
+            'tests_count': 5, 'passed_tests_count': 2, 'skipped_tests_count': 1, 'failed_tests_count': 1,
+            'broken_tests_count': 1, 'not_run_tests_count': 1, 'execution_time': 4.25
+        })
+        self.assertIsNone(self.statistic(self.test_run.id))
+
+        TestRunResult.objects.filter(test_run_id=result['test_run_id'], status=TestRunResult.STATUS_PASS).delete()
+        update_materialized_view(test_run_ids=[result['test_run_id']])
+        self.assertEqual(self.statistic(result['test_run_id'])['tests_count'], 3)
+
+        TestRunResult.objects.filter(test_run_id=result['test_run_id']).delete()
+        update_materialized_view(test_run_ids=[result['test_run_id']])
+        self.assertIsNone(self.statistic(result['test_run_id']))
+
+    def test_changed_results_update_statistic(self, update_materialized_view_mock):
+        self.client.force_authenticate(user=self.user)
+        result = self.import_report()
+        update_materialized_view(test_run_ids=[result['test_run_id']])
+        passed_result = TestRunResult.objects.filter(test_run_id=result['test_run_id'],
+                                                     status=TestRunResult.STATUS_PASS).first()
+
+        response = self.client.patch('/api/test-run-results/{}/'.format(passed_result.id),
+                                     {'status': TestRunResult.STATUS_FAIL}, format='json')
+        self.assertEqual(response.status_code, 200)
+        statistic = self.statistic(result['test_run_id'])
+        self.assertEqual((statistic['passed_tests_count'], statistic['failed_tests_count']), (1, 2))
+
+        response = self.client.delete('/api/test-run-results/{}/'.format(passed_result.id))
+        self.assertEqual(response.status_code, 204)
+        statistic = self.statistic(result['test_run_id'])
+        self.assertEqual((statistic['tests_count'], statistic['failed_tests_count']), (4, 1))
+
+    def test_periodic_update_of_recent_test_runs(self, update_materialized_view_mock):
+        result = self.import_report()
+
+        update_materialized_view()
+        self.assertEqual(self.statistic(result['test_run_id'])['tests_count'], 5)
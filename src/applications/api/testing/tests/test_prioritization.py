@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from unittest import mock
+
+from django.core.cache import cache
+
+from applications.api.common.tests import ApiBaseTestClass
+from applications.api.external.utils import ConfirmationHMAC
+from applications.testing import selectors
+from applications.testing.selectors import Priority, prioritized_test_list
+from applications.vcs.models import Area, Branch, Commit, File, FileChange
+
+
+@mock.patch('applications.testing.selectors.prioritize_task', mock.MagicMock())
+class PrioritizationTestCase(ApiBaseTestClass):
+    def setUp(self):
+        self.setup_db()
+        cache.clear()
+
+        self.branch = Branch.objects.create(project=self.project, name='master')
+        changed_file = File.objects.create(project=self.project, filename='service.py',
+                                           full_filename='src/service.py')
+        self.commit = Commit.objects.create(project=self.project, sha='a' * 40, display_id='a' * 7,
+                                            message='Change service', is_processed=True)
+        FileChange.objects.create(commit=self.commit, file=changed_file)
+
+        default = Area.get_default(project=self.project)
+        self.create_test_model_object('test_service', class_name='ServiceTests',
+                                      area=default).associated_files.add(changed_file)
+        self.create_test_model_object('test_report', class_name='ReportTests',
+                                      area=default).associated_areas.add(self.create_area_model_object('Report'))
+        self.create_test_model_object('test_unassigned', class_name='OtherTests', area=default)
+
+    def get_params(self, priority):
+        return {'project': self.project, 'test_suite': self.test_suite, 'commit': self.commit,
+                'commit_type': 'Single', 'priority': priority, 'keyword': ''}
+
+    def test_tiers_calculated_once(self):
+        with mock.patch('applications.testing.selectors.get_default_high_queryset',
+                        wraps=selectors.get_default_high_queryset) as high:
+            tiers = {priority: sorted(prioritized_test_list(params=self.get_params(priority))
+                                      .values_list('name', flat=True))
+                     for priority in [Priority.HIGH, Priority.MEDIUM, Priority.LOW, Priority.UNASSIGNED]}
+            top = prioritized_test_list(params=dict(self.get_params(Priority.PERCENT), percent=50))
+            self.assertEqual(high.call_count, 1)
+
+            # Another commit set is calculated again.
+            commit = Commit.objects.create(project=self.project, sha='b' * 40, display_id='b' * 7, message='Docs')
+            params = dict(self.get_params(Priority.HIGH), commit=commit)
+            self.assertEqual(prioritized_test_list(params=params).count(), 0)
+            self.assertEqual(high.call_count, 2)
+
+        self.assertEqual(tiers, {Priority.HIGH: ['test_service'], Priority.MEDIUM: [],
+                                 Priority.LOW: ['test_report', 'test_service'], Priority.UNASSIGNED: ['test_unassigned']})
+        self.assertEqual(list(top.values_list('name', flat=True)), ['test_service'])
+
+    def test_tiers_not_cached_before_commit_processed(self):
+        Commit.objects.filter(id=self.commit.id).update(is_processed=False)
+        FileChange.objects.filter(commit=self.commit).delete()
+        self.assertEqual(prioritized_test_list(params=self.get_params(Priority.HIGH)).count(), 0)
+
+        # Changed files of the commit are processed after the first request.
+        FileChange.objects.create(commit=self.commit, file=File.objects.get(project=self.project))
+        Commit.objects.filter(id=self.commit.id).update(is_processed=True)
+        self.assertEqual(list(prioritized_test_list(params=self.get_params(Priority.HIGH))
+                              .values_list('name', flat=True)), ['test_service'])
+
+        with mock.patch('applications.testing.selectors.get_default_high_queryset') as high:
+            self.assertEqual(prioritized_test_list(params=self.get_params(Priority.HIGH)).count(), 1)
+        high.assert_not_called()
+
+    def test_all_tiers_view(self):
+        response = self.client.get('/api/external/prioritized-tests/all/', {
+            'name_type': 'test', 'project': self.project.id, 'test_suite': self.test_suite.id,
+            'target_branch': self.branch.name, 'commit_type': 'Single', 'commit': self.commit.sha,
+            'classname': True, 'classname_separator': '.', 'testsuitename': False,
+        }, HTTP_TOKEN=ConfirmationHMAC(self.organization).key)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['high'], ['ServiceTests.test_service'])
+        self.assertEqual(response.data['unassigned'], ['OtherTests.test_unassigned'])
+        self.assertEqual(sorted(score['name'] for score in response.data['scores']),
+                         ['OtherTests.test_unassigned', 'ReportTests.test_report', 'ServiceTests.test_service'])
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from unittest import mock
+
+from django.core.files.base import ContentFile
+from django.db import models
+
+from applications.api.common.tests import ApiBaseTestClass
+from applications.api.testing.tests.test_defect_perform import FAILED_REPORT, PASSED_REPORT
+from applications.testing.models import Defect, Test, TestRun, TestRunCurrentResult, TestRunResult
+from applications.testing.tasks import update_materialized_view
+from applications.testing.tools import SpecFlow
+from applications.vcs.models import Commit
+
+
+@mock.patch('applications.testing.models.add_caused_by_commits_task', mock.MagicMock())
+@mock.patch('applications.testing.models.add_closed_by_commits_task', mock.MagicMock())
+@mock.patch('applications.testing.tools.SpecFlow.update_materialized_view', mock.MagicMock())
+class ReportGroupsTestCase(ApiBaseTestClass):
+    def setUp(self):
+        self.setup_db()
+        self.client.force_authenticate(user=self.user)
+
+    def import_reports(self, reports):
+        commit = Commit.objects.create(project=self.project, sha='a' * 40, display_id='a' * 7)
+        for index, report in enumerate(reports):
+            SpecFlow.ImportUtils(
+                type_xml=SpecFlow.TYPE_JUNIT,
+                file_obj=ContentFile(report, name='report.xml'),
+                data=dict(project=self.project, test_suite=self.test_suite, commit=commit),
+                user_id=self.user.id,
+                test_run_name='run {}'.format(index),
+                host='http://localhost/test-runs/'
+            ).import_xml_tests()
+
+    def group(self, name, **params):
+        response = self.client.get('/api/report/tests/group/{}/'.format(name), params)
+        self.assertEqual(response.status_code, 200)
+        return sorted((test['name'], test['current_status']) for test in response.data['results'])
+
+    def test_current_results_are_newest_results(self):
+        self.import_reports([FAILED_REPORT, PASSED_REPORT])
+        test_run = TestRun.objects.get(project=self.project, name='run 1')
+        test_run_result = TestRunResult.objects.get(test_run=test_run, test__name='test_pass')
+        test_run_result.pk = None
+        test_run_result.status = TestRunResult.STATUS_BROKEN
+        test_run_result.save()
+        TestRunCurrentResult.refresh([test_run.id])
+
+        expected = Test.objects.filter(project=self.project).annotate(status=models.Subquery(
+            TestRunResult.objects.filter(test=models.OuterRef('id'), test_run=test_run)
+            .order_by('-created').values('status')[:1]
+        )).values_list('id', 'status')
+        current_results = test_run.current_results.values_list('test_id', 'status')
+        self.assertEqual(sorted(current_results), sorted(expected))
+        self.assertEqual(dict(current_results)[Test.objects.get(name='test_pass').id], TestRunResult.STATUS_BROKEN)
+
+        # Removed results are dropped from the index, the next refresh restores the previous one.
+        TestRunResult.objects.filter(test_run=test_run, status=TestRunResult.STATUS_BROKEN).delete()
+        TestRunCurrentResult.refresh([test_run.id])
+        self.assertEqual(sorted(current_results), sorted(expected))
+
+    def test_current_results_follow_changed_results(self):
+        self.import_reports([PASSED_REPORT])
+        test_run = TestRun.objects.get(project=self.project, name='run 0')
+        test_run_result = TestRunResult.objects.get(test_run=test_run, test__name='test_pass')
+
+        def current_status():
+            return test_run.current_results.get(test__name='test_pass').status
+
+        response = self.client.patch('/api/test-run-results/{}/'.format(test_run_result.id),
+                                     {'status': TestRunResult.STATUS_BROKEN}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(current_status(), TestRunResult.STATUS_BROKEN)
+
+        # Results changed by other paths are picked by their update time.
+        test_run_result.refresh_from_db()
+        test_run_result.status = TestRunResult.STATUS_FAIL
+        test_run_result.save()
+        update_materialized_view()
+        self.assertEqual(current_status(), TestRunResult.STATUS_FAIL)
+
+        newest_result = TestRunResult.objects.get(id=test_run_result.id)
+        newest_result.pk = None
+        newest_result.status = TestRunResult.STATUS_PASS
+        newest_result.save()
+        TestRunCurrentResult.refresh([test_run.id])
+        self.assertEqual(current_status(), TestRunResult.STATUS_PASS)
+
+        # The previous result becomes current again once the newest one is deleted.
+        response = self.client.delete('/api/test-run-results/{}/'.format(newest_result.id))
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(current_status(), TestRunResult.STATUS_FAIL)
+
+    def test_groups(self):
+        self.import_reports([FAILED_REPORT, PASSED_REPORT])
+        flaky = Test.objects.get(project=self.project, name='test_shared_one')
+        Defect.objects.create(project=self.project, name='flaky', reason='flaky', type=Defect.TYPE_FLAKY,
+                              created_by_test_run=TestRun.objects.get(name='run 1')).associated_tests.add(flaky)
+        for name, values in [('test_no_message', dict(type=Defect.TYPE_INVALID_TEST, status=Defect.STATUS_NEW)),
+                             ('test_fail', dict(type=Defect.TYPE_PROJECT, status=Defect.STATUS_IN_PROGRESS)),
+                             ('test_error', dict(type=Defect.TYPE_PROJECT, status=Defect.STATUS_READY))]:
+            Defect.objects.filter(project=self.project, associated_tests__name=name).update(**values)
+
+        self.assertEqual(self.group('flaky'), [('test_shared_one', TestRunResult.STATUS_PASS)])
+        self.assertEqual(self.group('invalid'), [('test_no_message', TestRunResult.STATUS_PASS)])
+        self.assertEqual(self.group('ready-defect'), [('test_error', TestRunResult.STATUS_PASS)])
+        self.assertEqual(self.group('open-defect'), [('test_fail', TestRunResult.STATUS_PASS)])
+        self.assertEqual(self.group('passed'), [('test_pass', TestRunResult.STATUS_PASS),
+                                                ('test_shared_two', TestRunResult.STATUS_FAIL)])
+
+        self.assertEqual(self.group('passed', current_status=TestRunResult.STATUS_FAIL),
+                         [('test_shared_two', TestRunResult.STATUS_FAIL)])
+        self.assertEqual(self.group('open-defect', current_status=TestRunResult.STATUS_FAIL), [])
+
+        # Statuses of an older test run, the flaky defect was created later.
+        test_run = TestRun.objects.get(name='run 0').id
+        self.assertEqual(self.group('flaky', test_run=test_run), [])
+        self.assertEqual(self.group('passed', test_run=test_run),
+                         [('test_pass', TestRunResult.STATUS_PASS), ('test_shared_one', TestRunResult.STATUS_FAIL),
+                          ('test_shared_two', TestRunResult.STATUS_FAIL)])
@@ -303,6 +303,17 @@ class TestRunResultModelViewSet(viewsets.ModelViewSet):
         queryset = queryset.filter(project__organization=get_current_organization(self.request))
         return queryset
 
+    def perform_update(self, serializer):
+        instance = serializer.save()
+        TestRunCurrentResult.refresh([instance.test_run_id])
+        TestRunMaterializedModel.refresh([instance.test_run_id])
+
+    def perform_destroy(self, instance):
+        test_run_id = instance.test_run_id
+        instance.delete()
+        TestRunCurrentResult.refresh([test_run_id])
+        TestRunMaterializedModel.refresh([test_run_id])
+
     # @swagger_auto_schema(method='POST',
     #                      request_body=ImportTestingReportSerializer)  # , responses={201: OutputImportSerializer()})
     @action(methods=['POST', ], detail=False, url_path=r'import')
@@ -322,6 +333,24 @@ class TestRunResultModelViewSet(viewsets.ModelViewSet):
 
         return Response(data=report_serializer.data, status=status.HTTP_201_CREATED)
 
+    @action(methods=['POST', ], detail=False, url_path=r'import-async')
+    def import_async_view(self, request, *args, **kwargs):
+
+        serializer = ImportTestingReportSerializer(data=request.data, context={'request': request})
+        serializer.is_valid(raise_exception=True)
+
+        test_report = serializer.save(self.request, asynchronous=True)
+        report_serializer = TestReportStatusSerializer(test_report)
+
+        return Response(data=report_serializer.data, status=status.HTTP_202_ACCEPTED)
+
+    @action(methods=['GET', ], detail=False, url_path=r'import-status/(?P<test_report_pk>[0-9]+)')
+    def import_status_view(self, request, test_report_pk=None, *args, **kwargs):
+        queryset = TestReport.objects.filter(project__organization=get_current_organization(self.request))
+        test_report = get_object_or_404(queryset, pk=test_report_pk)
+        report_serializer = TestReportStatusSerializer(test_report)
+        return Response(data=report_serializer.data, status=status.HTTP_200_OK)
+
 
 class DefectModelViewSet(viewsets.ModelViewSet):
     """
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from datetime import datetime, timedelta
+
+import pytz
+from django.db.models import Count
+
+from applications.api.common.tests import ApiBaseTestClass
+from applications.testing.models import Defect
+from applications.vcs.models import Commit
+from applications.vcs.utils.analysis import avg_per_hour, avg_per_range, calculate_team_analysis, \
+    calculate_user_analysis, calculate_user_analysis_by_range, count_weekday
+
+
+class AnalysisTestCase(ApiBaseTestClass):
+    def setUp(self):
+        self.setup_db()
+
+        now = datetime.now(pytz.UTC).replace(minute=0, second=0, microsecond=0)
+        self.commits = list()
+        for index, (days, hour, output, rework, author) in enumerate([
+            (20, 9, 10, 0, 'alice'),
+            (20, 9, 30, 50, 'alice'),
+            (13, 14, 5, 100, 'bob'),
+            (6, 9, 7, 20, 'alice'),
+            (2, 23, 1, 0, 'bob'),
+            (0, 0, 4, 10, 'alice'),
+        ]):
+            self.commits.append(Commit.objects.create(
+                project=self.project, sha=str(index) * 40, display_id=str(index) * 7, output=output, rework=rework,
+                author={'name': author, 'email': author + '@example.com'},
+                timestamp=(now - timedelta(days=days)).replace(hour=hour)
+            ))
+
+        for close_type in [Defect.CLOSE_TYPE_FIXED, None, Defect.CLOSE_TYPE_DUPLICATE]:
+            defect = Defect.objects.create(project=self.project, name='defect', reason='defect',
+                                           close_type=close_type)
+            defect.caused_by_commits.add(self.commits[1])
+        defect.caused_by_commits.add(self.commits[2])
+
+    def commit_values(self, commits, *fields):
+        return [{field: getattr(commit, field) for field in fields} for commit in commits]
+
+    def test_user_analysis(self):
+        queryset = Commit.objects.filter(project=self.project).annotate(
+            parents_count=Count('parents')).exclude(parents_count__gte=2)
+        result = calculate_user_analysis(queryset)
+
+        first = self.commits[0].timestamp
+        count_days = (datetime.now(pytz.UTC) - first).days + 1
+        by_hour = {hour: [commit for commit in self.commits if commit.timestamp.hour == hour] for hour in range(24)}
+
+        self.assertEqual(result['hour']['commits'], [len(by_hour[hour]) / float(count_days) for hour in range(24)])
+        self.assertEqual(result['hour']['output'], [
+            avg_per_hour(self.commit_values(by_hour[hour], 'output', 'timestamp'), 'output', first)
+            for hour in range(24)])
+        self.assertEqual(result['hour']['rework'], [
+            avg_per_hour(self.commit_values(by_hour[hour], 'rework', 'timestamp'), 'rework', first)
+            for hour in range(24)])
+        # Two of three defects of the second commit are counted, 9 o'clock has three commits.
+        self.assertAlmostEqual(result['hour']['defects'][9], 2 / 3.0 * 100)
+
+        self.assertEqual(result['today']['commits'], {'all': 1, 'avg': 6 / float(count_days)})
+        self.assertEqual(result['today']['output']['all'], 4)
+        self.assertEqual(result['today']['output']['avg'], 57 / float(count_days))
+        self.assertEqual(result['today']['rework']['avg'], (70 / 3.0 + 100 + 0 + 10) / count_days)
+        self.assertEqual(result['today']['defects']['all'], 0)
+
+        count_week = count_weekday(first)
+        self.assertEqual(sum(result['weekday']['commits'][weekday] * count_week.get(weekday, 0)
+                             for weekday in range(7)),
+                         len([commit for commit in self.commits if commit.timestamp.isoweekday() != 6]))
+
+        self.assertEqual([day['value'] for day in result['all_day']['commits']], [2, 1, 1, 1, 1])
+        self.assertEqual([day['value'] for day in result['all_day']['defects']], [2, 0, 0, 0, 0])
+        self.assertEqual([day['value'] for day in result['all_day']['rework']], [25.0, 100.0, 20.0, 0.0, 10.0])
+
+    def test_range_analysis(self):
+        end_date = datetime.now(pytz.UTC)
+        timestamp_range = (end_date - timedelta(days=14), end_date)
+        queryset = Commit.objects.filter(project=self.project, timestamp__range=timestamp_range)
+        commits = [commit for commit in self.commits if commit.timestamp >= timestamp_range[0]]
+
+        result = calculate_user_analysis_by_range(queryset, {'timestamp__range': timestamp_range})
+
+        self.assertEqual(result, {
+            'output': avg_per_range(self.commit_values(commits, 'output', 'timestamp'), 'output', timestamp_range),
+            'commits': avg_per_range(self.commit_values(commits, 'id', 'timestamp'), 'commits', timestamp_range),
+            'defects': 1 / 4.0 * 100,
+            'rework': avg_per_range(self.commit_values(commits, 'rework', 'timestamp'), 'rework', timestamp_range),
+        })
+
+        team = calculate_team_analysis(queryset, ['alice', 'bob', 'carol'], {'timestamp__range': timestamp_range})
+        self.assertEqual(team['alice'], calculate_user_analysis_by_range(
+            queryset.filter(author__name='alice'), {'timestamp__range': timestamp_range}))
+        self.assertEqual(team['bob']['defects'], 50.0)
+        self.assertEqual(team['carol'], {'output': 0, 'commits': 0, 'defects': 0, 'rework': 0})
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from unittest import mock
+
+from applications.api.common.tests import ApiBaseTestClass
+from applications.project.models import Project
+from applications.vcs.models import Area
+from applications.vcs.tools import area_analyzer
+from applications.vcs.utils.areas import AreaResolver
+
+JAVA_PATCH = 'package com.example;\nimport com.example.util.Strings;\nimport com.example.model.User;\n'
+
+CHANGED_FILES = [
+    ('src/app/models.py', ''),
+    ('lib/utils/text.py', ''),
+    ('lib/other/views.py', ''),
+    ('lib/utils/split.py', ''),
+    ('src/Main.java', JAVA_PATCH),
+    ('/README', ''),
+]
+
+
+@mock.patch.object(area_analyzer.support_langs, 'java', 'java', create=True)
+class AreaResolverTestCase(ApiBaseTestClass):
+    def setUp(self):
+        self.setup_db()
+        self.other_project = Project.objects.create(organization=self.organization, name='other_project')
+        for project in [self.project, self.other_project]:
+            project.auto_area_on_commit = True
+            project.save()
+            Area.objects.create(project=project, name='app', type=Area.TYPE_FOLDER)
+            Area.objects.create(project=project, name='com.example.util', type=Area.TYPE_CODE)
+
+    @staticmethod
+    def get_names(area_ids):
+        return sorted(Area.objects.filter(id__in=area_ids).values_list('name', flat=True))
+
+    def test_same_areas_as_per_file_resolution(self):
+        expected = list()
+        for filename, patch in CHANGED_FILES:
+            areas = Area.get_by_filename(project=self.other_project, filename=filename)
+            areas.extend(Area.create_from_code(project=self.other_project, filename=filename, patch=patch))
+            expected.append(sorted({area.name for area in areas}))
+
+        area_resolver = AreaResolver(self.project)
+        for filename, patch in CHANGED_FILES:
+            area_resolver.add(filename, patch=patch)
+        result = [self.get_names(area_ids) for area_ids in area_resolver.resolve()]
+
+        self.assertEqual(result, expected)
+        self.assertEqual(result[4], ['Default Area', 'com.example', 'com.example.model', 'com.example.util', 'src'])
+        self.assertEqual(sorted(Area.objects.filter(project=self.project).values_list('name', 'type')),
+                         sorted(Area.objects.filter(project=self.other_project).values_list('name', 'type')))
+
+    def test_areas_created_with_one_insert(self):
+        area_resolver = AreaResolver(self.project)
+        area_resolver.add('src/app/models.py')
+        area_resolver.resolve()
+
+        # Known areas are resolved from memory, new ones are inserted and selected once for the batch.
+        with self.assertNumQueries(2):
+            for filename, patch in CHANGED_FILES * 10:
+                area_resolver.add(filename, patch=patch)
+            self.assertEqual(len(area_resolver.resolve()), len(CHANGED_FILES) * 10)
+
+        with self.assertNumQueries(0):
+            area_resolver.add('lib/utils/text.py')
+            area_ids = area_resolver.resolve()[0]
+        self.assertEqual(self.get_names(area_ids), ['Default Area', 'utils'])
+
+    def test_code_areas_of_other_types_skipped(self):
+        Area.objects.create(project=self.project, name='com.example.model', type=Area.TYPE_FOLDER)
+
+        area_resolver = AreaResolver(self.project)
+        area_resolver.add('Main.java', patch=JAVA_PATCH)
+        self.assertEqual(self.get_names(area_resolver.resolve()[0]),
+                         ['Default Area', 'com.example', 'com.example.util'])
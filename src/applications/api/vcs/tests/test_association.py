@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from applications.api.common.tests import ApiBaseTestClass
+from applications.testing.tasks import add_association_for_tests
+from applications.vcs.models import Area, File
+from applications.vcs.utils.analysis import find_similarity_in_name, similarity
+from applications.vcs.utils.association import NGramIndex, TEST_ARGS, find_and_associate_areas
+
+
+def find_similar_areas_exhaustive(test, areas):
+    """ Areas matched by scoring every area of the project as before the index, the best ones first. """
+    areas = [{'id': area.id, 'name': area.name} for area in areas]
+    for area in areas:
+        for arg in TEST_ARGS:
+            name = getattr(test, arg)
+            area[arg + '_similarity'] = 0 if name is None else similarity(name, area['name'])
+    return find_similarity_in_name(areas)
+
+
+class AssociationTestCase(ApiBaseTestClass):
+    def setUp(self):
+        self.setup_db()
+
+        self.areas = [self.create_area_model_object(name) for name in [
+            'CheckoutService', 'PaymentGateway', 'Reporting', 'UserProfile', 'Notifications', 'SearchIndex',
+        ]]
+        self.files = list()
+        for full_filename in ['src/checkout/service.py', 'src/checkout/basket.py', 'src/payment/gateway.py',
+                              'src/reporting/monthly_report.py', 'src/users/profile.py', 'src/search/index.py',
+                              'tests/checkout/service.py']:
+            self.files.append(File.objects.create(project=self.project, full_filename=full_filename,
+                                                  filename=full_filename.rsplit('/', 1)[-1], sha='a' * 40))
+
+        default = Area.get_default(project=self.project)
+        self.tests = [
+            self.create_test_model_object('test_checkout_service_total', class_name='CheckoutServiceTests',
+                                          area=default),
+            self.create_test_model_object('test_monthly_report', class_name='ReportingTests', area=default),
+            self.create_test_model_object('test_gateway_timeout', class_name='', area=default),
+        ]
+
+    def test_search(self):
+        index = NGramIndex(['CheckoutService', 'PaymentGateway', 'Reporting', 'report'])
+
+        self.assertEqual(index.search('test_monthly_report').tolist(), [2, 3])
+        self.assertEqual(index.search('test_monthly_report', limit=1).tolist(), [3])
+        self.assertEqual(index.search('xyz').tolist(), [])
+
+    def test_best_areas_as_exhaustive_scoring(self):
+        for test in self.tests:
+            similar_areas = find_similar_areas_exhaustive(test, self.areas)
+            find_and_associate_areas(test)
+
+            # Areas without common trigrams are not candidates anymore, the best matches stay.
+            associated_areas = set(test.associated_areas.values_list('id', flat=True))
+            self.assertLessEqual(associated_areas, {area['id'] for arg in TEST_ARGS for area in similar_areas[arg]})
+            for arg in TEST_ARGS:
+                if similar_areas[arg] and getattr(test, arg):
+                    self.assertIn(similar_areas[arg][0]['id'], associated_areas)
+
+    def test_associate_tests_in_batch(self):
+        add_association_for_tests(test_ids=[test.id for test in self.tests])
+
+        checkout, report, gateway = self.tests
+        self.assertIn('CheckoutService', checkout.associated_areas.values_list('name', flat=True))
+        self.assertEqual(sorted(checkout.associated_files.values_list('full_filename', flat=True))[:2],
+                         ['src/checkout/service.py', 'tests/checkout/service.py'])
+        self.assertIn('Reporting', report.associated_areas.values_list('name', flat=True))
+        self.assertIn('src/reporting/monthly_report.py', report.associated_files.values_list('full_filename', flat=True))
+        self.assertIn('src/payment/gateway.py', gateway.associated_files.values_list('full_filename', flat=True))
+
+        # Associating again doesn't duplicate links.
+        count = checkout.associated_files.count()
+        add_association_for_tests(test_ids=[checkout.id])
+        self.assertEqual(checkout.associated_files.count(), count)
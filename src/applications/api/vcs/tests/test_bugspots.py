@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import collections
+import math
+import time
+from datetime import datetime, timedelta
+from hashlib import md5
+from unittest import mock
+
+import pytz
+from django.core.cache import cache
+
+from applications.api.common.tests import ApiBaseTestClass
+from applications.vcs.models import Commit, File, FileChange
+from applications.vcs.utils.bugspots import BUGSPOTS_RESCAN_MARGIN, Bugspots, DEFAULT_REGEX, get_fix_changes
+
+
+def get_hotspots_per_commit(project, queryset, grep=DEFAULT_REGEX):
+    """ Hot spots scored commit by commit as they were before the arrays. """
+    commits = queryset.order_by('-timestamp')
+    if not commits:
+        return []
+
+    head_filenames = set(File.objects.filter(project=project).values_list('full_filename', flat=True))
+    files = collections.defaultdict(list)
+    for timestamp, filename in commits.filter(message__iregex=grep).values_list('timestamp', 'files__full_filename'):
+        if filename in head_filenames:
+            files[filename].append(int(time.mktime(timestamp.timetuple())))
+
+    repo_start = int(time.mktime(commits.first().timestamp.timetuple()))
+    repo_age = int(time.mktime(commits.last().timestamp.timetuple())) - repo_start or 1
+
+    result = [(name, sum(1 / (1 + math.exp(-12 * ((t - repo_start) / repo_age) + 12)) for t in commit_dates))
+              for name, commit_dates in files.items()]
+    return sorted(result, key=lambda item: item[1], reverse=True)
+
+
+class BugspotsTestCase(ApiBaseTestClass):
+    def setUp(self):
+        self.setup_db()
+        cache.clear()
+
+        self.now = datetime.now(pytz.UTC).replace(microsecond=0)
+        self.files = dict()
+        for filename in ['api.py', 'models.py', 'views.py', 'utils.py', 'README']:
+            self.files[filename] = File.objects.create(project=self.project, filename=filename,
+                                                       full_filename=filename)
+
+        for index, (days, message, filenames) in enumerate([
+            (30, 'Initial', ['api.py', 'models.py', 'views.py', 'README']),
+            (25, 'Fix models', ['models.py']),
+            (20, 'Fixed api and models', ['api.py', 'models.py']),
+            (12, 'Add utils', ['utils.py']),
+            (10, 'Bug in utils', ['utils.py', 'views.py']),
+            (5, 'Closes issue with views', ['views.py']),
+            (1, 'Docs', ['README']),
+        ]):
+            self.create_commit(index, days, message, filenames)
+
+    def create_commit(self, index, days, message, filenames):
+        commit = Commit.objects.create(project=self.project, sha=str(index) * 40, display_id=str(index) * 7,
+                                       message=message, timestamp=self.now - timedelta(days=days))
+        for filename in filenames:
+            FileChange.objects.create(commit=commit, file=self.files[filename])
+        return commit
+
+    def assertSameHotspots(self, queryset):
+        expected = get_hotspots_per_commit(self.project, queryset)
+        hotspots = Bugspots(self.project, queryset).get_hotspots()
+
+        self.assertEqual([hotspot.filename for hotspot in hotspots], [name for name, _ in expected])
+        for hotspot, (_, score) in zip(hotspots, expected):
+            self.assertAlmostEqual(hotspot.score, score)
+        return hotspots
+
+    def test_same_hotspots_as_per_commit_scoring(self):
+        hotspots = self.assertSameHotspots(Commit.objects.filter(project=self.project))
+        self.assertEqual(len(hotspots), 4)
+
+        queryset = Commit.objects.filter(project=self.project, timestamp__lte=self.now - timedelta(days=11))
+        self.assertSameHotspots(queryset)
+        self.assertEqual(Bugspots(self.project, queryset).get_red_hotspots()[0].filename, 'models.py')
+
+        self.assertEqual(Bugspots(self.project, Commit.objects.none()).get_hotspots(), [])
+
+    def test_changes_cached_incrementally(self):
+        queryset = Commit.objects.filter(project=self.project)
+        self.assertSameHotspots(queryset)
+        changes = get_fix_changes(self.project)
+        self.assertEqual(len(changes['commit_ids']), 6)
+
+        commit = self.create_commit(7, 0, 'Fix docs', ['README'])
+        self.assertSameHotspots(queryset)
+        changes = get_fix_changes(self.project)
+        self.assertEqual(len(changes['commit_ids']), 7)
+        self.assertEqual(changes['commit_ids'][-1], commit.id)
+
+        # Cached changes are used, only new changes and the re-scan margin are fetched.
+        with mock.patch('applications.vcs.utils.bugspots.FileChange.objects.filter',
+                        wraps=FileChange.objects.filter) as filter_changes:
+            get_fix_changes(self.project)
+        self.assertEqual(filter_changes.call_args.kwargs['id__gt'], changes['last_id'] - BUGSPOTS_RESCAN_MARGIN)
+
+        # Another regular expression has its own changes.
+        self.assertEqual(len(get_fix_changes(self.project, grep='^Add')['commit_ids']), 1)
+
+    def test_late_changes_below_last_id_cached(self):
+        queryset = Commit.objects.filter(project=self.project)
+        last_id = get_fix_changes(self.project)['last_id']
+
+        # Changes which show up after newer ones were cached are found by the re-scan.
+        Commit.objects.filter(project=self.project, message='Add utils').update(message='Fix utils')
+        changes = get_fix_changes(self.project)
+        self.assertEqual(len(changes['commit_ids']), 7)
+        self.assertEqual(len(set(changes['ids'].tolist())), 7)
+        self.assertEqual(changes['last_id'], last_id)
+        self.assertSameHotspots(queryset)
+
+    @mock.patch('applications.vcs.utils.bugspots.BUGSPOTS_CACHE_SEGMENT_SIZE', 4)
+    def test_changes_cached_in_segments(self):
+        queryset = Commit.objects.filter(project=self.project)
+        get_fix_changes(self.project)
+        self.create_commit(7, 0, 'Fix docs', ['README'])
+        changes = get_fix_changes(self.project)
+
+        key = 'bugspots:{}:{}'.format(self.project.id, md5(DEFAULT_REGEX.encode('utf-8')).hexdigest())
+        self.assertEqual(cache.get('{}:count'.format(key)), 2)
+        self.assertEqual([len(cache.get('{}:{}'.format(key, index))['ids']) for index in range(2)], [4, 3])
+
+        # Changes are fetched again when a segment is evicted.
+        cache.delete('{}:0'.format(key))
+        self.assertEqual(get_fix_changes(self.project)['ids'].tolist(), changes['ids'].tolist())
+        self.assertSameHotspots(queryset)
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import json
+from datetime import datetime, timedelta
+
+import pytz
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from applications.api.common.tests import ApiBaseTestClass
+from applications.testing.selectors import get_commit_range_list
+from applications.vcs.models import Branch, Commit, ParentCommit
+from applications.vcs.utils.commit_graph import get_commit_range, is_ancestor
+
+
+class CommitGraphTestCase(ApiBaseTestClass):
+    def setUp(self):
+        self.setup_db()
+
+        now = datetime.now(pytz.UTC)
+        self.branch = Branch.objects.create(project=self.project, name='master')
+        self.commits = dict()
+        # The side commit is older than 'c2' although it is merged after it.
+        for index, (name, hours) in enumerate([('c0', 50), ('c1', 40), ('c2', 30), ('side', 35), ('merge', 20),
+                                               ('c4', 10), ('other', 5)]):
+            commit = Commit.objects.create(project=self.project, sha=str(index) * 40, display_id=str(index) * 7,
+                                           timestamp=now - timedelta(hours=hours))
+            commit.branches.add(self.branch)
+            self.commits[name] = commit
+
+        # Children arrive before their parents.
+        for child, parents in [('c4', ['merge']), ('merge', ['c2', 'side']), ('c2', ['c1']), ('side', ['c1']),
+                               ('c1', ['c0']), ('other', ['c0'])]:
+            for index_number, parent in enumerate(parents, start=1):
+                self.commits[child].add_parent(self.commits[parent], index_number)
+
+        for commit in self.commits.values():
+            commit.refresh_from_db()
+
+    def test_generations(self):
+        self.assertEqual({name: commit.generation for name, commit in self.commits.items()},
+                         {'c0': 1, 'c1': 2, 'c2': 3, 'side': 3, 'merge': 4, 'c4': 5, 'other': 2})
+
+        for child, parent in ParentCommit.objects.values_list('to_commit__generation', 'from_commit__generation'):
+            self.assertGreater(child, parent)
+
+    def test_ancestry(self):
+        commits = self.commits
+        with self.assertNumQueries(1):
+            self.assertTrue(is_ancestor(commits['c0'], commits['c4']))
+        self.assertTrue(is_ancestor(commits['side'], commits['merge']))
+        self.assertFalse(is_ancestor(commits['c2'], commits['side']))
+        self.assertFalse(is_ancestor(commits['other'], commits['c4']))
+
+        self.assertTrue(commits['c4'].is_connected_with_commit(commits['c1']))
+        self.assertTrue(commits['c1'].is_connected_with_commit(commits['c4']))
+        self.assertFalse(commits['side'].is_connected_with_commit(commits['c2']))
+
+    def test_commit_range(self):
+        commits = self.commits
+        ids = {commit.id: name for name, commit in commits.items()}
+
+        # The side branch forks below 'c2', the walk is repeated down to the generation of the fork.
+        with self.assertNumQueries(2):
+            commit_range = get_commit_range(from_commit=commits['c2'], to_commit=commits['c4'])
+        self.assertEqual(sorted(ids[commit_id] for commit_id in commit_range), ['c4', 'merge', 'side'])
+
+        commit_range = get_commit_range_list(target_branch=self.branch, first_commit=commits['c4'],
+                                             second_commit=commits['c2'])
+        self.assertEqual(sorted(ids[commit_id] for commit_id in commit_range), ['c2', 'c4', 'merge', 'side'])
+        commit_range = get_commit_range_list(target_branch=self.branch, first_commit=commits['c4'],
+                                             second_commit=commits['c2'], exclusive=True)
+        self.assertEqual(sorted(ids[commit_id] for commit_id in commit_range), ['c2', 'merge', 'side'])
+
+    def test_commit_range_without_parents(self):
+        # Commits of the branch without parent links yet are taken by the timestamp window.
+        commit = Commit.objects.create(project=self.project, sha='9' * 40, display_id='9' * 7,
+                                       timestamp=self.commits['other'].timestamp + timedelta(hours=1))
+        commit.branches.add(self.branch)
+        ids = {commit.id: name for name, commit in self.commits.items()}
+        ids[commit.id] = 'new'
+
+        commit_range = get_commit_range_list(target_branch=self.branch, first_commit=commit,
+                                             second_commit=self.commits['c2'])
+        self.assertEqual(sorted(ids[commit_id] for commit_id in commit_range), ['c2', 'c4', 'merge', 'new', 'other'])
+
+    def test_commit_range_walk_bounded_by_generation(self):
+        now = datetime.now(pytz.UTC)
+        history = list()
+        for index in range(200):
+            commit = Commit.objects.create(project=self.project, sha='h{:039d}'.format(index),
+                                           display_id='h{:06d}'.format(index), timestamp=now + timedelta(hours=index))
+            if history:
+                commit.add_parent(history[-1], 1)
+                commit.refresh_from_db()
+            history.append(commit)
+
+        with CaptureQueriesContext(connection) as context:
+            commit_range = get_commit_range(from_commit=history[-4], to_commit=history[-1])
+        self.assertEqual(sorted(commit_range), [commit.id for commit in history[-3:]])
+        self.assertEqual(len(context.captured_queries), 1)
+
+        # Ancestors of `from_commit` below the range are not walked.
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN (ANALYZE, FORMAT JSON) ' + context.captured_queries[0]['sql'])
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        nodes = [plan[0]['Plan']]
+        while nodes:
+            node = nodes.pop()
+            if node.get('Subplan Name') == 'CTE excluded':
+                self.assertLessEqual(node['Actual Rows'], 2)
+                break
+            nodes.extend(node.get('Plans', []))
+        else:
+            self.fail('CTE excluded not found in the plan')
+
+    def test_commit_range_with_long_side_branch(self):
+        now = datetime.now(pytz.UTC)
+
+        def create_commit(sha, *parents):
+            commit = Commit.objects.create(project=self.project, sha=sha, display_id=sha[:7], timestamp=now)
+            for index_number, parent in enumerate(parents, start=1):
+                commit.add_parent(parent, index_number)
+            commit.refresh_from_db()
+            return commit
+
+        main = [create_commit('m{:039d}'.format(0))]
+        for index in range(1, 100):
+            main.append(create_commit('m{:039d}'.format(index), main[-1]))
+        side = [create_commit('s{:039d}'.format(0), main[9])]
+        for index in range(1, 40):
+            side.append(create_commit('s{:039d}'.format(index), side[-1]))
+        merge = create_commit('x' * 40, main[-1], side[-1])
+
+        # The fork is 90 generations below `from_commit`, the walk isn't repeated for every side commit.
+        with CaptureQueriesContext(connection) as context:
+            commit_range = get_commit_range(from_commit=main[-1], to_commit=merge)
+        self.assertEqual(sorted(commit_range), sorted([merge.id] + [commit.id for commit in side]))
+        self.assertLessEqual(len(context.captured_queries), 8)
@@ -3,8 +3,7 @@
 import traceback
 from django.contrib.auth import get_user_model
 
-from applications.integration.ssh_v2.models import GitSSHv2Repository
-from applications.integration.ssh_v2.tasks import fetch_commits_task_v2
+from applications.integration.ssh_v2.models import GitSSHv2Repository, PendingCommitTask
 from applications.integration.tasks import processing_commits_fast_task
 from applications.vcs.models import Branch, Commit, Tag
 
@@ -49,8 +48,7 @@ def event_commit(data, repository_id):
         # )
     except Exception:
         print(traceback.format_exc())
-    task = fetch_commits_task_v2.delay(project_id=repository.project_id,
-                                       repository_id=repository.id, model_name=repository._meta.model_name, data=data)
+    task = PendingCommitTask.enqueue(repository=repository, data=data)
     return task.status
 
 
@@ -0,0 +1,37 @@
+# Generated by Django 3.2.25 on 2026-10-18 12:18
+
+import django.contrib.postgres.fields
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('git_ssh_v2_integration', '0005_alter_gitsshv2repository_is_installed_hook'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PendingCommitTask',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model_name', models.CharField(max_length=255)),
+                ('data', models.JSONField(default=dict)),
+                ('commits_sha', django.contrib.postgres.fields.ArrayField(base_field=models.CharField(max_length=255), default=list, size=None)),
+                ('promoted', models.BooleanField(default=False)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('repository', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='pending_tasks', to='git_ssh_v2_integration.gitsshv2repository')),
+            ],
+            options={
+                'verbose_name': 'pending commit task',
+                'verbose_name_plural': 'pending commit tasks',
+                'ordering': ['id'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='pendingcommittask',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['commits_sha'], name='git_ssh_v2__commits_c5b8b8_gin'),
+        ),
+    ]
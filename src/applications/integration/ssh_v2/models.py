@@ -7,6 +7,8 @@ import os
 import re
 from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import GinIndex
 from django.db import models
 
 
@@ -95,3 +97,50 @@ class GitSSHv2Repository(models.Model):
         from applications.integration.ssh_v2.utils import processing_commits_fast
         result = processing_commits_fast(project=project, repository=repository, data=data)
         return result
+
+
+class PendingCommitTask(models.Model):
+    """
+    Webhook commits waiting in the queue for `fetch_commits_task_v2`, prioritization looks up the task of
+    a commit here to run it out of turn.
+    """
+    repository = models.ForeignKey('GitSSHv2Repository', related_name='pending_tasks', on_delete=models.CASCADE)
+    model_name = models.CharField(max_length=255)
+    data = models.JSONField(default=dict)
+    commits_sha = ArrayField(models.CharField(max_length=255), default=list)
+    promoted = models.BooleanField(default=False)
+
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta(object):
+        ordering = ['id', ]
+        indexes = [GinIndex(fields=['commits_sha'])]
+        verbose_name = 'pending commit task'
+        verbose_name_plural = 'pending commit tasks'
+
+    def __str__(self):
+        return 'PendingCommitTask ({}) <Repository: {}>'.format(self.id, self.repository_id)
+
+    @classmethod
+    def enqueue(cls, repository, data):
+        pending_task = cls.objects.create(
+            repository=repository,
+            model_name=repository._meta.model_name,
+            data=data,
+            commits_sha=[commit['sha'] for commit in data.get('commits', [])]
+        )
+        return pending_task.apply_async()
+
+    def apply_async(self, **options):
+        from applications.integration.ssh_v2.tasks import fetch_commits_task_v2
+        return fetch_commits_task_v2.apply_async(
+            args=[],
+            kwargs={
+                "project_id": self.repository.project_id,
+                "repository_id": self.repository_id,
+                "model_name": self.model_name,
+                "data": self.data,
+                "pending_task_id": self.id,
+            },
+            **options
+        )
@@ -15,12 +15,17 @@ from applications.testing.utils.import_defects_v2 import import_defects_v2
 
 
 @app.task(bind=True)
-def fetch_commits_task_v2(self, project_id=None, repository_id=None, model_name=None, data=None):
+def fetch_commits_task_v2(self, project_id=None, repository_id=None, model_name=None, data=None,
+                          pending_task_id=None):
+    from applications.integration.ssh_v2.models import PendingCommitTask
     from applications.integration.ssh_v2.utils import commits_processed
 
     if data is None:
         data = {}
 
+    if pending_task_id is not None:
+        PendingCommitTask.objects.filter(id=pending_task_id).delete()
+
     processed = commits_processed(repository_id=repository_id, data=data)
     if processed:
         return
@@ -15,11 +15,12 @@ from django.utils import dateparse, timezone
 from django.utils.dateparse import parse_datetime
 from django.utils.encoding import force_bytes
 from hashlib import sha1, md5
-from django.db import models
+from django.db import models, transaction
 from applications.integration.utils import get_repository_model
 from applications.project.models import Project
-from applications.vcs.models import File, Commit, Branch, FileChange, Area
-from system.celery_app import app
+from applications.vcs.models import File, Commit, Branch, FileChange, Area, ParentCommit, CommitAreas
+from applications.vcs.utils.areas import AreaResolver, add_areas
+from applications.vcs.utils.commit_graph import update_commit_generations
 
 
 patch_re = re.compile(
@@ -41,7 +42,7 @@ status_choice = {
 }
 
 
-def prepare_branch(project, branch_name):
+def get_branch_name(branch_name):
     ref = branch_name
     if "refs/remotes/origin/" in ref:
         ref = ref[len("refs/remotes/origin/"):]
@@ -53,10 +54,30 @@ def prepare_branch(project, branch_name):
         ref = ref[len("refs/heads/"):]
     elif "heads/" in ref:
         ref = ref[len("heads/"):]
-    branch, created = Branch.objects.get_or_create(project=project, name=ref)
+    return ref
+
+
+def prepare_branch(project, branch_name):
+    branch, created = Branch.objects.get_or_create(project=project, name=get_branch_name(branch_name))
     return branch
 
 
+def prepare_branches(project, branch_names):
+    """
+    Bulk version of `prepare_branch`.
+
+    :return: dict of branch name from the payload -> branch instance
+    """
+    names = {branch_name: get_branch_name(branch_name) for branch_name in branch_names}
+    if not names:
+        return dict()
+
+    Branch.objects.bulk_create([Branch(project=project, name=name) for name in set(names.values())],
+                               ignore_conflicts=True)
+    branches = {branch.name: branch for branch in Branch.objects.filter(project=project, name__in=set(names.values()))}
+    return {branch_name: branches[name] for branch_name, name in names.items()}
+
+
 def prepare_commit_sha(commit):
     sha = commit.get('sha', None)
     if not sha:
@@ -65,145 +86,141 @@ def prepare_commit_sha(commit):
     return sha
 
 
+def get_commit_timestamp(commit_datetime):
+    try:
+        if commit_datetime and dateparse.parse_datetime(commit_datetime) is not None:
+            return commit_datetime
+    except ValueError:
+        pass
+
+    for datetime_format in ['%A, %B %d, %Y %I:%M:%S %p', '%A, %B %d, %Y %I']:
+        try:
+            return timezone.datetime.strptime(commit_datetime, datetime_format).strftime('%Y-%m-%dT%H:%M:%S')
+        except (TypeError, ValueError):
+            continue
+    return timezone.now().strftime('%Y-%m-%dT%H:%M:%S')
+
+
+def get_commit_defaults(repository=None, commit=None):
+    commit_message = commit.get("message")
+    return {
+        'repo_id': repository.id,
+        'display_id': commit["sha"][:7],
+        'author': commit.get("author", {}),
+        'committer': commit.get("committer", {}),
+        'message': commit_message[:255] if commit_message else "--empty--",
+        'stats': commit.get("stats", dict(additions=0, deletions=0, total=0)),
+        'timestamp': get_commit_timestamp(commit.get("date")),
+        'url': '',
+    }
+
+
+def link_commits_to_default_area(project=None, commit_ids=None):
+    area_default = Area.get_default(project=project)
+    commit_ids = set(commit_ids)
+    commit_ids -= set(CommitAreas.objects.filter(
+        commit_id__in=commit_ids, area_id=area_default.id).values_list('commit_id', flat=True))
+    CommitAreas.objects.bulk_create([CommitAreas(commit_id=commit_id, area_id=area_default.id)
+                                     for commit_id in commit_ids])
+
+
+def link_commits_to_branches(commit_branches=None):
+    """
+    :param commit_branches: iterable of (commit id, branch id) pairs
+    """
+    branch_through_model = Commit.branches.through
+    branch_through_model.objects.bulk_create([
+        branch_through_model(commit_id=commit_id, branch_id=branch_id)
+        for commit_id, branch_id in set(commit_branches)
+    ], ignore_conflicts=True)
+
+
 def sync_full_commits(project=None, repository=None, data=None):
-    new_hashes = []
+    """
+    Stores commits of the payload with their parents, branches and the default area. The number of queries
+    doesn't depend on the number of commits, commits stored already are only linked to the branches.
 
+    :return: list of sha of created commits
+    """
     commits = data.get('commits', [])
     head_commit = data.get('head_commit', None)
 
     if head_commit:
         commits.append(head_commit)
 
-    commit_sha_from_commits = map(lambda x: prepare_commit_sha(x), commits)
-
-    exist_commit_sha = list(project.commits.filter(sha__in=commit_sha_from_commits).values_list('sha', flat=True))
-
-    new_commits_sha = filter(lambda x: prepare_commit_sha(x) not in exist_commit_sha, commits)
-
-    for commit in new_commits_sha:
-        new_branch_list = list()
-
+    payload_commits = dict()
+    commit_branch_names = dict()
+    for commit in commits:
         commit["sha"] = prepare_commit_sha(commit)
 
         if not commit["sha"]:
             continue
 
         if "branches" in commit:
-
-            commit_branches = commit.get("branches")
-
-            if not commit_branches:
-                commit_branches = ["main", ]
-
-            for branch_name in commit_branches:
-                try:
-
-                    branch = prepare_branch(project=project, branch_name=branch_name)
-
-                    new_branch_list.append(branch)
-                except Exception as e:
-                    continue
+            branch_names = commit.get("branches") or ["main", ]
+        elif data.get('ref'):
+            branch_names = [data['ref'], ]
         else:
-            if 'ref' in data:
-                if data['ref'] != '':
-                    new_branch = prepare_branch(project=project, branch_name=data['ref'])
-                    new_branch_list.append(new_branch)
-
-        try:
-            commit = Commit.objects.get(project=project, sha=commit["sha"])
-            commit.branches.add(*new_branch_list)
-        except Commit.DoesNotExist:
-            new_commit = create_commit(project=project, repository=repository, commit=commit, branch_list=new_branch_list, is_parent=False)
-            new_hashes.append(new_commit.sha)
-        except Commit.MultipleObjectsReturned as e:
-            continue
-        except RuntimeError as e:
-            continue
-        except TypeError as e:
+            branch_names = []
+
+        payload_commits.setdefault(commit["sha"], commit)
+        commit_branch_names.setdefault(commit["sha"], set()).update(branch_names)
+
+    if not payload_commits:
+        return []
+
+    branches = prepare_branches(project, set().union(*commit_branch_names.values()))
+
+    parent_commits = dict()
+    for commit in payload_commits.values():
+        for parent in commit.get("parents", None) or list():
+            if parent.get("sha"):
+                parent_commits.setdefault(parent["sha"], parent)
+
+    existing_commits = dict(Commit.objects.filter(
+        project=project, sha__in=set(payload_commits) | set(parent_commits)).values_list('sha', 'id'))
+
+    new_commits = dict()
+    for sha, commit in list(payload_commits.items()) + list(parent_commits.items()):
+        if sha not in existing_commits and sha not in new_commits:
+            new_commits[sha] = commit
+
+    # Commits pushed in parallel with the same sha are skipped and selected below.
+    Commit.objects.bulk_create([
+        Commit(project=project, sha=sha, **get_commit_defaults(repository=repository, commit=commit))
+        for sha, commit in new_commits.items()
+    ], ignore_conflicts=True)
+    commit_ids = dict(existing_commits)
+    if new_commits:
+        commit_ids.update(Commit.objects.filter(project=project, sha__in=list(new_commits)).values_list('sha', 'id'))
+
+    # Parents of the new commits are linked to the branches of the commits as well.
+    commit_branches = set()
+    parent_links = set()
+    for sha, commit in payload_commits.items():
+        branch_ids = {branches[branch_name].id for branch_name in commit_branch_names[sha]}
+        commit_branches.update((commit_ids[sha], branch_id) for branch_id in branch_ids)
+        if sha in existing_commits:
             continue
-
-    return new_hashes
-
-
-def create_commit(project=None, repository=None, commit=None, branch_list=None, is_parent=False):
-    new_commit_tmpl = Commit()
-    sha_commit = commit["sha"]
-
-    new_commit_tmpl.project = project
-    new_commit_tmpl.repo_id = repository.id
-    new_commit_tmpl.sha = sha_commit
-    new_commit_tmpl.display_id = sha_commit[:7]
-
-    new_commit_tmpl.author = commit.get("author", {})
-    new_commit_tmpl.committer = commit.get("committer", {})
-
-    commit_message = commit.get("message")
-    if commit_message:
-        new_commit_tmpl.message = commit_message[:255]
-    else:
-        new_commit_tmpl.message = "--empty--"
-
-    new_commit_tmpl.stats = commit.get("stats", dict(additions=0, deletions=0, total=0))
-
-    commit_datetime = commit.get("date")
-
-    if dateparse.parse_datetime(commit_datetime) is None:
-        try:
-            commit_datetime = timezone.datetime.strptime(commit_datetime, '%A, %B %d, %Y %I:%M:%S %p')
-            commit_datetime = commit_datetime.strftime('%Y-%m-%dT%H:%M:%S')
-        except ValueError:
-            commit_datetime = timezone.datetime.strptime(commit_datetime, '%A, %B %d, %Y %I')
-            commit_datetime = commit_datetime.strftime('%Y-%m-%dT%H:%M:%S')
-        except Exception:
-            commit_datetime = timezone.now().strftime('%Y-%m-%dT%H:%M:%S')
-
-    new_commit_tmpl.timestamp = commit_datetime
-    new_commit_tmpl.url = ''
-    # new_commit_tmpl.save()
-
-    new_commit, created = Commit.objects.get_or_create(
-        project_id=new_commit_tmpl.project_id,
-        sha=new_commit_tmpl.sha,
-        defaults={
-            'repo_id': new_commit_tmpl.repo_id,
-            'display_id': new_commit_tmpl.display_id,
-            'author': new_commit_tmpl.author,
-            'committer': new_commit_tmpl.committer,
-            'message': new_commit_tmpl.message,
-            'stats': new_commit_tmpl.stats,
-            'timestamp': new_commit_tmpl.timestamp,
-            'url': new_commit_tmpl.url
-        }
-
-    )
-
-    area_default = Area.get_default(project)
-    new_commit.areas.add(area_default)
-    new_commit.branches.add(*branch_list)
-
-    if is_parent:  # TODO: FIX Exception RuntimeError: 'maximum recursion depth exceeded while calling a Python object'
-        new_commit.areas.add(area_default)
-        return new_commit
-
-    index_number = 0
-    try:
-        for parent in commit.get("parents", list()):
-            index_number += 1
-            parent_commit_sha = parent["sha"]
-            try:
-                parent_commit = Commit.objects.get(project_id=repository.project_id, sha=parent_commit_sha)
-            except Commit.DoesNotExist:
-                parent_commit = create_commit(project=project, repository=repository,
-                                              commit=parent, branch_list=branch_list, is_parent=True)
-            except Commit.MultipleObjectsReturned:
+        for index_number, parent in enumerate(commit.get("parents", None) or list(), start=1):
+            if parent.get("sha") not in commit_ids:
                 continue
+            commit_branches.update((commit_ids[parent["sha"]], branch_id) for branch_id in branch_ids)
+            parent_links.add((commit_ids[parent["sha"]], commit_ids[sha], index_number))
+
+    link_commits_to_branches(commit_branches)
+    link_commits_to_default_area(project=project, commit_ids=[commit_ids[sha] for sha in new_commits])
 
-            parent_commit.branches.add(*branch_list)
-            new_commit.add_parent(parent_commit, index_number)
-    except TypeError as e:
-        raise TypeError(e)
+    new_commit_ids = {commit_ids[sha] for sha in payload_commits if sha not in existing_commits}
+    parent_links -= set(ParentCommit.objects.filter(
+        to_commit_id__in=new_commit_ids).values_list('from_commit_id', 'to_commit_id', 'index_number'))
+    ParentCommit.objects.bulk_create([
+        ParentCommit(from_commit_id=from_commit_id, to_commit_id=to_commit_id, index_number=index_number)
+        for from_commit_id, to_commit_id, index_number in sorted(parent_links, key=lambda x: (x[1], x[2]))
+    ])
+    update_commit_generations(to_commit_id for _, to_commit_id, _ in parent_links)
 
-    return new_commit
+    return [sha for sha in payload_commits if sha not in existing_commits]
 
 
 def processing_commit_file_v2(project=None, repository=None, data=None):
@@ -221,6 +238,11 @@ def processing_commit_file_v2(project=None, repository=None, data=None):
 
     commits = data.get('commits', [])
 
+    # Areas of all changed files of the payload are resolved at once.
+    area_resolver = AreaResolver(project)
+    changed_files = list()
+    processed_commit_ids = list()
+
     for commit in commits:
         commit["sha"] = prepare_commit_sha(commit)
         new_commit = Commit.objects.filter(project=project, sha=commit["sha"]).last()
@@ -252,17 +274,19 @@ def processing_commit_file_v2(project=None, repository=None, data=None):
 
             file_list.append(project_file.full_filename)
 
-            filename_areas = Area.get_by_filename(project=project, filename=filename)
-            code_areas = Area.create_from_code(project=project, filename=filename, patch=patch)
-            project_file.areas.add(*filename_areas)
-            project_file.areas.add(*code_areas)
+            area_resolver.add(filename, patch=patch)
+            changed_files.append((project_file.id, new_commit.id))
+
+        processed_commit_ids.append(new_commit.id)
 
-            new_commit.areas.add(*filename_areas)
-            new_commit.areas.add(*code_areas)
-            # Default areas included in results
+    files_areas, commits_areas = set(), set()
+    for (file_id, commit_id), areas in zip(changed_files, area_resolver.resolve()):
+        files_areas.update((file_id, area_id) for area_id in areas)
+        commits_areas.update((commit_id, area_id) for area_id in areas)
+    # Default areas included in results
+    add_areas(files_areas=files_areas, commits_areas=commits_areas)
 
-        new_commit.is_processed = True
-        new_commit.save()
+    Commit.objects.filter(id__in=processed_commit_ids).update(is_processed=True, updated=timezone.now())
 
     file_list = list(set(file_list))
     return file_list
@@ -323,43 +347,43 @@ def processing_commits_fast(project=None, repository=None, data=None):
 
     branch = prepare_branch(project, ref)
 
-    for commit in commits:
-        sha = commit['sha']
-        display_id = commit['sha'][:7]
-        message = commit['message'][:255]
-        timestamp = datetimeparser.parse(commit['date'])
-        author = commit['author']
-        committer = commit['committer']
-        url = ''
-
-        defaults = {
-            'repo_id': sha,
-            'display_id': display_id,
-            'message': message,
-            'author': author,
-            'committer': committer,
-            'stats': {
+    payload_commits = {commit['sha']: commit for commit in commits}
+    if not payload_commits:
+        return True
+
+    existing_commits = dict(Commit.objects.filter(project=project, sha__in=list(payload_commits)).values_list('sha', 'id'))
+    Commit.objects.filter(id__in=existing_commits.values()).update(is_processed=False, updated=timezone.now())
+
+    new_commits = list()
+    for sha, commit in payload_commits.items():
+        if sha in existing_commits:
+            continue
+        new_commits.append(Commit(
+            project=project,
+            sha=sha,
+            repo_id=sha,
+            display_id=sha[:7],
+            message=commit['message'][:255],
+            author=commit['author'],
+            committer=commit['committer'],
+            stats={
                 'deletions': 0,
                 'additions': 0,
                 'total': 0
             },
-            'timestamp': timestamp.strftime('%Y-%m-%dT%H:%M:%S'),
-            'url': url
-        }
-        new_commit, created = Commit.objects.get_or_create(
-            project=project,
-            sha=sha,
-            defaults=defaults
-        )
-        new_commit.is_processed = False
-        new_commit.save()
+            timestamp=datetimeparser.parse(commit['date']).strftime('%Y-%m-%dT%H:%M:%S'),
+            url='',
+            is_processed=False
+        ))
+    Commit.objects.bulk_create(new_commits, ignore_conflicts=True)
 
-        area_default = Area.get_default(project=project)
-        area_through_model = Commit.areas.through
-        area_through_model.objects.update_or_create(commit_id=new_commit.id, area_id=area_default.id)
+    commit_ids = dict(existing_commits)
+    if new_commits:
+        commit_ids.update(Commit.objects.filter(
+            project=project, sha__in=[commit.sha for commit in new_commits]).values_list('sha', 'id'))
 
-        branch_through_model = Commit.branches.through
-        branch_through_model.objects.update_or_create(commit_id=new_commit.id, branch_id=branch.id)
+    link_commits_to_default_area(project=project, commit_ids=commit_ids.values())
+    link_commits_to_branches((commit_id, branch.id) for commit_id in commit_ids.values())
 
     return True
 
@@ -385,27 +409,21 @@ def commits_processed(repository_id=None, data=None):
 
 
 def prioritize_task(commits_sha):
-    from applications.integration.ssh_v2.tasks import fetch_commits_task_v2
-
-    reserved_tasks = app.control.inspect().reserved().items()
-    for queue, tasks in reserved_tasks:
-        if queue.startswith("common"):
-            for task in tasks:
-                project_id = task.get("kwargs").get("project_id")
-                repository_id = task.get("kwargs").get("repository_id")
-                model_name = task.get("kwargs").get("model_name")
-                data = task.get("kwargs").get("data")
-                if task.get("name") == "applications.integration.ssh_v2.tasks.fetch_commits_task_v2":
-                    for commit in task.get("kwargs").get("data").get("commits"):
-                        if commit.get("sha") in commits_sha:
-                            fetch_commits_task_v2.apply_async(
-                                args=[],
-                                kwargs={
-                                    "project_id": project_id,
-                                    "repository_id": repository_id,
-                                    "model_name": model_name,
-                                    "data": data,
-                                },
-                                queue="commit_processing",
-                            )
-                            break
\ No newline at end of file
+    """
+    Runs the waiting `fetch_commits_task_v2` tasks of the commits in the 'commit_processing' queue, the task
+    left in its queue returns at once because the commits are processed already.
+    """
+    from applications.integration.ssh_v2.models import PendingCommitTask
+
+    commits_sha = list(commits_sha)
+    if not commits_sha:
+        return
+
+    with transaction.atomic():
+        pending_tasks = list(PendingCommitTask.objects.select_for_update(skip_locked=True, of=('self', )).select_related(
+            'repository').filter(commits_sha__overlap=commits_sha, promoted=False))
+        PendingCommitTask.objects.filter(id__in=[pending_task.id for pending_task in pending_tasks]).update(
+            promoted=True)
+
+    for pending_task in pending_tasks:
+        pending_task.apply_async(queue="commit_processing")
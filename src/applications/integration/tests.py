@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import os
+import tempfile
+from unittest import mock
+
+import git
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from applications.api.common.tests import ApiBaseTestClass
+from applications.integration.ssh_v2.models import GitSSHv2Repository, PendingCommitTask
+from applications.integration.ssh_v2.tasks import fetch_commits_task_v2
+from applications.integration.ssh_v2.utils import prioritize_task, processing_commits_fast, sync_full_commits
+from applications.integration.utils import create_commit_changed_files, create_or_update_commit, \
+    processing_commits, processing_files
+from applications.project.models import Project
+from applications.vcs.models import Area, Branch, Commit, File, FileChange, ParentCommit
+
+
+class LocalRepository(object):
+    def __init__(self, project, path):
+        self.project = project
+        self.repo = git.Repo(path)
+
+    def get_repo(self, **kwargs):
+        return self.repo
+
+    def get_refs(self):
+        return ['master', 'feature']
+
+    def get_commits(self, refspec=None, **kwargs):
+        return list(self.repo.iter_commits(rev=refspec, reverse=True))
+
+    def url_commit(self, sha):
+        return 'http://localhost/commits/{}'.format(sha)
+
+
+def processing_each(project, repository):
+    """ Per commit ingestion as it was before the bulk one. """
+    for refspec in repository.get_refs():
+        branch, _ = Branch.objects.get_or_create(project=project, name=refspec)
+        for commit in repository.get_commits(refspec=refspec):
+            create_or_update_commit(project=project, repository=repository, branch=branch, refspec=refspec,
+                                    commit=commit)
+    for refspec in repository.get_refs():
+        for commit in repository.get_commits(refspec=refspec):
+            create_commit_changed_files(project=project, repository=repository, repo=repository.repo,
+                                        refspec=refspec, commit=commit)
+
+
+class ProcessingCommitsTestCase(ApiBaseTestClass):
+    def setUp(self):
+        self.setup_db()
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.repo = self.create_repo(self.directory.name)
+
+    def commit(self, repo, message, files):
+        for filename, content in files.items():
+            filepath = os.path.join(repo.working_dir, filename)
+            os.makedirs(os.path.dirname(filepath), exist_ok=True)
+            with open(filepath, 'w') as outfile:
+                outfile.write(content)
+            repo.index.add([filename])
+        return repo.index.commit(message)
+
+    def create_repo(self, path):
+        repo = git.Repo.init(path, initial_branch='master')
+        with repo.config_writer() as config:
+            config.set_value('user', 'name', 'Developer')
+            config.set_value('user', 'email', 'developer@example.com')
+
+        self.commit(repo, 'Initial', {'src/app/models.py': 'class User:\n    pass\n', 'README': 'readme\n'})
+        self.commit(repo, 'Add views', {'src/app/views.py': 'def index():\n    pass\n'})
+        repo.create_head('feature').checkout()
+        self.commit(repo, 'Feature', {'src/app/models.py': 'class User:\n    name = None\n',
+                                      'src/lib/utils/text.py': 'def split():\n    pass\n'})
+        repo.heads.master.checkout()
+        self.commit(repo, 'Fix views', {'src/app/views.py': 'def index():\n    return None\n'})
+        repo.git.merge('feature', '--no-ff', '-m', 'Merge feature')
+        repo.heads.feature.checkout()
+        self.commit(repo, 'More feature', {'src/lib/utils/text.py': 'def split():\n    return []\n'})
+        return repo
+
+    @staticmethod
+    def summary(project):
+        commits = Commit.objects.filter(project=project)
+        return {
+            'commits': sorted((commit.sha, commit.message, commit.stats['total'],
+                               sorted(commit.branches.values_list('name', flat=True)),
+                               sorted(commit.areas.values_list('name', flat=True)))
+                              for commit in commits),
+            'parents': sorted(ParentCommit.objects.filter(to_commit__project=project).values_list(
+                'from_commit__sha', 'to_commit__sha', 'index_number')),
+            'files': sorted((file.full_filename, file.filename, file.parent.full_filename if file.parent else None,
+                             file.level, file.sha, sorted(file.areas.values_list('name', flat=True)))
+                            for file in File.objects.filter(project=project)),
+            'changes': sorted(FileChange.objects.filter(commit__project=project).values_list(
+                'commit__sha', 'file__full_filename', 'additions', 'deletions', 'status', 'patch')),
+        }
+
+    def test_same_result_as_per_commit_processing(self):
+        for project in [self.project, Project.objects.create(organization=self.organization, name='other')]:
+            project.auto_area_on_commit = True
+            project.save()
+        expected_project = Project.objects.get(name='other')
+
+        processing_each(expected_project, LocalRepository(expected_project, self.directory.name))
+
+        repository = LocalRepository(self.project, self.directory.name)
+        commits = processing_commits(project=self.project, repository=repository)
+        files = processing_files(project=self.project, repository=repository)
+
+        self.assertEqual(len(commits), 9)
+        self.assertIn('src/lib/utils/text.py', files)
+
+        expected = self.summary(expected_project)
+        self.assertEqual(len(expected['commits']), 6)
+        self.maxDiff = None
+        self.assertEqual(self.summary(self.project), expected)
+
+    def test_file_trees_rebuilt(self):
+        repository = LocalRepository(self.project, self.directory.name)
+        processing_commits(project=self.project, repository=repository)
+        processing_files(project=self.project, repository=repository)
+
+        self.assertFalse(File.objects.filter(project=self.project, lft=0).exists())
+        src = File.objects.get(project=self.project, full_filename='src')
+        self.assertEqual(
+            sorted(src.get_descendants().values_list('full_filename', flat=True)),
+            ['src/app', 'src/app/models.py', 'src/app/views.py', 'src/lib', 'src/lib/utils', 'src/lib/utils/text.py']
+        )
+
+        # Processing again doesn't add anything.
+        processing_commits(project=self.project, repository=repository)
+        processing_files(project=self.project, repository=repository)
+        self.assertEqual(Commit.objects.filter(project=self.project).count(), 6)
+        self.assertEqual(File.objects.filter(project=self.project).count(), 8)
+        self.assertEqual(Area.objects.filter(project=self.project, name='Default Area').count(), 1)
+
+
+@mock.patch('applications.integration.ssh_v2.tasks.fetch_commits_task_v2.apply_async')
+class PrioritizeTaskTestCase(ApiBaseTestClass):
+    def setUp(self):
+        self.setup_db()
+        self.repository = GitSSHv2Repository.objects.create(project=self.project, user=self.user,
+                                                            repository_name='repository')
+        self.data = {'commits': [{'sha': 'a' * 40}, {'sha': 'b' * 40}]}
+
+    def test_pending_task_promoted_once(self, apply_async):
+        PendingCommitTask.enqueue(repository=self.repository, data=self.data)
+        pending_task = PendingCommitTask.objects.get(repository=self.repository)
+        self.assertEqual(pending_task.commits_sha, ['a' * 40, 'b' * 40])
+        self.assertEqual(apply_async.call_args.kwargs['kwargs']['pending_task_id'], pending_task.id)
+        self.assertNotIn('queue', apply_async.call_args.kwargs)
+
+        prioritize_task(commits_sha=['c' * 40])
+        self.assertEqual(apply_async.call_count, 1)
+
+        prioritize_task(commits_sha=['b' * 40, 'c' * 40])
+        self.assertEqual(apply_async.call_count, 2)
+        self.assertEqual(apply_async.call_args.kwargs['queue'], 'commit_processing')
+        self.assertEqual(apply_async.call_args.kwargs['kwargs']['data'], self.data)
+
+        prioritize_task(commits_sha=['a' * 40])
+        self.assertEqual(apply_async.call_count, 2)
+
+    @mock.patch('applications.integration.ssh_v2.utils.commits_processed', mock.MagicMock(return_value=True))
+    def test_pending_task_removed_when_run(self, apply_async):
+        PendingCommitTask.enqueue(repository=self.repository, data=self.data)
+        pending_task = PendingCommitTask.objects.get(repository=self.repository)
+
+        fetch_commits_task_v2.apply(kwargs=apply_async.call_args.kwargs['kwargs'])
+
+        self.assertFalse(PendingCommitTask.objects.filter(id=pending_task.id).exists())
+
+
+class SyncCommitsTestCase(ApiBaseTestClass):
+    def setUp(self):
+        self.setup_db()
+        self.repository = GitSSHv2Repository.objects.create(project=self.project, user=self.user,
+                                                            repository_name='repository')
+
+    @staticmethod
+    def get_payload(prefix, size):
+        """ Linear history of `size` commits on top of the root commit which is only sent as a parent. """
+        shas = ['{}{:039d}'.format(prefix, index) for index in range(size + 1)]
+        commits = [{'sha': sha, 'date': '2021-01-0{}T10:00:00+00:00'.format(index % 9 + 1), 'message': sha,
+                    'author': {'name': 'author'}, 'committer': {'name': 'author'},
+                    'branches': ['origin/feature'] if index == size else [],
+                    'parents': [{'sha': shas[index - 1], 'date': 'Monday, January 4, 2021 10:00:00 AM'}]}
+                   for index, sha in enumerate(shas) if index]
+        return {'commits': commits, 'ref': 'refs/heads/master'}
+
+    def sync(self, data):
+        with CaptureQueriesContext(connection) as context:
+            new_commits_sha = sync_full_commits(project=self.project, repository=self.repository, data=data)
+        return new_commits_sha, len(context.captured_queries)
+
+    def test_sync_full_commits(self):
+        data = self.get_payload('a', 3)
+        new_commits_sha, _ = self.sync(data)
+
+        shas = [commit['sha'] for commit in data['commits']]
+        self.assertEqual(new_commits_sha, shas)
+        commits = {commit.sha: commit for commit in Commit.objects.filter(project=self.project)}
+        self.assertEqual(len(commits), 4)
+        root = commits['a' + '0' * 39]
+        self.assertEqual([commits[sha].generation for sha in shas], [2, 3, 4])
+        self.assertEqual(list(commits[shas[0]].parents.all()), [root])
+        self.assertEqual(root.timestamp.day, 4)
+
+        self.assertEqual(sorted(commits[shas[-1]].branches.values_list('name', flat=True)), ['feature'])
+        self.assertEqual(sorted(commits[shas[-2]].branches.values_list('name', flat=True)), ['feature', 'main'])
+        self.assertEqual(list(root.branches.values_list('name', flat=True)), ['main'])
+        default = Area.get_default(project=self.project)
+        self.assertEqual(Commit.objects.filter(project=self.project, areas=default).count(), 4)
+
+        # Stored commits are skipped.
+        new_commits_sha, _ = self.sync(self.get_payload('a', 3))
+        self.assertEqual(new_commits_sha, [])
+        self.assertEqual(ParentCommit.objects.count(), 3)
+        self.assertEqual(Commit.objects.filter(project=self.project, areas=default).count(), 4)
+
+    def test_queries_independent_of_payload_size(self):
+        Area.get_default(project=self.project)
+        _, small_queries = self.sync(self.get_payload('b', 2))
+        _, large_queries = self.sync(self.get_payload('c', 50))
+        self.assertEqual(small_queries, large_queries)
+        self.assertEqual(Commit.objects.filter(project=self.project).count(), 2 + 1 + 50 + 1)
+
+    def test_processing_commits_fast(self):
+        data = self.get_payload('d', 3)
+        Commit.objects.create(project=self.project, sha=data['commits'][0]['sha'], is_processed=True)
+
+        self.assertTrue(processing_commits_fast(project=self.project, repository=self.repository, data=data))
+        commits = Commit.objects.filter(project=self.project)
+        self.assertEqual(commits.count(), 3)
+        self.assertFalse(commits.filter(is_processed=True).exists())
+        self.assertEqual(commits.filter(branches__name='master').count(), 3)
+        self.assertEqual(commits.filter(areas=Area.get_default(project=self.project)).count(), 3)
@@ -5,12 +5,17 @@ import os
 import time
 import re
 from datetime import datetime, timedelta
+from itertools import islice
 from django.apps import apps as django_apps
 from django.conf import settings
-from django.db import models
+from django.db import models, transaction
+from django.utils import timezone
 from git import GitCommandError
 
-from applications.vcs.models import Commit, Branch, File, FileChange, Area, ParentCommit
+from applications.vcs.models import Commit, Branch, File, FileChange, Area, ParentCommit, CommitAreas
+from applications.vcs.utils.areas import AreaResolver, add_areas
+from applications.vcs.utils.bugspots import get_fix_changes
+from applications.vcs.utils.commit_graph import update_commit_generations
 
 mtime = time.time
 sleep = time.sleep
@@ -29,6 +34,16 @@ output_re = re.compile(
 
 FNULL = open(os.devnull, 'w')
 
+COMMIT_BATCH_SIZE = getattr(settings, 'INTEGRATION_COMMIT_BATCH_SIZE', 500)
+
+STATUS_CHOICE = {
+    'A': FileChange.STATUS_ADDED,
+    'M': FileChange.STATUS_MODIFIED,
+    'D': FileChange.STATUS_DELETED,
+    'R': FileChange.STATUS_RENAMED,
+    'T': FileChange.STATUS_MODIFIED,
+}
+
 
 def get_repository_model(model_name):
     """
@@ -87,6 +102,7 @@ def processing_commits(project=None, repository=None, ref=None, before=None, aft
         refs = [ref, ]
 
     new_commits = []
+    stored_commits = dict()
 
     for refspec in refs:
 
@@ -103,33 +119,123 @@ def processing_commits(project=None, repository=None, ref=None, before=None, aft
                 commits
             )
 
-        for commit in commits:
-            new_commit, _ = create_or_update_commit(project=repository.project, repository=repository, branch=branch,
-                                                    refspec=refspec, commit=commit)
-            new_commits.append(new_commit)
-
-        # db_exist_commits = list(
-        #     Commit.objects.filter(
-        #         project=project,
-        #         sha__in=map(lambda x: str(x.hexsha), commits)).values_list('sha', flat=True)
-        # )
-        #
-        # for commit in filter(lambda x: str(x.hexsha) not in db_exist_commits, commits):
-        #     new_commit, _ = create_or_update_commit(project=repository.project, repository=repository, branch=branch,
-        #                                             refspec=refspec, commit=commit)
-        #     new_commits.append(new_commit)
-        #
-        # update_commits_queryset = Commit.objects.filter(project=repository.project, sha__in=db_exist_commits)
-        #
-        # through_model = Commit.branches.through
-        # through_model.objects.bulk_create([
-        #     through_model(commit_id=id, branch_id=branch.id)
-        #     for id in update_commits_queryset.exclude(branches__id=branch.id).values_list('id', flat=True)
-        # ])
+        for commits_batch in iter_batches(commits):
+            new_commits.extend(bulk_create_or_update_commits(project=repository.project, repository=repository,
+                                                             branch=branch, commits=commits_batch,
+                                                             stored_commits=stored_commits))
 
     return new_commits
 
 
+def get_commit_defaults(repository=None, commit=None):
+    return {
+        'repo_id': commit.hexsha,
+        'display_id': commit.hexsha[:7],
+        'author': {
+            'email': commit.author.email,
+            'name': commit.author.name,
+            'date': datetime.fromtimestamp(commit.authored_date).strftime('%Y-%m-%dT%H:%M:%SZ'),
+        },
+        'committer': {
+            'email': commit.committer.email,
+            'name': commit.committer.name,
+            'date': datetime.fromtimestamp(commit.committed_date).strftime('%Y-%m-%dT%H:%M:%SZ'),
+        },
+        'message': commit.message[:255],
+        'stats': {
+            'deletions': commit.stats.total.get('deletions', 0),
+            'additions': commit.stats.total.get('insertions', 0),
+            'total': commit.stats.total.get('lines', 0)
+        },
+        'timestamp': datetime.fromtimestamp(commit.authored_date).strftime('%Y-%m-%dT%H:%M:%SZ'),
+        'url': repository.url_commit(commit.hexsha)
+    }
+
+
+def iter_batches(iterable, batch_size=COMMIT_BATCH_SIZE):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def bulk_create_or_update_commits(project=None, repository=None, branch=None, commits=None, stored_commits=None):
+    """
+    Bulk version of `create_or_update_commit` for a batch of commits walked in `reverse` order.
+
+    :param stored_commits: dict of sha -> commit instance filled by previous batches, commits from it are
+    only linked to the branch.
+    :return: list of commit instances in order of `commits`
+    """
+    if stored_commits is None:
+        stored_commits = dict()
+
+    git_commits = dict()
+    for commit in commits:
+        for parent in commit.parents:
+            git_commits.setdefault(parent.hexsha, parent)
+        git_commits[commit.hexsha] = commit
+
+    commits_shas = {commit.hexsha for commit in commits}
+    unknown_shas = [sha for sha in git_commits if sha not in stored_commits]
+
+    existing_commits = {commit.sha: commit for commit in Commit.objects.filter(project=project, sha__in=unknown_shas)}
+
+    updated_commits = list()
+    for sha, db_commit in existing_commits.items():
+        if sha in commits_shas:
+            commit = git_commits[sha]
+            db_commit.stats = {
+                'deletions': commit.stats.total.get('deletions', 0),
+                'additions': commit.stats.total.get('insertions', 0),
+                'total': commit.stats.total.get('lines', 0)
+            }
+            db_commit.updated = timezone.now()
+            updated_commits.append(db_commit)
+    Commit.objects.bulk_update(updated_commits, ['stats', 'updated'])
+
+    created_commits = [Commit(project=project, sha=sha, **get_commit_defaults(repository=repository, commit=git_commits[sha]))
+                       for sha in unknown_shas if sha not in existing_commits]
+    Commit.objects.bulk_create(created_commits)
+
+    stored_commits.update(existing_commits)
+    stored_commits.update({commit.sha: commit for commit in created_commits})
+
+    new_commit_ids = {stored_commits[sha].id for sha in unknown_shas}
+    parent_commits = set()
+    for commit in commits:
+        if stored_commits[commit.hexsha].id not in new_commit_ids:
+            continue
+        for index_number, parent in enumerate(commit.parents, start=1):
+            parent_commits.add((stored_commits[parent.hexsha].id, stored_commits[commit.hexsha].id, index_number))
+
+    parent_commits -= set(ParentCommit.objects.filter(
+        to_commit_id__in=new_commit_ids).values_list('from_commit_id', 'to_commit_id', 'index_number'))
+    ParentCommit.objects.bulk_create([
+        ParentCommit(from_commit_id=from_commit_id, to_commit_id=to_commit_id, index_number=index_number)
+        for from_commit_id, to_commit_id, index_number in sorted(parent_commits, key=lambda x: (x[1], x[2]))
+    ])
+    update_commit_generations(to_commit_id for _, to_commit_id, _ in parent_commits)
+
+    area_default = Area.get_default(project=project)
+    commit_ids = {stored_commits[sha].id for sha in git_commits}
+    commit_ids_with_default_area = set(CommitAreas.objects.filter(
+        commit_id__in=new_commit_ids, area_id=area_default.id).values_list('commit_id', flat=True))
+    CommitAreas.objects.bulk_create([
+        CommitAreas(commit_id=commit_id, area_id=area_default.id)
+        for commit_id in new_commit_ids - commit_ids_with_default_area
+    ])
+
+    branch_through_model = Commit.branches.through
+    branch_through_model.objects.bulk_create([
+        branch_through_model(commit_id=commit_id, branch_id=branch.id) for commit_id in commit_ids
+    ], ignore_conflicts=True)
+
+    return [stored_commits[commit.hexsha] for commit in commits]
+
+
 def create_commit(project=None, repository=None, branch=None, refspec=None, commit=None, is_parent=False):
 
     defaults = {
@@ -326,6 +432,7 @@ def processing_files(project=None, repository=None, ref=None, before=None, after
         refs = [ref, ]
 
     commits_changed_files = []
+    processed_shas = set()
 
     for refspec in refs:
 
@@ -341,23 +448,28 @@ def processing_files(project=None, repository=None, ref=None, before=None, after
                 commits
             )
 
-        for commit in commits:
-            changed_files, result = create_commit_changed_files(project=repository.project, repository=repository,
-                                                                repo=repo, refspec=refspec, commit=commit)
-            if result:
-                commits_changed_files.extend(changed_files)
+        # Refs share most of their history, every commit is processed once.
+        commits = [commit for commit in commits if commit.hexsha not in processed_shas]
+        processed_shas.update(commit.hexsha for commit in commits)
 
-    return commits_changed_files
+        for commits_batch in iter_batches(commits):
+            changed_files = bulk_create_commits_changed_files(project=repository.project, repository=repository,
+                                                              repo=repo, commits=commits_batch)
+            commits_changed_files.extend(changed_files)
 
+    File.rebuild_file_trees(project=repository.project)
+    get_fix_changes(project=repository.project)
 
-def create_commit_changed_files(project=None, repository=None, repo=None, refspec=None, commit=None):
+    return commits_changed_files
 
-    changed_files = []
 
-    try:
-        db_commit = Commit.objects.get(project=project, sha=commit.hexsha)
-    except Commit.DoesNotExist:
-        return changed_files, False
+def get_commit_changes(repo=None, commit=None):
+    """
+    Changed files of commit against each of its parents.
+
+    :return: list of dicts with path, sha, stats, status, patch and previous_filename
+    """
+    changes = []
 
     parents = list(commit.parents)
 
@@ -394,55 +506,153 @@ def create_commit_changed_files(project=None, repository=None, repo=None, refspe
             else:
                 file_sha = str()
 
-            filename = obj_path
-            project_file = File.add_file_tree(project, filename, sha=file_sha)
-
             previous_filename = diff.rename_from
 
             if previous_filename is None:
                 previous_filename = str()
 
-            patch = diff.diff
+            changes.append({
+                'path': obj_path,
+                'sha': file_sha,
+                'stats': stats,
+                'status': STATUS_CHOICE.get(get_diff_type(diff)),
+                'patch': diff.diff,
+                'previous_filename': previous_filename,
+            })
 
-            status_choice = {
-                'A': FileChange.STATUS_ADDED,
-                'M': FileChange.STATUS_MODIFIED,
-                'D': FileChange.STATUS_DELETED,
-                'R': FileChange.STATUS_RENAMED,
-                'T': FileChange.STATUS_MODIFIED,
-            }
-            current_diff_type = get_diff_type(diff)
-
-            # try:
-            #     patch = unicode(patch, encoding='utf-8')
-            # except UnicodeDecodeError:
-            #     patch = ''
-
-            project_file.add_changes(
-                commit=db_commit,
-                additions=stats.get('insertions'),
-                deletions=stats.get('deletions'),
-                changes=stats.get('lines'),
-                status=status_choice.get(current_diff_type),
-                patch=patch,
-                previous_filename=previous_filename,
-            )
+    return changes
 
-            changed_files.append(project_file.full_filename)
 
-            filename_areas = Area.get_by_filename(project=project, filename=filename)
-            code_areas = Area.create_from_code(project=project, filename=filename, patch=patch)
+def create_commit_changed_files(project=None, repository=None, repo=None, refspec=None, commit=None):
 
-            project_file.areas.add(*filename_areas)
-            project_file.areas.add(*code_areas)
+    changed_files = []
 
-            db_commit.areas.add(*filename_areas)
-            db_commit.areas.add(*code_areas)
-            # Default areas included in results
+    try:
+        db_commit = Commit.objects.get(project=project, sha=commit.hexsha)
+    except Commit.DoesNotExist:
+        return changed_files, False
+
+    area_resolver = AreaResolver(project)
+    project_files = []
+    for change in get_commit_changes(repo=repo, commit=commit):
+        filename = change['path']
+        project_file = File.add_file_tree(project, filename, sha=change['sha'])
+
+        stats = change['stats']
+        patch = change['patch']
+
+        project_file.add_changes(
+            commit=db_commit,
+            additions=stats.get('insertions'),
+            deletions=stats.get('deletions'),
+            changes=stats.get('lines'),
+            status=change['status'],
+            patch=patch,
+            previous_filename=change['previous_filename'],
+        )
+
+        changed_files.append(project_file.full_filename)
+
+        area_resolver.add(filename, patch=patch)
+        project_files.append(project_file)
+
+    files_areas, commits_areas = set(), set()
+    for project_file, areas in zip(project_files, area_resolver.resolve()):
+        files_areas.update((project_file.id, area_id) for area_id in areas)
+        commits_areas.update((db_commit.id, area_id) for area_id in areas)
+    # Default areas included in results
+    add_areas(files_areas=files_areas, commits_areas=commits_areas)
 
     return changed_files, True
 
 
+def clean_text(value):
+    if isinstance(value, bytes):
+        value = value.decode('utf8', errors='replace')
+    return value.replace(chr(0x00), '')
+
+
+def bulk_create_commits_changed_files(project=None, repository=None, repo=None, commits=None):
+    """
+    Bulk version of `create_commit_changed_files` for a batch of commits.
+    File trees touched by the batch are left for `File.rebuild_file_trees`.
+
+    :return: list of full filenames of changed files
+    """
+    db_commits = dict(Commit.objects.filter(
+        project=project, sha__in=[commit.hexsha for commit in commits]).values_list('sha', 'id'))
+
+    changes = []
+    for commit in commits:
+        if commit.hexsha not in db_commits:
+            continue
+        for change in get_commit_changes(repo=repo, commit=commit):
+            change['commit_id'] = db_commits[commit.hexsha]
+            changes.append(change)
+
+    if not changes:
+        return []
+
+    with transaction.atomic():
+        files = File.bulk_add_file_tree(project, [change['path'] for change in changes], rebuild=False)
+
+        updated_files = dict()
+        for change in changes:
+            project_file = files[change['path']]
+            if project_file.sha != change['sha']:
+                project_file.sha = change['sha']
+                updated_files[project_file.id] = project_file
+        File.objects.bulk_update(list(updated_files.values()), ['sha'])
+
+        file_changes = dict()
+        for change in changes:
+            stats = change['stats']
+            file_changes[(change['commit_id'], files[change['path']].id)] = {
+                'additions': stats.get('insertions'),
+                'deletions': stats.get('deletions'),
+                'changes': stats.get('lines'),
+                'status': change['status'],
+                'patch': clean_text(change['patch']),
+                'blame': '',
+                'previous_filename': clean_text(change['previous_filename']),
+            }
+
+        existing_file_changes = {
+            (file_change.commit_id, file_change.file_id): file_change
+            for file_change in FileChange.objects.filter(
+                commit_id__in={commit_id for commit_id, _ in file_changes}).only('id', 'commit_id', 'file_id')
+        }
+
+        now = timezone.now()
+        created_file_changes, updated_file_changes = [], []
+        for (commit_id, file_id), values in file_changes.items():
+            file_change = existing_file_changes.get((commit_id, file_id))
+            if file_change is None:
+                created_file_changes.append(FileChange(commit_id=commit_id, file_id=file_id, **values))
+            else:
+                for field, value in values.items():
+                    setattr(file_change, field, value)
+                file_change.updated = now
+                updated_file_changes.append(file_change)
+
+        FileChange.objects.bulk_create(created_file_changes)
+        FileChange.objects.bulk_update(updated_file_changes, ['additions', 'deletions', 'changes', 'status', 'patch',
+                                                              'blame', 'previous_filename', 'updated'])
+
+        area_resolver = AreaResolver(project)
+        for change in changes:
+            area_resolver.add(change['path'], patch=change['patch'])
+
+        files_areas, commits_areas = set(), set()
+        for change, areas in zip(changes, area_resolver.resolve()):
+            for area_id in areas:
+                files_areas.add((files[change['path']].id, area_id))
+                commits_areas.add((change['commit_id'], area_id))
+        add_areas(files_areas=files_areas, commits_areas=commits_areas)
+
+    return [files[change['path']].full_filename for change in changes]
+
+
 def processing_rework(project=None, repository=None, ref=None, before=None, after=None, since_time=None):
 
     repo = repository.get_repo(ref=ref, before=before, after=after)
@@ -1,5 +1,8 @@
 
 from datetime import datetime, timedelta
+from django.conf import settings
+from django.db import models
+from django.utils import timezone
 from applications.testing.models import TestSuite
 from applications.project.models import Project
 from applications.ml.models import MLModel, MLDataset, DatasetStates, MLStates, create_sequence
@@ -7,6 +10,10 @@ from applications.ml.utils.log import logger
 from applications.ml.utils.functional import Statistic
 
 
+# Datasets not updated in preparing for longer are treated as interrupted and resumed.
+DATASET_PREPARING_TIMEOUT = timedelta(seconds=getattr(settings, "ML_DATASET_PREPARING_TIMEOUT", 6 * 60 * 60))
+
+
 def create_and_check_models():
     stats = Statistic()
 
@@ -66,7 +73,10 @@ def create_and_check_models():
 def perform_prepare_datasets():
     stats = Statistic()
 
-    queryset = MLDataset.objects.filter(state=DatasetStates.PENDING).order_by("test_suite", "index", "updated")[:30]
+    stale_preparing = models.Q(state=DatasetStates.PREPARING, updated__lt=timezone.now() - DATASET_PREPARING_TIMEOUT)
+    queryset = MLDataset.objects.filter(
+        models.Q(state=DatasetStates.PENDING) | stale_preparing
+    ).order_by("test_suite", "index", "updated")[:30]
     stats.total = queryset.count()
     logger.info(f"{stats} models for preparing datasets are selected")
 
@@ -0,0 +1,19 @@
+# Generated by Django 3.2.25 on 2026-10-18 12:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('testing', '0023_test_run_current_result'),
+        ('ml', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mldataset',
+            name='prepared_tests',
+            field=models.ManyToManyField(blank=True, related_name='prepared_datasets', to='testing.Test'),
+        ),
+    ]
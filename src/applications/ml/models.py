@@ -5,8 +5,11 @@ from dateutil.relativedelta import relativedelta
 from django.db import models
 from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
+from django.utils import timezone
 from applications.ml.utils.dataset import get_dataset_test_ids, export_datasets
 from applications.ml.utils.log import logger
+from applications.ml.utils.model import get_model_directory, get_nlp_model_filename
+from applications.ml.utils.registry import model_registry
 from applications.ml.network import TestPrioritizationNLPCBM
 
 
@@ -38,6 +41,12 @@ class MLDataset(models.Model):
         blank=True
     )
 
+    prepared_tests = models.ManyToManyField(
+        "testing.Test",
+        related_name="prepared_datasets",
+        blank=True
+    )
+
     state = models.CharField(
         verbose_name="state",
         max_length=128,
@@ -86,13 +95,29 @@ class MLDataset(models.Model):
                                         from_date=self.from_date, to_date=self.to_date)
         return self.test_suite.tests.filter(id__in=test_ids)
 
+    def claim(self):
+        """
+        Moves the dataset to preparing if nobody changed it since it was loaded, so a stale preparing dataset
+        is resumed by one process only.
+        """
+        now = timezone.now()
+        claimed = MLDataset.objects.filter(id=self.id, state=self.state, updated=self.updated).update(
+            state=DatasetStates.PREPARING, updated=now)
+        if claimed:
+            self.state = DatasetStates.PREPARING
+            self.updated = now
+        return bool(claimed)
+
     def prepare(self):
-        self.state = DatasetStates.PREPARING
-        self.save()
-        # TODO: RUN function with threads
-        # TODO: Update one more time tests
-        tests = list(self.tests_for_train)
-        self.tests.set(tests)
+        # Interrupted preparing is resumed from the tests not exported yet.
+        resume = self.state == DatasetStates.PREPARING
+        if not self.claim():
+            logger.info(f"{self} is prepared by another process")
+            return
+        if not resume:
+            tests = list(self.tests_for_train)
+            self.tests.set(tests)
+            self.prepared_tests.clear()
 
         try:
             organization_id = int(self.test_suite.project.organization_id)
@@ -100,12 +125,14 @@ class MLDataset(models.Model):
             test_suite_id = int(self.test_suite_id)
             index = self.index
 
-            test_ids = list(self.tests.values_list("id", flat=True))
-            if len(test_ids) == 0:
+            if not self.tests.exists():
                 self.state = DatasetStates.SKIPPED
                 self.save()
                 return
 
+            test_ids = list(self.tests.exclude(
+                id__in=self.prepared_tests.values("id")).order_by("id").values_list("id", flat=True))
+
             result = export_datasets(
                 organization_id=organization_id,
                 project_id=project_id,
@@ -114,7 +141,8 @@ class MLDataset(models.Model):
                 test_ids=test_ids,
                 from_date=self.from_date,
                 to_date=self.to_date,
-                max_workers=10
+                max_workers=10,
+                on_complete=self.complete_tests
             )
             self.state = DatasetStates.PREPARED
         except Exception as exc:
@@ -123,6 +151,12 @@ class MLDataset(models.Model):
         self.save()
 
 
+    def complete_tests(self, test_ids):
+        # The update time tells that preparing is still running.
+        self.prepared_tests.add(*test_ids)
+        MLDataset.objects.filter(id=self.id).update(updated=timezone.now())
+
+
 class MLModel(models.Model):
 
     test_suite = models.OneToOneField(
@@ -173,6 +207,7 @@ class MLModel(models.Model):
         try:
             tpcbm = TestPrioritizationNLPCBM(ml_model=self)
             clf = tpcbm.train()
+            model_registry.invalidate(self.test_suite_id)
             if clf.is_fitted:
                 self.state = MLStates.TRAINED
             else:
@@ -222,15 +257,23 @@ class MLModel(models.Model):
         from applications.testing.models import TestSuite
         tpcbm = None
         try:
-            test_suite = TestSuite.objects.get(id=test_suite_id)
+            test_suite = TestSuite.objects.select_related("project").get(id=test_suite_id)
             project = test_suite.project
-            organization = project.organization
 
-            tpcbm = TestPrioritizationNLPCBM(organization_id=organization.id,
-                                             project_id=project.id, test_suite_id=test_suite.id)
-            if not tpcbm.is_fitted:
+            model_filepath = get_model_directory(
+                organization_id=project.organization_id,
+                project_id=project.id,
+                test_suite_id=test_suite.id
+            ) / get_nlp_model_filename(test_suite_id=test_suite.id)
+
+            def loader():
+                clf = TestPrioritizationNLPCBM(organization_id=project.organization_id,
+                                               project_id=project.id, test_suite_id=test_suite.id)
+                return clf if clf.is_fitted else None
+
+            tpcbm = model_registry.get(test_suite.id, model_filepath, loader)
+            if tpcbm is None:
                 logger.error(f"Classifier not fitted for {test_suite_id}")
-                tpcbm = None
         except Exception as exc:
             logger.exception(f"Classifier not load for {test_suite_id}", exc_info=True)
             tpcbm = None
@@ -1,6 +1,6 @@
 import io
-import pathlib
 import gc
+import pathlib
 import typing
 import pickle
 import warnings
@@ -22,8 +22,6 @@ from dateutil.relativedelta import relativedelta
 
 from abc import ABC, abstractmethod
 
-from django.conf import settings
-
 from applications.ml.utils.log import logger
 from applications.ml.utils.functional import reduce_mem_usage
 from applications.ml.utils.dataset import get_dataset_filelist, get_nlp_dataset_filelist
@@ -31,7 +29,8 @@ from applications.ml.utils.model import (get_model_directory, get_model_filename
                                          get_riskiness_model_directory, get_riskiness_model_filename)
 from applications.ml.utils.text import similarity, similarity_np
 from applications.ml.utils.database import native_execute_query
-from applications.ml.utils.text import get_vector_from_list
+from applications.ml.utils.text import get_sentence_from_list
+from applications.ml.utils.embedding import embedding_service
 
 
 warnings.filterwarnings("ignore")
@@ -100,20 +99,11 @@ class CommitRiskinessRFCM(ABC):
         from applications.vcs.models import Commit
         from_datetime = datetime.now() + relativedelta(weeks=-4)  # TODO: Change!!!
         from_datetime = from_datetime.replace(hour=0, minute=0, second=0, microsecond=0, tzinfo=pytz.UTC)
-        commits = Commit.objects.filter(project_id=project_id, timestamp__gte=from_datetime).prefetch_related(
-            "caused_defects", "founded_defects", "files", "parents")
-
-        dataset = []
-
-        for commit in commits:
-            commit_stats = self.get_commit_stats(commit)
-            if commit_stats:
-                commit_stats["defect_caused"] = 0
-                if commit.caused_defects.count():
-                    commit_stats["defect_caused"] = 1
-                dataset.append(commit_stats)
+        commits = Commit.objects.filter(project_id=project_id, timestamp__gte=from_datetime)
 
-        dataframe = pd.DataFrame(data=dataset)
+        dataframe = self.get_commits_stats(commits)
+        caused_commit_ids = commits.filter(caused_defects__isnull=False).values_list("id", flat=True)
+        dataframe["defect_caused"] = dataframe.index.isin(set(caused_commit_ids)).astype(int)
         return dataframe
 
     def load_predict_dataset(self, project_id: int, commit_sha_list: typing.Optional[typing.List]) -> pd.DataFrame:
@@ -127,13 +117,20 @@ class CommitRiskinessRFCM(ABC):
         else:
             commits = commits.filter(timestamp__gte=from_datetime)
 
+        dataframe = self.get_commits_stats(commits)
+        return dataframe
+
+    def get_commits_stats(self, commits) -> pd.DataFrame:
+        """ Stats of commits indexed by commit id, commits without stats are skipped. """
         dataset = []
+        index = []
         for commit in commits:
             commit_stats = self.get_commit_stats(commit)
             if commit_stats:
                 dataset.append(commit_stats)
+                index.append(commit.id)
 
-        dataframe = pd.DataFrame(data=dataset)
+        dataframe = pd.DataFrame(data=dataset, index=index)
         return dataframe
 
     @abstractmethod
@@ -257,58 +254,70 @@ class FastCommitRiskinessRFCM(CommitRiskinessRFCM):
     ]
 
     def get_commit_stats(self, commit):
-        import math
-        import time
-
-        files_count = commit.files.count()
-        total_string_changed = commit.stats.get('total', 0)
-
-        directories = {}
-        subsystems = {}
-
-        for commit_file in commit.files.all():
-            path_elements = commit_file.full_filename.split('/')
-
-            if commit_file.sha:
-                if len(path_elements) == 1:
-                    directories['root'] = 1
-                    subsystems['root'] = 1
-                else:
-                    directories['/'.join(path_elements[0:-1])] = 1
-                    subsystems[path_elements[0]] = 1
+        from applications.vcs.models import Commit
 
-        ages = 0
-        parents = commit.parents.all()
+        dataframe = self.get_commits_stats(Commit.objects.filter(id=commit.id))
+        if dataframe.empty:
+            return None
+        return dataframe.iloc[0].to_dict()
+
+    def get_commits_stats(self, commits) -> pd.DataFrame:
+        """
+        Stats of commits with one query for commits, changed files and parents each,
+        aggregated with group-bys.
+        """
+        from applications.vcs.models import Commit, FileChange
+
+        dataframe = pd.DataFrame(
+            data=list(commits.values_list("id", "sha", "stats", "timestamp", "message")),
+            columns=["id", "sha", "stats", "timestamp", "message"]
+        ).set_index("id")
+        if dataframe.empty:
+            return pd.DataFrame()
+
+        stats = dataframe["stats"].map(lambda value: value or {})
+        timestamps = dataframe["timestamp"].map(lambda value: value.timestamp())
+
+        files = pd.DataFrame(
+            data=list(FileChange.objects.filter(commit__in=commits).values_list(
+                "commit_id", "file__full_filename", "file__sha")),
+            columns=["commit_id", "full_filename", "sha"]
+        )
+        # Directories and subsystems of files known in the repository only.
+        files = files.assign(
+            directory=files["full_filename"].map(lambda path: path.rsplit("/", 1)[0] if "/" in path else "root"),
+            subsystem=files["full_filename"].map(lambda path: path.split("/", 1)[0] if "/" in path else "root"),
+        )
+        known_files = files[files["sha"].fillna("") != ""].groupby("commit_id")
 
-        for parent in parents:
-            ages += time.mktime(parent.timestamp.timetuple())
+        parents = pd.DataFrame(
+            data=list(Commit.objects.filter(id__in=commits, parents__isnull=False).values_list(
+                "id", "parents__timestamp")),
+            columns=["id", "timestamp"]
+        )
+        parents_timestamps = parents["timestamp"].map(lambda value: value.timestamp()).groupby(parents["id"]).mean()
+
+        dataframe = dataframe.assign(
+            deletions=stats.map(lambda value: value.get("deletions", 0)),
+            additions=stats.map(lambda value: value.get("additions", 0)),
+            total_lines_modified=stats.map(lambda value: value.get("total", 0)),
+            dayofweek=dataframe["timestamp"].map(lambda value: value.weekday()),
+            hour=dataframe["timestamp"].map(lambda value: value.hour),
+            len_message=dataframe["message"].str.len(),
+            changed_files=files.groupby("commit_id").size(),
+            changed_directories=known_files["directory"].nunique(),
+            changed_subsystems=known_files["subsystem"].nunique(),
+            age=timestamps - parents_timestamps,
+        )
+        counts = ["changed_files", "changed_directories", "changed_subsystems"]
+        dataframe[counts] = dataframe[counts].fillna(0).astype(int)
+        dataframe["age"] = dataframe["age"].fillna(0)
 
-        if parents:
-            age = time.mktime(commit.timestamp.timetuple()) - (ages / len(parents))
-        else:
-            age = 0
+        with np.errstate(divide="ignore", invalid="ignore"):
+            avg = dataframe["changed_files"] / dataframe["total_lines_modified"].replace(0, np.nan)
+            dataframe["entropy"] = (avg * np.log2(avg)).replace([np.inf, -np.inf], np.nan).fillna(0)
 
-        try:
-            avg = float(files_count) / total_string_changed
-            entropy = avg * math.log(avg, 2)
-        except:
-            entropy = 0
-
-        commit_stats = {
-            'sha': commit.sha,
-            'deletions': commit.stats.get('deletions', 0),
-            'additions': commit.stats.get('additions', 0),
-            'total_lines_modified': commit.stats.get('total', 0),
-            'dayofweek': commit.timestamp.weekday(),
-            'hour': commit.timestamp.hour,
-            'len_message': len(commit.message),
-            'changed_files': files_count,
-            'changed_directories': len(directories),
-            'changed_subsystems': len(subsystems),
-            'age': age,
-            'entropy': entropy,
-        }
-        return commit_stats
+        return dataframe[["sha"] + self.DEFAULT_PREDICT_ALLOWED_COLUMNS[1:]]
 
 
 class SlowCommitRiskinessRFCM(CommitRiskinessRFCM):
@@ -381,6 +390,19 @@ class TestPrioritizationNLPCBM(object):
         "test_areas_to_commit_dependent_areas",
     ]
 
+    SIMILARITY_FEATURES = {
+        "test_names_to_commit_files": ("test_names", "defect_closed_by_caused_by_intersection_files"),
+        "test_names_to_commit_folders": ("test_names", "defect_closed_by_caused_by_intersection_folders"),
+        "test_names_to_commit_dependent_areas": ("test_names",
+                                                 "defect_closed_by_caused_by_intersection_dependent_areas"),
+        "test_class_to_commit_areas": ("test_classes_names", "defect_closed_by_caused_by_intersection_areas"),
+        "test_class_to_commit_files": ("test_classes_names", "defect_closed_by_caused_by_intersection_files"),
+        "test_class_to_commit_dependent_areas": ("test_classes_names",
+                                                 "defect_closed_by_caused_by_intersection_dependent_areas"),
+        "test_areas_to_commit_dependent_areas": ("test_areas",
+                                                 "defect_closed_by_caused_by_intersection_dependent_areas"),
+    }
+
     DEFAULT_TRAIN_COLUMNS = [
         "test_names",
         "test_classes_names",
@@ -471,16 +493,16 @@ class TestPrioritizationNLPCBM(object):
 
     def _read_file(self, filepath) -> pd.DataFrame:
         """ Clean spec symbols """
-        file = open(filepath, "r")
-        data = file.read()
-        if data:
-            data = data.replace("\\\\", "\\")
-            file_content = io.StringIO(data)
-            df = pd.read_json(file_content)
-        else:
-            df = pd.DataFrame()
-        file.close()
-        return df
+        filepath = pathlib.PosixPath(filepath)
+        with open(filepath, "r") as file:
+            data = file.read()
+        if not data:
+            return pd.DataFrame()
+        if filepath.suffix == ".jsonl":
+            return pd.read_json(io.StringIO(data), lines=True)
+        # JSON arrays exported by psql
+        data = data.replace("\\\\", "\\")
+        return pd.read_json(io.StringIO(data))
 
     def _prepare_dataframe(self, df: pd.DataFrame,
                            target_column: typing.AnyStr,
@@ -489,67 +511,28 @@ class TestPrioritizationNLPCBM(object):
 
         prepared_df = pd.DataFrame()
 
-        import tensorflow_hub as hub
-
-        try:
-            embed = hub.load(str(pathlib.PosixPath(settings.STORAGE_ROOT) / "universal-sentence-encoder_4"))
-        except OSError:
-            embed = hub.load("https://tfhub.dev/google/universal-sentence-encoder/4")
-        except Exception as exc:
-            raise Exception("Error load embed from hub")
-
         if not df.empty:
 
             for column_name in target_columns:
-                df[column_name] = df[column_name].replace(np.NaN, None)
+                df[column_name] = df[column_name].replace(np.nan, None)
                 df[column_name] = df[column_name].apply(lambda x: x if x is not None else ["Null"])
 
-            new_features = {i: [] for i in list_of_features + [target_column]}
-
-            # Generate features
-            for idx, row in df.iterrows():
-
-                test_names = [row.test_names]
-                test_classes_names = [row.test_classes_names]
-                test_areas = [row.test_areas]
-                defect_closed_by_caused_by_intersection_areas = [row.defect_closed_by_caused_by_intersection_areas]
-                defect_closed_by_caused_by_intersection_files = [row.defect_closed_by_caused_by_intersection_files]
-                defect_closed_by_caused_by_intersection_folders = [row.defect_closed_by_caused_by_intersection_folders]
-                defect_closed_by_caused_by_intersection_dependent_areas = [row.defect_closed_by_caused_by_intersection_dependent_areas]
-
-                test_names_vector = get_vector_from_list(test_names, embed=embed)
-                test_classes_names_vector = get_vector_from_list(test_classes_names, embed=embed)
-                test_areas_vector = get_vector_from_list(test_areas, embed=embed)
-
-                commits_area_vector = get_vector_from_list(defect_closed_by_caused_by_intersection_areas, embed=embed)
-                commits_file_vector = get_vector_from_list(defect_closed_by_caused_by_intersection_files, embed=embed)
-                commits_folder_vector = get_vector_from_list(defect_closed_by_caused_by_intersection_folders, embed=embed)
-                commits_dependent_vector = get_vector_from_list(defect_closed_by_caused_by_intersection_dependent_areas, embed=embed)
-
-                test_names_to_commit_files = similarity_np(test_names_vector, commits_file_vector)
-                test_names_to_commit_folders = similarity_np(test_names_vector, commits_folder_vector)
-                test_names_to_commit_dependent_areas = similarity_np(test_names_vector, commits_dependent_vector)
-
-                test_class_to_commit_areas = similarity_np(test_classes_names_vector, commits_area_vector)
-                test_class_to_commit_files = similarity_np(test_classes_names_vector, commits_file_vector)
-                test_class_to_commit_dependent_areas = similarity_np(test_classes_names_vector, commits_dependent_vector)
-
-                test_areas_to_commit_dependent_areas = similarity_np(test_areas_vector, commits_dependent_vector)
+            # Embed every text column once, unique sentences are encoded in batches and cached.
+            vectors = {}
+            for column_name in {column for feature in list_of_features for column in self.SIMILARITY_FEATURES[feature]}:
+                sentences = [get_sentence_from_list([value]) for value in df[column_name].values]
+                vectors[column_name] = embedding_service.embed(sentences)
 
-                new_features["test_names_to_commit_files"].append(test_names_to_commit_files)
-                new_features["test_names_to_commit_folders"].append(test_names_to_commit_folders)
-                new_features["test_names_to_commit_dependent_areas"].append(test_names_to_commit_dependent_areas)
-                new_features["test_class_to_commit_areas"].append(test_class_to_commit_areas)
-                new_features["test_class_to_commit_files"].append(test_class_to_commit_files)
-                new_features["test_class_to_commit_dependent_areas"].append(test_class_to_commit_dependent_areas)
-                new_features["test_areas_to_commit_dependent_areas"].append(test_areas_to_commit_dependent_areas)
+            new_features = {}
+            for feature in list_of_features:
+                left_column, right_column = self.SIMILARITY_FEATURES[feature]
+                new_features[feature] = np.einsum("ij,ij->i", vectors[left_column], vectors[right_column])
 
-                new_features[target_column].append(row[target_column])
+            new_features[target_column] = df[target_column].values
 
             prepared_df = pd.DataFrame(new_features)
             prepared_df = prepared_df[list_of_features + [target_column]]
 
-        del embed
         del df
         gc.collect()
         return prepared_df
@@ -0,0 +1,394 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import io
+import math
+import os
+import tempfile
+import time
+from datetime import timedelta
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from applications.api.common.tests import ApiBaseTestClass
+from applications.ml.models import DatasetStates, MLDataset
+from applications.ml.network import FastCommitRiskinessRFCM, TestPrioritizationNLPCBM
+from applications.ml.utils.dataset import export_datasets, get_dataset_filelist
+from applications.ml.utils.embedding import EMBEDDING_DIMENSION, EmbeddingService, EmbeddingStore
+from applications.ml.utils.registry import ModelRegistry
+from applications.ml.utils.text import get_vector_from_list, similarity_np
+from applications.organization.models import Organization, Site
+from applications.project.models import Project
+from applications.testing.models import Defect
+from applications.testing.utils.prediction.riskiness.slow_model import update_slow_commits_metrics
+from applications.vcs.models import Area, AuthorExperience, Commit, File, FileChange, FileHistory, ParentCommit
+
+
+class ModelRegistryTestCase(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.loads = []
+
+    def write_model(self, name, content):
+        filepath = os.path.join(self.directory.name, name)
+        with open(filepath, "wb") as outfile:
+            outfile.write(content)
+        return filepath
+
+    def loader(self, name):
+        def load():
+            self.loads.append(name)
+            return name
+        return load
+
+    def test_cached_until_file_changes(self):
+        registry = ModelRegistry()
+        filepath = self.write_model("1.nlp.cbm", b"model")
+
+        self.assertEqual(registry.get(1, filepath, self.loader("first")), "first")
+        self.assertEqual(registry.get(1, filepath, self.loader("second")), "first")
+        self.assertEqual(self.loads, ["first"])
+
+        self.write_model("1.nlp.cbm", b"retrained model")
+        self.assertEqual(registry.get(1, filepath, self.loader("second")), "second")
+
+        stats = registry.stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["reloads"]), (1, 2, 1))
+
+    def test_missing_file(self):
+        registry = ModelRegistry()
+        filepath = self.write_model("1.nlp.cbm", b"model")
+        registry.get(1, filepath, self.loader("first"))
+
+        os.remove(filepath)
+        self.assertIsNone(registry.get(1, filepath, self.loader("second")))
+        self.assertEqual(registry.stats()["size"], 0)
+
+    def test_lru_eviction(self):
+        registry = ModelRegistry(max_size=2, memory_budget=12)
+        first = self.write_model("1.nlp.cbm", b"12345")
+        second = self.write_model("2.nlp.cbm", b"12345")
+        third = self.write_model("3.nlp.cbm", b"12345")
+
+        registry.get(1, first, self.loader("first"))
+        registry.get(2, second, self.loader("second"))
+        registry.get(1, first, self.loader("first"))
+        registry.get(3, third, self.loader("third"))
+
+        # Memory budget allows two models, the least recently used one is dropped.
+        self.assertEqual(registry.stats()["evictions"], 1)
+        registry.get(1, first, self.loader("first"))
+        registry.get(2, second, self.loader("second"))
+        self.assertEqual(self.loads, ["first", "second", "third", "second"])
+
+    def test_invalidate(self):
+        registry = ModelRegistry()
+        filepath = self.write_model("1.nlp.cbm", b"model")
+        registry.get(1, filepath, self.loader("first"))
+
+        registry.invalidate(1)
+        self.assertEqual(registry.get(1, filepath, self.loader("second")), "second")
+
+
+def fake_encoder(sentences):
+    vectors = []
+    for sentence in sentences:
+        seed = int.from_bytes(hashlib.sha1(sentence.encode("utf-8")).digest()[:4], "little")
+        vectors.append(np.random.RandomState(seed).rand(EMBEDDING_DIMENSION).astype(np.float32))
+    return np.array(vectors)
+
+
+class EmbeddingServiceTestCase(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.encoder = mock.Mock(side_effect=fake_encoder)
+
+    def test_unique_sentences_encoded_in_batches(self):
+        service = EmbeddingService(store=EmbeddingStore(self.directory.name), encoder=self.encoder, batch_size=2)
+
+        vectors = service.embed(["a b", "c", "a b", "d", "e"])
+
+        self.assertEqual(vectors.shape, (5, EMBEDDING_DIMENSION))
+        self.assertEqual(vectors.dtype, np.float32)
+        np.testing.assert_array_equal(vectors[0], vectors[2])
+        np.testing.assert_array_equal(vectors[1], fake_encoder(["c"])[0])
+        self.assertEqual([call.args[0] for call in self.encoder.call_args_list], [["a b", "c"], ["d", "e"]])
+
+    def test_vectors_persisted_between_processes(self):
+        EmbeddingService(store=EmbeddingStore(self.directory.name), encoder=self.encoder).embed(["a", "b"])
+
+        # A fresh store reads vectors written by another one.
+        service = EmbeddingService(store=EmbeddingStore(self.directory.name), encoder=self.encoder)
+        vectors = service.embed(["b", "c"])
+
+        self.assertEqual(self.encoder.call_count, 2)
+        self.assertEqual(self.encoder.call_args.args[0], ["c"])
+        np.testing.assert_array_equal(vectors, fake_encoder(["b", "c"]))
+
+    def test_similarity_features_match_row_by_row_embedding(self):
+        columns = TestPrioritizationNLPCBM.DEFAULT_PREDICT_COLUMNS
+        df = pd.DataFrame([
+            {column: ["{}Name{}".format(column, index), "shared/path.py"] for column in columns}
+            for index in range(3)
+        ] + [{column: None for column in columns}])
+        df["test_id"] = [1, 2, 3, 4]
+
+        service = EmbeddingService(store=EmbeddingStore(self.directory.name), encoder=self.encoder)
+        with mock.patch("applications.ml.network.embedding_service", service):
+            prepared_df = TestPrioritizationNLPCBM._prepare_dataframe(
+                TestPrioritizationNLPCBM, df.copy(), target_column="test_id", target_columns=columns,
+                list_of_features=TestPrioritizationNLPCBM.DEFAULT_LIST_OF_FEATURES)
+
+        for column in columns:
+            df[column] = df[column].apply(lambda x: x if x is not None else ["Null"])
+        for feature, (left_column, right_column) in TestPrioritizationNLPCBM.SIMILARITY_FEATURES.items():
+            expected = [similarity_np(get_vector_from_list([row[left_column]], embed=fake_encoder),
+                                      get_vector_from_list([row[right_column]], embed=fake_encoder))
+                        for _, row in df.iterrows()]
+            np.testing.assert_allclose(prepared_df[feature].values, expected, rtol=1e-5)
+        self.assertEqual(prepared_df["test_id"].tolist(), [1, 2, 3, 4])
+
+
+def get_fast_commit_stats(commit):
+    """ Stats of a commit queried one by one as before the group-bys. """
+    files_count = commit.files.count()
+    total_string_changed = commit.stats.get('total', 0)
+
+    directories = {}
+    subsystems = {}
+    for commit_file in commit.files.all():
+        path_elements = commit_file.full_filename.split('/')
+        if commit_file.sha:
+            if len(path_elements) == 1:
+                directories['root'] = 1
+                subsystems['root'] = 1
+            else:
+                directories['/'.join(path_elements[0:-1])] = 1
+                subsystems[path_elements[0]] = 1
+
+    parents = commit.parents.all()
+    ages = sum(time.mktime(parent.timestamp.timetuple()) for parent in parents)
+    age = time.mktime(commit.timestamp.timetuple()) - (ages / len(parents)) if parents else 0
+
+    try:
+        avg = float(files_count) / total_string_changed
+        entropy = avg * math.log(avg, 2)
+    except Exception:
+        entropy = 0
+
+    return {
+        'sha': commit.sha,
+        'deletions': commit.stats.get('deletions', 0),
+        'additions': commit.stats.get('additions', 0),
+        'total_lines_modified': commit.stats.get('total', 0),
+        'dayofweek': commit.timestamp.weekday(),
+        'hour': commit.timestamp.hour,
+        'len_message': len(commit.message),
+        'changed_files': files_count,
+        'changed_directories': len(directories),
+        'changed_subsystems': len(subsystems),
+        'age': age,
+        'entropy': entropy,
+    }
+
+
+class CommitRiskinessFeaturesTestCase(TestCase):
+    def setUp(self):
+        organization = Organization.objects.create(name='test_org', site=Site.objects.get_current())
+        self.project = Project.objects.create(organization=organization, name='test_project')
+
+        files = {full_filename: File.objects.create(project=self.project, full_filename=full_filename,
+                                                    filename=full_filename.rsplit('/', 1)[-1], sha=sha)
+                 for full_filename, sha in [('README', 'a'), ('src/api/views.py', 'b'), ('src/api/urls.py', 'c'),
+                                            ('docs/index.md', ''), ('tests/test_api.py', 'd')]}
+
+        now = timezone.now()
+        self.commits = []
+        for index, (hours, stats, filenames) in enumerate([
+            (50, {'additions': 10, 'deletions': 0, 'total': 10}, ['README', 'src/api/views.py']),
+            (30, {'additions': 1, 'deletions': 1, 'total': 2}, ['src/api/views.py', 'src/api/urls.py',
+                                                                'docs/index.md']),
+            (20, {'additions': 0, 'deletions': 0, 'total': 0}, ['tests/test_api.py']),
+            (10, {'additions': 5, 'deletions': 3, 'total': 8}, []),
+            (1, {}, ['docs/index.md', 'tests/test_api.py']),
+        ]):
+            commit = Commit.objects.create(project=self.project, sha=str(index) * 40, display_id=str(index) * 7,
+                                           message='Commit {}\n\nCo-authored-by: A <a@b>'.format(index),
+                                           author={'name': 'author'}, stats=stats,
+                                           timestamp=now - timedelta(hours=hours))
+            for filename in filenames:
+                FileChange.objects.create(commit=commit, file=files[filename], changes=len(filename))
+            self.commits.append(commit)
+
+        for index, (child, parent) in enumerate([(1, 0), (2, 1), (3, 1), (3, 2)]):
+            ParentCommit.objects.create(to_commit=self.commits[child], from_commit=self.commits[parent],
+                                        index_number=index)
+
+        Defect.objects.create(project=self.project, name='defect', reason='reason').caused_by_commits.add(
+            self.commits[1])
+
+        # Models without a classifier loaded from the storage.
+        self.fast_model = FastCommitRiskinessRFCM.__new__(FastCommitRiskinessRFCM)
+
+    def test_fast_stats_as_commit_by_commit(self):
+        commits = Commit.objects.filter(project=self.project)
+        with self.assertNumQueries(3):
+            df = self.fast_model.get_commits_stats(commits)
+
+        self.assertEqual(df.columns.tolist(), FastCommitRiskinessRFCM.DEFAULT_PREDICT_ALLOWED_COLUMNS)
+        for commit in self.commits:
+            row = df.loc[commit.id].to_dict()
+            for column, value in get_fast_commit_stats(commit).items():
+                if isinstance(value, float):
+                    self.assertAlmostEqual(row[column], value, places=3, msg=column)
+                else:
+                    self.assertEqual(row[column], value, msg=column)
+
+        self.assertTrue(self.fast_model.get_commits_stats(commits.none()).empty)
+
+    def test_train_dataset_defect_caused(self):
+        df = self.fast_model.load_train_dataset(self.project.id)
+
+        self.assertEqual(df.set_index('sha')['defect_caused'].to_dict(),
+                         {commit.sha: int(commit == self.commits[1]) for commit in self.commits})
+
+    def get_slow_stats(self):
+        return {commit.sha: commit.stats.get('slow_model') for commit in Commit.objects.filter(project=self.project)}
+
+    def test_slow_stats_saved(self):
+        self.assertTrue(update_slow_commits_metrics(project_id=self.project.id))
+
+        stats = self.get_slow_stats()
+        self.assertIsNone(stats[self.commits[3].sha])
+        self.assertEqual(stats[self.commits[0].sha]['author_changes'], 0.5)
+        self.assertEqual(stats[self.commits[1].sha]['changed_files'], 3)
+        self.assertEqual(stats[self.commits[1].sha]['changed_directories'], 2)
+        self.assertEqual(stats[self.commits[1].sha]['developers'], 2)
+        # Experience and history of files come from the previous commits.
+        self.assertEqual(stats[self.commits[1].sha]['author_changes'], 3.0)
+        self.assertAlmostEqual(stats[self.commits[1].sha]['author_changes_subsystem'], 2 / 3)
+        self.assertEqual(stats[self.commits[1].sha]['files_unique_changes'], 1)
+        self.assertAlmostEqual(stats[self.commits[1].sha]['lines_code_before_commit'], 10 / 3)
+
+        self.assertEqual(FileHistory.objects.get(file__full_filename='src/api/views.py').unique_changes, 2)
+        self.assertEqual(dict(AuthorExperience.objects.filter(project=self.project).values_list(
+            'subsystem', 'changes')), {'root': 1, 'src': 3, 'docs': 2, 'tests': 2})
+
+    def test_slow_stats_incremental(self):
+        update_slow_commits_metrics(project_id=self.project.id)
+        expected = self.get_slow_stats()
+
+        # Process the last commits in a later run.
+        for commit in Commit.objects.filter(project=self.project):
+            commit.stats.pop('slow_model')
+            commit.save()
+        FileHistory.objects.all().delete()
+        AuthorExperience.objects.all().delete()
+        new_commits = self.commits[3:]
+        Commit.objects.filter(id__in=[commit.id for commit in new_commits]).update(
+            timestamp=timezone.now() - timedelta(weeks=10))
+        update_slow_commits_metrics(project_id=self.project.id)
+        for commit in new_commits:
+            Commit.objects.filter(id=commit.id).update(timestamp=commit.timestamp)
+
+        # The queries of the new commits and the lock of the project state.
+        with self.assertNumQueries(13):
+            update_slow_commits_metrics(project_id=self.project.id)
+        self.assertEqual(self.get_slow_stats(), expected)
+
+    def test_slow_stats_replayed(self):
+        update_slow_commits_metrics(project_id=self.project.id)
+        expected = self.get_slow_stats()
+
+        # Stats and state left by runs which did not keep the state between commits.
+        for commit in Commit.objects.filter(project=self.project):
+            commit.stats['slow_model'] = None
+            commit.save()
+        AuthorExperience.objects.filter(project=self.project).update(changes=100)
+
+        call_command('replay_slow_model_stats', project_id=self.project.id, stdout=io.StringIO())
+        self.assertEqual(self.get_slow_stats(), expected)
+        self.assertEqual(dict(AuthorExperience.objects.filter(project=self.project).values_list(
+            'subsystem', 'changes')), {'root': 1, 'src': 3, 'docs': 2, 'tests': 2})
+
+
+def fake_dataset_sql(test_suite_id, test_id, from_date, to_date):
+    """ Rows of a test without tables, the test id is the number of rows. """
+    return "SELECT {test_suite_id} AS test_suite_id, {test_id} AS test_id, " \
+           "'C:\\tests\\' || n AS test_name, n AS row_number " \
+           "FROM generate_series(1, {test_id} % 10) AS n".format(test_suite_id=test_suite_id, test_id=test_id)
+
+
+@mock.patch('applications.ml.utils.dataset.dataset_sql', fake_dataset_sql)
+class DatasetExportTestCase(ApiBaseTestClass):
+    def setUp(self):
+        self.setup_db()
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        storage = override_settings(STORAGE_ROOT=self.directory.name)
+        storage.enable()
+        self.addCleanup(storage.disable)
+
+        default = Area.get_default(project=self.project)
+        self.tests = [self.create_test_model_object('test_{}'.format(index), area=default) for index in range(5)]
+        self.dataset = MLDataset.objects.create(test_suite=self.test_suite, index=0)
+
+    def read_datasets(self, test_ids):
+        filelist = get_dataset_filelist(organization_id=self.organization.id, project_id=self.project.id,
+                                        test_suite_id=self.test_suite.id, index=0, test_ids=test_ids)
+        model = TestPrioritizationNLPCBM.__new__(TestPrioritizationNLPCBM)
+        return {int(filepath.stem): model._read_file(filepath) for filepath in filelist}
+
+    def test_export_in_batches(self):
+        test_ids = [test.id for test in self.tests]
+        completed = []
+        result = export_datasets(organization_id=self.organization.id, project_id=self.project.id,
+                                 test_suite_id=self.test_suite.id, index=0, test_ids=test_ids,
+                                 from_date=None, to_date=None, max_workers=2, batch_size=2,
+                                 on_complete=completed.append)
+
+        self.assertEqual(result, 5)
+        self.assertEqual(sorted(map(len, completed)), [1, 2, 2])
+        datasets = self.read_datasets(test_ids)
+        self.assertEqual(sorted(datasets), sorted(test_ids))
+        for test_id, df in datasets.items():
+            self.assertEqual(len(df), test_id % 10)
+            if len(df):
+                self.assertEqual(set(df['test_id']), {test_id})
+                self.assertEqual(df['test_name'].tolist()[0], 'C:\\tests\\1')
+
+    def test_prepare_resumed(self):
+        test_ids = sorted(test.id for test in self.tests)
+        with mock.patch('applications.ml.models.get_dataset_test_ids', return_value=test_ids):
+            with mock.patch('applications.ml.models.export_datasets', side_effect=RuntimeError):
+                self.dataset.prepare()
+        self.assertEqual(self.dataset.state, DatasetStates.ERROR)
+
+        # Interrupted after the first tests are exported.
+        self.dataset.state = DatasetStates.PREPARING
+        self.dataset.save()
+        self.dataset.prepared_tests.add(*test_ids[:2])
+        with mock.patch('applications.ml.models.export_datasets', wraps=export_datasets) as export:
+            self.dataset.prepare()
+
+        self.assertEqual(export.call_args.kwargs['test_ids'], test_ids[2:])
+        self.assertEqual(self.dataset.state, DatasetStates.PREPARED)
+        self.assertEqual(sorted(self.dataset.prepared_tests.values_list('id', flat=True)), test_ids)
+
+    def test_prepare_claimed_once(self):
+        self.dataset.state = DatasetStates.PREPARING
+        self.dataset.save()
+        other_dataset = MLDataset.objects.get(id=self.dataset.id)
+
+        self.assertTrue(self.dataset.claim())
+        # Another process loaded the same stale dataset, it leaves it to the first one.
+        with mock.patch('applications.ml.models.export_datasets') as export:
+            other_dataset.prepare()
+        export.assert_not_called()
+        self.assertFalse(other_dataset.claim())
@@ -1,16 +1,20 @@
 import pathlib
 import typing
 import glob
+import threading
 import concurrent.futures
 
 from django.db import connection
 from django.conf import settings
 
-from .database import psql_execute_query
 from .log import logger
 from .functional import Statistic
 
 
+# Tests exported by one COPY query.
+DATASET_BATCH_SIZE = getattr(settings, "ML_DATASET_BATCH_SIZE", 50)
+
+
 def get_dataset_directory(organization_id: int, project_id: int, test_suite_id: int,
                           index: int) -> pathlib.PosixPath:
     directory = pathlib.PosixPath(settings.STORAGE_ROOT) / "machine_learning" / "priority" / \
@@ -20,6 +24,12 @@ def get_dataset_directory(organization_id: int, project_id: int, test_suite_id:
 
 
 def get_dataset_filename(test_id: int) -> str:
+    filename = f"{test_id}.jsonl"
+    return filename
+
+
+def get_legacy_dataset_filename(test_id: int) -> str:
+    """ JSON array exported by psql before JSON lines. """
     filename = f"{test_id}.json"
     return filename
 
@@ -34,9 +44,11 @@ def get_dataset_filelist(organization_id: int, project_id: int, test_suite_id: i
         index=index
     )
     for test_id in test_ids:
-        file_path = dataset_directory / get_dataset_filename(test_id)
-        if file_path.exists():
-            file_paths.append(file_path)
+        for filename in [get_dataset_filename(test_id), get_legacy_dataset_filename(test_id)]:
+            file_path = dataset_directory / filename
+            if file_path.exists():
+                file_paths.append(file_path)
+                break
     return file_paths
 
 
@@ -45,7 +57,8 @@ def get_nlp_dataset_filelist(organization_id: int, project_id: int, test_suite_i
                 str(organization_id) / str(project_id) / "datasets" / str(test_suite_id)
     directory.mkdir(parents=True, exist_ok=True)
 
-    file_paths = list(map(pathlib.PosixPath, glob.glob(f"{directory / '*' / '*.json'}")))
+    file_paths = list(map(pathlib.PosixPath, glob.glob(f"{directory / '*' / '*.jsonl'}")))
+    file_paths += list(map(pathlib.PosixPath, glob.glob(f"{directory / '*' / '*.json'}")))
     return file_paths
 
 
@@ -70,79 +83,122 @@ def dataset_sql(test_suite_id: int, test_id: int, from_date, to_date) -> str:
     return sql
 
 
-def dataset_export_sql(organization_id:int, project_id: int, test_suite_id: int, index: int, test_id: int,
-                       from_date, to_date) -> str:
+def dataset_batch_sql(test_suite_id: int, test_ids: typing.List[int], from_date, to_date) -> str:
+    """ Rows of the dataset query of each test, prefixed with the test id. """
     dataset_sql_query = dataset_sql(
         test_suite_id=test_suite_id,
-        test_id=test_id,
+        test_id="batch.test_id",
         from_date=from_date,
         to_date=to_date
     )
-    dataset_path = get_dataset_directory(organization_id=organization_id, project_id=project_id,
-                                         test_suite_id=test_suite_id, index=index)
-    dataset_path.mkdir(parents=True, exist_ok=True)
-
-    dataset_filename = get_dataset_filename(test_id=test_id)
-
-    sql_query = f"\copy (SELECT array_to_json(array_agg(row_to_json(t))) FROM ({dataset_sql_query}) t) " \
-                f"To '{dataset_path / dataset_filename}'"
+    test_ids = ",".join(str(int(test_id)) for test_id in test_ids)
+    sql_query = f"SELECT batch.test_id, row_to_json(t) " \
+                f"FROM unnest(ARRAY[{test_ids}]::integer[]) AS batch(test_id) " \
+                f"CROSS JOIN LATERAL ({dataset_sql_query}) t"
     return sql_query
 
 
-def export_dataset_to_file(organization_id: int, project_id: int, test_suite_id: int, index: int,
-                           test_id: int, from_date, to_date) -> bool:
+class DatasetWriter(object):
+    """
+    Splits `COPY ... TO STDOUT` output of a batch into JSON lines files of each test. Files are
+    written under a temporary name and renamed when the whole batch is copied.
+    """
+
+    def __init__(self, directory: pathlib.PosixPath, test_ids: typing.List[int]):
+        self.directory = directory
+        self.files = {test_id: open(self.temporary_path(test_id), "w", encoding="utf-8") for test_id in test_ids}
+        self.tail = ""
+
+    def temporary_path(self, test_id: int) -> pathlib.PosixPath:
+        return self.directory / f"{get_dataset_filename(test_id)}.tmp"
+
+    def write(self, data):
+        if isinstance(data, bytes):
+            data = data.decode("utf-8")
+        lines = (self.tail + data).split("\n")
+        self.tail = lines.pop()
+        for line in lines:
+            test_id, row = line.split("\t", 1)
+            # Text COPY format doubles backslashes, the JSON itself has no tabs or newlines.
+            self.files[int(test_id)].write(row.replace("\\\\", "\\") + "\n")
+
+    def close(self, complete: bool = True):
+        for test_id, file in self.files.items():
+            file.close()
+            if complete:
+                self.temporary_path(test_id).replace(self.directory / get_dataset_filename(test_id))
+            else:
+                self.temporary_path(test_id).unlink()
+
 
-    logger.debug(f"{test_suite_id} [{index}] preparing for the <Test: {test_id}>")
-    export_sql = dataset_export_sql(organization_id=organization_id, project_id=project_id, test_suite_id=test_suite_id,
-                                    index=index, test_id=test_id, from_date=from_date, to_date=to_date)
+def export_dataset_batch(organization_id: int, project_id: int, test_suite_id: int, index: int,
+                         test_ids: typing.List[int], from_date, to_date) -> typing.List[int]:
+    logger.debug(f"{test_suite_id} [{index}] preparing for the <Tests: {test_ids}>")
+    dataset_path = get_dataset_directory(organization_id=organization_id, project_id=project_id,
+                                         test_suite_id=test_suite_id, index=index)
+    export_sql = dataset_batch_sql(test_suite_id=test_suite_id, test_ids=test_ids,
+                                   from_date=from_date, to_date=to_date)
+    writer = DatasetWriter(dataset_path, test_ids)
     try:
-        output = psql_execute_query(query=export_sql)
-        result = True
-        logger.debug(f"{test_suite_id} [{index}] complete preparing for the <Test: {test_id}>")
+        with connection.cursor() as cursor:
+            cursor.copy_expert(f"COPY ({export_sql}) TO STDOUT", writer)
+        writer.close()
+        logger.debug(f"{test_suite_id} [{index}] complete preparing for the <Tests: {test_ids}>")
+        return test_ids
     except Exception as exc:
-        logger.exception(f"{test_suite_id} [{index}] error preparing for the <Test: {test_id}>", exc_info=True)
-        result = False
-    return result
+        writer.close(complete=False)
+        logger.exception(f"{test_suite_id} [{index}] error preparing for the <Tests: {test_ids}>", exc_info=True)
+        return []
+    finally:
+        # Every worker thread has its own connection.
+        if threading.current_thread() is not threading.main_thread():
+            connection.close()
 
 
 def export_datasets(organization_id: int, project_id: int, test_suite_id: int, index: int,
-                    test_ids: typing.List[int], from_date, to_date, max_workers: typing.Optional[int] = 20):
-
+                    test_ids: typing.List[int], from_date, to_date, max_workers: typing.Optional[int] = 4,
+                    batch_size: typing.Optional[int] = DATASET_BATCH_SIZE,
+                    on_complete: typing.Optional[typing.Callable[[typing.List[int]], None]] = None):
+    """
+    Exports datasets of tests in batches over worker connections, `on_complete` is called
+    with the test ids of every exported batch.
+    """
     stats = Statistic()
     stats.total = len(test_ids)
 
     logger.info(f"{stats} {test_suite_id} [{index}] tests for preparing datasets for the model are selected")
 
+    batches = [test_ids[i:i + batch_size] for i in range(0, len(test_ids), batch_size)]
     with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-        future_to_test_id = {
+        future_to_test_ids = {
             executor.submit(
-                export_dataset_to_file,
+                export_dataset_batch,
                 organization_id=organization_id,
                 project_id=project_id,
                 test_suite_id=test_suite_id,
                 index=index,
-                test_id=test_id,
+                test_ids=batch,
                 from_date=from_date,
                 to_date=to_date
             )
-            : test_id for test_id in test_ids
+            : batch for batch in batches
         }
 
-        for future in concurrent.futures.as_completed(future_to_test_id):
-            stats.increase_current()
+        for future in concurrent.futures.as_completed(future_to_test_ids):
+            batch = future_to_test_ids[future]
+            exported_test_ids = future.result()
 
-            test_id = future_to_test_id[future]
-            result = future.result()
+            for test_id in batch:
+                stats.increase_current()
+                if test_id in exported_test_ids:
+                    stats.increase_success()
+                else:
+                    stats.increase_failure()
 
-            if result:
-                stats.increase_success()
-            else:
-                stats.increase_failure()
+            if exported_test_ids and on_complete is not None:
+                on_complete(exported_test_ids)
 
-            if stats.progress_percent % 10 == 0:
-                logger.debug(f"{stats} {test_suite_id} [{index}] preparing datasets for tests")
+            logger.debug(f"{stats} {test_suite_id} [{index}] preparing datasets for tests")
 
     logger.info(f"{stats} {test_suite_id} [{index}] prepared datasets for tests")
     return stats.success
-
-
@@ -0,0 +1,188 @@
+import fcntl
+import hashlib
+import pathlib
+import threading
+import typing
+
+import numpy as np
+
+from django.conf import settings
+
+from applications.ml.utils.log import logger
+
+
+EMBEDDING_DIMENSION = 512
+
+EMBEDDING_BATCH_SIZE = getattr(settings, "ML_EMBEDDING_BATCH_SIZE", 1024)
+
+ENCODER_NAME = "universal-sentence-encoder_4"
+
+ENCODER_URL = "https://tfhub.dev/google/universal-sentence-encoder/4"
+
+
+def get_embedding_directory() -> pathlib.PosixPath:
+    directory = pathlib.PosixPath(settings.STORAGE_ROOT) / "machine_learning" / "embeddings" / ENCODER_NAME
+    directory.mkdir(parents=True, exist_ok=True)
+    return directory
+
+
+def load_encoder():
+    import tensorflow_hub as hub
+
+    try:
+        embed = hub.load(str(pathlib.PosixPath(settings.STORAGE_ROOT) / ENCODER_NAME))
+    except OSError:
+        embed = hub.load(ENCODER_URL)
+    except Exception as exc:
+        raise Exception("Error load embed from hub") from exc
+    return embed
+
+
+class EmbeddingStore(object):
+    """
+    Persistent sentence vectors shared by worker processes.
+
+    Vectors are appended to a float32 matrix file which is read through a memory map,
+    the sha1 digests of their sentences are appended to a key file in the same order.
+    Writers hold an exclusive lock on the directory.
+    """
+
+    KEY_SIZE = 20
+
+    def __init__(self, directory, dimension: int = EMBEDDING_DIMENSION):
+        self.directory = pathlib.PosixPath(directory)
+        self.dimension = dimension
+        self.keys_filepath = self.directory / "keys.bin"
+        self.vectors_filepath = self.directory / "vectors.f32"
+        self.lock_filepath = self.directory / ".lock"
+
+        self._index = dict()
+        self._rows = 0
+        self._vectors = np.empty((0, dimension), dtype=np.float32)
+        self._lock = threading.RLock()
+        self._sync()
+
+    @classmethod
+    def get_key(cls, sentence: str) -> bytes:
+        return hashlib.sha1(sentence.encode("utf-8")).digest()
+
+    def __len__(self):
+        return len(self._index)
+
+    def _sync(self):
+        """ Pick up vectors added by other processes. """
+        try:
+            size = self.keys_filepath.stat().st_size
+        except FileNotFoundError:
+            return
+
+        rows = size // self.KEY_SIZE
+        if rows <= self._rows:
+            return
+
+        with open(self.keys_filepath, "rb") as infile:
+            infile.seek(self._rows * self.KEY_SIZE)
+            data = infile.read((rows - self._rows) * self.KEY_SIZE)
+
+        for row, offset in enumerate(range(0, len(data), self.KEY_SIZE), start=self._rows):
+            self._index.setdefault(data[offset:offset + self.KEY_SIZE], row)
+
+        self._rows = rows
+        self._vectors = np.memmap(self.vectors_filepath, dtype=np.float32, mode="r",
+                                  shape=(rows, self.dimension))
+
+    def get_many(self, keys: typing.List[bytes]) -> typing.Dict[bytes, np.ndarray]:
+        with self._lock:
+            if any(key not in self._index for key in keys):
+                self._sync()
+            return {key: self._vectors[self._index[key]] for key in keys if key in self._index}
+
+    def add_many(self, keys: typing.List[bytes], vectors: np.ndarray):
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dimension)
+
+        with self._lock, open(self.lock_filepath, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                self._sync()
+
+                new_rows = dict()
+                for key, vector in zip(keys, vectors):
+                    if key not in self._index and key not in new_rows:
+                        new_rows[key] = vector
+
+                if not new_rows:
+                    return
+
+                # Vectors go first, so keys never point to missing vectors.
+                mode = "r+b" if self.vectors_filepath.exists() else "wb"
+                with open(self.vectors_filepath, mode) as outfile:
+                    outfile.seek(self._rows * self.dimension * 4)
+                    outfile.write(np.stack(list(new_rows.values())).astype(np.float32).tobytes())
+                    outfile.truncate()
+
+                with open(self.keys_filepath, "ab") as outfile:
+                    outfile.write(b"".join(new_rows.keys()))
+
+                self._sync()
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+class EmbeddingService(object):
+    """
+    Embeds sentences with the encoder loaded once per process.
+    Unique sentences missing from the store are encoded in batches of `batch_size`.
+    """
+
+    def __init__(self, store: typing.Optional[EmbeddingStore] = None, encoder=None,
+                 batch_size: int = EMBEDDING_BATCH_SIZE):
+        self._store = store
+        self._encoder = encoder
+        self.batch_size = batch_size
+        self._lock = threading.Lock()
+
+    @property
+    def store(self) -> EmbeddingStore:
+        with self._lock:
+            if self._store is None:
+                self._store = EmbeddingStore(get_embedding_directory())
+            return self._store
+
+    @property
+    def encoder(self):
+        with self._lock:
+            if self._encoder is None:
+                self._encoder = load_encoder()
+            return self._encoder
+
+    def _encode(self, sentences: typing.List[str]) -> np.ndarray:
+        vectors = self.encoder(sentences)
+        if hasattr(vectors, "numpy"):
+            vectors = vectors.numpy()
+        return np.asarray(vectors, dtype=np.float32)
+
+    def embed(self, sentences: typing.List[str]) -> np.ndarray:
+        """ Return float32 matrix with a row per sentence. """
+        store = self.store
+
+        unique_sentences = list(dict.fromkeys(sentences))
+        keys = {sentence: store.get_key(sentence) for sentence in unique_sentences}
+        vectors = store.get_many(list(keys.values()))
+
+        missing = [sentence for sentence in unique_sentences if keys[sentence] not in vectors]
+        if missing:
+            logger.debug(f"Encode {len(missing)} of {len(unique_sentences)} sentences")
+
+        for offset in range(0, len(missing), self.batch_size):
+            batch = missing[offset:offset + self.batch_size]
+            batch_keys = [keys[sentence] for sentence in batch]
+            batch_vectors = self._encode(batch)
+            store.add_many(batch_keys, batch_vectors)
+            vectors.update(zip(batch_keys, batch_vectors))
+
+        if not sentences:
+            return np.empty((0, store.dimension), dtype=np.float32)
+        return np.stack([vectors[keys[sentence]] for sentence in sentences]).astype(np.float32, copy=False)
+
+
+embedding_service = EmbeddingService()
@@ -0,0 +1,119 @@
+import os
+import threading
+import time
+import typing
+from collections import OrderedDict
+
+from django.conf import settings
+
+from applications.ml.utils.log import logger
+
+
+MODEL_REGISTRY_MAX_SIZE = getattr(settings, "ML_MODEL_REGISTRY_MAX_SIZE", 32)
+
+MODEL_REGISTRY_MEMORY_BUDGET = getattr(settings, "ML_MODEL_REGISTRY_MEMORY_BUDGET", 512 * 1024 * 1024)
+
+
+class ModelRegistry(object):
+    """
+    Per-process cache of loaded models.
+
+    Entries are evicted in LRU order when there are more than `max_size` of them or
+    their model files take more than `memory_budget` bytes. A model is loaded again
+    when the modification time or the size of its file changes.
+    """
+
+    def __init__(self, max_size: int = MODEL_REGISTRY_MAX_SIZE, memory_budget: int = MODEL_REGISTRY_MEMORY_BUDGET):
+        self.max_size = max_size
+        self.memory_budget = memory_budget
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+        self._memory = 0
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+        self.evictions = 0
+        self.load_time = 0.0
+
+    @staticmethod
+    def _get_version(filepath) -> typing.Optional[typing.Tuple[int, int]]:
+        try:
+            stat = os.stat(filepath)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def get(self, key, filepath, loader: typing.Callable[[], typing.Any]):
+        """
+        Return the model cached under `key` or load it with `loader`.
+        Returns None if `filepath` doesn't exist.
+        """
+        version = self._get_version(filepath)
+
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if version is None:
+                self.misses += 1
+                if entry is not None:
+                    self._remove(key)
+                return None
+
+            if entry is not None and entry["version"] == version:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return entry["model"]
+
+            self.misses += 1
+            if entry is not None:
+                self.reloads += 1
+                self._remove(key)
+
+            started = time.monotonic()
+            model = loader()
+            load_time = time.monotonic() - started
+            self.load_time += load_time
+
+            logger.debug(f"Model {key} loaded from {filepath} in {load_time:.3f}s")
+
+            self._entries[key] = {"model": model, "version": version, "size": version[1]}
+            self._memory += version[1]
+            self._evict()
+            return model
+
+    def invalidate(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._memory = 0
+
+    def stats(self) -> typing.Dict:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "memory": self._memory,
+                "hits": self.hits,
+                "misses": self.misses,
+                "reloads": self.reloads,
+                "evictions": self.evictions,
+                "load_time": self.load_time,
+            }
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self._memory -= entry["size"]
+
+    def _evict(self):
+        # The most recently used entry is kept even if it doesn't fit into the budget alone.
+        while len(self._entries) > 1 and (len(self._entries) > self.max_size or self._memory > self.memory_budget):
+            key = next(iter(self._entries))
+            self._remove(key)
+            self.evictions += 1
+            logger.debug(f"Model {key} evicted from registry")
+
+
+model_registry = ModelRegistry()
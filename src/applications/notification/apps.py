@@ -9,4 +9,7 @@ class NotificationConfig(AppConfig):
     name = 'applications.notification'
     verbose_name = _('Notification')
 
+    def ready(self):
+        import applications.notification.signals  # noqa
+
 
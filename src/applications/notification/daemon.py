@@ -6,11 +6,15 @@ import time
 from signal import SIGTERM
 from django.db import connection, transaction
 from django.conf import settings
+from django.utils import timezone
 from .utils import *
 
 
 PIDFILE = os.path.join(settings.BASE_DIR, 'notification.pid')
 
+SCHEDULER_MIN_SLEEP = 1
+SCHEDULER_MAX_SLEEP = getattr(settings, 'NOTIFICATION_SCHEDULER_MAX_SLEEP', 60)
+
 
 class Daemon(object):
     """
@@ -57,9 +61,9 @@ class Daemon(object):
             sys.exit(1)
 
         # redirect standard file descriptors
-        si = file(self.stdin, 'r')
-        so = file(self.stdout, 'a+')
-        se = file(self.stderr, 'a+', 0)
+        si = open(self.stdin, 'r')
+        so = open(self.stdout, 'a+')
+        se = open(self.stderr, 'ab+', 0)
 
         pid = str(os.getpid())
 
@@ -67,7 +71,8 @@ class Daemon(object):
         # sys.stdout.flush()
 
         if self.pidfile:
-            file(self.pidfile, 'w+').write("%s\n" % pid)
+            with open(self.pidfile, 'w+') as pf:
+                pf.write("%s\n" % pid)
 
         atexit.register(self.delpid)
         os.dup2(si.fileno(), sys.stdin.fileno())
@@ -87,15 +92,13 @@ class Daemon(object):
         # Check for a pidfile to see if the daemon already runs
 
         try:
-            pf = file(self.pidfile, 'r')
-            pf_val = pf.read().strip()
+            with open(self.pidfile, 'r') as pf:
+                pf_val = pf.read().strip()
 
             if pf_val == '':
                 pid = 0
             else:
                 pid = int(pf_val)
-
-            pf.close()
         except IOError:
             pid = None
         except SystemExit:
@@ -113,9 +116,8 @@ class Daemon(object):
 
     def get_pid(self):
         try:
-            pf = file(self.pidfile, 'r')
-            pid = int(pf.read().strip())
-            pf.close()
+            with open(self.pidfile, 'r') as pf:
+                pid = int(pf.read().strip())
         except IOError:
             pid = None
         except SystemExit:
@@ -128,9 +130,8 @@ class Daemon(object):
         """
         # Get the pid from the pidfile
         try:
-            pf = file(self.pidfile, 'r')
-            pid = int(pf.read().strip())
-            pf.close()
+            with open(self.pidfile, 'r') as pf:
+                pid = int(pf.read().strip())
         except IOError:
             pid = None
 
@@ -172,6 +173,16 @@ class Daemon(object):
 
 class NotificationDaemon(Daemon):
 
+    def get_sleep_seconds(self, next_send):
+        """
+        Sleep until the next due notification, new and changed notifications are
+        picked up after SCHEDULER_MAX_SLEEP at the latest.
+        """
+        if next_send is None:
+            return SCHEDULER_MAX_SLEEP
+        seconds = (next_send - timezone.now()).total_seconds()
+        return min(max(seconds, SCHEDULER_MIN_SLEEP), SCHEDULER_MAX_SLEEP)
+
     def run(self):
         try:
             # TODO: Special obligitary close connection created by parent process
@@ -180,19 +191,16 @@ class NotificationDaemon(Daemon):
             # logging.exception('An error occured when running notification daemon')
             pass
         while True:
+            next_send = None
             try:
 
-                check_updates_one_off()
-                check_updates_immediately()
-                check_updates_daily()
-                check_updates_weekly()
-                check_updates_fortnightly()
+                next_send = check_updates_scheduled()
 
             except Exception as e:
                 # logging.debug(e)
                 pass
 
-            time.sleep(120)
+            time.sleep(self.get_sleep_seconds(next_send))
 
     def cron(self):
 
@@ -217,7 +225,8 @@ class NotificationDaemon(Daemon):
 
         if self.pidfile:
             pid = os.getpid()
-            open(self.pidfile, 'w+').write("%s\n" % pid)
+            with open(self.pidfile, 'w+') as pf:
+                pf.write("%s\n" % pid)
 
         try:
             # TODO: Special obligitary close connection created by parent process
@@ -226,11 +235,7 @@ class NotificationDaemon(Daemon):
             # logging.exception('An error occured when running notification daemon')
             pass
 
-        check_updates_one_off()
-        check_updates_immediately()
-        check_updates_daily()
-        check_updates_weekly()
-        check_updates_fortnightly()
+        check_updates_scheduled()
 
         if os.path.exists(self.pidfile):
             os.remove(self.pidfile)
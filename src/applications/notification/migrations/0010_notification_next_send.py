@@ -0,0 +1,66 @@
+# Generated by Django 3.2.25 on 2026-10-18 11:49
+
+import datetime
+
+import pytz
+from django.db import migrations, models
+from django.utils import timezone
+
+# Values of the model at the time of the migration.
+PERIOD_IMMEDIATELY = 0
+PERIOD_DAILY = 1
+PERIOD_WEEKLY = 2
+PERIOD_FORTNIGHTLY = 3
+PERIOD_ONE_OFF = 4
+PERIOD_DELTA = {
+    PERIOD_DAILY: datetime.timedelta(days=1),
+    PERIOD_WEEKLY: datetime.timedelta(weeks=1),
+    PERIOD_FORTNIGHTLY: datetime.timedelta(weeks=2),
+}
+IMMEDIATE_INTERVAL = datetime.timedelta(minutes=15)
+
+
+def get_next_send(notification, now):
+    if notification.period == PERIOD_ONE_OFF:
+        return now
+
+    previous_send = notification.schedule_last_send or now
+    if notification.period == PERIOD_IMMEDIATELY:
+        return previous_send + IMMEDIATE_INTERVAL
+
+    schedule_timezone = pytz.timezone(notification.schedule_timezone)
+    next_send = previous_send.astimezone(schedule_timezone).replace(tzinfo=None) + PERIOD_DELTA[notification.period]
+
+    if notification.period in (PERIOD_WEEKLY, PERIOD_FORTNIGHTLY) and notification.schedule_weekday is not None:
+        weekday = next_send.isoweekday() % 7 + 1
+        next_send -= datetime.timedelta(days=weekday - notification.schedule_weekday)
+
+    if notification.schedule_hour is not None and 0 <= notification.schedule_hour <= 23:
+        next_send = next_send.replace(hour=notification.schedule_hour)
+
+    next_send = next_send.replace(minute=0, second=0, microsecond=0)
+    return schedule_timezone.localize(next_send).astimezone(pytz.UTC)
+
+
+def set_next_send(apps, schema_editor):
+    Notification = apps.get_model('notification', 'Notification')
+    now = timezone.now()
+    for notification in Notification.objects.all():
+        notification.next_send = get_next_send(notification, now)
+        notification.save(update_fields=['next_send'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notification', '0009_alter_notification_project'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notification',
+            name='next_send',
+            field=models.DateTimeField(blank=True, db_index=True, default=None, null=True),
+        ),
+        migrations.RunPython(set_next_send, migrations.RunPython.noop),
+    ]
@@ -4,11 +4,17 @@ from __future__ import unicode_literals
 import datetime
 
 import pytz
+from django.conf import settings
 from django.db import models
 from django.db.models import JSONField
+from django.utils import timezone
 
 TIMEZONES = tuple(zip(pytz.all_timezones, pytz.all_timezones))
 
+# Immediate notifications are sent on test run and defect events, the interval only
+# picks up changes which don't trigger them.
+IMMEDIATE_INTERVAL = getattr(settings, 'NOTIFICATION_IMMEDIATE_INTERVAL', datetime.timedelta(minutes=15))
+
 
 def relative_date(reference, weekday, timevalue):
     hour, minute = divmod(timevalue, 1)
@@ -132,6 +138,7 @@ class Notification(models.Model):
 
     schedule_timezone = models.CharField(max_length=64, choices=TIMEZONES, default='UTC')
     schedule_last_send = models.DateTimeField(default=None, blank=True, null=True)
+    next_send = models.DateTimeField(default=None, blank=True, null=True, db_index=True)
 
     one_off_start_date = models.DateField(default=None, blank=True, null=True)
     one_off_end_date = models.DateField(default=None, blank=True, null=True)
@@ -145,3 +152,53 @@ class Notification(models.Model):
         indexes = [
             models.Index(fields=['-schedule_last_send']),
         ]
+
+    PERIOD_DELTA = {
+        PERIOD_DAILY: datetime.timedelta(days=1),
+        PERIOD_WEEKLY: datetime.timedelta(weeks=1),
+        PERIOD_FORTNIGHTLY: datetime.timedelta(weeks=2),
+    }
+
+    def save(self, *args, **kwargs):
+        self.next_send = self.get_next_send()
+        if 'update_fields' in kwargs and kwargs['update_fields'] is not None:
+            kwargs['update_fields'] = set(kwargs['update_fields']) | {'next_send'}
+        super(Notification, self).save(*args, **kwargs)
+
+    def claim(self, next_send):
+        """
+        Moves the next send of the notification if nobody moved it since it was loaded, so a due
+        notification is checked by one of the scheduler and event checks only.
+        """
+        claimed = Notification.objects.filter(id=self.id, next_send=self.next_send).update(next_send=next_send)
+        if claimed:
+            self.next_send = next_send
+        return bool(claimed)
+
+    def get_next_send(self, now=None):
+        """
+        Time of the next check of the notification after the last send, in the schedule
+        timezone: a period after the last send, moved to the schedule weekday of that week
+        for weekly periods and to the schedule hour.
+        """
+        now = now or timezone.now()
+        if self.period == self.PERIOD_ONE_OFF:
+            return now
+
+        previous_send = self.schedule_last_send or now
+        if self.period == self.PERIOD_IMMEDIATELY:
+            return previous_send + IMMEDIATE_INTERVAL
+
+        schedule_timezone = pytz.timezone(self.schedule_timezone)
+        next_send = previous_send.astimezone(schedule_timezone).replace(tzinfo=None) + self.PERIOD_DELTA[self.period]
+
+        if self.period in (self.PERIOD_WEEKLY, self.PERIOD_FORTNIGHTLY) and self.schedule_weekday is not None:
+            # Weekdays are numbered as in `__week_day` lookups, 1 is Sunday.
+            weekday = next_send.isoweekday() % 7 + 1
+            next_send -= datetime.timedelta(days=weekday - self.schedule_weekday)
+
+        if self.schedule_hour is not None and 0 <= self.schedule_hour <= 23:
+            next_send = next_send.replace(hour=self.schedule_hour)
+
+        next_send = next_send.replace(minute=0, second=0, microsecond=0)
+        return schedule_timezone.localize(next_send).astimezone(pytz.UTC)
@@ -1 +1,12 @@
 # -*- coding: utf-8 -*-
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from applications.notification.models import Notification
+from applications.notification.tasks import schedule_immediate_notifications
+from applications.testing.models import Defect
+
+
+@receiver(post_save, sender=Defect)
+def defect_post_save(sender, instance, **kwargs):
+    schedule_immediate_notifications(project_id=instance.project_id, types=[Notification.TYPE_DEFECT])
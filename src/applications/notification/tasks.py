@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+from system.celery_app import app, Singleton
+
+from django.conf import settings
+from django.core.mail import get_connection
+from django.db import transaction
+
+
+EMAIL_RETRY_DELAY = getattr(settings, 'NOTIFICATION_EMAIL_RETRY_DELAY', 60)
+
+
+@app.task(base=Singleton, raise_on_duplicate=False, lock_expiry=5 * 60)
+def send_immediate_notifications_task(project_id, types):
+    from applications.notification.utils import check_updates_for_events
+
+    check_updates_for_events(project_id=project_id, types=types)
+    return True
+
+
+@app.task(bind=True, max_retries=5)
+def send_notification_emails_task(self, emails, subject, bodies, from_email):
+    """
+    Sends a rendered notification to each email, over one SMTP connection in batches. A failed
+    batch is retried with exponential backoff for the emails not sent yet.
+    """
+    from applications.notification.utils.email import EMAIL_BATCH_SIZE, build_email_message
+
+    with get_connection() as connection:
+        for i in range(0, len(emails), EMAIL_BATCH_SIZE):
+            messages = [build_email_message(email, subject, bodies, from_email)
+                        for email in emails[i:i + EMAIL_BATCH_SIZE]]
+            try:
+                connection.send_messages(messages)
+            except Exception as exc:
+                raise self.retry(exc=exc, countdown=EMAIL_RETRY_DELAY * 2 ** self.request.retries,
+                                 kwargs=dict(emails=emails[i:], subject=subject, bodies=bodies,
+                                             from_email=from_email))
+    return len(emails)
+
+
+def schedule_immediate_notifications(project_id, types):
+    """
+        Check immediate notifications of a project when the current transaction is committed,
+        types are added to a check of the project already queued in the transaction.
+    :param project_id: Project id
+    :param types: Notification TYPE_* list
+    :return:
+    """
+    connection = transaction.get_connection()
+    for on_commit in connection.run_on_commit:
+        callback = on_commit[1]
+        if getattr(callback, 'notification_project_id', None) == project_id:
+            callback.notification_types.extend(t for t in types if t not in callback.notification_types)
+            return
+
+    def callback():
+        send_immediate_notifications_task.delay(project_id=project_id, types=callback.notification_types)
+
+    callback.notification_project_id = project_id
+    callback.notification_types = list(types)
+    transaction.on_commit(callback)
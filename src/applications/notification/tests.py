@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from datetime import datetime, timedelta
+from unittest import mock
+
+import pytz
+from django.core import mail
+from django.core.cache import cache
+from django.core.mail.backends.locmem import EmailBackend
+from django.utils import timezone
+
+from applications.api.common.tests import ApiBaseTestClass
+from applications.notification.models import IMMEDIATE_INTERVAL, Notification
+from applications.notification.tasks import schedule_immediate_notifications, send_notification_emails_task
+from applications.notification.utils import RETRY_INTERVAL, check_updates_scheduled
+from applications.notification.utils.email import send_notification_emails
+from applications.notification.utils.test_prioritization import calculate_statistic, \
+    get_statistic_for_related_defects, get_test_ids_by_priority
+from applications.testing.models import Defect
+from applications.vcs.models import Area, Commit, File, FileChange
+
+
+class NotificationSchedulerTestCase(ApiBaseTestClass):
+    def setUp(self):
+        self.setup_db()
+        self.last_send = datetime(2026, 10, 14, 10, 30, tzinfo=pytz.UTC)  # Wednesday
+
+    def create_notification(self, **kwargs):
+        args = {
+            'project': self.project,
+            'type': Notification.TYPE_TEST_RUN,
+            'schedule_last_send': self.last_send,
+        }
+        args.update(kwargs)
+        return Notification.objects.create(**args)
+
+    def test_next_send(self):
+        notification = self.create_notification(period=Notification.PERIOD_IMMEDIATELY)
+        self.assertEqual(notification.next_send, self.last_send + IMMEDIATE_INTERVAL)
+
+        notification = self.create_notification(period=Notification.PERIOD_DAILY, schedule_hour=9,
+                                                schedule_timezone='Europe/Kiev')
+        self.assertEqual(notification.next_send, datetime(2026, 10, 15, 6, tzinfo=pytz.UTC))
+
+        notification = self.create_notification(period=Notification.PERIOD_WEEKLY, schedule_hour=9,
+                                                schedule_weekday=Notification.SCHEDULE_WEEKDAY_MONDAY)
+        self.assertEqual(notification.next_send, datetime(2026, 10, 19, 9, tzinfo=pytz.UTC))
+
+        notification = self.create_notification(period=Notification.PERIOD_FORTNIGHTLY, schedule_hour=None,
+                                                schedule_weekday=Notification.SCHEDULE_WEEKDAY_SUNDAY)
+        self.assertEqual(notification.next_send, datetime(2026, 10, 25, 10, tzinfo=pytz.UTC))
+
+        # Sending moves the next send a period further.
+        notification.schedule_last_send = notification.next_send
+        notification.save(update_fields=['schedule_last_send'])
+        notification.refresh_from_db()
+        self.assertEqual(notification.next_send, datetime(2026, 11, 8, 10, tzinfo=pytz.UTC))
+
+    def test_check_due_notifications(self):
+        due = self.create_notification(period=Notification.PERIOD_DAILY)
+        pending = self.create_notification(period=Notification.PERIOD_WEEKLY,
+                                           schedule_last_send=timezone.now())
+
+        def check_test_runs_daily(notify):
+            notify.schedule_last_send = notify.current_datetime
+            notify.save()
+
+        check = mock.MagicMock(side_effect=check_test_runs_daily)
+        other_check = mock.MagicMock()
+        checks = {
+            Notification.PERIOD_DAILY: check,
+            Notification.PERIOD_WEEKLY: other_check,
+        }
+        with mock.patch.dict('applications.notification.utils.CHECKS', {Notification.TYPE_TEST_RUN: checks}):
+            next_send = check_updates_scheduled()
+
+        self.assertEqual(check.call_count, 1)
+        self.assertEqual(check.call_args.args[0].id, due.id)
+        other_check.assert_not_called()
+        due.refresh_from_db()
+        self.assertGreater(due.next_send, timezone.now())
+        self.assertEqual(next_send, min(due.next_send, pending.next_send))
+
+        # Notifications without updates are checked again after the retry interval.
+        Notification.objects.filter(id=due.id).update(next_send=self.last_send)
+        check.side_effect = None
+        with mock.patch.dict('applications.notification.utils.CHECKS', {Notification.TYPE_TEST_RUN: checks}):
+            check_updates_scheduled()
+        due.refresh_from_db()
+        self.assertAlmostEqual(due.next_send, timezone.now() + RETRY_INTERVAL, delta=timedelta(minutes=1))
+
+    def test_notification_claimed_once(self):
+        notification = self.create_notification(period=Notification.PERIOD_DAILY)
+        concurrent = Notification.objects.get(id=notification.id)
+
+        self.assertTrue(notification.claim(self.last_send + RETRY_INTERVAL))
+        self.assertFalse(concurrent.claim(self.last_send + RETRY_INTERVAL))
+        self.assertEqual(Notification.objects.get(id=notification.id).next_send, self.last_send + RETRY_INTERVAL)
+
+    def test_defect_changes_check_immediate_notifications(self):
+        with mock.patch('applications.notification.tasks.send_immediate_notifications_task.delay') as delay:
+            with self.captureOnCommitCallbacks(execute=True):
+                Defect.objects.create(project=self.project, name='defect', reason='reason')
+
+        delay.assert_called_with(project_id=self.project.id, types=[Notification.TYPE_DEFECT])
+
+    def test_immediate_notifications_checked_once_per_transaction(self):
+        with mock.patch('applications.notification.tasks.send_immediate_notifications_task.delay') as delay:
+            with self.captureOnCommitCallbacks(execute=True):
+                for i in range(3):
+                    Defect.objects.create(project=self.project, name='defect {}'.format(i), reason='reason')
+                schedule_immediate_notifications(project_id=self.project.id, types=[Notification.TYPE_TEST_RUN,
+                                                                                    Notification.TYPE_DEFECT])
+
+        delay.assert_called_once_with(project_id=self.project.id,
+                                      types=[Notification.TYPE_DEFECT, Notification.TYPE_TEST_RUN])
+
+
+class NotificationEmailTestCase(ApiBaseTestClass):
+    def setUp(self):
+        self.setup_db()
+        self.notification = Notification.objects.create(project=self.project, type=Notification.TYPE_TEST_RUN,
+                                                        period=Notification.PERIOD_DAILY)
+
+    def test_render_once_for_all_emails(self):
+        context = {'period': 'daily', 'test_runs': [], 'user_timezone': 'UTC', 'test_run_url': '/test-runs/'}
+        with mock.patch('django.template.backends.django.Template.render', autospec=True,
+                        return_value='rendered') as render, \
+                mock.patch('applications.notification.tasks.send_notification_emails_task.delay') as delay:
+            send_notification_emails(self.notification, ['a@example.com', ' b@example.com', 'a@example.com', ''],
+                                     context=context)
+
+        # Subject and html body, once for both emails.
+        self.assertEqual(render.call_count, 2)
+        self.assertEqual(delay.call_args.kwargs['emails'], ['a@example.com', 'b@example.com'])
+
+        send_notification_emails_task(**delay.call_args.kwargs)
+        self.assertEqual([message.to for message in mail.outbox], [['a@example.com'], ['b@example.com']])
+        self.assertEqual(mail.outbox[0].content_subtype, 'html')
+
+    @mock.patch('applications.notification.utils.email.EMAIL_BATCH_SIZE', 2)
+    def test_retry_unsent_batches(self):
+        emails = ['{}@example.com'.format(i) for i in range(5)]
+        send_messages = EmailBackend.send_messages
+        calls = []
+
+        def send_messages_once_failing(backend, messages):
+            calls.append([message.to[0] for message in messages])
+            if len(calls) == 2:
+                raise IOError('Connection closed')
+            return send_messages(backend, messages)
+
+        with mock.patch.object(EmailBackend, 'send_messages', send_messages_once_failing):
+            send_notification_emails_task.apply(kwargs=dict(emails=emails, subject='subject',
+                                                            bodies={'txt': 'body'}, from_email='from@example.com'))
+
+        self.assertEqual(calls, [emails[0:2], emails[2:4], emails[2:4], emails[4:5]])
+        self.assertEqual([message.to[0] for message in mail.outbox], emails)
+
+
+class TestPrioritizationStatisticTestCase(ApiBaseTestClass):
+    def setUp(self):
+        self.setup_db()
+        cache.clear()
+
+        commit = Commit.objects.create(project=self.project, sha='a' * 40, display_id='a' * 7,
+                                       timestamp=timezone.now())
+        changed_file, other_file = [File.objects.create(project=self.project, filename=filename,
+                                                        full_filename=filename) for filename in ['a.py', 'b.py']]
+        FileChange.objects.create(commit=commit, file=changed_file)
+        area = self.create_area_model_object('Checkout')
+        commit.areas.add(area)
+
+        default = Area.get_default(project=self.project)
+        self.create_test_model_object('test_high', area=default).associated_files.add(changed_file)
+        self.create_test_model_object('test_medium', area=default).associated_areas.add(area)
+        self.create_test_model_object('test_low', area=default).associated_files.add(other_file)
+        self.create_test_model_object('test_unassigned', area=default)
+
+        self.notifications = [Notification.objects.create(project=self.project, period=Notification.PERIOD_WEEKLY,
+                                                          type=Notification.TYPE_TEST_PRIORITIZATION)
+                              for _ in range(2)]
+        for notify in self.notifications:
+            notify.current_datetime = timezone.now()
+            notify.previous_send_datetime = notify.current_datetime - timedelta(weeks=1)
+
+    def test_related_defects(self):
+        test_ids_by_priority = {'high': {1, 2}, 'medium': {3}, 'low': {4}, 'unassigned': {5}}
+        defect_test_ids = [(10, 1), (10, 3), (11, 3), (12, 4), (12, 5), (13, 5)]
+
+        self.assertEqual(get_statistic_for_related_defects(test_ids_by_priority, defect_test_ids), {
+            'number_low_defects': 1,
+            'percentage_high_defects': '25.00%',
+            'percentage_medium_defects': '25.00%',
+            'percentage_low_defects': '25.00%',
+            'percentage_unassigned_defects': '25.00%',
+        })
+
+    def test_statistic_shared_by_notifications(self):
+        with mock.patch('applications.notification.utils.test_prioritization.get_test_ids_by_priority',
+                        wraps=get_test_ids_by_priority) as get_tests:
+            first, second = self.notifications
+            second.current_datetime = first.current_datetime
+            second.previous_send_datetime = first.previous_send_datetime
+            statistic = calculate_statistic(first)
+            self.assertEqual(calculate_statistic(second), statistic)
+            self.assertEqual(get_tests.call_count, 1)
+
+            second.previous_send_datetime = second.current_datetime
+            calculate_statistic(second)
+            self.assertEqual(get_tests.call_count, 2)
+
+        total_tests_info = statistic['total_tests_info']
+        self.assertEqual([total_tests_info['number_{}_tests'.format(priority)]
+                          for priority in ['high', 'medium', 'low', 'unassigned']], [1, 1, 1, 1])
+        self.assertEqual(statistic['runned_tests_info']['number_high_tests'], 0)
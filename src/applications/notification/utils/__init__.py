@@ -1,9 +1,13 @@
 # -*- coding: utf-8 -*-
+import datetime
 
+from django.conf import settings
+from django.utils import timezone
 from django.db.models import *
 from django.db.models.expressions import *
 from django.db.models.functions import *
 
+from applications.notification.models import IMMEDIATE_INTERVAL, Notification
 from .alert import *
 from .defect import *
 from .monitor import *
@@ -288,3 +292,113 @@ def check_updates_fortnightly():
 
     except Exception as e:
         print(e)
+
+
+CHECKS = {
+    Notification.TYPE_RISK: {
+        Notification.PERIOD_IMMEDIATELY: check_risks_immediately,
+        Notification.PERIOD_DAILY: check_risks_daily,
+        Notification.PERIOD_WEEKLY: check_risks_weekly,
+        Notification.PERIOD_FORTNIGHTLY: check_risks_fortnightly,
+    },
+    Notification.TYPE_ALERT: {
+        Notification.PERIOD_IMMEDIATELY: check_alerts_immediately,
+        Notification.PERIOD_DAILY: check_alerts_daily,
+        Notification.PERIOD_WEEKLY: check_alerts_weekly,
+        Notification.PERIOD_FORTNIGHTLY: check_alerts_fortnightly,
+    },
+    Notification.TYPE_DEFECT: {
+        Notification.PERIOD_IMMEDIATELY: check_defects_immediately,
+        Notification.PERIOD_DAILY: check_defects_daily,
+        Notification.PERIOD_WEEKLY: check_defects_weekly,
+        Notification.PERIOD_FORTNIGHTLY: check_defects_fortnightly,
+    },
+    Notification.TYPE_TEST_RUN: {
+        Notification.PERIOD_IMMEDIATELY: check_test_runs_immediately,
+        Notification.PERIOD_DAILY: check_test_runs_daily,
+        Notification.PERIOD_WEEKLY: check_test_runs_weekly,
+        Notification.PERIOD_FORTNIGHTLY: check_test_runs_fortnightly,
+    },
+    Notification.TYPE_MONITOR: {
+        Notification.PERIOD_IMMEDIATELY: check_monitor_immediately,
+        Notification.PERIOD_DAILY: check_monitor_daily,
+        Notification.PERIOD_WEEKLY: check_monitor_weekly,
+        Notification.PERIOD_FORTNIGHTLY: check_monitor_fortnightly,
+    },
+    Notification.TYPE_TEST_PRIORITIZATION: {
+        Notification.PERIOD_IMMEDIATELY: check_test_prioritization_immediately,
+        Notification.PERIOD_DAILY: check_test_prioritization_daily,
+        Notification.PERIOD_WEEKLY: check_test_prioritization_weekly,
+        Notification.PERIOD_FORTNIGHTLY: check_test_prioritization_fortnightly,
+    },
+    Notification.TYPE_RISK_ANALYSIS: {
+        Notification.PERIOD_IMMEDIATELY: check_risks_analysis_immediately,
+        Notification.PERIOD_DAILY: check_risks_analysis_daily,
+        Notification.PERIOD_WEEKLY: check_risks_analysis_weekly,
+        Notification.PERIOD_FORTNIGHTLY: check_risks_analysis_fortnightly,
+    },
+}
+
+# Periodic notifications without updates to send are checked again after the interval.
+RETRY_INTERVAL = getattr(settings, 'NOTIFICATION_RETRY_INTERVAL', datetime.timedelta(hours=1))
+
+
+def check_notifications(notification_queryset):
+    # type: (QuerySet) -> None
+    """
+        Check updates for periodic notifications and schedule their next check
+    :param notification_queryset: Notification queryset
+    :return:
+    """
+    current_datetime = timezone.now()
+
+    for notify in notification_queryset.exclude(period=Notification.PERIOD_ONE_OFF).select_related('project'):
+        # Attributes used by checks as they are annotated by prepare_queryset.
+        notify.current_datetime = current_datetime
+        notify.previous_send_datetime = notify.schedule_last_send or current_datetime
+
+        if notify.period == Notification.PERIOD_IMMEDIATELY:
+            retry_interval = IMMEDIATE_INTERVAL
+        else:
+            retry_interval = RETRY_INTERVAL
+
+        # Until the check sends updates the notification is due again after the retry interval,
+        # notifications claimed by a concurrent check are skipped.
+        if not notify.claim(current_datetime + retry_interval):
+            continue
+
+        try:
+            CHECKS[notify.type][notify.period](notify)
+        except Exception as e:
+            print(e)
+
+        # Checks save the notification with the next send time after sending.
+        next_send = Notification.objects.filter(id=notify.id).values_list('next_send', flat=True).first()
+        if next_send is not None and next_send <= current_datetime:
+            Notification.objects.filter(id=notify.id).update(next_send=timezone.now() + retry_interval)
+
+
+def check_updates_scheduled():
+    """
+        Check updates for one off notifications and periodic notifications which are due
+    :return: time of the next due notification or None
+    """
+    if Notification.objects.filter(period=Notification.PERIOD_ONE_OFF).exists():
+        check_updates_one_off()
+
+    check_notifications(Notification.objects.filter(next_send__lte=timezone.now()))
+
+    return Notification.objects.exclude(period=Notification.PERIOD_ONE_OFF).aggregate(
+        next_send=Min('next_send'))['next_send']
+
+
+def check_updates_for_events(project_id, types):
+    # type: (int, list) -> None
+    """
+        Check updates for immediate notifications of a project after test runs or defects change
+    :param project_id: Project id
+    :param types: Notification TYPE_* list
+    :return:
+    """
+    check_notifications(Notification.objects.filter(
+        project_id=project_id, type__in=types, period=Notification.PERIOD_IMMEDIATELY))
@@ -5,7 +5,7 @@ import pytz
 from django.db.models import Max
 
 from applications.notification.models import Notification
-from applications.notification.utils.email import send_notification_email
+from applications.notification.utils.email import send_notification_emails
 from applications.testing.models import Defect
 
 
@@ -37,10 +37,8 @@ def check_updates(notify, date_range=None):
             email_context['period'] = notify.get_period_display()
             email_context['defects'] = defect_queryset
 
-            for email in emails:
-                email_context['user_timezone'] = notify.schedule_timezone
-                email_context['email'] = email
-                send_notification_email(notify=notify, context=email_context)
+            email_context['user_timezone'] = notify.schedule_timezone
+            send_notification_emails(notify=notify, emails=emails, context=email_context)
 
             if not notify.period == Notification.PERIOD_ONE_OFF:
                 if notify.period == Notification.PERIOD_IMMEDIATELY:
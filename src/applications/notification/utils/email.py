@@ -1,7 +1,10 @@
 # -*- coding: utf-8 -*-
+import functools
+
+from django.conf import settings
 from django.core.mail import EmailMessage, EmailMultiAlternatives
 from django.template import TemplateDoesNotExist
-from django.template.loader import render_to_string
+from django.template.loader import get_template
 
 from applications.notification.models import Notification
 from applications.notification.utils.build_url import build_absolute_uri
@@ -16,40 +19,69 @@ TYPE_MAPPING = {
     Notification.TYPE_RISK_ANALYSIS: 'risk_analysis',
 }
 
+FROM_EMAIL = 'TestBrain Reports <noreply@appsurify.com>'
 
-def send_notification_email(notify, context=None):
-    if context is None:
-        context = {}
+# Messages sent over one SMTP connection.
+EMAIL_BATCH_SIZE = getattr(settings, 'NOTIFICATION_EMAIL_BATCH_SIZE', 50)
 
-    context['domain'] = build_absolute_uri(notify.project.organization, '')
-    try:
-        type_notification = TYPE_MAPPING.get(notify.type)
 
-        from_email = 'TestBrain Reports <noreply@appsurify.com>'
+@functools.lru_cache(maxsize=None)
+def get_templates(type_notification):
+    """
+    Compiled subject and body templates of a notification type, bodies by extension.
+    """
+    subject = get_template('notification/email/email_{type}_subject.txt'.format(type=type_notification))
+
+    bodies = {}
+    for ext in ['html', 'txt']:
+        try:
+            template_name = 'notification/email/email_{type}_message.{ext}'.format(type=type_notification, ext=ext)
+            bodies[ext] = get_template(template_name)
+        except TemplateDoesNotExist:
+            if ext == 'txt' and not bodies:
+                # We need at least one body
+                raise
+    return subject, bodies
+
 
-        subject = render_to_string('notification/email/email_{type}_subject.txt'.format(
-            type=type_notification), context).strip()
+def render_notification_email(notify, context):
+    type_notification = TYPE_MAPPING.get(notify.type)
+    subject, bodies = get_templates(type_notification)
+    return {
+        'subject': subject.render(context).strip(),
+        'bodies': {ext: template.render(context).strip() for ext, template in bodies.items()},
+        'from_email': FROM_EMAIL,
+    }
 
-        bodies = {}
 
-        for ext in ['html', 'txt']:
-            try:
-                template_name = 'notification/email/email_{type}_message.{ext}'.format(type=type_notification, ext=ext)
-                bodies[ext] = render_to_string(template_name, context).strip()
-            except TemplateDoesNotExist:
-                if ext == 'txt' and not bodies:
-                    # We need at least one body
-                    raise
+def build_email_message(email, subject, bodies, from_email):
+    if 'txt' in bodies:
+        msg = EmailMultiAlternatives(subject, bodies['txt'], from_email, [email])
+        if 'html' in bodies:
+            msg.attach_alternative(bodies['html'], 'text/html')
+    else:
+        msg = EmailMessage(subject, bodies['html'], from_email, [email])
+        msg.content_subtype = 'html'  # Main content is now text/html
+    return msg
 
-        if 'txt' in bodies:
-            msg = EmailMultiAlternatives(subject, bodies['txt'], from_email, [context['email']])
-            if 'html' in bodies:
-                msg.attach_alternative(bodies['html'], 'text/html')
-        else:
-            msg = EmailMessage(subject, bodies['html'], from_email, [context['email']])
-            msg.content_subtype = 'html'  # Main content is now text/html
 
-        msg.send()
+def send_notification_emails(notify, emails, context=None):
+    """
+    Renders the notification once and queues sending it to every email.
+    """
+    from applications.notification.tasks import send_notification_emails_task
+
+    if context is None:
+        context = {}
+
+    emails = list(dict.fromkeys(email.strip() for email in emails if email.strip()))
+    if not emails:
+        return False
+
+    context['domain'] = build_absolute_uri(notify.project.organization, '')
+    try:
+        message = render_notification_email(notify, context)
+        send_notification_emails_task.delay(emails=emails, **message)
         return True
 
     except Exception as e:
@@ -6,7 +6,7 @@ from django.db import models
 from django.db.models import Func
 
 from applications.notification.models import Notification
-from applications.notification.utils.email import send_notification_email
+from applications.notification.utils.email import send_notification_emails
 from applications.vcs.models import Commit, Area, File
 
 
@@ -49,9 +49,7 @@ def check_updates(notify, date_range=None):
             email_context['areas'] = list(areas_queryset)
             email_context['files'] = list(files_queryset)
 
-            for email in emails:
-                email_context['email'] = email
-                send_notification_email(notify=notify, context=email_context)
+            send_notification_emails(notify=notify, emails=emails, context=email_context)
             if not notify.period == Notification.PERIOD_ONE_OFF:
                 if notify.period == Notification.PERIOD_IMMEDIATELY:
                     schedule_last_send = datetime.datetime.now().replace(tzinfo=pytz.timezone('UTC'))
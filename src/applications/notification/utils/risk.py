@@ -6,7 +6,7 @@ from django.db import models
 from django.db.models import Max, Func
 
 from applications.notification.models import Notification
-from applications.notification.utils.email import send_notification_email
+from applications.notification.utils.email import send_notification_emails
 from applications.vcs.models import Commit, Area
 
 
@@ -44,9 +44,7 @@ def check_updates(notify, date_range=None):
             email_context['commits'] = commit_queryset
             email_context['user_timezone'] = notify.schedule_timezone
 
-            for email in emails:
-                email_context['email'] = email
-                send_notification_email(notify=notify, context=email_context)
+            send_notification_emails(notify=notify, emails=emails, context=email_context)
 
             if not notify.period == Notification.PERIOD_ONE_OFF:
                 if notify.period == Notification.PERIOD_IMMEDIATELY:
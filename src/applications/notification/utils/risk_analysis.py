@@ -7,7 +7,7 @@ from django.db.models import Max, QuerySet, Q
 
 from rest_framework.request import Request
 from applications.notification.models import Notification
-from applications.notification.utils.email import send_notification_email
+from applications.notification.utils.email import send_notification_emails
 from applications.project.models import Project
 
 from applications.vcs.models import Commit, Area, File, FileChange
@@ -244,9 +244,7 @@ def check_updates(notify, date_range=None):
         email_context['project_name'] = notify.project.name
         email_context['period'] = notify.get_period_display()
         emails = notify.emails.split(',')
-        for email in emails:
-            email_context['email'] = email
-            send_notification_email(notify, context=email_context)
+        send_notification_emails(notify=notify, emails=emails, context=email_context)
 
         if not notify.period == Notification.PERIOD_ONE_OFF:
             schedule_last_send = notify.current_datetime.replace(tzinfo=pytz.timezone('UTC'))
@@ -1,19 +1,24 @@
 # -*- coding: utf-8 -*-
-import logging
+import collections
+import copy
 import pytz
-import datetime
-from django.db.models import Max
+from hashlib import md5
+
+from django.conf import settings
+from django.core.cache import cache
+
 from applications.notification.models import Notification
-from applications.notification.utils.email import send_notification_email
+from applications.notification.utils.email import send_notification_emails
 from applications.vcs.models import Commit
-from django.db.models import Max, Prefetch, OuterRef, Subquery, Count, Case, When, F, Q
-from django.db.models.functions import TruncSecond
-from django.utils import timezone
-from applications.testing.models import TestRun, TestRunResult, Defect, Test
-from applications.api.report.views import TestReportModelViewSet
+from applications.testing.models import TestRun, TestSuite, Defect, Test
+from applications.testing.selectors import get_default_high_queryset, get_default_medium_queryset, \
+    get_default_unassigned_queryset
+
 
-from django.http import HttpRequest
-from rest_framework.request import Request
+PRIORITIES = ('high', 'medium', 'low', 'unassigned')
+
+# Statistics are shared by notifications checked in the same send cycle.
+STATISTIC_CACHE_TIMEOUT = getattr(settings, 'NOTIFICATION_STATISTIC_CACHE_TIMEOUT', 60 * 60)
 
 
 def percentage(part, whole):
@@ -24,50 +29,46 @@ def percentage(part, whole):
     return result + '%'
 
 
-def get_statistic_for_related_defects(test_ids_by_priority):
-    all_high_tests = test_ids_by_priority['high']
-    all_medium_tests = test_ids_by_priority['medium']
-    all_low_tests = test_ids_by_priority['low']
-    all_unassigned_tests = test_ids_by_priority['unassigned']
-
-    high_defects_queryset = Defect.objects.filter(type=Defect.TYPE_PROJECT,
-                                                  associated_tests__id__in=all_high_tests).distinct('id')
-    high_defects_number = high_defects_queryset.count()
-
-    excluded_defects_ids = list(high_defects_queryset.values_list('id', flat=True)[:])
-    medium_defects_queryset = Defect.objects.filter(type=Defect.TYPE_PROJECT,
-                                                    associated_tests__id__in=all_medium_tests)
-    medium_defects_queryset = medium_defects_queryset.exclude(id__in=excluded_defects_ids).distinct('id')
-    medium_defects_number = medium_defects_queryset.count()
+def get_statistic_for_related_defects(test_ids_by_priority, defect_test_ids=None):
+    """
+    Project defects of tests by priority, a defect is counted only in the highest priority of its tests.
+    :param test_ids_by_priority: Dict with sets of test ids by priority
+    :param defect_test_ids: Pairs of project defect id and associated test id, fetched when not passed
+    :return: Dict with numbers and percentages of defects
+    """
+    if defect_test_ids is None:
+        defect_test_ids = get_defect_test_ids(set().union(*test_ids_by_priority.values()))
 
-    excluded_defects_ids += list(medium_defects_queryset.values_list('id', flat=True))
-    low_defects_queryset = Defect.objects.filter(type=Defect.TYPE_PROJECT,
-                                                 associated_tests__in=all_low_tests)
-    low_defects_queryset = low_defects_queryset.exclude(id__in=excluded_defects_ids).distinct('id')
-    low_defects_number = low_defects_queryset.count()
+    defects_by_test = collections.defaultdict(set)
+    for defect_id, test_id in defect_test_ids:
+        defects_by_test[test_id].add(defect_id)
 
-    excluded_defects_ids += list(low_defects_queryset.values_list('id', flat=True))
-    unassigned_defects_queryset = Defect.objects.filter(type=Defect.TYPE_PROJECT,
-                                                        associated_tests__in=all_unassigned_tests)
-    unassigned_defects_queryset = unassigned_defects_queryset.exclude(id__in=excluded_defects_ids).distinct('id')
-    unassigned_defects_number = unassigned_defects_queryset.count()
+    defects_numbers = {}
+    excluded_defects_ids = set()
+    for priority in PRIORITIES:
+        defects_ids = set().union(*(defects_by_test[test_id] for test_id in test_ids_by_priority[priority]))
+        defects_ids -= excluded_defects_ids
+        excluded_defects_ids |= defects_ids
+        defects_numbers[priority] = len(defects_ids)
 
-    total_number_of_defects = high_defects_number
-    total_number_of_defects += medium_defects_number
-    total_number_of_defects += low_defects_number
-    total_number_of_defects += unassigned_defects_number
+    total_number_of_defects = sum(defects_numbers.values())
 
     result = {
-        'number_low_defects': low_defects_number,
+        'number_low_defects': defects_numbers['low'],
 
-        'percentage_high_defects': percentage(high_defects_number, total_number_of_defects),
-        'percentage_medium_defects': percentage(medium_defects_number, total_number_of_defects),
-        'percentage_low_defects': percentage(low_defects_number, total_number_of_defects),
-        'percentage_unassigned_defects': percentage(unassigned_defects_number, total_number_of_defects),
+        'percentage_high_defects': percentage(defects_numbers['high'], total_number_of_defects),
+        'percentage_medium_defects': percentage(defects_numbers['medium'], total_number_of_defects),
+        'percentage_low_defects': percentage(defects_numbers['low'], total_number_of_defects),
+        'percentage_unassigned_defects': percentage(defects_numbers['unassigned'], total_number_of_defects),
     }
     return result
 
 
+def get_defect_test_ids(test_ids):
+    return list(Defect.associated_tests.through.objects.filter(
+        defect__type=Defect.TYPE_PROJECT, test_id__in=test_ids).values_list('defect_id', 'test_id'))
+
+
 def calculate_tests_number_statistic(tests_number_by_priority):
     all_high_tests_number = tests_number_by_priority['high']
     all_medium_tests_number = tests_number_by_priority['medium']
@@ -92,118 +93,83 @@ def calculate_tests_number_statistic(tests_number_by_priority):
     return total_tests_info
 
 
-# TODO: need some refactoring
-def calculate_statistic(notify, date_range=None):
-    # type: (Notification, tuple) -> dict
+def get_test_ids_by_priority(project, commits_ids):
     """
-        Check updates for notification
-    :param notify: Notification instance
-    :param date_range: Tuple with datetime objects for one_off range
+    Test ids by priority for each commit, over all test suites of the project.
+    :param project: Project instance
+    :param commits_ids: List of commit ids
+    :return: Dict of commit id to dict with sets of test ids by priority
+    """
+    result = {commit_id: {priority: set() for priority in PRIORITIES} for commit_id in commits_ids}
+    if not commits_ids:
+        return result
+
+    for test_suite in TestSuite.objects.filter(project=project):
+        params = {'project': project, 'test_suite': test_suite}
+        queryset = Test.objects.filter(project=project, test_suites=test_suite)
+        test_ids = set(queryset.values_list('id', flat=True))
+        unassigned_test_ids = set(get_default_unassigned_queryset(queryset, params=params).values_list('id', flat=True))
+
+        for commit_id in commits_ids:
+            high_test_ids = set(get_default_high_queryset(
+                queryset, [commit_id], params=params).values_list('id', flat=True))
+            medium_test_ids = set(get_default_medium_queryset(
+                queryset, [commit_id], params=params).values_list('id', flat=True))
+
+            tests = result[commit_id]
+            tests['high'] |= high_test_ids
+            tests['medium'] |= medium_test_ids - high_test_ids
+            tests['low'] |= test_ids - high_test_ids - medium_test_ids - unassigned_test_ids
+            tests['unassigned'] |= unassigned_test_ids
+    return result
+
+
+def get_runned_test_ids(commits_ids):
+    """
+    Ids of tests in test runs with results by commit.
+    """
+    result = collections.defaultdict(set)
+    test_runs_tests = TestRun.tests.through.objects.filter(
+        testrun__commit_id__in=commits_ids, testrun__test_run_results__isnull=False
+    ).values_list('testrun__commit_id', 'test_id').distinct()
+    for commit_id, test_id in test_runs_tests:
+        result[commit_id].add(test_id)
+    return result
+
+
+def calculate_statistic_by_commits(project, commits_ids):
+    # type: (Project, list) -> dict
+    """
+        Calculate test and defect statistic by priority for commits
+    :param project: Project instance
+    :param commits_ids: List of commit ids
     :return: result: Dict with results
     """
+    test_ids_by_priority = get_test_ids_by_priority(project, commits_ids)
+    runned_test_ids = get_runned_test_ids(commits_ids)
 
-    all_high_tests = set()
-    all_medium_tests = set()
-    all_low_tests = set()
-    all_unassigned_tests = set()
+    tests_numbers_by_priority = dict.fromkeys(PRIORITIES, 0)
+    tests_by_priority = {priority: set() for priority in PRIORITIES}
+    runned_tests_numbers_by_priority = dict.fromkeys(PRIORITIES, 0)
+    runned_tests_by_priority = {priority: set() for priority in PRIORITIES}
 
-    all_runned_high_tests = set()
-    all_runned_medium_tests = set()
-    all_runned_low_tests = set()
-    all_runned_unassigned_tests = set()
+    for commit_id in commits_ids:
+        for priority, test_ids in test_ids_by_priority[commit_id].items():
+            tests_numbers_by_priority[priority] += len(test_ids)
+            tests_by_priority[priority] |= test_ids
 
-    all_high_tests_number = 0
-    all_medium_tests_number = 0
-    all_low_tests_number = 0
-    all_unassigned_tests_number = 0
+            runned_tests = test_ids & runned_test_ids[commit_id]
+            runned_tests_numbers_by_priority[priority] += len(runned_tests)
+            runned_tests_by_priority[priority] |= runned_tests
 
-    all_runned_high_tests_number = 0
-    all_runned_medium_tests_number = 0
-    all_runned_low_tests_number = 0
-    all_runned_unassigned_tests_number = 0
+    defect_test_ids = get_defect_test_ids(set().union(*tests_by_priority.values()))
 
-    project_commits = Commit.objects.filter(project=notify.project)
-    if not date_range:
-        previous_send_datetime = notify.previous_send_datetime.replace(tzinfo=pytz.timezone('UTC'))
-        project_commits = project_commits.filter(created__gt=previous_send_datetime).order_by('-created')
-    else:
-        project_commits = project_commits.filter(created__date__range=date_range).order_by('-created')
-
-    queryset = Test.objects.filter(project=notify.project)
-    for commit in project_commits:
-        request = HttpRequest()
-        request.GET['commit'] = str(commit.id)
-        request.GET['project'] = str(notify.project.id)
-        request.META['HTTP_HOST'] = str(notify.project.organization.site.domain)
-        request = Request(request)
-        test_view = TestReportModelViewSet(request=request)
-
-        testruns_with_results_on_this_commit = TestRun.objects.filter(commit=commit,
-                                                                      test_run_results__isnull=False)
-        runned_tests_ids = set(
-            Test.objects.filter(test_runs__in=testruns_with_results_on_this_commit).values_list('id', flat=True))
-
-        cur_high_tests = set(test_view.get_high_queryset(queryset.all()).values_list('id', flat=True))
-        all_high_tests_number += len(cur_high_tests)
-        all_high_tests = all_high_tests.union(cur_high_tests)
-
-        runned_high_tests = cur_high_tests.intersection(runned_tests_ids)
-        all_runned_high_tests_number += len(runned_high_tests)
-        all_runned_high_tests = all_runned_high_tests.union(runned_high_tests)
-
-        cur_medium_tests = set(test_view.get_medium_queryset(queryset.all()).values_list('id', flat=True))
-        all_medium_tests_number += len(cur_medium_tests)
-        all_medium_tests = all_medium_tests.union(cur_medium_tests)
-
-        runned_medium_tests = cur_medium_tests.intersection(runned_tests_ids)
-        all_runned_medium_tests_number += len(runned_medium_tests)
-        all_runned_medium_tests = all_runned_medium_tests.union(runned_high_tests)
-
-        cur_low_tests = set(test_view.get_low_queryset(queryset.all()).values_list('id', flat=True))
-        all_low_tests_number += len(cur_low_tests)
-        all_low_tests = all_low_tests.union(cur_low_tests)
-        runned_low_tests = cur_low_tests.intersection(runned_tests_ids)
-        all_runned_low_tests_number += len(runned_low_tests)
-        all_runned_low_tests = all_runned_low_tests.union(runned_low_tests)
-
-        cur_unassigned_tests = set(test_view.get_unassigned_queryset(queryset.all()).values_list('id', flat=True))
-        all_unassigned_tests_number += len(cur_unassigned_tests)
-        all_unassigned_tests = all_unassigned_tests.union(cur_unassigned_tests)
-        runned_unassigned_tests = cur_medium_tests.intersection(runned_tests_ids)
-        all_runned_unassigned_tests_number += len(runned_unassigned_tests)
-        all_runned_unassigned_tests = all_runned_unassigned_tests.union(runned_unassigned_tests)
-
-    tests_numbers_by_priority = {
-        'high': all_high_tests_number,
-        'medium': all_medium_tests_number,
-        'low': all_low_tests_number,
-        'unassigned': all_unassigned_tests_number
-    }
-    tests_by_priority = {
-        'high': all_high_tests,
-        'medium': all_medium_tests,
-        'low': all_low_tests,
-        'unassigned': all_unassigned_tests
-    }
     total_tests_info = calculate_tests_number_statistic(tests_numbers_by_priority)
-    defects_for_all_tests_info = get_statistic_for_related_defects(tests_by_priority)
+    defects_for_all_tests_info = get_statistic_for_related_defects(tests_by_priority, defect_test_ids)
     total_tests_info.update(defects_for_all_tests_info)
 
-    runned_tests_by_priority = {
-        'high': all_runned_high_tests,
-        'medium': all_runned_medium_tests,
-        'low': all_runned_low_tests,
-        'unassigned': all_runned_unassigned_tests
-    }
-    runned_tests_numbers_by_priority = {
-        'high': all_runned_high_tests_number,
-        'medium': all_runned_medium_tests_number,
-        'low': all_runned_low_tests_number,
-        'unassigned': all_runned_unassigned_tests_number
-
-    }
     total_runned_tests_info = calculate_tests_number_statistic(runned_tests_numbers_by_priority)
-    defects_for_runned_tests_info = get_statistic_for_related_defects(runned_tests_by_priority)
+    defects_for_runned_tests_info = get_statistic_for_related_defects(runned_tests_by_priority, defect_test_ids)
     total_runned_tests_info.update(defects_for_runned_tests_info)
 
     result = {
@@ -213,6 +179,35 @@ def calculate_statistic(notify, date_range=None):
     return result
 
 
+def calculate_statistic(notify, date_range=None):
+    # type: (Notification, tuple) -> dict
+    """
+        Calculate statistic for notification, shared by notifications of the project checked
+        in the same send cycle for the same period
+    :param notify: Notification instance
+    :param date_range: Tuple with datetime objects for one_off range
+    :return: result: Dict with results
+    """
+    project_commits = Commit.objects.filter(project=notify.project)
+    if not date_range:
+        previous_send_datetime = notify.previous_send_datetime.replace(tzinfo=pytz.timezone('UTC'))
+        current_datetime = notify.current_datetime.replace(tzinfo=pytz.timezone('UTC'))
+        project_commits = project_commits.filter(created__gt=previous_send_datetime, created__lte=current_datetime)
+        scope = (previous_send_datetime.isoformat(), current_datetime.isoformat())
+    else:
+        project_commits = project_commits.filter(created__date__range=date_range)
+        scope = tuple(str(value) for value in date_range)
+
+    cache_key = 'notification:test_prioritization:{project_id}:{scope}'.format(
+        project_id=notify.project_id, scope=md5(repr(scope).encode()).hexdigest())
+    result = cache.get(cache_key)
+    if result is None:
+        commits_ids = list(project_commits.order_by('-created').values_list('id', flat=True))
+        result = calculate_statistic_by_commits(notify.project, commits_ids)
+        cache.set(cache_key, result, STATISTIC_CACHE_TIMEOUT)
+    return copy.deepcopy(result)
+
+
 def check_updates(notify, date_range=None):
     # type: (Notification, tuple) -> None
     """
@@ -231,9 +226,7 @@ def check_updates(notify, date_range=None):
         email_context['project_name'] = notify.project.name
         email_context['period'] = notify.get_period_display()
         emails = notify.emails.split(',')
-        for email in emails:
-            email_context['email'] = email
-            send_notification_email(notify=notify, context=email_context)
+        send_notification_emails(notify=notify, emails=emails, context=email_context)
 
         if not notify.period == Notification.PERIOD_ONE_OFF:
             schedule_last_send = notify.current_datetime.replace(tzinfo=pytz.timezone('UTC'))
@@ -6,7 +6,7 @@ from django.db.models import Max, OuterRef, Subquery, Count, Case, When, F, Q
 from django.db.models.functions import TruncSecond
 
 from applications.notification.models import Notification
-from applications.notification.utils.email import send_notification_email
+from applications.notification.utils.email import send_notification_emails
 from applications.testing.models import TestRunResult, Defect
 
 
@@ -156,9 +156,7 @@ def check_updates(notify, date_range=None):
             email_context['test_runs'] = test_run_queryset
             email_context['test_run_url'] = build_absolute_uri(notify.project.organization, '/test-runs/')
 
-            for email in emails:
-                email_context['email'] = email
-                send_notification_email(notify=notify, context=email_context)
+            send_notification_emails(notify=notify, emails=emails, context=email_context)
 
         if not notify.period == Notification.PERIOD_ONE_OFF:
             if notify.period == Notification.PERIOD_IMMEDIATELY:
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+from django.core.management.base import BaseCommand
+
+from applications.project.models import Project
+from applications.testing.utils.prediction.riskiness.slow_model import update_slow_commits_metrics
+
+
+class Command(BaseCommand):
+    help = 'Used to compute slow model stats of commits of the training window again from the reset ' \
+           'files history and authors experience.'
+
+    def handle(self, *args, **options):
+        project_id = options.get('project_id')
+
+        if project_id:
+            projects = Project.objects.filter(id=project_id).only('id', 'name')
+        else:
+            projects = Project.objects.all().only('id', 'name')
+
+        for project in projects:
+            update_slow_commits_metrics(project_id=project.id, replay=True)
+            self.stdout.write('{project_name} slow model stats replayed'.format(project_name=project.name))
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--project_id', dest='project_id',
+            default=False,
+            help='Project id',
+            type=int
+        )
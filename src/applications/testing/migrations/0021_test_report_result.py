@@ -0,0 +1,31 @@
+# Generated by Django 3.2.25 on 2026-10-18 10:54
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('testing', '0020_testrunmaterializedmodel'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='testreport',
+            name='author',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='test_reports', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='testreport',
+            name='host',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='testreport',
+            name='result',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
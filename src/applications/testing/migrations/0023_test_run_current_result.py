@@ -0,0 +1,58 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('testing', '0022_test_run_statistic_table'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            """
+            CREATE TABLE testing_testruncurrentresult (
+                test_run_result_id integer NOT NULL PRIMARY KEY
+                    REFERENCES testing_testrunresult(id) ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED,
+                test_run_id integer NOT NULL
+                    REFERENCES testing_testrun(id) ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED,
+                test_id integer NOT NULL
+                    REFERENCES testing_test(id) ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED,
+                status varchar(255) NOT NULL,
+                created timestamp with time zone NOT NULL,
+                UNIQUE (test_run_id, test_id)
+            );
+            CREATE INDEX testing_testruncurrentresult_test_created
+                ON testing_testruncurrentresult (test_id, created DESC);
+            INSERT INTO testing_testruncurrentresult (test_run_result_id, test_run_id, test_id, status, created)
+            SELECT DISTINCT ON (test_run_id, test_id)
+                id,
+                test_run_id,
+                test_id,
+                status,
+                created
+            FROM testing_testrunresult
+            ORDER BY test_run_id,
+                test_id,
+                created DESC,
+                id DESC;
+            """,
+            """
+            DROP TABLE testing_testruncurrentresult;
+            """
+        ),
+        migrations.CreateModel(
+            name='TestRunCurrentResult',
+            fields=[
+                ('test_run_result', models.OneToOneField(on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='+', serialize=False, to='testing.testrunresult')),
+                ('status', models.CharField(max_length=255)),
+                ('created', models.DateTimeField()),
+                ('test', models.ForeignKey(on_delete=django.db.models.deletion.DO_NOTHING, related_name='current_results', to='testing.test')),
+                ('test_run', models.ForeignKey(on_delete=django.db.models.deletion.DO_NOTHING, related_name='current_results', to='testing.testrun')),
+            ],
+            options={
+                'db_table': 'testing_testruncurrentresult',
+                'managed': False,
+            },
+        ),
+    ]
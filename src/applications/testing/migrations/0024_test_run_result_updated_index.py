@@ -0,0 +1,17 @@
+# Generated by Django 3.2.25 on 2026-10-18 13:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('testing', '0023_test_run_current_result'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='testrunresult',
+            index=models.Index(fields=['updated'], name='testrunresult_updated_idx'),
+        ),
+    ]
@@ -23,7 +23,8 @@ try:
 except ImportError:
     from django.utils.encoding import force_unicode as force_text
 
-from collections import Counter
+import copy
+from collections import Counter, defaultdict, deque
 
 User = get_user_model()
 
@@ -105,6 +106,26 @@ class TestReport(models.Model):
         null=False
     )
 
+    author = models.ForeignKey(
+        User,
+        related_name="test_reports",
+        blank=True,
+        null=True,
+        on_delete=models.SET_NULL
+    )
+
+    host = models.CharField(
+        max_length=255,
+        blank=True,
+        null=False
+    )
+
+    result = JSONField(
+        default=dict,
+        blank=True,
+        null=False
+    )
+
     created = models.DateTimeField(
         verbose_name="created",
         auto_now_add=True,
@@ -657,6 +678,7 @@ class TestRun(MPTTModel):
                 test_run_results.append(tr)
 
         test_run_results_queryset = TestRunResult.objects.bulk_create(test_run_results)
+        TestRunCurrentResult.refresh([self.id])
         return test_run_results_queryset
 
     def _current_test_run_results(self):
@@ -939,10 +961,129 @@ class TestRunMaterializedModel(models.Model):
 
     @staticmethod
     @transaction.atomic
-    def refresh():
-        sql = f"""REFRESH MATERIALIZED VIEW mv_test_count_by_type;"""
+    def refresh(test_run_ids=None):
+        """
+        Recalculate statistics of 'test_run_ids' test runs (of all test runs when omitted).
+        Rows of test runs without results are removed.
+        """
+        if test_run_ids is None:
+            condition = 'TRUE'
+        else:
+            test_run_ids = list(test_run_ids)
+            if not test_run_ids:
+                return
+            condition = 'test_run_id = ANY(%(test_run_ids)s)'
+
+        sql = f"""
+        DELETE FROM mv_test_count_by_type
+        WHERE {condition} AND NOT EXISTS (
+            SELECT 1 FROM testing_testrunresult
+            WHERE testing_testrunresult.test_run_id = mv_test_count_by_type.test_run_id
+        );
+        WITH test_run_execution_time AS (
+            SELECT
+                testing_testrunresult.test_run_id,
+                SUM(testing_testrunresult.execution_time) as execution_time
+            FROM testing_testrunresult
+            WHERE {condition}
+            GROUP BY 1
+        ), test_run_statistic AS (
+        SELECT test_run_id,
+            COUNT(*) AS tests_count,
+            COUNT(CASE WHEN status = 'pass' THEN 1 END) AS passed_tests_count,
+            COUNT(CASE WHEN status = 'skipped' THEN 1 END) AS skipped_tests_count,
+            COUNT(CASE WHEN status = 'fail' THEN 1 END) AS failed_tests_count,
+            COUNT(CASE WHEN status = 'broken' THEN 1 END) AS broken_tests_count,
+            COUNT(CASE WHEN status IN ('pending', 'skipped', 'not_run') THEN 1 END) AS not_run_tests_count
+        FROM (
+            SELECT DISTINCT ON (test_run_id, test_id)
+            test_run_id,
+            test_id,
+            status
+            FROM testing_testrunresult
+            WHERE {condition}
+            ORDER BY test_run_id,
+            test_id,
+            test_run_start_date DESC
+        ) t
+        GROUP BY test_run_id)
+        INSERT INTO mv_test_count_by_type
+        SELECT test_run_execution_time.test_run_id,
+            test_run_statistic.tests_count,
+            test_run_statistic.passed_tests_count,
+            test_run_statistic.skipped_tests_count,
+            test_run_statistic.failed_tests_count,
+            test_run_statistic.broken_tests_count,
+            test_run_statistic.not_run_tests_count,
+            test_run_execution_time.execution_time
+        FROM test_run_execution_time
+        INNER JOIN test_run_statistic ON test_run_execution_time.test_run_id = test_run_statistic.test_run_id
+        ON CONFLICT (test_run_id) DO UPDATE SET
+            tests_count = EXCLUDED.tests_count,
+            passed_tests_count = EXCLUDED.passed_tests_count,
+            skipped_tests_count = EXCLUDED.skipped_tests_count,
+            failed_tests_count = EXCLUDED.failed_tests_count,
+            broken_tests_count = EXCLUDED.broken_tests_count,
+            not_run_tests_count = EXCLUDED.not_run_tests_count,
+            execution_time = EXCLUDED.execution_time;
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(sql, {'test_run_ids': test_run_ids})
+
+
+class TestRunCurrentResult(models.Model):
+    """
+    The newest result of every test in a test run, used to resolve current statuses
+    of tests without scanning all of their results.
+    """
+    test_run_result = models.OneToOneField('testing.TestRunResult', related_name='+',
+                                           on_delete=models.DO_NOTHING, primary_key=True)
+    test_run = models.ForeignKey('testing.TestRun', related_name='current_results', on_delete=models.DO_NOTHING)
+    test = models.ForeignKey('testing.Test', related_name='current_results', on_delete=models.DO_NOTHING)
+    status = models.CharField(max_length=255)
+    created = models.DateTimeField()
+
+    class Meta(object):
+        managed = False
+        db_table = 'testing_testruncurrentresult'
+
+    @staticmethod
+    def refresh(test_run_ids=None):
+        """
+        Update newest results of tests of 'test_run_ids' test runs (of all test runs when omitted).
+        Rows of deleted results are removed by the database.
+        """
+        if test_run_ids is None:
+            condition = 'TRUE'
+        else:
+            test_run_ids = list(test_run_ids)
+            if not test_run_ids:
+                return
+            condition = 'test_run_id = ANY(%(test_run_ids)s)'
+
+        sql = f"""
+        INSERT INTO testing_testruncurrentresult (test_run_result_id, test_run_id, test_id, status, created)
+        SELECT DISTINCT ON (test_run_id, test_id)
+            id,
+            test_run_id,
+            test_id,
+            status,
+            created
+        FROM testing_testrunresult
+        WHERE {condition}
+        ORDER BY test_run_id,
+            test_id,
+            created DESC,
+            id DESC
+        ON CONFLICT (test_run_id, test_id) DO UPDATE SET
+            test_run_result_id = EXCLUDED.test_run_result_id,
+            status = EXCLUDED.status,
+            created = EXCLUDED.created
+        WHERE testing_testruncurrentresult.test_run_result_id != EXCLUDED.test_run_result_id
+            OR testing_testruncurrentresult.status != EXCLUDED.status;
+        """
         with connection.cursor() as cursor:
-            cursor.execute(sql)
+            cursor.execute(sql, {'test_run_ids': test_run_ids})
 
 
 class TestRunResult(models.Model):
@@ -1046,6 +1187,7 @@ class TestRunResult(models.Model):
         verbose_name_plural = _(u'test run results')
         indexes = [
             models.Index(fields=['-created'], name='testrunresult_created_idx'),
+            models.Index(fields=['updated'], name='testrunresult_updated_idx'),
         ]
 
     def __unicode__(self):
@@ -1369,29 +1511,73 @@ class Defect(models.Model):
         else:
             return False
 
+    def get_commit_ancestry(self, commit, test_suite, stop_statuses, max_depth):
+        """
+        Breadth-first walk over ancestors of 'commit' up to 'max_depth' parents. The walk doesn't go through
+        commits where any of associated tests has a result with one of 'stop_statuses' in 'test_suite'.
+
+        :param commit: instance of commit
+        :param test_suite: instance of test suite
+        :param stop_statuses: list of test run result statuses
+        :param max_depth: max number of parents between 'commit' and an ancestor
+        :return: set of visited commit ids including 'commit'
+        """
+        parent_ids = defaultdict(list)
+
+        if max_depth > 0:
+            sql = """
+            WITH RECURSIVE ancestry(to_commit_id, from_commit_id, depth) AS (
+                SELECT to_commit_id, from_commit_id, 0 FROM vcs_parentcommit WHERE to_commit_id = %(commit_id)s
+                UNION
+                SELECT parent.to_commit_id, parent.from_commit_id, ancestry.depth + 1
+                FROM vcs_parentcommit parent
+                INNER JOIN ancestry ON parent.to_commit_id = ancestry.from_commit_id
+                WHERE ancestry.depth + 1 < %(max_depth)s
+            )
+            SELECT DISTINCT to_commit_id, from_commit_id FROM ancestry;
+            """
+            with connection.cursor() as cursor:
+                cursor.execute(sql, {'commit_id': commit.id, 'max_depth': max_depth})
+                for to_commit_id, from_commit_id in cursor.fetchall():
+                    parent_ids[to_commit_id].append(from_commit_id)
+
+        stop_commit_ids = set(TestRunResult.objects.filter(
+            commit_id__in={parent_id for ids in parent_ids.values() for parent_id in ids},
+            test_run__commit=models.F('commit'),
+            test_run__project=self.project,
+            test_run__test_suite=test_suite,
+            test__in=self.associated_tests.all(),
+            status__in=stop_statuses
+        ).values_list('commit_id', flat=True).distinct())
+
+        commit_ids = {commit.id}
+        queue = deque([(commit.id, 0)])
+        while queue:
+            commit_id, depth = queue.popleft()
+            if depth >= max_depth:
+                continue
+            for parent_id in parent_ids.get(commit_id, []):
+                if parent_id in commit_ids or parent_id in stop_commit_ids:
+                    continue
+                commit_ids.add(parent_id)
+                queue.append((parent_id, depth + 1))
+        return commit_ids
+
+    def add_commits(self, through, commit_ids):
+        commit_ids = set(commit_ids) - set(through.objects.filter(
+            defect=self, commit_id__in=commit_ids).values_list('commit_id', flat=True))
+        through.objects.bulk_create([through(defect=self, commit_id=commit_id) for commit_id in commit_ids])
+
     def add_caused_by_commits(self, commit, test_suite, cur_recursion_level=1, max_recursion_depth=50):
         if cur_recursion_level > max_recursion_depth:
             err_msg = 'Argument "cur_recursion_level"=%d should ' \
                       'be less than "max_recursion_depth"=%d.' % (cur_recursion_level, max_recursion_depth)
             raise ValueError(err_msg)
 
-        self.caused_by_commits.add(commit)
-        # self.caused_by_commits.get_or_create(commit=commit, defect=self)
-
-        for parent_commit in commit.parents.iterator():
-            test_runs_old = TestRun.objects.filter(commit=parent_commit, project=self.project, test_suite=test_suite)
-            test_run_results = TestRunResult.objects.filter(test_run__in=test_runs_old)
-            tests = Test.objects.filter(test_run_results__in=test_run_results)
-            add_commit = True
-            for test in tests:                
-                if test in self.associated_tests.iterator():
-                    test_runs_pass = TestRunResult.objects.filter(
-                        test=test, commit=parent_commit, test_run__in=test_runs_old, status=TestRunResult.STATUS_PASS)
-                    if test_runs_pass.exists():
-                        add_commit = False
-                        break
-            if add_commit and cur_recursion_level < max_recursion_depth:
-                self.add_caused_by_commits(parent_commit, test_suite, cur_recursion_level+1)
+        # Parents are followed until associated tests pass on them.
+        commit_ids = self.get_commit_ancestry(commit, test_suite, [TestRunResult.STATUS_PASS],
+                                              max_recursion_depth - cur_recursion_level)
+        self.add_commits(DefectCausedByCommits, commit_ids)
 
     def add_closed_by_commits(self, commit, test_suite, cur_recursion_level=1, max_recursion_depth=50):
         if cur_recursion_level > max_recursion_depth:
@@ -1399,21 +1585,10 @@ class Defect(models.Model):
                       'be less than "max_recursion_depth"=%d.' % (cur_recursion_level, max_recursion_depth)
             raise ValueError(err_msg)
 
-        self.closed_by_commits.add(commit)
-        for parent_commit in commit.parents.iterator():
-            test_runs_old = TestRun.objects.filter(commit=parent_commit, project=self.project, test_suite=test_suite)
-            test_run_results = TestRunResult.objects.filter(test_run__in=test_runs_old)
-            tests = Test.objects.filter(test_run_results__in=test_run_results)
-            add_commit = True
-            for test in tests:
-                if test in self.associated_tests.iterator():
-                    test_runs_fail = TestRunResult.objects.filter(
-                        test=test, commit=parent_commit, test_run__in=test_runs_old, status=TestRunResult.STATUS_FAIL)
-                    if test_runs_fail.exists():
-                        add_commit = False
-                        break
-            if add_commit and cur_recursion_level < max_recursion_depth:
-                self.add_closed_by_commits(parent_commit, test_suite, cur_recursion_level+1)
+        # Parents are followed until associated tests fail on them.
+        commit_ids = self.get_commit_ancestry(commit, test_suite, [TestRunResult.STATUS_FAIL],
+                                              max_recursion_depth - cur_recursion_level)
+        self.add_commits(DefectClosedByCommits, commit_ids)
 
     @classmethod
     def perform(cls, test_run_result, **kwargs):
@@ -1668,6 +1843,310 @@ class Defect(models.Model):
 
         return True
 
+    @classmethod
+    def perform_bulk(cls, test_run, test_run_results, batch_size=1000):
+        """
+        Set-based variant of 'perform' for results of one test run.
+
+        Results are bucketed by status and failure message, defects are resolved with one query per bucket type
+        and all many-to-many links are inserted in bulk. Defects are created, continued, reopened, closed and
+        marked as flaky the same way as calling 'perform' for every result, failed results being handled first.
+
+        :param test_run:
+        :param test_run_results: saved results of 'test_run'
+        :param batch_size:
+        :return:
+        """
+        failed_results = [test_run_result for test_run_result in test_run_results
+                          if test_run_result.status in [TestRunResult.STATUS_FAIL, TestRunResult.STATUS_BROKEN]]
+        passed_results = [test_run_result for test_run_result in test_run_results
+                          if test_run_result.status == TestRunResult.STATUS_PASS]
+
+        if not failed_results and not passed_results:
+            return True
+
+        test_suite = test_run.test_suite
+        project = test_run.project
+
+        auto_raise = test_suite.auto_raise_defect
+        auto_close = test_suite.auto_close_defect
+
+        # Statuses of the run per test (and commit) for flaky detection, loaded once.
+        statuses_by_test = defaultdict(list)
+        statuses_by_commit = defaultdict(list)
+        for test_id, commit_id, status in TestRunResult.objects.filter(
+            test_suite=test_suite,
+            test_run=test_run,
+            test_id__in={test_run_result.test_id for test_run_result in failed_results + passed_results}
+        ).order_by('created').values_list('test_id', 'commit_id', 'status'):
+            statuses_by_test[test_id].append(status)
+            statuses_by_commit[(test_id, commit_id)].append(status)
+
+        def is_flaky(test_run_result, any_commit=False):
+            if any_commit:
+                return cls.is_flaky(statuses_by_test[test_run_result.test_id])
+            return cls.is_flaky(statuses_by_commit[(test_run_result.test_id, test_run_result.commit_id)])
+
+        links = defaultdict(list)
+
+        def link(defect, test_run_result, prefix, commits=True):
+            links[prefix + 'test_suites'].append((defect, test_suite.id))
+            links[prefix + 'test_runs'].append((defect, test_run.id))
+            links[prefix + 'test_run_results'].append((defect, test_run_result.id))
+            links[prefix + 'tests'].append((defect, test_run_result.test_id))
+            if commits and test_run_result.commit_id is not None:
+                links[prefix + 'commits'].append((defect, test_run_result.commit_id))
+
+        def flush_links():
+            for field_name, pairs in links.items():
+                field = cls._meta.get_field(field_name)
+                through = field.remote_field.through
+                source_name = field.m2m_field_name() + '_id'
+                target_name = field.m2m_reverse_field_name() + '_id'
+                rows = {(defect.id, target_id) for defect, target_id in pairs}
+                through.objects.bulk_create(
+                    [through(**{source_name: defect_id, target_name: target_id}) for defect_id, target_id in rows],
+                    batch_size=batch_size, ignore_conflicts=True)
+            links.clear()
+
+        new_defects = list()
+        created_defects = list()
+        reopened_defects = list()
+        changed_defects = dict()
+
+        def create_defect(test_run_result):
+            if test_run_result.failure_message:
+                name = test_run_result.failure_message[:255]
+                reason = test_run_result.failure_message[:255]
+            else:
+                name = 'Defect created from result #{id}'.format(id=test_run_result.id)
+                reason = 'Create by failure status.'
+
+            if test_run.is_local:
+                defect_type = Defect.TYPE_LOCAL
+            elif is_flaky(test_run_result):
+                defect_type = Defect.TYPE_FLAKY
+            else:
+                defect_type = Defect.TYPE_PROJECT
+
+            defect = cls(
+                project=project, name=name, reason=reason, error=test_run_result.stacktrace, matching='unknown',
+                type=defect_type, create_type=Defect.CREATE_TYPE_AUTOMATIC, status=Defect.STATUS_NEW,
+                severity=Defect.SEVERITY_TRIVIAL, priority=1, found_date=timezone.now(),
+                created_by_test_suite=test_suite, created_by_test_run=test_run,
+                created_by_test_run_result=test_run_result, created_by_test_id=test_run_result.test_id,
+                created_by_commit_id=test_run_result.commit_id,
+                discovery_phase='', discovery_method='', origination_phase='', root_cause='',
+                resolution_type='', leakage_reason='', owner=test_run.author
+            )
+
+            links['associated_tests'].append((defect, test_run_result.test_id))
+            link(defect, test_run_result, 'found_')
+            link(defect, test_run_result, 'caused_by_', commits=False)
+
+            new_defects.append(defect)
+            created_defects.append((defect, test_run_result))
+            return defect
+
+        def reopen_defect(defect, test_run_result):
+            reopened = copy.copy(defect)
+            reopened.pk = None
+            reopened._state.adding = True
+            reopened.original_defect_id = defect.id
+
+            if is_flaky(test_run_result, any_commit=True):
+                reopened.type = Defect.TYPE_FLAKY
+
+            reopened.status = Defect.STATUS_NEW
+            reopened.reopen_date = timezone.now()
+
+            if test_run.author:
+                reopened.owner = test_run.author
+
+            links['associated_tests'].append((reopened, test_run_result.test_id))
+            link(reopened, test_run_result, 'caused_by_', commits=False)
+            link(reopened, test_run_result, 'found_')
+            link(reopened, test_run_result, 'reopen_')
+
+            new_defects.append(reopened)
+            reopened_defects.append((reopened, test_run_result))
+            return reopened
+
+        def continue_defect(defect, test_run_result):
+            if is_flaky(test_run_result):
+                defect.type = Defect.TYPE_FLAKY
+
+            links['associated_tests'].append((defect, test_run_result.test_id))
+            link(defect, test_run_result, 'found_')
+
+            if defect.pk is not None:
+                changed_defects[defect.pk] = defect
+
+        # Failed and broken results
+        grouped_results = dict()
+        for test_run_result in failed_results:
+            grouped_results.setdefault(test_run_result.failure_message, []).append(test_run_result)
+
+        existing_defects = defaultdict(list)
+        reopened_defect_ids = set()
+        for defect in cls.objects.filter(project=project, reason__in=list(grouped_results)).order_by('id'):
+            existing_defects[defect.reason].append(defect)
+            if defect.original_defect_id is not None:
+                reopened_defect_ids.add(defect.original_defect_id)
+
+        for failure_message, results in grouped_results.items():
+            defects = existing_defects.get(failure_message)
+
+            if not defects:
+                if not auto_raise:
+                    continue
+
+                defect = create_defect(results[0])
+                for test_run_result in results[1:]:
+                    # Long or empty messages are stored truncated or replaced, so they never match again.
+                    if defect.reason == failure_message:
+                        continue_defect(defect, test_run_result)
+                    else:
+                        create_defect(test_run_result)
+                continue
+
+            for defect in list(defects):
+                if defect.status == Defect.STATUS_CLOSED and defect.id not in reopened_defect_ids:
+                    reopened_defect_ids.add(defect.id)
+                    defects.append(reopen_defect(defect, results[0]))
+                else:
+                    continue_defect(defect, results[0])
+
+            for test_run_result in results[1:]:
+                for defect in defects:
+                    continue_defect(defect, test_run_result)
+
+        now = timezone.now()
+        for defect in changed_defects.values():
+            defect.updated = now
+
+        cls.objects.bulk_create(new_defects, batch_size=batch_size)
+        cls.objects.bulk_update(changed_defects.values(), ['type', 'updated'], batch_size=batch_size)
+        flush_links()
+
+        for defect, test_run_result in created_defects + reopened_defects:
+            if test_run_result.commit_id is not None:
+                add_caused_by_commits_task.delay(defect.id, test_run_result.commit_id, test_suite.id)
+
+        for defect, test_run_result in created_defects:
+            defect.send_notification_mail(open=True)
+
+        for defect, test_run_result in reopened_defects:
+            defect.send_notification_mail(reopen=True)
+
+        if not passed_results:
+            return True
+
+        # Passed results
+        associated_tests_through = cls.associated_tests.through
+
+        defect_ids_by_test = defaultdict(list)
+        for defect_id, test_id in associated_tests_through.objects.filter(
+            test_id__in={test_run_result.test_id for test_run_result in passed_results}
+        ).exclude(
+            models.Q(defect__status=Defect.STATUS_CLOSED) | models.Q(defect__type=Defect.TYPE_FLAKY)
+        ).order_by('defect_id').values_list('defect_id', 'test_id'):
+            defect_ids_by_test[test_id].append(defect_id)
+
+        defects = cls.objects.select_related('created_by_commit').in_bulk(
+            {defect_id for defect_ids in defect_ids_by_test.values() for defect_id in defect_ids})
+
+        if not defects:
+            return True
+
+        # Defect has failures when the newest result of any of its associated tests is failed.
+        tests_by_defect = defaultdict(set)
+        for defect_id, test_id in associated_tests_through.objects.filter(
+                defect_id__in=list(defects)).values_list('defect_id', 'test_id'):
+            tests_by_defect[defect_id].add(test_id)
+
+        current_statuses = dict(TestRunResult.objects.filter(
+            test_id__in={test_id for test_ids in tests_by_defect.values() for test_id in test_ids}
+        ).order_by('test_id', '-execution_ended').distinct('test_id').values_list('test_id', 'status'))
+
+        failed_defect_ids = {
+            defect_id for defect_id, test_ids in tests_by_defect.items()
+            if any(current_statuses.get(test_id) in [TestRunResult.STATUS_FAIL, TestRunResult.STATUS_BROKEN]
+                   for test_id in test_ids)
+        }
+
+        Commit = cls._meta.get_field('found_commits').related_model
+        commits = Commit.objects.in_bulk(
+            {test_run_result.commit_id for test_run_result in passed_results if test_run_result.commit_id})
+
+        connected_commits = dict()
+        closed_defects = list()
+        changed_defects = dict()
+
+        for test_run_result in passed_results:
+            commit = commits.get(test_run_result.commit_id)
+
+            for defect_id in defect_ids_by_test.get(test_run_result.test_id, []):
+                defect = defects[defect_id]
+
+                if defect.status == Defect.STATUS_CLOSED or defect.type == Defect.TYPE_FLAKY:
+                    continue
+
+                if defect_id not in failed_defect_ids:
+                    if not auto_close or defect.type == Defect.TYPE_ENVIRONMENTAL:
+                        continue
+
+                    # We don't close defect if commit where we have passed test results is earlier that commit
+                    # where defect was created or is not its descendant.
+                    created_by_commit = defect.created_by_commit
+                    if commit is not None and created_by_commit is not None:
+                        if commit.timestamp < created_by_commit.timestamp:
+                            continue
+
+                        key = (created_by_commit.id, commit.id)
+                        if key not in connected_commits:
+                            connected_commits[key] = created_by_commit.is_connected_with_commit(commit)
+                        if connected_commits[key] is False:
+                            continue
+
+                    defect.close_type = Defect.CLOSE_TYPE_FIXED
+                    defect.status = Defect.STATUS_CLOSED
+                    defect.close_date = timezone.now()
+
+                    link(defect, test_run_result, 'found_')
+
+                    defect.closed_test_suite = test_suite
+                    defect.closed_test_run = test_run
+                    defect.closed_test_run_result = test_run_result
+                    defect.closed_test_id = test_run_result.test_id
+
+                    if commit is not None:
+                        defect.closed_commit = commit
+
+                    closed_defects.append((defect, test_run_result))
+                else:
+                    if is_flaky(test_run_result):
+                        defect.type = Defect.TYPE_FLAKY
+
+                changed_defects[defect_id] = defect
+
+        now = timezone.now()
+        for defect in changed_defects.values():
+            defect.updated = now
+
+        cls.objects.bulk_update(changed_defects.values(), [
+            'type', 'status', 'close_type', 'close_date', 'closed_test_suite', 'closed_test_run',
+            'closed_test_run_result', 'closed_test', 'closed_commit', 'updated'
+        ], batch_size=batch_size)
+        flush_links()
+
+        for defect, test_run_result in closed_defects:
+            if test_run_result.commit_id is not None:
+                add_closed_by_commits_task.delay(defect.id, test_run_result.commit_id, test_suite.id)
+            defect.send_notification_mail(close=True)
+
+        return True
+
     #
     # @classmethod
     # def create(cls, project, test_suite, test, test_run, test_run_result, commit=None, *args, **kwargs):
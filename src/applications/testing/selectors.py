@@ -3,7 +3,10 @@ import logging
 import time
 from datetime import timedelta, date
 import gc
+import functools
 import pathlib
+from hashlib import md5
+from django.core.cache import cache
 from django.db import models
 from django.db.models import Q, F, Count, Value, CharField, Subquery, OuterRef
 from django.db.models.functions import Concat, Coalesce
@@ -15,7 +18,9 @@ from django.db.models.expressions import *
 from django.db.models.lookups import GreaterThan
 from django.db.models.functions import *
 import re
+import numpy as np
 from nltk.stem import PorterStemmer
+from scipy.sparse import csr_matrix
 
 from rest_framework_filters import FilterSet
 
@@ -24,9 +29,11 @@ from applications.integration.ssh_v2.utils import prioritize_task
 
 from applications.testing.models import Test, TestRun, TestSuite, TestRunResult, Defect
 from applications.vcs.models import Commit, Area, Branch
+from applications.vcs.utils.commit_graph import get_commit_range, is_ancestor
 from applications.vcs.utils.analysis import calculate_user_analysis, calculate_user_analysis_by_range, \
     avg_per_range, calculate_similar_by_commit
 from applications.ml.models import MLModel
+from applications.ml.utils.text import STOP_WORDS
 from system.celery_app import app
 
 
@@ -36,6 +43,9 @@ LOOKUP_SEP = '__'
 TEST_RUNS_ML_USING_THRESHOLD = 100
 MINIMAL_NUMBER_OF_TESTRUNS_FOR_ML_MODEL_USING = 10
 
+TEST_TOKENS_CACHE_TIMEOUT = getattr(settings, 'TESTING_TEST_TOKENS_CACHE_TIMEOUT', 7 * 24 * 60 * 60)
+PRIORITIZATION_CACHE_TIMEOUT = getattr(settings, 'TESTING_PRIORITIZATION_CACHE_TIMEOUT', 5 * 60)
+
 
 class Priority(models.IntegerChoices):
     HIGH = 1
@@ -66,14 +76,42 @@ PRIORITY_FOR_TEST = 10
 PRIORITY_FOR_TEST_WITH_DAY = 11
 PRIORITY_EXECUTION_TIME_UNDER = 12
 
+PRIORITY_TIERS = {
+    PRIORITY_HIGH: 'high',
+    PRIORITY_MEDIUM: 'medium',
+    PRIORITY_LOW: 'low',
+    PRIORITY_UNASSIGNED: 'unassigned',
+}
 
-def prioritized_test_list(*, params=None):
+
+def get_prioritization_cache_key(params, commit_list):
+    test_suite = params["test_suite"]
+    scope = (params["project"].id, test_suite.id if test_suite else None, params["commit"].id,
+             tuple(sorted(set(commit_list))), params.get("keyword", None) or "")
+    return 'testing.prioritization.{}'.format(md5(repr(scope).encode('utf-8')).hexdigest())
+
+
+def calculate_prioritization(*, params=None):
+    """
+    Computes every priority tier and the scores of tests for the commits of the request at once.
+
+    The result is cached for a short time, so requests for the other tiers of the same test suite, commits
+    and keyword reuse it instead of predicting again. It isn't cached while changed files of some commit are
+    not processed yet, the tiers change when they are.
+
+    :return: dict with lists of test ids for 'high', 'medium', 'low' and 'unassigned' tiers and 'scores' -
+             list of (test id, score) pairs with the best tests first.
+    """
     params = params or {}
 
-    use_sql = False
     test_suite = params["test_suite"]
 
     commit_list = get_commit_list(params=params)
+    cache_key = get_prioritization_cache_key(params, commit_list)
+    result = cache.get(cache_key)
+    if result is not None:
+        return result
+
     commit_queryset = Commit.objects.filter(id__in=set(commit_list))
 
     commit_queryset_sha = commit_queryset.values_list("sha", flat=True)
@@ -83,15 +121,6 @@ def prioritized_test_list(*, params=None):
     except Exception as exc:
         logging.exception(f"Error with 'prioritize_task'", exc_info=True)
 
-    # while True:
-    #     fully_processed = True
-    #     for commit in commit_queryset:
-    #         if not commit.is_processed:
-    #             fully_processed = False
-    #             break
-    #     if fully_processed:
-    #         break
-
     test_run_count = TestRun.objects.filter(test_suite=test_suite).count()
 
     queryset = Test.objects.filter(
@@ -104,69 +133,82 @@ def prioritized_test_list(*, params=None):
     if test_suite:
         ml_predictor = MLModel.load_model(test_suite_id=test_suite.id)
 
-    ml_model_existing_flag = ml_predictor is not None
+    use_sql = ml_predictor is None or test_run_count < MINIMAL_NUMBER_OF_TESTRUNS_FOR_ML_MODEL_USING
+    keyword = params.get("keyword", None)
 
-    if ml_model_existing_flag is False or test_run_count < MINIMAL_NUMBER_OF_TESTRUNS_FOR_ML_MODEL_USING:
-        use_sql = True
+    logging.info(f"Calculate prioritization with params: {params} - use SQL: {use_sql}")
+
+    unassigned_test_ids = list(get_default_unassigned_queryset(queryset, params=params).values_list('id', flat=True))
+
+    ml_prediction = None
+    if not use_sql:
+        ml_prediction = ml_predictor.predict(queryset, commit_queryset, keyword=keyword)
+        ml_priorities = ml_prediction.groupby("priority")["test_id"].apply(list).to_dict()
+        # With a few test runs the model is trusted only if it leaves less tests unassigned.
+        if test_run_count < TEST_RUNS_ML_USING_THRESHOLD and \
+                len(unassigned_test_ids) <= len(ml_priorities.get('unassigned', [])):
+            use_sql = True
+
+    if use_sql:
+        high_test_ids = list(get_default_high_queryset(queryset, commit_list, params=params).values_list('id', flat=True))
+        medium_test_ids = list(
+            get_default_medium_queryset(queryset, commit_list, params=params).values_list('id', flat=True))
+        low_test_ids = list(queryset.exclude(id__in=set(medium_test_ids) | set(unassigned_test_ids))
+                            .distinct('name').values_list('id', flat=True))
+    else:
+        high_test_ids, medium_test_ids, low_test_ids = [
+            list(queryset.filter(id__in=ml_priorities.get(tier, [])).distinct('name').values_list('id', flat=True))
+            for tier in ['high', 'medium', 'low']
+        ]
+
+    if ml_prediction is not None and test_run_count >= TEST_RUNS_ML_USING_THRESHOLD:
+        ml_prediction = ml_prediction.sort_values(by="result", ignore_index=True, ascending=False)
+        scores = [(int(test_id), float(score)) for test_id, score in zip(ml_prediction["test_id"],
+                                                                         ml_prediction["result"])]
+    else:
+        scores = list(calculate_score(test_queryset=queryset, commit_id=params["commit"].id).items())
+
+    result = {
+        'high': high_test_ids,
+        'medium': medium_test_ids,
+        'low': low_test_ids,
+        'unassigned': unassigned_test_ids,
+        'scores': scores,
+    }
+    if not commit_queryset.filter(is_processed=False).exists():
+        cache.set(cache_key, result, timeout=PRIORITIZATION_CACHE_TIMEOUT)
+    return result
 
-    priority = params["priority"]
-    keyword = params.get("keyword", None)
 
-    logging.info(f"Get priority tests with params: {params} - use SQL: {use_sql}")
+def get_test_display_names(queryset, params=None):
+    """ Names of tests prefixed with class and area names if requested, by test ids. """
+    params = params or {}
+    names = dict()
+    for test_id, name, class_name, area_name in queryset.values_list('id', 'name', 'class_name', 'area__name'):
+        if params.get("classname", False):
+            name = (class_name or '') + params.get("classname_separator", "") + name
+        if params.get("testsuitename", False):
+            name = (area_name or '') + params.get("testsuitename_separator", "") + name
+        names[test_id] = name
+    return names
 
-    if priority == PRIORITY_HIGH:
-        if use_sql:
-            queryset = get_default_high_queryset(queryset, commit_list, params=params)
-        else:
-            if test_run_count >= TEST_RUNS_ML_USING_THRESHOLD:
-                test_ids = ml_predictor.predict_by_priority(queryset, commit_queryset, keyword=keyword)['high']
-                queryset = queryset.filter(id__in=test_ids).distinct('name')
-            else:
-                ml_prediction_results = ml_predictor.predict_by_priority(queryset, commit_queryset, keyword=keyword)
-                ml_unassigned_tests_num = len(ml_prediction_results['unassigned'])
-                original_unassigned_num = get_default_unassigned_queryset(queryset, params=params).count()
-                if original_unassigned_num > ml_unassigned_tests_num:
-                    test_ids = ml_prediction_results['high']
-                    queryset = queryset.filter(id__in=test_ids).distinct('name')
-                else:
-                    queryset = get_default_high_queryset(queryset, commit_list, params=params)
 
-    elif priority == PRIORITY_MEDIUM:
-        if use_sql:
-            queryset = get_default_medium_queryset(queryset, commit_list, params=params)
-        else:
-            if test_run_count >= TEST_RUNS_ML_USING_THRESHOLD:
-                test_ids = ml_predictor.predict_by_priority(queryset, commit_queryset, keyword=keyword)['medium']
-                queryset = queryset.filter(id__in=test_ids).distinct('name')
-            else:
-                ml_prediction_results = ml_predictor.predict_by_priority(queryset, commit_queryset, keyword=keyword)
-                ml_unassigned_tests_num = len(ml_prediction_results['unassigned'])
-                original_unassigned_num = get_default_unassigned_queryset(queryset, params=params).count()
-                if original_unassigned_num > ml_unassigned_tests_num:
-                    test_ids = ml_prediction_results['medium']
-                    queryset = queryset.filter(id__in=test_ids).distinct('name')
-                else:
-                    queryset = get_default_medium_queryset(queryset, commit_list, params=params)
+def prioritized_test_list(*, params=None):
+    params = params or {}
 
-    elif priority == PRIORITY_LOW:
-        if use_sql:
-            queryset = get_default_low_queryset(queryset, commit_list, params=params)
-        else:
-            if test_run_count >= TEST_RUNS_ML_USING_THRESHOLD:
-                test_ids = ml_predictor.predict_by_priority(queryset, commit_queryset, keyword=keyword)['low']
-                queryset = queryset.filter(id__in=test_ids).distinct('name')
-            else:
-                ml_prediction_results = ml_predictor.predict_by_priority(queryset, commit_queryset, keyword=keyword)
-                ml_unassigned_tests_num = len(ml_prediction_results['unassigned'])
-                original_unassigned_num = get_default_unassigned_queryset(queryset, params=params).count()
-                if original_unassigned_num > ml_unassigned_tests_num:
-                    test_ids = ml_prediction_results['low']
-                    queryset = queryset.filter(id__in=test_ids).distinct('name')
-                else:
-                    queryset = get_default_low_queryset(queryset, commit_list, params=params)
+    test_suite = params["test_suite"]
 
-    elif priority == PRIORITY_UNASSIGNED:
-        queryset = get_default_unassigned_queryset(queryset, params=params)
+    queryset = Test.objects.filter(
+        project=params["project"]
+    )
+    if test_suite:
+        queryset = queryset.filter(test_suites=test_suite)
+
+    priority = params["priority"]
+
+    if priority in PRIORITY_TIERS:
+        prioritization = calculate_prioritization(params=params)
+        queryset = queryset.filter(id__in=prioritization[PRIORITY_TIERS[priority]]).distinct('name')
 
     elif priority == PRIORITY_READY_DEFECT:
         queryset = get_default_ready_defect_queryset(queryset, params=params)
@@ -177,29 +219,13 @@ def prioritized_test_list(*, params=None):
     elif priority == PRIORITY_RERUN:
         queryset = get_default_rerun_queryset(queryset, test_run=None, params=params)
 
-    elif priority == PRIORITY_TOP20:
-        params["percent"] = 20
-        if use_sql:
-            queryset = get_default_top20_queryset(queryset, commit_list, percent=params["percent"], params=params)
-        else:
-            if test_run_count >= TEST_RUNS_ML_USING_THRESHOLD:
-                test_ids = ml_predictor.predict_by_percent(queryset, commit_queryset, keyword=keyword,
-                                                           percent=params.get("percent", 20))
-                queryset = queryset.filter(id__in=test_ids).distinct('name')
-            else:
-                queryset = get_default_top20_queryset(queryset, commit_list, percent=params["percent"], params=params)
-
-    elif priority == PRIORITY_PERCENT:
-        if use_sql:
-            queryset = get_default_by_percent_queryset(queryset, commit_list, percent=params["percent"], params=params)
-        else:
-            if test_run_count >= TEST_RUNS_ML_USING_THRESHOLD:
-                test_ids = ml_predictor.predict_by_percent(queryset, commit_queryset, keyword=keyword,
-                                                           percent=params.get("percent"))
-                queryset = queryset.filter(id__in=test_ids).distinct('name')
-            else:
-                queryset = get_default_by_percent_queryset(
-                    queryset, commit_list, percent=params["percent"], params=params)
+    elif priority == PRIORITY_TOP20 or priority == PRIORITY_PERCENT:
+        if priority == PRIORITY_TOP20:
+            params["percent"] = 20
+        prioritization = calculate_prioritization(params=params)
+        scores = prioritization['scores']
+        test_ids = [test_id for test_id, _ in scores[:int(len(scores) * (params["percent"] / 100))]]
+        queryset = Test.objects.filter(id__in=test_ids).distinct('name')
 
     elif priority == PRIORITY_FOR_TEST or priority == PRIORITY_FOR_TEST_WITH_DAY:
         queryset = get_default_all_queryset(queryset, params=params)
@@ -262,18 +288,33 @@ def get_commit_range_list(target_branch=None, first_commit=None, second_commit=N
     :param exclusive: boolean
     :return: instance of py:obj:`Commit`
     """
-    if first_commit.timestamp < second_commit.timestamp:
+    if (first_commit.generation, first_commit.timestamp) < (second_commit.generation, second_commit.timestamp):
         ancestor = first_commit
         descendant = second_commit
     else:
         ancestor = second_commit
         descendant = first_commit
 
+    # Commits without parents yet (e.g. webhook commits before the full fetch) are taken by the timestamp window.
+    if ancestor.id != descendant.id and not is_ancestor(ancestor, descendant):
+        if first_commit.timestamp < second_commit.timestamp:
+            ancestor = first_commit
+            descendant = second_commit
+        else:
+            ancestor = second_commit
+            descendant = first_commit
+
+        if exclusive:
+            query = Q(timestamp__gte=ancestor.timestamp, timestamp__lt=descendant.timestamp)
+        else:
+            query = Q(timestamp__gte=ancestor.timestamp, timestamp__lte=descendant.timestamp)
+        return list(target_branch.commits.filter(query).values_list('id', flat=True))
+
+    commit_ids = set(get_commit_range(from_commit=ancestor, to_commit=descendant))
+    commit_ids.add(ancestor.id)
     if exclusive:
-        query = Q(timestamp__gte=ancestor.timestamp, timestamp__lt=descendant.timestamp)
-    else:
-        query = Q(timestamp__gte=ancestor.timestamp, timestamp__lte=descendant.timestamp)
-    return list(target_branch.commits.filter(query).values_list('id', flat=True))
+        commit_ids.discard(descendant.id)
+    return list(target_branch.commits.filter(id__in=commit_ids).values_list('id', flat=True))
 
 
 def get_commit_list(*, params=None):
@@ -810,125 +851,56 @@ def number_common_elements(list1, list2):
     return count
 
 
-def get_tokens_from_list(list):
-    #use library for stopworks rather than this
-    ps = PorterStemmer()
-    tokens = []
-    stop_words = ["0o", "0s", "3a", "3b", "3d", "6b", "6o", "a", "a1", "a2", "a3", "a4", "ab", "able",
-                  "about", "above", "abst", "ac", "accordance", "according", "accordingly", "across",
-                  "act", "actually", "ad", "added", "adj", "ae", "af", "affected", "affecting", "affects",
-                  "after", "afterwards", "ag", "again", "against", "ah", "ain", "ain't", "aj", "al", "all",
-                  "allow", "allows", "almost", "alone", "along", "already", "also", "although", "always", "am",
-                  "among", "amongst", "amoungst", "amount", "an", "and", "announce", "another", "any",
-                  "anybody", "anyhow", "anymore", "anyone", "anything", "anyway", "anyways", "anywhere", "ao", "ap",
-                  "apart", "apparently", "appear", "appreciate", "appropriate", "approximately", "ar", "are", "aren",
-                  "arent", "aren't", "arise", "around", "as", "a's", "aside", "ask", "asking", "associated", "at",
-                  "au", "auth", "av", "available", "aw", "away", "awfully", "ax", "ay", "az", "b", "b1", "b2",
-                  "b3", "ba", "back", "bc", "bd", "be", "became", "because", "become", "becomes", "becoming",
-                  "been", "before", "beforehand", "begin", "beginning", "beginnings", "begins", "behind", "being",
-                  "believe", "below", "beside", "besides", "best", "better", "between", "beyond", "bi", "bill",
-                  "biol", "bj", "bk", "bl", "bn", "both", "bottom", "bp", "br", "brief", "briefly", "bs", "bt",
-                  "bu", "but", "bx", "by", "c", "c1", "c2", "c3", "ca", "call", "came", "can", "cannot", "cant",
-                  "can't", "cause", "causes", "cc", "cd", "ce", "certain", "certainly", "cf", "cg", "ch", "changes",
-                  "ci", "cit", "cj", "cl", "clearly", "cm", "c'mon", "cn", "co", "com", "come", "comes",
-                  "con", "concerning", "consequently", "consider", "considering", "contain", "containing",
-                  "contains", "corresponding", "could", "couldn", "couldnt", "couldn't", "course", "cp", "cq",
-                  "cr", "cry", "cs", "c's", "ct", "cu", "currently", "cv", "cx", "cy", "cz", "d", "d2", "da",
-                  "date", "dc", "dd", "de", "definitely", "describe", "described", "despite", "detail", "df",
-                  "di", "did", "didn", "didn't", "different", "dj", "dk", "dl", "do", "does", "doesn", "doesn't",
-                  "doing", "don", "done", "don't", "down", "downwards", "dp", "dr", "ds", "dt", "du", "due",
-                  "during", "dx", "dy", "e", "e2", "e3", "ea", "each", "ec", "ed", "edu", "ee", "ef", "effect",
-                  "eg", "ei", "eight", "eighty", "either", "ej", "el", "eleven", "else", "elsewhere", "em",
-                  "empty", "en", "end", "ending", "enough", "entirely", "eo", "ep", "eq", "er", "es", "especially",
-                  "est", "et", "et-al", "etc", "eu", "ev", "even", "ever", "every", "everybody", "everyone",
-                  "everything", "everywhere", "ex", "exactly", "example", "except", "ey", "f", "f2", "fa",
-                  "far", "fc", "few", "ff", "fi", "fifteen", "fifth", "fify", "fill", "find", "fire", "first",
-                  "five", "fix", "fj", "fl", "fn", "fo", "followed", "following", "follows", "for", "former",
-                  "formerly", "forth", "forty", "found", "four", "fr", "from", "front", "fs", "ft", "fu", "full",
-                  "further", "furthermore", "fy", "g", "ga", "gave", "ge", "get", "gets", "getting", "gi", "give",
-                  "given", "gives", "giving", "gj", "gl", "go", "goes", "going", "gone", "got", "gotten", "gr",
-                  "greetings", "gs", "gy", "h", "h2", "h3", "had", "hadn", "hadn't", "happens", "hardly", "has",
-                  "hasn", "hasnt", "hasn't", "have", "haven", "haven't", "having", "he", "hed", "he'd", "he'll",
-                  "hello", "help", "hence", "her", "here", "hereafter", "hereby", "herein", "heres", "here's",
-                  "hereupon", "hers", "herself", "hes", "he's", "hh", "hi", "hid", "him", "himself", "his",
-                  "hither", "hj", "ho", "home", "hopefully", "how", "howbeit", "however", "how's", "hr", "hs",
-                  "http", "hu", "hundred", "hy", "i", "i2", "i3", "i4", "i6", "i7", "i8", "ia", "ib",
-                  "ibid", "ic", "id", "i'd", "ie", "if", "ig", "ignored", "ih", "ii", "ij", "il", "i'll", "im",
-                  "i'm", "immediate", "immediately", "importance", "important", "in", "inasmuch", "inc",
-                  "indeed", "index", "indicate", "indicated", "indicates", "information", "inner", "insofar",
-                  "instead", "interest", "into", "invention", "inward", "io", "ip", "iq", "ir", "is", "isn",
-                  "isn't", "it", "itd", "it'd", "it'll", "its", "it's", "itself", "iv", "i've", "ix", "iy",
-                  "iz", "j", "jj", "jr", "js", "jt", "ju", "just", "k", "ke", "keep", "keeps", "kept", "kg",
-                  "kj", "km", "know", "known", "knows", "ko", "l", "l2", "la", "largely", "last", "lately",
-                  "later", "latter", "latterly", "lb", "lc", "le", "least", "les", "less", "lest", "let",
-                  "lets", "let's", "lf", "like", "liked", "likely", "line", "little", "lj", "ll", "ll",
-                  "ln", "lo", "look", "looking", "looks", "los", "lr", "ls", "lt", "ltd", "m", "m2",
-                  "ma", "made", "mainly", "make", "makes", "many", "may", "maybe", "me", "mean", "means",
-                  "meantime", "meanwhile", "merely", "mg", "might", "mightn", "mightn't", "mill", "million",
-                  "mine", "miss", "ml", "mn", "mo", "more", "moreover", "most", "mostly", "move", "mr",
-                  "mrs", "ms", "mt", "mu", "much", "mug", "must", "mustn", "mustn't", "my", "myself", "n",
-                  "n2", "na", "name", "namely", "nay", "nc", "nd", "ne", "near", "nearly", "necessarily",
-                  "necessary", "need", "needn", "needn't", "needs", "neither", "never", "nevertheless",
-                  "new", "next", "ng", "ni", "nine", "ninety", "nj", "nl", "nn", "no", "nobody", "non",
-                  "none", "nonetheless", "noone", "nor", "normally", "nos", "not", "noted", "nothing",
-                  "novel", "now", "nowhere", "nr", "ns", "nt", "ny", "o", "oa", "ob", "obtain", "obtained",
-                  "obviously", "oc", "od", "of", "off", "often", "og", "oh", "oi", "oj", "ok", "okay", "ol",
-                  "old", "om", "omitted", "on", "once", "one", "ones", "only", "onto", "oo", "op", "oq", "or", "ord",
-                  "os", "ot", "other", "others", "otherwise", "ou", "ought", "our", "ours", "ourselves", "out",
-                  "outside", "over", "overall", "ow", "owing", "own", "ox", "oz", "p", "p1", "p2", "p3", "page",
-                  "pagecount", "pages", "par", "part", "particular", "particularly", "pas", "past", "pc", "pd",
-                  "pe", "per", "perhaps", "pf", "ph", "pi", "pj", "pk", "pl", "placed", "please", "plus", "pm",
-                  "pn", "po", "poorly", "possible", "possibly", "potentially", "pp", "pq", "pr", "predominantly",
-                  "present", "presumably", "previously", "primarily", "probably", "promptly", "proud", "provides",
-                  "ps", "pt", "pu", "put", "py", "q", "qj", "qu", "que", "quickly", "quite", "qv", "r", "r2",
-                  "ra", "ran", "rather", "rc", "rd", "re", "readily", "really", "reasonably", "recent",
-                  "recently", "ref", "refs", "regarding", "regardless", "regards", "related", "relatively",
-                  "research", "research-articl", "respectively", "resulted", "resulting", "results", "rf",
-                  "rh", "ri", "right", "rj", "rl", "rm", "rn", "ro", "rq", "rr", "rs", "rt", "ru", "run",
-                  "rv", "ry", "s", "s2", "sa", "said", "same", "saw", "say", "saying", "says", "sc", "sd",
-                  "se", "sec", "second", "secondly", "section", "see", "seeing", "seem", "seemed", "seeming",
-                  "seems", "seen", "self", "selves", "sensible", "sent", "serious", "seriously", "seven",
-                  "several", "sf", "shall", "shan", "shan't", "she", "shed", "she'd", "she'll", "shes",
-                  "she's", "should", "shouldn", "shouldn't", "should've", "show", "showed", "shown",
-                  "showns", "shows", "si", "side", "significant", "significantly", "similar", "similarly",
-                  "since", "sincere", "six", "sixty", "sj", "sl", "slightly", "sm", "sn", "so", "some",
-                  "somebody", "somehow", "someone", "somethan", "something", "sometime", "sometimes", "somewhat",
-                  "somewhere", "soon", "sorry", "sp", "specifically", "specified", "specify", "specifying",
-                  "sq", "sr", "ss", "st", "still", "stop", "strongly", "sub", "substantially", "successfully",
-                  "such", "sufficiently", "suggest", "sup", "sure", "sy", "system", "sz", "t", "t1", "t2",
-                  "t3", "take", "taken", "taking", "tb", "tc", "td", "te", "tell", "ten", "tends", "tf",
-                  "th", "than", "thank", "thanks", "thanx", "that", "that'll", "thats", "that's", "that've",
-                  "the", "their", "theirs", "them", "themselves", "then", "thence", "there", "thereafter",
-                  "thereby", "thered", "therefore", "therein", "there'll", "thereof", "therere", "theres",
-                  "there's", "thereto", "thereupon", "there've", "these", "they", "theyd", "they'd", "they'll",
-                  "theyre", "they're", "they've", "thickv", "thin", "think", "third", "this", "thorough",
-                  "thoroughly", "those", "thou", "though", "thoughh", "thousand", "three", "throug",
-                  "through", "throughout", "thru", "thus", "ti", "til", "tip", "tj", "tl", "tm", "tn", "to",
-                  "together", "too", "took", "top", "toward", "towards", "tp", "tq", "tr", "tried", "tries",
-                  "truly", "try", "trying", "ts", "t's", "tt", "tv", "twelve", "twenty", "twice", "two", "tx",
-                  "u", "u201d", "ue", "ui", "uj", "uk", "um", "un", "under", "unfortunately", "unless", "unlike", "unlikely", "until", "unto", "uo", "up", "upon", "ups", "ur", "us", "use", "used", "useful", "usefully", "usefulness", "uses", "using", "usually", "ut", "v", "va", "value", "various", "vd", "ve", "ve", "very", "via", "viz", "vj", "vo", "vol", "vols", "volumtype", "vq", "vs", "vt", "vu", "w", "wa", "want", "wants", "was", "wasn", "wasnt", "wasn't", "way", "we", "wed", "we'd", "welcome", "well", "we'll", "well-b", "went", "were", "we're", "weren", "werent", "weren't", "we've", "what", "whatever", "what'll", "whats", "what's", "when", "whence", "whenever", "when's", "where", "whereafter", "whereas", "whereby", "wherein", "wheres", "where's", "whereupon", "wherever", "whether", "which", "while", "whim", "whither", "who", "whod", "whoever", "whole", "who'll", "whom", "whomever", "whos", "who's", "whose", "why", "why's", "wi", "widely", "will", "willing", "wish", "with", "within", "without", "wo", "won", "wonder", "wont", "won't", "words", "world", "would", "wouldn", "wouldnt", "wouldn't", "www", "x", "x1", "x2", "x3", "xf", "xi", "xj", "xk", "xl", "xn", "xo", "xs", "xt", "xv", "xx", "y", "y2", "yes", "yet", "yj", "yl", "you", "youd", "you'd", "you'll", "your", "youre", "you're", "yours", "yourself", "yourselves", "you've", "yr", "ys", "yt", "z", "zero", "zi", "zz"]
-
-    for item in list:
-        if item not in stop_words:
-            tokens_alpha = non_alpha_split(item)
-            #print("filetokensalpha")
-            #print(tokens_alpha)
-            for token in tokens_alpha:
-                #print("file token")
-                #print(file_token)
+stem = functools.lru_cache(maxsize=65536)(PorterStemmer().stem)
+
+
+# Weights of common tokens of test name, class name, area name and of all three of them
+# with commit areas, files, folders, dependent areas, message, areas and files, areas and files and message.
+SCORE_WEIGHTS = (
+    (1, 1, 1, 1, 1, 0, 0),
+    (1, 1, 1, 1, 1, 2, 2),
+    (1, 1, 1, 1, 1, 1, 1),
+    (1, 1, 1, 1, 1, 1, 1),
+)
+
+
+def get_tokens_from_list(items):
+    tokens = dict()
+    for item in items:
+        if item not in STOP_WORDS:
+            for token in non_alpha_split(item):
                 if token != "":
-                    token_lower = token.lower()
-                    token_lower = ps.stem(token_lower)
-                    #!!!!!
-                    #stem and lemmitize here!!!!!!!!!!!!!!!!!!!!!!!
-                    #!!!!!
+                    token_lower = stem(token.lower())
+                    if token_lower not in STOP_WORDS:
+                        tokens[token_lower] = None
+    return list(tokens)
+
 
-                    #I think we want to add tokens multiple times it probably means it is more meaningful and should be counted multiple times - this is a theory though
-                    if token_lower not in tokens:
-                        if token_lower not in stop_words:
-                            tokens.append(token_lower)
+def get_test_tokens(tests):
+    """
+    Tokens of name, class name and area name of tests.
+    Cached by the values themselves, so renamed tests get new tokens.
 
-    return tokens
+    :param tests: iterable of (id, name, class_name, area_name)
+    :return: dict of test id -> (name tokens, class name tokens, area name tokens)
+    """
+    keys = dict()
+    for test_id, *values in tests:
+        values = tuple(value or '' for value in values)
+        keys[test_id] = ('test_tokens:' + md5('\x00'.join(values).encode('utf-8')).hexdigest(), values)
+
+    cached = cache.get_many([key for key, _ in keys.values()])
+
+    missing = dict()
+    result = dict()
+    for test_id, (key, values) in keys.items():
+        if key not in cached:
+            cached[key] = missing[key] = tuple(get_tokens_from_list([value]) for value in values)
+        result[test_id] = cached[key]
+
+    if missing:
+        cache.set_many(missing, timeout=TEST_TOKENS_CACHE_TIMEOUT)
+    return result
 
 
 def calculate_score(test_queryset, commit_id):
@@ -946,105 +918,51 @@ def calculate_score(test_queryset, commit_id):
     defect_closed_by_caused_by_intersection_dependent_areas = [x for x in list(
         commit.areas.values_list('dependencies__name', flat=True)) if x]
 
-    result = {}
-
-    test_queryset = test_queryset.distinct('name')
-
-    for test in test_queryset:
-
-        test_names = [test.name]
-
-        test_classes_names = [test.class_name]
-
-        test_areas = [test.area.name]
-
-        test_names_tokens = get_tokens_from_list(test_names)
-        test_classes_names_tokens = get_tokens_from_list(test_classes_names)
-        test_areas_tokens = get_tokens_from_list(test_areas)
-
+    commits_area_tokens = get_tokens_from_list(defect_closed_by_caused_by_intersection_areas)
+    commits_file_tokens = get_tokens_from_list(defect_closed_by_caused_by_intersection_files)
+    commits_folder_tokens = get_tokens_from_list(defect_closed_by_caused_by_intersection_folders)
+    commits_dependent_tokens = get_tokens_from_list(defect_closed_by_caused_by_intersection_dependent_areas)
+    commit_message_tokens = get_tokens_from_list(commit_message)
+
+    commit_multiple_tokens = common_elements(commits_area_tokens, commits_file_tokens)
+    # Compared with the raw message, not with its tokens.
+    commit_multiple_message_tokens = common_elements(commit_multiple_tokens, commit_message)
+
+    commit_tokens = [commits_area_tokens, commits_file_tokens, commits_folder_tokens, commits_dependent_tokens,
+                     commit_message_tokens, commit_multiple_tokens, commit_multiple_message_tokens]
+
+    tests = list(test_queryset.distinct('name').values_list('id', 'name', 'class_name', 'area__name'))
+    test_tokens = get_test_tokens(tests)
+
+    # Weight of every commit token for every kind of test tokens, score of a test is the sum of weights
+    # of its tokens.
+    vocabulary = dict()
+    for tokens in commit_tokens:
+        for token in tokens:
+            vocabulary.setdefault(token, len(vocabulary))
+
+    weights = np.zeros((len(SCORE_WEIGHTS), len(vocabulary)), dtype=np.int64)
+    for kind, kind_weights in enumerate(SCORE_WEIGHTS):
+        for tokens, weight in zip(commit_tokens, kind_weights):
+            for token in tokens:
+                weights[kind, vocabulary[token]] += weight
+
+    rows, columns = list(), list()
+    for row, (test_id, *_) in enumerate(tests):
+        test_names_tokens, test_classes_names_tokens, test_areas_tokens = test_tokens[test_id]
         test_multiple_tokens = common_elements(test_names_tokens, test_classes_names_tokens)
         test_multiple_tokens = common_elements(test_multiple_tokens, test_areas_tokens)
 
-        commits_area_tokens = get_tokens_from_list(defect_closed_by_caused_by_intersection_areas)
-        commits_file_tokens = get_tokens_from_list(defect_closed_by_caused_by_intersection_files)
-        commits_folder_tokens = get_tokens_from_list(defect_closed_by_caused_by_intersection_folders)
-        commits_dependent_tokens  = get_tokens_from_list(defect_closed_by_caused_by_intersection_dependent_areas)
-
-        #unsure about line below
-        commit_message_tokens = get_tokens_from_list(commit_message)
-
-        commit_multiple_tokens = common_elements(commits_area_tokens, commits_file_tokens)
-        commit_multiple_message_tokens = common_elements(commit_multiple_tokens, commit_message)
-        #dependent areas shouldn't be added as they will always be separate
-
-        #New Features
-
-        #remove rework and risk
-
-        test_names_to_commit_areas = number_common_elements(test_names_tokens, commits_area_tokens)
-        test_names_to_commit_files = number_common_elements(test_names_tokens, commits_file_tokens)
-        test_names_to_commit_folders = number_common_elements(test_names_tokens, commits_folder_tokens)
-        test_names_to_commit_dependent_areas = number_common_elements(test_names_tokens, commits_dependent_tokens)
-        test_names_to_commit_message = number_common_elements(test_names_tokens, commit_message_tokens)
-        test_names_to_commit_multiple = number_common_elements(test_names_tokens, commit_multiple_tokens)
-        test_names_to_commit_multiple_message = number_common_elements(test_names_tokens, commit_multiple_message_tokens)
-
-        test_class_to_commit_areas = number_common_elements(test_classes_names_tokens, commits_area_tokens)
-        test_class_to_commit_files = number_common_elements(test_classes_names_tokens, commits_file_tokens)
-        test_class_to_commit_folders = number_common_elements(test_classes_names_tokens, commits_folder_tokens)
-        test_class_to_commit_dependent_areas = number_common_elements(test_classes_names_tokens, commits_dependent_tokens)
-        test_class_to_commit_message = number_common_elements(test_classes_names_tokens, commit_message_tokens)
-        test_class_to_commit_multiple = number_common_elements(test_classes_names_tokens, commit_multiple_tokens)
-        test_class_to_commit_multiple_message = number_common_elements(test_classes_names_tokens, commit_multiple_message_tokens)
-
-        test_areas_to_commit_areas = number_common_elements(test_areas_tokens, commits_area_tokens)
-        test_areas_to_commit_files = number_common_elements(test_areas_tokens, commits_file_tokens)
-        test_areas_to_commit_folders = number_common_elements(test_areas_tokens, commits_folder_tokens)
-        test_areas_to_commit_dependent_areas = number_common_elements(test_areas_tokens, commits_dependent_tokens)
-        test_areas_to_commit_message = number_common_elements(test_areas_tokens, commit_message_tokens)
-        test_areas_to_commit_multiple = number_common_elements(test_areas_tokens, commit_multiple_tokens)
-        test_areas_to_commit_multiple_message = number_common_elements(test_areas_tokens, commit_multiple_message_tokens)
-
-        test_multiple_to_commit_areas = number_common_elements(test_multiple_tokens, commits_area_tokens)
-        test_multiple_to_commit_files = number_common_elements(test_multiple_tokens, commits_file_tokens)
-        test_multiple_to_commit_folders = number_common_elements(test_multiple_tokens, commits_folder_tokens)
-        test_multiple_to_commit_dependent_areas = number_common_elements(test_multiple_tokens, commits_dependent_tokens)
-        test_multiple_to_commit_message = number_common_elements(test_multiple_tokens, commit_message_tokens)
-        test_multiple_to_commit_multiple = number_common_elements(test_multiple_tokens, commit_multiple_tokens)
-        test_multiple_to_commit_multiple_message = number_common_elements(test_multiple_tokens, commit_multiple_message_tokens)
-
-        score = (test_names_to_commit_areas
-                 + test_names_to_commit_files
-                 + test_names_to_commit_folders
-                 + test_names_to_commit_dependent_areas
-                 + test_names_to_commit_message
-                 + test_class_to_commit_multiple
-                 + test_class_to_commit_multiple_message
-                 + test_class_to_commit_areas
-                 + test_class_to_commit_files
-                 + test_class_to_commit_folders
-                 + test_class_to_commit_dependent_areas
-                 + test_class_to_commit_message
-                 + test_class_to_commit_multiple
-                 + test_class_to_commit_multiple_message
-                 + test_areas_to_commit_areas
-                 + test_areas_to_commit_files
-                 + test_areas_to_commit_folders
-                 + test_areas_to_commit_dependent_areas
-                 + test_areas_to_commit_message
-                 + test_areas_to_commit_multiple
-                 + test_areas_to_commit_multiple_message
-                 + test_multiple_to_commit_areas
-                 + test_multiple_to_commit_files
-                 + test_multiple_to_commit_folders
-                 + test_multiple_to_commit_dependent_areas
-                 + test_multiple_to_commit_message
-                 + test_multiple_to_commit_multiple
-                 + test_multiple_to_commit_multiple_message)
-
-        result[test.id] = score
-
-    sorted_tuples = sorted(result.items(), key=lambda item: item[1], reverse=True)
-    # for k, v in sorted_tuples:
-    #     print(f"{k}\t{v}")
-    return {k: v for k, v in sorted_tuples}
+        for kind, tokens in enumerate([test_names_tokens, test_classes_names_tokens, test_areas_tokens,
+                                       test_multiple_tokens]):
+            for token in tokens:
+                if token in vocabulary:
+                    rows.append(row)
+                    columns.append(kind * len(vocabulary) + vocabulary[token])
+
+    matrix = csr_matrix((np.ones(len(rows), dtype=np.int64), (rows, columns)),
+                        shape=(len(tests), len(SCORE_WEIGHTS) * len(vocabulary)))
+    scores = matrix @ weights.ravel()
+
+    order = np.argsort(-scores, kind='stable')
+    return {tests[index][0]: int(scores[index]) for index in order}
@@ -4,15 +4,22 @@ from system.celery_app import app, Singleton
 from celery import group
 
 import functools
+import logging
 import time
 from celery.exceptions import Reject
 from hashlib import md5
 from contextlib import contextmanager
+from datetime import timedelta
 
+from django.conf import settings
 from django.core.cache import cache
+from django.utils import timezone
 
 
-from applications.vcs.utils.association import find_and_associate_areas, find_and_association_files
+from applications.vcs.utils.association import associate_tests
+
+
+STATISTICS_REFRESH_WINDOW = getattr(settings, 'TESTING_STATISTICS_REFRESH_WINDOW', timedelta(minutes=15))
 
 
 @app.task(bind=True)
@@ -55,28 +62,67 @@ def add_closed_by_commits_task(self, defect_id, commit_id, test_suite_id):
 
 @app.task(bind=True)
 def add_association_for_test(self, test_id):
+    return add_association_for_tests(test_ids=[test_id])
+
+
+@app.task(bind=True)
+def add_association_for_tests(self, test_ids):
     from applications.testing.models import Test
-    tests = Test.objects.filter(id=test_id)
-    for test in tests:
-        result_areas = find_and_associate_areas(test)
-        result_files = find_and_association_files(test)
+    tests = Test.objects.filter(id__in=test_ids).select_related('project').order_by('project_id', 'id')
+    return associate_tests(tests)
 
 
 @app.task(bind=True)
-def periodic_add_association(self, chunk_size=20):
+def periodic_add_association(self, chunk_size=200):
     from applications.project.models import Project
     from celery.utils.functional import chunks
     test_ids = list(Project.objects.order_by('-id').exclude(tests__isnull=True)
                     .values_list('tests__id', flat=True).distinct())
+    # Tests of one chunk share indexes of their project areas and files.
     for chunk in chunks(test_ids, chunk_size):
-        # add_association_for_test.delay(chunk)
-        job = group([add_association_for_test.s(test_id) for test_id in chunk])
-        result = job.apply_async()
+        add_association_for_tests.delay(chunk)
         time.sleep(1)
 
 
 @app.task(base=Singleton, raise_on_duplicate=False, lock_expiry=5 * 60)
-def update_materialized_view(*args, **kwargs):
-    from applications.testing.models import TestRunMaterializedModel
-    TestRunMaterializedModel.refresh()
+def update_materialized_view(test_run_ids=None, *args, **kwargs):
+    """
+    Update statistics of given test runs. Periodic calls pass no ids and update
+    test runs which got new or changed results within the last STATISTICS_REFRESH_WINDOW.
+    """
+    from applications.testing.models import TestRunCurrentResult, TestRunMaterializedModel, TestRunResult
 
+    if test_run_ids is None:
+        since = timezone.now() - STATISTICS_REFRESH_WINDOW
+        test_run_ids = list(
+            TestRunResult.objects.filter(updated__gte=since).values_list('test_run_id', flat=True).distinct())
+
+    TestRunCurrentResult.refresh(test_run_ids)
+    TestRunMaterializedModel.refresh(test_run_ids)
+
+
+@app.task(bind=True)
+def import_test_report_task(self, test_report_id):
+    from applications.integration.ssh_v2.utils import prioritize_task
+    from applications.testing.models import TestReport
+    from applications.testing.tools.SpecFlow import ImportUtils
+
+    # Only the worker which moved the report out of PENDING imports it, redelivered tasks are skipped.
+    claimed = TestReport.objects.filter(pk=test_report_id, status=TestReport.Status.PENDING).update(
+        status=TestReport.Status.PROCESSING, updated=timezone.now())
+    if claimed != 1:
+        return False
+    test_report = TestReport.objects.get(pk=test_report_id)
+
+    try:
+        prioritize_task(commits_sha=[test_report.commit_sha])
+    except Exception:
+        logging.exception("Error with 'prioritize_task'", exc_info=True)
+
+    try:
+        utils = ImportUtils.from_test_report(test_report)
+        return utils.import_xml_tests()
+    except Exception as exc:
+        TestReport.objects.filter(pk=test_report_id).update(
+            status=TestReport.Status.FAILURE, result={"error": str(exc)})
+        raise
@@ -1,24 +1,26 @@
 # -*- coding: utf-8 -*-
+import functools
 import os
 from collections import OrderedDict
 from datetime import timedelta
-import subprocess
 import lxml.etree as ET
-import defusedxml.ElementTree as dET
 import xmltodict
 from django.conf import settings
 from django.db import transaction, models
 from django.db.models import signals
 from django.utils import timezone
 
-from tempfile import mkstemp
-from lxml.etree import XMLSyntaxError
+from lxml.etree import XMLSyntaxError, XSLTError
 
-from applications.testing.models import Test, TestSuite, TestRun, TestRunResult, Defect, TestReport
+from applications.testing.models import Test, TestSuite, TestRun, TestRunCurrentResult, TestRunResult, Defect, \
+    TestReport
 from applications.testing.signals import model_test_run_tests_changed, model_test_run_result_complete_test_run, \
-    model_test_run_result_perform_defect
-from applications.vcs.models import Area, ParentCommit
+    model_test_run_result_perform_defect, model_test_run_result_calculate_execution_time, \
+    model_test_run_result_perform_related_fields
+from applications.vcs.models import Area, Commit, ParentCommit
 from applications.testing.tasks import update_materialized_view
+from applications.notification.models import Notification
+from applications.notification.tasks import schedule_immediate_notifications
 
 
 TYPE_NUNIT3 = 'nunit3'
@@ -28,6 +30,20 @@ TYPE_TRX = 'trx'
 
 ALLOWED_FORMAT_TYPES = [TYPE_JUNIT, TYPE_NUNIT3, TYPE_TRX]
 
+XSLT_ROOT = os.path.join(settings.BASE_DIR, 'applications/testing/tools')
+
+FORMAT_TYPE_XSLT = {
+    TYPE_NUNIT3: 'nunit3-junit.xslt',
+    TYPE_TRX: 'mstest-to-junit.xsl',
+}
+
+# Reports bigger than this (in bytes) are imported with the streaming parser.
+IMPORT_STREAMING_THRESHOLD = getattr(settings, 'TESTING_IMPORT_STREAMING_THRESHOLD', 10 * 1024 * 1024)
+# Number of testcases written per bulk insert in streaming mode.
+IMPORT_BATCH_SIZE = getattr(settings, 'TESTING_IMPORT_BATCH_SIZE', 5000)
+# Size of the report chunks fed to the parser in streaming mode.
+IMPORT_CHUNK_SIZE = getattr(settings, 'TESTING_IMPORT_CHUNK_SIZE', 64 * 1024)
+
 
 def preprocessing_dict(xmldict):
     new_xmldict = dict()
@@ -51,35 +67,89 @@ def preprocessing_area_dict(xmldict):
     return new_xmldict
 
 
-def external_processor(xslt, source):
-    xslt_fd, xslt_filename = mkstemp()
-    xslt_file = open(xslt_filename, 'w')
-    xslt_file.write(xslt)
-    xslt_file.close()
-    os.close(xslt_fd)
-
-    source_fd, source_filename = mkstemp()
-    source_file = open(source_filename, 'w')
-    source_file.write(source)
-    source_file.close()
-    os.close(source_fd)
-
-    commandLine = 'saxon -s:{source_filename} -xsl:{xslt_filename}'.format(
-        source_filename=source_filename, xslt_filename=xslt_filename)
-    process = subprocess.Popen(commandLine, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    out = process.stdout.read().strip()
-    error = process.stderr.read().strip()
-    if error:
-        process.kill()
-        raise Exception(error)
-    return out
+def element_to_dict(element):
+    """
+    Convert <testcase> element into the same shape xmltodict produces for it,
+    so streaming and in-memory imports share one testcase handler.
+    """
+    xmldict = OrderedDict(('@{}'.format(key), value) for key, value in element.attrib.items())
+    for child in element:
+        if not isinstance(child.tag, str):
+            continue
+        if child.tag in ('system-out', 'system-err'):
+            xmldict[child.tag] = child.text or str()
+        else:
+            child_dict = OrderedDict(('@{}'.format(key), value) for key, value in child.attrib.items())
+            child_dict['#text'] = child.text
+            xmldict[child.tag] = child_dict
+    return xmldict
+
+
+def read_chunks(source, chunk_size=IMPORT_CHUNK_SIZE):
+    """
+    Yield report in chunks, uploaded files are read as they go and stored reports are sliced.
+    """
+    if hasattr(source, 'chunks'):
+        yield from source.chunks(chunk_size)
+    else:
+        for start in range(0, len(source), chunk_size):
+            yield source[start:start + chunk_size]
+
+
+def iterparse_chunks(chunks, **kwargs):
+    """
+    Same events as `lxml.etree.iterparse` for report given in chunks of bytes or str.
+    """
+    parser = ET.XMLPullParser(resolve_entities=False, no_network=True, huge_tree=True, **kwargs)
+    for chunk in chunks:
+        parser.feed(chunk)
+        yield from parser.read_events()
+    parser.close()
+    yield from parser.read_events()
+
+
+@functools.lru_cache(maxsize=None)
+def get_xslt(filename):
+    """
+    Compile stylesheet once per process, following calls reuse the same XSLT object.
+    """
+    xslt = ET.parse(os.path.join(XSLT_ROOT, filename))
+    return ET.XSLT(xslt)
+
+
+def transform_report(type_xml, source):
+    """
+    Convert NUnit3/TRX report into JUnit format in-process.
+    """
+    parser = ET.XMLParser(resolve_entities=False, no_network=True, huge_tree=True)
+    if hasattr(source, 'read'):
+        dom = ET.parse(source, parser=parser)
+    else:
+        if isinstance(source, str):
+            source = source.encode('utf-8')
+        dom = ET.fromstring(source, parser=parser)
+    transform = get_xslt(FORMAT_TYPE_XSLT[type_xml])
+    new_dom = transform(dom)
+    return ET.tostring(new_dom, pretty_print=True)
 
 
 class ImportUtils(object):
 
-    def __init__(self, type_xml, file_obj, data, user_id, test_run_name, host):
+    def __init__(self, type_xml, file_obj, data, user_id, test_run_name, host, streaming=None, batch_size=None,
+                 test_report=None):
         self.type_xml = type_xml
-        self.infile = file_obj.read()
+        if streaming is None:
+            size = len(test_report.source) if test_report is not None else file_obj.size
+            streaming = size > IMPORT_STREAMING_THRESHOLD
+        self.streaming = streaming
+        if test_report is not None:
+            self.infile = test_report.source
+        elif streaming:
+            # Uploaded file is parsed as it is read, the report is not kept in memory nor stored.
+            self.infile = file_obj
+        else:
+            self.infile = file_obj.read()
+        self.batch_size = batch_size or IMPORT_BATCH_SIZE
         self.data = data
         self.user_id = user_id
         self.project = data.get('project')
@@ -112,7 +182,11 @@ class ImportUtils(object):
         self.test_run_name = test_run_name
         self.test_run = None
 
-        source = self.infile
+        if test_report is not None:
+            self.test_report = test_report
+            return
+
+        source = str() if streaming else self.infile
         if isinstance(source, bytes):
             source = source.decode('utf-8', errors='replace')
 
@@ -129,32 +203,44 @@ class ImportUtils(object):
             source=source,
             destination="",
             format=format,
-            status=TestReport.Status.PENDING
+            status=TestReport.Status.PENDING,
+            author_id=self.user_id,
+            host=self.host
         )
         self.test_report.save()
 
+    @classmethod
+    def from_test_report(cls, test_report, **kwargs):
+        """
+        Build importer for report that was stored earlier (e.g. by asynchronous upload).
+        """
+        commit = Commit.objects.filter(project_id=test_report.project_id, sha=test_report.commit_sha).first()
+        return cls(
+            type_xml=test_report.format.lower(),
+            file_obj=None,
+            data=dict(project=test_report.project, test_suite=test_report.test_suite, commit=commit),
+            user_id=test_report.author_id,
+            test_run_name=test_report.test_run_name,
+            host=test_report.host,
+            test_report=test_report,
+            **kwargs
+        )
+
+    def report_failure(self, error):
+        self.test_report.status = TestReport.Status.FAILURE
+        self.test_report.result = {"error": error}
+        self.test_report.save(update_fields=["status", "result", "updated"])
+        return {"error": error}
+
     def import_xml_tests(self):
         self.test_report.status = TestReport.Status.PROCESSING
         self.test_report.save(update_fields=["status", "updated"])
 
-        if self.type_xml == 'nunit3':
-            xslt = ET.parse(os.path.join(settings.BASE_DIR, 'applications/testing/tools/nunit3-junit.xslt'))
-            transform = ET.XSLT(xslt)
-            dom = dET.fromstring(self.infile)
-            new_dom = transform(dom)
-            new_dom_str = ET.tostring(new_dom, pretty_print=True)
-            infile = new_dom_str
-        elif self.type_xml == 'trx':
-            xslt = open(os.path.join(settings.BASE_DIR, 'applications/testing/tools/mstest-to-junit.xsl'), 'r').read()
-            if isinstance(xslt, bytes):
-                xslt = xslt.decode('utf-8', errors='replace')
-            source = self.infile
-            if isinstance(source, bytes):
-                source = source.decode('utf-8', errors='replace')
-            result = external_processor(xslt=xslt, source=source)
-            if isinstance(result, bytes):
-                result = result.decode('utf-8', errors='replace')
-            infile = result
+        if self.type_xml in FORMAT_TYPE_XSLT:
+            try:
+                infile = transform_report(self.type_xml, self.infile)
+            except (XMLSyntaxError, XSLTError):
+                return self.report_failure("XML Parse error.")
 
         elif self.type_xml == 'junit':
             infile = self.infile
@@ -162,28 +248,39 @@ class ImportUtils(object):
                 infile = infile.decode('utf-8', errors='replace')
 
         else:
-            self.test_report.status = TestReport.Status.FAILURE
-            self.test_report.save(update_fields=["status", "updated"])
-            return {"error": "Unknown report type."}
+            return self.report_failure("Unknown report type.")
 
+        xml_dict = None
+        if not self.streaming:
+            try:
+                xml_dict = xmltodict.parse(infile)
+                if isinstance(infile, bytes):
+                    infile = infile.decode('utf-8', errors='replace')
+                self.test_report.destination = infile
+                self.test_report.save(update_fields=["destination", "updated"])
+            except Exception:
+                return self.report_failure("XML Parse error.")
+
+        # Report broken in the middle of streaming leaves neither test run nor results behind.
         try:
-            xml_dict = xmltodict.parse(infile)
-            if isinstance(infile, bytes):
-                infile = infile.decode('utf-8', errors='replace')
-            self.test_report.destination = infile
-            self.test_report.save(update_fields=["destination", "updated"])
-        except Exception as e:
-            self.test_report.status = TestReport.Status.FAILURE
-            self.test_report.save(update_fields=["status", "updated"])
-            return {"error": "XML Parse error."}
+            with transaction.atomic():
+                data = self.import_test_run(infile, xml_dict)
+        except XMLSyntaxError:
+            return self.report_failure("XML Parse error.")
+
+        self.test_report.status = TestReport.Status.SUCCESS
+        self.test_report.result = data
+        self.test_report.save(update_fields=["status", "result", "updated"])
+        TestRunCurrentResult.refresh([self.test_run.id])
+        update_materialized_view.delay(test_run_ids=[self.test_run.id])
+        schedule_immediate_notifications(project_id=self.test_run.project_id,
+                                         types=[Notification.TYPE_TEST_RUN, Notification.TYPE_DEFECT])
+        return data
 
+    def import_test_run(self, infile, xml_dict):
         ts = self.data.get('test_suite', None)
         self.test_suite = TestSuite.objects.get(id=ts.id)
 
-        root = xml_dict.get('testsuites', None)
-        if root is None:
-            root = xml_dict
-
         previous_testrun = None
 
         if self.test_run_name:
@@ -253,33 +350,10 @@ class ImportUtils(object):
                                          status=TestRunResult.STATUS_SKIPPED).exclude(
                 created_defects__type=Defect.TYPE_FLAKY).values_list('id', flat=True))
 
-        areas = root.get('testsuite', [])
-        test_run_results = []
-
-        if isinstance(areas, OrderedDict):
-            areas = [areas]
-
-        for area in areas:
-            area = preprocessing_area_dict(area)
-            area_obj, created = Area.objects.get_or_create(project=self.project, name=area.get('name')[:255])
-            test_run_results = list()
-            if isinstance(area.get('testcase'), OrderedDict):
-                tests = self.prepare_tests([area.get('testcase')], area_obj)
-
-                with transaction.atomic(using=TestRunResult.objects.db, savepoint=False):
-                    test_run_results.append(self.create_test_case(area.get('testcase'), area_obj, tests))
-
-            elif isinstance(area.get('testcase'), list):
-                tests = self.prepare_tests(area.get('testcase'), area_obj)
-
-                with transaction.atomic(using=TestRunResult.objects.db, savepoint=False):
-                    for test_case in area.get('testcase'):
-                        test_run_results.append(self.create_test_case(test_case, area_obj, tests))
-
-            self.test_run_result_complete()
-
-            for test_run_result in test_run_results:
-                Defect.perform(test_run_result)
+        if self.streaming:
+            self.import_areas_streaming(infile)
+        else:
+            self.import_areas(xml_dict)
 
         self.new_defects = self.test_suite.created_defects.exclude(original_defect__isnull=False).exclude(
             type=Defect.TYPE_FLAKY).exclude(id__in=old_defects).count()
@@ -326,12 +400,93 @@ class ImportUtils(object):
             'report_url': self.host,
             'test_run_id': self.test_run.id,
         }
-
-        self.test_report.status = TestReport.Status.SUCCESS
-        self.test_report.save(update_fields=["status", "updated"])
-        update_materialized_view.delay()
         return data
 
+    def import_areas(self, xml_dict):
+        root = xml_dict.get('testsuites', None)
+        if root is None:
+            root = xml_dict
+
+        areas = root.get('testsuite', [])
+
+        if isinstance(areas, OrderedDict):
+            areas = [areas]
+
+        for area in areas:
+            area = preprocessing_area_dict(area)
+            area_obj, created = Area.objects.get_or_create(project=self.project, name=area.get('name')[:255])
+            test_run_results = list()
+            if isinstance(area.get('testcase'), OrderedDict):
+                tests = self.prepare_tests([area.get('testcase')], area_obj)
+
+                with transaction.atomic(using=TestRunResult.objects.db, savepoint=False):
+                    test_run_results.append(self.create_test_case(area.get('testcase'), area_obj, tests))
+
+            elif isinstance(area.get('testcase'), list):
+                tests = self.prepare_tests(area.get('testcase'), area_obj)
+
+                with transaction.atomic(using=TestRunResult.objects.db, savepoint=False):
+                    for test_case in area.get('testcase'):
+                        test_run_results.append(self.create_test_case(test_case, area_obj, tests))
+
+            self.test_run_result_complete()
+
+            Defect.perform_bulk(self.test_run, [test_run_result for test_run_result in test_run_results
+                                                if isinstance(test_run_result, TestRunResult)])
+
+    def import_areas_streaming(self, infile):
+        """
+        Walk the report chunk by chunk and write results with bulk_create in batches
+        of `batch_size`, so memory does not grow with the size of the report.
+        """
+        context = iterparse_chunks(read_chunks(infile), events=('start', 'end'), tag=('testsuite', 'testcase'))
+
+        areas = list()
+        test_cases = list()
+
+        for event, element in context:
+            if element.tag == 'testsuite':
+                if test_cases:
+                    self.create_test_cases_bulk(test_cases, areas[-1])
+                    test_cases = list()
+
+                if event == 'start':
+                    area_obj, created = Area.objects.get_or_create(
+                        project=self.project, name=element.get('name', '')[:255])
+                    areas.append(area_obj)
+                else:
+                    areas.pop()
+                    self.test_run_result_complete()
+                    element.clear()
+
+            elif event == 'end' and areas:
+                test_cases.append(element_to_dict(element))
+                element.clear()
+                while element.getprevious() is not None:
+                    del element.getparent()[0]
+
+                if len(test_cases) >= self.batch_size:
+                    self.create_test_cases_bulk(test_cases, areas[-1])
+                    test_cases = list()
+
+        del context
+
+    def create_test_cases_bulk(self, testcase_json, area):
+        tests = self.prepare_tests(testcase_json, area)
+
+        test_run_results = list()
+        for test_case in testcase_json:
+            test_run_result = self.build_test_case(test_case, area, tests)
+            model_test_run_result_calculate_execution_time(sender=TestRunResult, instance=test_run_result)
+            model_test_run_result_perform_related_fields(sender=TestRunResult, instance=test_run_result)
+            test_run_results.append(test_run_result)
+
+        test_run_results = TestRunResult.objects.bulk_create(test_run_results, batch_size=self.batch_size)
+
+        Defect.perform_bulk(self.test_run, test_run_results)
+
+        return test_run_results
+
     def test_run_result_complete(self):
         if not self.test_run.test_run_results.exclude(status=TestRunResult.STATUS_PENDING).exists():
             self.test_run.status = TestRun.STATUS_COMPLETE
@@ -386,6 +541,18 @@ class ImportUtils(object):
     def create_test_case(self, testcase_json, area, tests):
         if not isinstance(testcase_json, OrderedDict):
             return {'error': 'Unknown error'}
+
+        test_run_result = self.build_test_case(testcase_json, area, tests)
+
+        signals.post_save.disconnect(receiver=model_test_run_result_complete_test_run, sender=TestRunResult)
+        signals.post_save.disconnect(receiver=model_test_run_result_perform_defect, sender=TestRunResult)
+        test_run_result.save()
+        signals.post_save.connect(receiver=model_test_run_result_complete_test_run, sender=TestRunResult)
+        signals.post_save.connect(receiver=model_test_run_result_perform_defect, sender=TestRunResult)
+
+        return test_run_result
+
+    def build_test_case(self, testcase_json, area, tests):
         testcase_json = preprocessing_dict(testcase_json)
 
         name_test = testcase_json.get('name')
@@ -436,13 +603,7 @@ class ImportUtils(object):
                 test_run_result.stacktrace = str()
                 test_run_result.failure_message = str()
 
-        test_run_result.log = testcase_json.get('system-out', str())
-
-        signals.post_save.disconnect(receiver=model_test_run_result_complete_test_run, sender=TestRunResult)
-        signals.post_save.disconnect(receiver=model_test_run_result_perform_defect, sender=TestRunResult)
-        test_run_result.save()
-        signals.post_save.connect(receiver=model_test_run_result_complete_test_run, sender=TestRunResult)
-        signals.post_save.connect(receiver=model_test_run_result_perform_defect, sender=TestRunResult)
+        test_run_result.log = testcase_json.get('system-out') or str()
 
         return test_run_result
 
@@ -3,178 +3,269 @@ import math
 import time
 import logging
 
-from collections import Counter
+from collections import Counter, defaultdict
 from datetime import datetime
 from dateutil.relativedelta import relativedelta
+from django.db import connection, transaction
 
 from applications.project.models import Project
 from applications.ml.network import SlowCommitRiskinessRFCM
-from applications.vcs.models import Commit
+from applications.vcs.models import AuthorExperience, Commit, FileChange, FileHistory
 
 
-def update_slow_commits_metrics(project_id):
-    try:
-        project = Project.objects.get(pk=project_id)
-    except Project.DoesNotExist:
-        return False, 'Project not exists'
-
-    from_datetime = datetime.now() + relativedelta(weeks=-4)  # TODO: Change!!!
-    from_datetime = from_datetime.replace(hour=0, minute=0, second=0, microsecond=0, tzinfo=pytz.UTC)
-
-    commits = Commit.objects.filter(project_id=project_id, timestamp__gte=from_datetime)
+BULK_UPDATE_BATCH_SIZE = 500
+# First key of the advisory locks which serialize slow model runs of a project.
+SLOW_MODEL_LOCK_KEY = 19
 
-    # branches = project.branches.all()
-    #
-    # for branch in branches:
-    #
-    #     commits = branch.commits.filter(timestamp__gte=from_datetime)
 
-    for db_commit in commits.order_by('timestamp'):
+def get_author_name(db_commit):
+    author_name = db_commit.author.get('name')
 
-        files = {}
-        dev_experience = {}
+    if not author_name:
+        author_name = db_commit.author.get('email')
 
-        commit_date = db_commit.timestamp
+    return (author_name or '')[:255]
 
-        author_name = db_commit.author.get('name')
 
-        if not author_name:
-            author_name = db_commit.author.get('email')
+def get_commit_stats(db_commit, file_changes, files, dev_experience):
+    """
+    Slow model stats of a commit from its (changes, file id, full filename) file changes.
+    The history of files by file id and the experience of authors by subsystem are read
+    and updated with the commit.
+    """
+    commit_date = db_commit.timestamp
 
-        total_lines_modified = db_commit.stats['total']
+    author_name = get_author_name(db_commit)
 
-        line_added = db_commit.stats['additions']
+    total_lines_modified = db_commit.stats.get('total', 0)
 
-        line_deleted = db_commit.stats['deletions']
+    line_added = db_commit.stats.get('additions', 0)
 
-        files_modified = db_commit.filechange_set.count()
+    line_deleted = db_commit.stats.get('deletions', 0)
 
-        entropy = 0
-        age = 0
+    files_modified = len(file_changes)
 
-        developers = 1 + Counter(db_commit.message.split()).get('Co-authored-by:', 0)
+    entropy = 0
+    age = 0
 
-        files_unique_changes = 0
-        total_changes_before_commit = 0
-        experience_weight = 0
-        author_changes = 0
-        author_changes_subsystem = 0
+    developers = 1 + Counter(db_commit.message.split()).get('Co-authored-by:', 0)
 
-        directories = {}
-        subsystems = {}
-        files_strings_modified = []
+    files_unique_changes = 0
+    total_changes_before_commit = 0
+    experience_weight = 0
+    author_changes = 0
+    author_changes_subsystem = 0
 
-        for file_item in db_commit.filechange_set.values('additions', 'deletions', 'changes',
-                                                         'file__full_filename'):
-            file_path = file_item['file__full_filename']
+    directories = {}
+    subsystems = {}
+    files_strings_modified = []
 
-            stats = {
-                'lines': file_item['changes']
-            }
+    for changes, file_id, file_path in file_changes:
 
-            # Original
-            path_elements = file_path.split('/')
+        stats = {
+            'lines': changes
+        }
 
-            last_file_changes = files.get(file_path, {})
+        # Original
+        path_elements = file_path.split('/')
 
-            if not last_file_changes:
-                files[file_path] = {}
+        last_file_changes = files.get(file_id, {})
 
-            last_change = last_file_changes.get('last_change', commit_date)
-            last_unique_changes = last_file_changes.get('unique_changes', 0)
-            last_files_strings = last_file_changes.get('last_files_strings', 0)
+        if not last_file_changes:
+            files[file_id] = {}
 
-            if not last_unique_changes:
-                files[file_path]['unique_changes'] = 0
+        last_change = last_file_changes.get('last_change', commit_date)
+        last_unique_changes = last_file_changes.get('unique_changes', 0)
+        last_files_strings = last_file_changes.get('last_files_strings', 0)
 
-            total_changes_before_commit += last_files_strings
+        if not last_unique_changes:
+            files[file_id]['unique_changes'] = 0
 
-            files_unique_changes += last_unique_changes
+        total_changes_before_commit += last_files_strings
 
-            if len(path_elements) == 1:
-                directory = 'root'
-                subsystem = 'root'
-            else:
-                directory = '/'.join(path_elements[0:-1])
-                subsystem = path_elements[0]
+        files_unique_changes += last_unique_changes
 
-            directories[directory] = 1
-            subsystems[subsystem] = 1
+        if len(path_elements) == 1:
+            directory = 'root'
+            subsystem = 'root'
+        else:
+            directory = '/'.join(path_elements[0:-1])
+            subsystem = path_elements[0][:255]
 
-            author_experiences = dev_experience.get(author_name)
+        directories[directory] = 1
+        subsystems[subsystem] = 1
 
-            if author_experiences:
-                experiences = dev_experience[author_name]
-                author_changes += sum(experiences.values())
+        author_experiences = dev_experience.get(author_name)
 
-                if subsystem in experiences:
-                    author_changes_subsystem = experiences[subsystem]
-                    experiences[subsystem] += 1
-                else:
-                    experiences[subsystem] = 1
+        if author_experiences:
+            experiences = dev_experience[author_name]
+            author_changes += sum(experiences.values())
 
+            if subsystem in experiences:
+                author_changes_subsystem = experiences[subsystem]
+                experiences[subsystem] += 1
+            else:
+                experiences[subsystem] = 1
+
+        else:
+            dev_experience[author_name] = {subsystem: 1}
+
+        files[file_id]['last_change'] = commit_date
+        files[file_id]['unique_changes'] += 1
+        files[file_id]['last_files_strings'] = last_files_strings + line_added - line_deleted
+
+        files_strings_modified.append(stats.get('lines'))
+
+        age += float((commit_date - last_change).seconds) / 86400
+
+        if age != 0:
+            experience_weight += (1 / (age + 1))
+        else:
+            experience_weight = 0
+
+    for file_modifies in files_strings_modified:
+        if file_modifies:
+            try:
+                avg = float(file_modifies) / total_lines_modified
+                entropy -= (avg * math.log(avg, 2))
+            except ZeroDivisionError:
+                continue
+
+    if not files_modified:
+        return None
+
+    lines_code_before_commit = float(total_changes_before_commit) / files_modified
+
+    age = age / files_modified
+
+    author_changes = float(author_changes) / files_modified
+    author_changes_subsystem = author_changes_subsystem / files_modified
+
+    modified_subsystems = len(subsystems)
+    modified_directories = len(directories)
+
+    commit_stats = {
+        'additions': line_added,
+        'deletions': line_deleted,
+        'total_lines_modified': total_lines_modified,
+        'lines_code_before_commit': lines_code_before_commit,
+        'changed_subsystems': modified_subsystems,
+        'changed_directories': modified_directories,
+        'changed_files': files_modified,
+        'developers': developers,
+        'files_unique_changes': files_unique_changes,
+        'author_changes': author_changes,
+        'experience_weight': experience_weight,
+        'author_changes_subsystem': author_changes_subsystem,
+        'entropy': entropy,
+        'age': age,
+    }
+    return commit_stats
+
+
+def load_state(project_id, file_changes, authors):
+    """
+    History of the changed files and experience of the authors in the project.
+    """
+    file_ids = {file_id for changes in file_changes.values() for _, file_id, _ in changes}
+    files = {
+        history.file_id: {
+            'last_change': history.last_change,
+            'unique_changes': history.unique_changes,
+            'last_files_strings': history.last_files_strings,
+        } for history in FileHistory.objects.filter(file_id__in=file_ids)
+    }
+
+    dev_experience = defaultdict(dict)
+    for author, subsystem, changes in AuthorExperience.objects.filter(
+            project_id=project_id, author__in=authors).values_list('author', 'subsystem', 'changes'):
+        dev_experience[author][subsystem] = changes
+    return files, dict(dev_experience)
+
+
+def save_state(project_id, files, dev_experience):
+    stored_file_ids = set(FileHistory.objects.filter(file_id__in=files.keys()).values_list('file_id', flat=True))
+    histories = [FileHistory(file_id=file_id, last_change=history['last_change'],
+                             unique_changes=history['unique_changes'],
+                             last_files_strings=history['last_files_strings'])
+                 for file_id, history in files.items()]
+    FileHistory.objects.bulk_update([history for history in histories if history.file_id in stored_file_ids],
+                                    ['last_change', 'unique_changes', 'last_files_strings'],
+                                    batch_size=BULK_UPDATE_BATCH_SIZE)
+    FileHistory.objects.bulk_create([history for history in histories if history.file_id not in stored_file_ids],
+                                    batch_size=BULK_UPDATE_BATCH_SIZE)
+
+    stored_experiences = {(experience.author, experience.subsystem): experience
+                          for experience in AuthorExperience.objects.filter(
+                              project_id=project_id, author__in=dev_experience.keys())}
+    new_experiences = []
+    for author, experiences in dev_experience.items():
+        for subsystem, changes in experiences.items():
+            experience = stored_experiences.get((author, subsystem))
+            if experience is None:
+                new_experiences.append(AuthorExperience(project_id=project_id, author=author,
+                                                        subsystem=subsystem, changes=changes))
             else:
-                dev_experience[author_name] = {subsystem: 1}
+                experience.changes = changes
+    AuthorExperience.objects.bulk_update(stored_experiences.values(), ['changes'], batch_size=BULK_UPDATE_BATCH_SIZE)
+    AuthorExperience.objects.bulk_create(new_experiences, batch_size=BULK_UPDATE_BATCH_SIZE)
 
-            files[file_path]['last_change'] = commit_date
-            files[file_path]['total_modified'] = stats.get('lines')
-            files[file_path]['authors'] = developers
-            files[file_path]['unique_changes'] += 1
-            files[file_path]['last_files_strings'] = last_files_strings + db_commit.stats['additions'] - \
-                                                     db_commit.stats['deletions']
 
-            files_strings_modified.append(stats.get('lines'))
+def lock_project_state(project_id):
+    """
+    Waits for slow model runs of the project in other transactions, the lock is held until the end of the transaction.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT pg_advisory_xact_lock(%s, %s)', [SLOW_MODEL_LOCK_KEY, project_id])
 
-            age += float((commit_date - last_change).seconds) / 86400
 
-            if age != 0:
-                experience_weight += (1 / (age + 1))
-            else:
-                experience_weight = 0
-
-        for file_modifies in files_strings_modified:
-            if file_modifies:
-                try:
-                    avg = float(file_modifies) / total_lines_modified
-                    entropy -= (avg * math.log(avg, 2))
-                except ZeroDivisionError:
-                    continue
-
-        if not files_modified:
-            continue
-
-        lines_code_before_commit = float(total_changes_before_commit) / files_modified
-
-        age = age / files_modified
-
-        author_changes = float(author_changes) / files_modified
-        author_changes_subsystem = author_changes_subsystem / files_modified
-
-        modified_subsystems = len(subsystems)
-        modified_directories = len(directories)
-
-        commit_stats = {
-            'additions': line_added,
-            'deletions': line_deleted,
-            'total_lines_modified': total_lines_modified,
-            'lines_code_before_commit': lines_code_before_commit,
-            'changed_subsystems': modified_subsystems,
-            'changed_directories': modified_directories,
-            'changed_files': files_modified,
-            'developers': developers,
-            'files_unique_changes': files_unique_changes,
-            'author_changes': author_changes,
-            'experience_weight': experience_weight,
-            'author_changes_subsystem': author_changes_subsystem,
-            'entropy': entropy,
-            'age': age,
-        }
+def update_slow_commits_metrics(project_id, replay=False):
+    """
+    Computes slow model stats of commits of the window processed for the first time. Files history
+    and authors experience are kept between runs, so only the new commits are read.
 
-        db_commit.stats['slow_model'] = commit_stats
-        db_commit.save()
+    With `replay` the history and experience of the project are reset and stats of all commits
+    of the window are computed again in timestamp order.
+    """
+    try:
+        project = Project.objects.get(pk=project_id)
+    except Project.DoesNotExist:
+        return False, 'Project not exists'
 
-    return True
+    from_datetime = datetime.now() + relativedelta(weeks=-4)  # TODO: Change!!!
+    from_datetime = from_datetime.replace(hour=0, minute=0, second=0, microsecond=0, tzinfo=pytz.UTC)
 
+    commits = Commit.objects.filter(project_id=project_id, timestamp__gte=from_datetime)
+    if not replay:
+        # Commits without files are marked processed with empty stats.
+        commits = commits.exclude(stats__has_key='slow_model')
+
+    with transaction.atomic():
+        # Concurrent runs would read the same state and lose each other's updates.
+        lock_project_state(project_id)
+        if replay:
+            FileHistory.objects.filter(file__project_id=project_id).delete()
+            AuthorExperience.objects.filter(project_id=project_id).delete()
+
+        commits = list(commits.select_for_update().only(
+            'id', 'timestamp', 'author', 'stats', 'message').order_by('timestamp', 'id'))
+
+        file_changes = defaultdict(list)
+        for commit_id, changes, file_id, full_filename in FileChange.objects.filter(
+                commit__in=commits).order_by('commit_id', 'id').values_list(
+                'commit_id', 'changes', 'file_id', 'file__full_filename'):
+            file_changes[commit_id].append((changes, file_id, full_filename))
+
+        files, dev_experience = load_state(project_id, file_changes,
+                                           authors={get_author_name(db_commit) for db_commit in commits})
+
+        for db_commit in commits:
+            db_commit.stats['slow_model'] = get_commit_stats(db_commit, file_changes[db_commit.id],
+                                                             files, dev_experience)
+
+        Commit.objects.bulk_update(commits, ['stats'], batch_size=BULK_UPDATE_BATCH_SIZE)
+        save_state(project_id, files, dev_experience)
+    return True
 
 
 def slow_model_analyzer(project_id, commits_hashes=None):
@@ -0,0 +1,50 @@
+# Generated by Django 3.2.25 on 2026-10-18 12:02
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('project', '0010_project_time_saving'),
+        ('vcs', '0015_commit_is_processed'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AuthorExperience',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('author', models.CharField(max_length=255)),
+                ('subsystem', models.CharField(max_length=255)),
+                ('changes', models.IntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'author experience',
+                'verbose_name_plural': 'author experiences',
+            },
+        ),
+        migrations.CreateModel(
+            name='FileHistory',
+            fields=[
+                ('file', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='history', serialize=False, to='vcs.file')),
+                ('last_change', models.DateTimeField()),
+                ('unique_changes', models.IntegerField(default=0)),
+                ('last_files_strings', models.IntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'file history',
+                'verbose_name_plural': 'file histories',
+            },
+        ),
+        migrations.AddField(
+            model_name='authorexperience',
+            name='project',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='author_experiences', to='project.project'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='authorexperience',
+            unique_together={('project', 'author', 'subsystem')},
+        ),
+    ]
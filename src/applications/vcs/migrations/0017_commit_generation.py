@@ -0,0 +1,47 @@
+# Generated by Django 3.2.25 on 2026-10-18 12:24
+
+import collections
+
+from django.db import migrations, models
+
+
+def calculate_generations(apps, schema_editor):
+    Commit = apps.get_model('vcs', 'Commit')
+    ParentCommit = apps.get_model('vcs', 'ParentCommit')
+
+    parents = collections.defaultdict(set)
+    children = collections.defaultdict(set)
+    for from_commit_id, to_commit_id in ParentCommit.objects.values_list('from_commit_id', 'to_commit_id').iterator():
+        parents[to_commit_id].add(from_commit_id)
+        children[from_commit_id].add(to_commit_id)
+
+    generations = dict()
+    waiting = {commit_id: len(commit_parents) for commit_id, commit_parents in parents.items()}
+    queue = collections.deque(commit_id for commit_id in children if commit_id not in parents)
+    while queue:
+        commit_id = queue.popleft()
+        generations[commit_id] = max([generations[parent_id] + 1 for parent_id in parents[commit_id]] + [1])
+        for child_id in children[commit_id]:
+            waiting[child_id] -= 1
+            if waiting[child_id] == 0:
+                queue.append(child_id)
+
+    commits = [Commit(id=commit_id, generation=generation) for commit_id, generation in generations.items()
+               if generation > 1]
+    Commit.objects.bulk_update(commits, ['generation'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vcs', '0016_slow_model_state'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='commit',
+            name='generation',
+            field=models.PositiveIntegerField(db_index=True, default=1),
+        ),
+        migrations.RunPython(calculate_generations, migrations.RunPython.noop),
+    ]
@@ -262,6 +262,134 @@ class File(MPTTModel):
 
         return current_filename_instance
 
+    @classmethod
+    def bulk_add_file_tree(cls, project, full_paths, rebuild=True):
+        """
+        Bulk version of `add_file_tree` without sha handling.
+        Files are resolved and created level by level with a couple of queries per level.
+
+        New files are inserted with the tree_id of their root and unset lft/rght (0),
+        trees are rebuilt by `rebuild_file_trees` unless `rebuild` is False.
+
+        :param project:
+        :param full_paths:
+        :param rebuild:
+        :return: dict of full path -> file instance
+        """
+        nodes = dict()
+        leafs = dict()
+
+        for full_path in full_paths:
+            if '\\' in full_path:
+                full_filename_parts = full_path.split('\\')
+            else:
+                full_filename_parts = full_path.split('/')
+
+            for level, filename in enumerate(full_filename_parts):
+                full_filename = '/'.join(full_filename_parts[:level + 1])
+                parent_full_filename = '/'.join(full_filename_parts[:level]) if level else None
+                nodes.setdefault(full_filename, (level, parent_full_filename, filename))
+
+            leafs[full_path] = full_filename
+
+        if not nodes:
+            return dict()
+
+        files = {file.full_filename: file for file in cls.objects.filter(
+            project=project, full_filename__in=list(nodes.keys()))}
+
+        next_tree_id = None
+        new_files = list()
+
+        for level in range(max(level for level, _, _ in nodes.values()) + 1):
+            missing = {full_filename: (files.get(parent_full_filename), filename)
+                       for full_filename, (node_level, parent_full_filename, filename) in nodes.items()
+                       if node_level == level and full_filename not in files}
+            if not missing:
+                continue
+
+            # Same lookup as in `add_file_tree` for files stored under another full filename.
+            queryset = cls.objects.filter(project=project, filename__in={filename for _, filename in missing.values()})
+            if level == 0:
+                queryset = queryset.filter(parent__isnull=True)
+            else:
+                queryset = queryset.filter(parent_id__in={parent.id for parent, _ in missing.values()})
+            stored_files = {(file.parent_id, file.filename): file for file in queryset}
+
+            level_files = list()
+            for full_filename, (parent, filename) in missing.items():
+                file = stored_files.get((parent.id if parent else None, filename))
+
+                if file is None:
+                    if parent is None:
+                        if next_tree_id is None:
+                            next_tree_id = (cls.objects.aggregate(tree_id=models.Max('tree_id'))['tree_id'] or 0) + 1
+                        tree_id, next_tree_id = next_tree_id, next_tree_id + 1
+                    else:
+                        tree_id = parent.tree_id
+
+                    file = cls(project=project, parent=parent, filename=filename, full_filename=full_filename,
+                               tree_id=tree_id, level=level, lft=0, rght=0)
+                    level_files.append(file)
+
+                files[full_filename] = file
+
+            cls.objects.bulk_create(level_files)
+            new_files.extend(level_files)
+
+        if new_files:
+            cls._inherit_folders_areas(project, new_files)
+
+        if rebuild:
+            cls.rebuild_file_trees(project)
+
+        return {full_path: files[full_filename] for full_path, full_filename in leafs.items()}
+
+    @classmethod
+    def _inherit_folders_areas(cls, project, new_files):
+        """
+        Areas new files inherit from their folders in `add_file_tree`, `new_files` are ordered by level.
+        """
+        default_area_id = Area.get_default(project).id
+
+        new_files_areas = dict()
+        folders_areas = dict()
+
+        for file in new_files:
+            parent = file.parent
+            areas = set()
+
+            if parent is not None and parent.id in new_files_areas:
+                areas = new_files_areas[parent.id]
+            elif parent is not None:
+                if parent.id not in folders_areas:
+                    parent_areas = parent.areas.exclude(id=default_area_id)
+                    parent_area_ids = set(parent_areas.values_list('id', flat=True))
+                    # The tree of a folder added by a previous bulk call can be not rebuilt yet.
+                    if parent_area_ids and parent.lft and parent.get_descendant_count() != \
+                            parent.get_descendants().filter(areas__in=parent_areas).count():
+                        parent_area_ids = set()
+                    folders_areas[parent.id] = parent_area_ids
+                areas = folders_areas[parent.id]
+
+            new_files_areas[file.id] = areas
+
+        through_model = cls.areas.through
+        through_model.objects.bulk_create([
+            through_model(file_id=file_id, area_id=area_id)
+            for file_id, areas in new_files_areas.items()
+            for area_id in areas
+        ], ignore_conflicts=True)
+
+    @classmethod
+    def rebuild_file_trees(cls, project):
+        """
+        Rebuild trees of the project which have files added by `bulk_add_file_tree`.
+        """
+        tree_ids = cls.objects.filter(project=project, lft=0).values_list('tree_id', flat=True).distinct()
+        for tree_id in list(tree_ids):
+            cls.objects.partial_rebuild(tree_id)
+
     def add_changes(self, commit, additions, deletions, changes, status, patch='', blame='', previous_filename=u''):
         """
         Method for adding information about file changes in a specific commit.
@@ -352,6 +480,38 @@ class FileChange(models.Model):
         return u'{id} {commit} {filename}'.format(id=self.id, commit=self.commit, filename=self.file.filename)
 
 
+class FileHistory(models.Model):
+    """
+    Change history of a file over the commits processed by the slow riskiness model.
+    """
+    file = models.OneToOneField('File', related_name='history', primary_key=True, on_delete=models.CASCADE)
+
+    last_change = models.DateTimeField(blank=False, null=False)
+    unique_changes = models.IntegerField(default=0, blank=False, null=False)
+    last_files_strings = models.IntegerField(default=0, blank=False, null=False)
+
+    class Meta(object):
+        verbose_name = _(u'file history')
+        verbose_name_plural = _(u'file histories')
+
+
+class AuthorExperience(models.Model):
+    """
+    Number of file changes of an author in a subsystem over the commits processed by the slow riskiness model.
+    """
+    project = models.ForeignKey('project.Project', related_name='author_experiences', blank=False, null=False,
+                                on_delete=models.CASCADE)
+
+    author = models.CharField(max_length=255, blank=False, null=False)
+    subsystem = models.CharField(max_length=255, blank=False, null=False)
+    changes = models.IntegerField(default=0, blank=False, null=False)
+
+    class Meta(object):
+        unique_together = ('project', 'author', 'subsystem')
+        verbose_name = _(u'author experience')
+        verbose_name_plural = _(u'author experiences')
+
+
 class Branch(models.Model):
     """
 
@@ -432,6 +592,8 @@ class Commit(models.Model):
     files = models.ManyToManyField('File', through='FileChange', blank=True)
     parents = models.ManyToManyField('self', through='ParentCommit', symmetrical=False, blank=True)
     is_processed = models.BooleanField(default=False)
+    # Greater than generations of all parents, see applications.vcs.utils.commit_graph
+    generation = models.PositiveIntegerField(default=1, db_index=True)
 
     timestamp = models.DateTimeField(default=timezone.now, blank=False, null=False)
 
@@ -458,33 +620,17 @@ class Commit(models.Model):
         :param second_commit: instance of commit
         :return: True if connection between commits exists, False if not.
         """
+        from applications.vcs.utils.commit_graph import is_ancestor
+
         if self.project != second_commit.project:
             raise ValueError('Both commits should be from one project.')
 
         if self.display_id == second_commit.display_id:
             return True
 
-        if self.timestamp < second_commit.timestamp:
-            ancestor = self
-            descendant = second_commit
-        else:
-            ancestor = second_commit
-            descendant = self
-
-        ancestor_timestamp = ancestor.timestamp
-        route_between_commits_is_founded = False
-        common_branches = set(ancestor.branches.all()).intersection(descendant.branches.all())
-        parent_exclude_condition = ~models.Q(branches__in=common_branches) | models.Q(timestamp__lt=ancestor_timestamp)
-        parents_list = list(descendant.parents.exclude(parent_exclude_condition).order_by('-timestamp'))
-        while len(parents_list) > 0:
-            current_commit = parents_list.pop(0)
-            if current_commit.display_id == ancestor.display_id:
-                route_between_commits_is_founded = True
-                break
-            parents_list = list(
-                current_commit.parents.exclude(parent_exclude_condition).order_by('-timestamp')
-            ) + parents_list
-        return route_between_commits_is_founded
+        if self.generation < second_commit.generation:
+            return is_ancestor(ancestor=self, descendant=second_commit)
+        return is_ancestor(ancestor=second_commit, descendant=self)
 
     def add_parent(self, from_commit, index_number):
         """
@@ -532,6 +678,13 @@ class ParentCommit(models.Model):
         verbose_name = _(u'parent commit')
         verbose_name_plural = _(u'parent commits')
 
+    def save(self, *args, **kwargs):
+        from applications.vcs.utils.commit_graph import update_commit_generations
+        created = self.pk is None
+        super(ParentCommit, self).save(*args, **kwargs)
+        if created:
+            update_commit_generations([self.to_commit_id])
+
     def __unicode__(self):
         return '{id} {index_number} {from_commit}'.format(id=self.id, index_number=self.index_number, from_commit=self.from_commit)
 
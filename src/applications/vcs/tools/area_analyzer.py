@@ -33,6 +33,12 @@ _support_langs = {
 support_langs = LookupDict(name=_support_langs)
 
 
+# Patterns are compiled once per language instead of each analyzed file.
+lang_patterns = {
+    'java': re.compile(r'(?P<type>(import|package))\s(static\s)?(?P<area>.+[^;|\n])', re.MULTILINE),
+}
+
+
 def _init():
     for code, titles in _support_langs.items():
         for title in titles:
@@ -82,8 +88,7 @@ class AreaCodeAnalyzer(object):
 
     def analyze_from_java(self):
         area_names = list()
-        RE_IMPORT = re.compile(r'(?P<type>(import|package))\s(static\s)?(?P<area>.+[^;|\n])', re.MULTILINE)
-        for item in RE_IMPORT.finditer(self.content):
+        for item in lang_patterns['java'].finditer(self.content):
             type = item.groupdict()['type']
             area = item.groupdict()['area']
             if type == 'import':
@@ -2,12 +2,15 @@
 from __future__ import unicode_literals, absolute_import
 
 import time
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 
+import numpy as np
 import pytz
 from django.contrib.auth import get_user_model
+from django.contrib.postgres.fields.jsonb import KeyTextTransform
 from django.db import models
-from django.db.models import Avg, Q
+from django.db.models import Q
+from django.db.models.functions import Coalesce
 
 # from applications.testing.models import Defect
 # from applications.vcs.models import Commit
@@ -25,160 +28,161 @@ def count_weekday(start_date):
     return week
 
 
-def calculate_user_analysis(queryset):
+def get_commits_analysis_data(queryset, author=False):
+    """
+    Timestamps, output, rework and caused defects of commits fetched with one query as arrays.
+    Defects are counted by subqueries, so joins of the queryset don't multiply them.
+
+    :param queryset: commits queryset
+    :param author: add author names
+    :return: dict of numpy arrays, `week_day` is numbered as in `__week_day` lookups (1 - Sunday)
+    """
     from applications.testing.models import Defect
-    result_by_hour = {
-        'defects': list(),
-        'commits': list(),
-        'rework': list(),
-        'output': list()
-    }
 
-    result_by_one_weekday = {
-        'commits': list(),
-        'output': list()
+    caused_defects = Defect.objects.filter(caused_by_commits=models.OuterRef('pk')).order_by().values(
+        'caused_by_commits')
+    fields = ['timestamp', 'output', 'rework', 'caused_defects_count', 'has_caused_defects']
+
+    queryset = queryset.annotate(
+        caused_defects_count=Coalesce(models.Subquery(
+            caused_defects.filter(
+                Q(close_type__in=[Defect.CLOSE_TYPE_FIXED, Defect.CLOSE_TYPE_WONT_FIX]) | Q(close_type__isnull=True)
+            ).annotate(count=models.Count('id')).values('count'),
+            output_field=models.IntegerField()), 0),
+        has_caused_defects=models.Exists(caused_defects),
+    )
+    if author:
+        queryset = queryset.annotate(analysis_author_name=KeyTextTransform('name', 'author'))
+        fields.append('analysis_author_name')
+
+    rows = list(queryset.values_list(*fields))
+
+    columns = list(zip(*rows)) if rows else [()] * len(fields)
+    timestamps = list(columns[0])
+
+    data = {
+        'timestamp': timestamps,
+        'hour': np.array([timestamp.hour for timestamp in timestamps], dtype=np.int64),
+        'week_day': np.array([timestamp.isoweekday() % 7 + 1 for timestamp in timestamps], dtype=np.int64),
+        'date': np.array([timestamp.toordinal() for timestamp in timestamps], dtype=np.int64),
+        'output': np.array(columns[1], dtype=np.float64),
+        'rework': np.array(columns[2], dtype=np.float64),
+        'defects': np.array(columns[3], dtype=np.float64),
+        'has_defects': np.array(columns[4], dtype=bool),
     }
+    if author:
+        data['author'] = np.array(columns[5], dtype=object)
+    return data
 
-    result_today = {
-        'commits': {'all': 0, 'avg': 0},
-        'output': {'all': 0, 'avg': 0},
-        'rework': {'all': 0, 'avg': 0},
-        'defects': {'all': 0, 'avg': 0}
-    }
 
-    result_by_weekday = {
-        'defects': list(),
-        'commits': list(),
-        'rework': list(),
-        'output': list()
-    }
+def group_sum(index, size, weights=None, mask=None):
+    if mask is not None:
+        index = index[mask]
+        weights = weights[mask] if weights is not None else None
+    return np.bincount(index, weights=weights, minlength=size).astype(np.float64)
 
-    result_by_all_day = {
-        'defects': list(),
-        'commits': list(),
-        'rework': list(),
-        'output': list()
-    }
 
-    all_commits = queryset.order_by('timestamp')
-    date_first_commit = all_commits.first().timestamp
-    count_week = count_weekday(date_first_commit)
+def group_mean(index, size, weights, mask=None):
+    count = group_sum(index, size, mask=mask)
+    total = group_sum(index, size, weights=weights, mask=mask)
+    return np.divide(total, count, out=np.zeros(size), where=count > 0)
 
-    current_weekday = datetime.now(pytz.UTC).weekday()
-    current_day = datetime.now(pytz.UTC).date()
-    queryset_defects = queryset.annotate(caused_defects__count=models.Count(
-        models.Case(
-            models.When(
-                models.Q(
-                    models.Q(caused_defects__close_type__in=[Defect.CLOSE_TYPE_FIXED,
-                                                             Defect.CLOSE_TYPE_WONT_FIX]) | models.Q(
-                        caused_defects__close_type__isnull=True)
-                ), then=models.F('caused_defects__id')
-            )
-        )
-    ))
-
-    for hour in range(24):
-        queryset_by_hour = queryset.filter(timestamp__hour=hour)
-        defects = queryset_defects.filter(timestamp__hour=hour)
-
-        result_by_hour['defects'].append(
-            avg_per_hour(defects.values('caused_defects__count', 'timestamp'), 'caused_defects__count',
-                         date_first_commit))
-        current_day_defects = defects.filter(timestamp__contains=current_day)
-        result_today['defects']['all'] += sum(
-            [x.get('caused_defects__count') for x in list(current_day_defects.values('caused_defects__count'))])
-
-        result_by_hour['commits'].append(
-            avg_per_hour(queryset_by_hour.values('id', 'timestamp'), 'commits', date_first_commit))
-        commits = queryset_by_hour.filter(timestamp__contains=current_day)
-        result_today['commits']['all'] += len(commits)
-        commits = queryset_by_hour.filter(timestamp__week_day=current_weekday)
-        if count_week.get(current_weekday):
-            result_by_one_weekday['commits'].append(len(commits) / count_week.get(current_weekday))
-        else:
-            result_by_one_weekday['commits'].append(0.0)
 
-        if queryset_by_hour:
-            reworks = queryset_by_hour.values('rework', 'timestamp')
-            result_by_hour['rework'].append(avg_per_hour(reworks, 'rework', date_first_commit))
+def sum_of_hour_means(data, values, mask=None):
+    return float(group_mean(data['hour'], 24, values, mask=mask).sum())
 
-            result_by_hour['output'].append(
-                avg_per_hour(queryset_by_hour.values('output', 'timestamp'), 'output', date_first_commit))
 
-            output_by_one_weekday = queryset_by_hour.filter(timestamp__week_day=current_weekday).values('output')
-            if count_week.get(current_weekday):
-                result_by_one_weekday['output'].append(
-                    sum([output.get('output') for output in output_by_one_weekday]) / count_week.get(current_weekday))
-            else:
-                result_by_one_weekday['output'].append(0.0)
-        else:
-            result_by_hour['rework'].append(0.0)
-            result_by_hour['output'].append(0.0)
-            result_by_one_weekday['output'].append(0.0)
+def calculate_user_analysis(queryset):
+    data = get_commits_analysis_data(queryset)
 
-    try:
-        result_today['defects']['all'] = (result_today['defects']['all'] /
-                                          queryset_defects.filter(timestamp__contains=current_day).count()) * 100
-        if result_today['defects']['all'] > 100:
-            result_today['defects']['all'] = 100
-    except ZeroDivisionError:
-        result_today['defects']['all'] = 0
+    now = datetime.now(pytz.UTC)
+    date_first_commit = min(data['timestamp'])
+    count_week = count_weekday(date_first_commit)
+    count_days = (now - date_first_commit).days + 1
 
-    result_today['commits']['avg'] = avg_per_hour(queryset.values('timestamp'), 'commits', date_first_commit)
+    current_weekday = now.weekday()
+    current_day = now.date().toordinal()
+    current_weekday_count = count_week.get(current_weekday)
 
-    result_today['output']['all'] = queryset.filter(timestamp__contains=current_day).aggregate(Avg('output')).get(
-        'output__avg')
+    hour = data['hour']
+    today = data['date'] == current_day
+    # Commits of the weekday are selected as `timestamp__week_day=datetime.weekday()` did.
+    one_weekday = data['week_day'] == current_weekday
 
-    if result_today['output']['all'] is None:
-        result_today['output']['all'] = 0
+    commits_by_hour = group_sum(hour, 24)
+    output_by_hour = group_sum(hour, 24, weights=data['output'])
 
-    result_today['output']['avg'] = avg_per_hour(queryset.values('timestamp', 'output'), 'output', date_first_commit)
+    if current_weekday_count:
+        one_weekday_commits = group_sum(hour, 24, mask=one_weekday) / current_weekday_count
+        one_weekday_output = group_sum(hour, 24, weights=data['output'], mask=one_weekday) / current_weekday_count
+    else:
+        one_weekday_commits = one_weekday_output = np.zeros(24)
 
-    result_today['rework']['all'] = queryset.filter(timestamp__contains=current_day).aggregate(Avg('rework')).get(
-        'rework__avg')
+    result_by_hour = {
+        'defects': np.minimum(group_mean(hour, 24, data['defects']) * 100, 100).tolist(),
+        'commits': (commits_by_hour / count_days).tolist(),
+        'rework': (group_mean(hour, 24, data['rework']) / count_days).tolist(),
+        'output': (output_by_hour / count_days).tolist(),
+    }
 
-    if result_today['rework']['all'] is None:
-        result_today['rework']['all'] = 0
+    result_by_one_weekday = {
+        'commits': one_weekday_commits.tolist(),
+        'output': one_weekday_output.tolist(),
+    }
+
+    today_count = int(today.sum())
+    today_defects = float(data['defects'][today].sum())
+    result_today = {
+        'commits': {'all': today_count, 'avg': len(hour) / float(count_days)},
+        'output': {'all': float(data['output'][today].mean()) if today_count else 0,
+                   'avg': float(data['output'].sum()) / count_days},
+        'rework': {'all': float(data['rework'][today].mean()) if today_count else 0,
+                   'avg': sum_of_hour_means(data, data['rework']) / count_days},
+        'defects': {'all': min(today_defects / today_count * 100, 100) if today_count else 0, 'avg': 0},
+    }
 
-    result_today['rework']['avg'] = avg_per_hour(queryset.values('timestamp', 'rework'), 'rework', date_first_commit)
+    result_by_weekday = {
+        'defects': list(),
+        'commits': list(),
+        'rework': list(),
+        'output': list()
+    }
 
     for weekday in range(7):
-        queryset_by_weekday = list(queryset.filter(timestamp__week_day=weekday).values('timestamp', 'rework', 'output'))
-        defects = queryset_defects.filter(timestamp__week_day=weekday).values('caused_defects__count', 'timestamp')
-
-        result_by_weekday['defects'].append(avg_per_day(defects, count_week, weekday, 'caused_defects__count'))
-        result_by_weekday['commits'].append(avg_per_day(queryset_by_weekday, count_week, weekday, 'commits'))
-        result_by_weekday['rework'].append(avg_per_day(queryset_by_weekday, count_week, weekday, 'rework'))
-        result_by_weekday['output'].append(avg_per_day(queryset_by_weekday, count_week, weekday, 'output'))
-
-    defect_by_all_day = dict()
-    for defect_commit in list(queryset_defects.values('caused_defects__count', 'timestamp')):
-        if defect_commit.get('timestamp').date() in defect_by_all_day.keys():
-            defect_by_all_day[defect_commit.get('timestamp').date()] += defect_commit.get('caused_defects__count')
+        by_weekday = data['week_day'] == weekday
+        weekday_count = count_week.get(weekday)
+
+        if by_weekday.any():
+            result_by_weekday['defects'].append(min(sum_of_hour_means(data, data['defects'], by_weekday) * 100, 100))
         else:
-            defect_by_all_day[defect_commit.get('timestamp').date()] = defect_commit.get('caused_defects__count')
-    commit_by_all_day = dict()
-    output_by_all_day = dict()
-    rework_by_all_day = dict()
-    for commit in list(queryset.values('id', 'output', 'rework', 'timestamp')):
-        if commit.get('timestamp').date() in commit_by_all_day.keys():
-            commit_by_all_day[commit.get('timestamp').date()] += 1
-            output_by_all_day[commit.get('timestamp').date()] += commit.get('output')
-            rework_by_all_day[commit.get('timestamp').date()] += commit.get('rework')
+            result_by_weekday['defects'].append(0.0)
+
+        if weekday_count:
+            result_by_weekday['commits'].append(float(by_weekday.sum()) / weekday_count)
+            result_by_weekday['rework'].append(sum_of_hour_means(data, data['rework'], by_weekday) / weekday_count)
+            result_by_weekday['output'].append(float(data['output'][by_weekday].sum()) / weekday_count)
         else:
-            commit_by_all_day[commit.get('timestamp').date()] = 1
-            output_by_all_day[commit.get('timestamp').date()] = commit.get('output')
-            rework_by_all_day[commit.get('timestamp').date()] = commit.get('rework')
-
-    result_by_all_day['commits'] = [{'value': value, 'timestamp': time.mktime(key.timetuple())} for key, value in
-                                    commit_by_all_day.items()]
-    result_by_all_day['defects'] = [{'value': value, 'timestamp': time.mktime(key.timetuple())} for key, value in
-                                    defect_by_all_day.items()]
-    result_by_all_day['output'] = [{'value': value, 'timestamp': time.mktime(key.timetuple())} for key, value in
-                                   output_by_all_day.items()]
-    result_by_all_day['rework'] = [{'value': value / commit_by_all_day[key], 'timestamp': time.mktime(key.timetuple())}
-                                   for key, value in rework_by_all_day.items()]
+            result_by_weekday['commits'].append(0.0)
+            result_by_weekday['rework'].append(0.0)
+            result_by_weekday['output'].append(0.0)
+
+    dates, date_index = np.unique(data['date'], return_inverse=True)
+    commits_by_date = group_sum(date_index, len(dates))
+    defects_by_date = group_sum(date_index, len(dates), weights=data['defects'])
+    output_by_date = group_sum(date_index, len(dates), weights=data['output'])
+    rework_by_date = group_sum(date_index, len(dates), weights=data['rework'])
+
+    timestamps = [time.mktime(date.fromordinal(day).timetuple()) for day in dates.tolist()]
+    result_by_all_day = {
+        'commits': [{'value': int(value), 'timestamp': timestamp}
+                    for value, timestamp in zip(commits_by_date, timestamps)],
+        'defects': [{'value': int(value), 'timestamp': timestamp}
+                    for value, timestamp in zip(defects_by_date, timestamps)],
+        'output': [{'value': int(value), 'timestamp': timestamp}
+                   for value, timestamp in zip(output_by_date, timestamps)],
+        'rework': [{'value': float(value / count), 'timestamp': timestamp}
+                   for value, count, timestamp in zip(rework_by_date, commits_by_date, timestamps)],
+    }
 
     result = {
         'hour': result_by_hour,
@@ -190,26 +194,53 @@ def calculate_user_analysis(queryset):
     return result
 
 
-def calculate_user_analysis_by_range(queryset, timestamp__range):
-    timestamp__range = timestamp__range.get('timestamp__range')
-
+def calculate_range_analysis(data, timestamp__range, mask=None):
+    """
+    Average output, commits, rework and defects of commits `data` per day of `timestamp__range`.
+    """
     result_range = {
         'output': 0,
         'commits': 0,
         'defects': 0,
         'rework': 0
     }
-    queryset_defects = queryset.exclude(caused_defects__isnull=True)
+
+    if mask is None:
+        mask = np.ones(len(data['date']), dtype=bool)
+
+    commits_count = int(mask.sum())
+    if not commits_count or not timestamp__range:
+        return result_range
+
     count_days = (timestamp__range[1] - timestamp__range[0]).days + 1
-    result_range['output'] = avg_per_range(queryset.values('output', 'timestamp'), 'output', timestamp__range)
-    result_range['commits'] = float(queryset.count()) / count_days
-    result_range['defects'] = float(
-                        queryset_defects.count()) / queryset.count() * 100 if queryset.count() > 0 else 0
-    result_range['rework'] = avg_per_range(queryset.values('rework', 'timestamp'), 'rework', timestamp__range)
 
+    dates, date_index = np.unique(data['date'][mask], return_inverse=True)
+    rework = group_mean(date_index, len(dates), data['rework'][mask])
+
+    result_range['output'] = float(data['output'][mask].sum()) / count_days
+    result_range['commits'] = float(commits_count) / count_days
+    result_range['defects'] = float(data['has_defects'][mask].sum()) / commits_count * 100
+    result_range['rework'] = min(float(rework.sum()), 100)
     return result_range
 
 
+def calculate_user_analysis_by_range(queryset, timestamp__range):
+    timestamp__range = timestamp__range.get('timestamp__range')
+    return calculate_range_analysis(get_commits_analysis_data(queryset), timestamp__range)
+
+
+def calculate_team_analysis(queryset, usernames, timestamp__range):
+    """
+    `calculate_user_analysis_by_range` of every user with one query.
+
+    :return: dict of username -> result
+    """
+    timestamp__range = timestamp__range.get('timestamp__range')
+    data = get_commits_analysis_data(queryset, author=True)
+    return {username: calculate_range_analysis(data, timestamp__range, mask=data['author'] == username)
+            for username in usernames}
+
+
 def avg(list_item, item_name):
     if item_name == 'output':
         return sum([item.get(item_name) for item in list_item])
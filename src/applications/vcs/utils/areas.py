@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""
+Areas of changed files resolved for a whole batch of files.
+"""
+from __future__ import unicode_literals
+
+from applications.vcs.models import Area, CommitAreas, File
+from applications.vcs.tools.area_analyzer import AreaCodeAnalyzer, support_langs
+
+
+def get_filename_area_names(filename):
+    if filename.startswith('/'):
+        return filename.split('/')[1:-1]
+    return filename.split('/')[0:-1]
+
+
+def get_code_area_names(filename, patch=''):
+    if not support_langs[filename[filename.rfind('.') + 1:]]:
+        return set()
+    try:
+        return {area_name for area_name in AreaCodeAnalyzer(filename=filename, content=patch).analyze() if area_name}
+    except Exception:
+        return set()
+
+
+class AreaResolver(object):
+    """
+    Areas of `Area.get_by_filename` and `Area.create_from_code` for changed files of the project.
+
+    Areas of the project are loaded once into a name -> area map, files are collected with `add` and areas
+    missing for all of them are created with one bulk insert by `resolve`.
+    """
+
+    def __init__(self, project):
+        self.project = project
+        self.areas = None
+        self.default_area_id = None
+        self.files = list()
+
+    def load(self):
+        if self.areas is None:
+            self.default_area_id = Area.get_default(project=self.project).id
+            self.areas = {name: (area_id, area_type) for name, area_id, area_type in
+                          Area.objects.filter(project=self.project).values_list('name', 'id', 'type')}
+
+    def add(self, filename, patch=''):
+        """
+        :return: index of the file in the result of `resolve`
+        """
+        self.files.append((filename, patch or ''))
+        return len(self.files) - 1
+
+    def get_type(self, name, new_areas):
+        if name in self.areas:
+            return self.areas[name][1]
+        return new_areas.get(name)
+
+    def resolve(self):
+        """
+        Creates areas missing for the added files, the files are removed from the resolver.
+
+        :return: list of area id sets in order of the added files
+        """
+        self.load()
+
+        # Areas are created in order of the files as `get_or_create` of the models did.
+        new_areas = dict()
+        files_area_names = list()
+        for filename, patch in self.files:
+            area_names = get_filename_area_names(filename)
+            names = {name for name in area_names if self.get_type(name, new_areas) == Area.TYPE_FOLDER}
+
+            if len(area_names) > 0 and len(names) == 0 and self.project.auto_area_on_commit is True:
+                if self.get_type(area_names[-1], new_areas) is None:
+                    new_areas[area_names[-1]] = Area.TYPE_FOLDER
+                names.add(area_names[-1])
+
+            for name in get_code_area_names(filename, patch):
+                if self.get_type(name, new_areas) is None:
+                    new_areas[name] = Area.TYPE_CODE
+                # Names taken by areas of other types are skipped.
+                if self.get_type(name, new_areas) == Area.TYPE_CODE:
+                    names.add(name)
+
+            files_area_names.append(names)
+
+        if new_areas:
+            Area.objects.bulk_create([Area(project=self.project, name=name, type=area_type)
+                                      for name, area_type in new_areas.items()], ignore_conflicts=True)
+            self.areas.update({name: (area_id, area_type) for name, area_id, area_type in Area.objects.filter(
+                project=self.project, name__in=list(new_areas)).values_list('name', 'id', 'type')})
+
+        self.files = list()
+        return [{self.areas[name][0] for name in names if name in self.areas} | {self.default_area_id}
+                for names in files_area_names]
+
+
+def add_areas(files_areas=None, commits_areas=None):
+    """
+    Links areas to files and commits, links existing already are skipped.
+
+    :param files_areas: iterable of (file id, area id) pairs
+    :param commits_areas: iterable of (commit id, area id) pairs
+    """
+    file_through_model = File.areas.through
+    file_through_model.objects.bulk_create([
+        file_through_model(file_id=file_id, area_id=area_id) for file_id, area_id in set(files_areas or [])
+    ], ignore_conflicts=True)
+
+    commits_areas = set(commits_areas or [])
+    if commits_areas:
+        commits_areas -= set(CommitAreas.objects.filter(
+            commit_id__in={commit_id for commit_id, _ in commits_areas}).values_list('commit_id', 'area_id'))
+    CommitAreas.objects.bulk_create([
+        CommitAreas(commit_id=commit_id, area_id=area_id) for commit_id, area_id in commits_areas
+    ])
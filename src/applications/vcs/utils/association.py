@@ -1,3 +1,7 @@
+import collections
+
+import numpy as np
+from django.conf import settings
 from django.db.models import Q
 from django.db.models.functions import Lower
 from applications.api.testing.stop_words import stop_words
@@ -7,29 +11,127 @@ from applications.vcs.utils.analysis import find_similarity_in_name, similarity
 # from applications.testing.models import Test
 
 
+ASSOCIATION_CANDIDATES_LIMIT = getattr(settings, 'VCS_ASSOCIATION_CANDIDATES_LIMIT', 100)
+
+TEST_ARGS = ['name', 'class_name', 'testsuite_name']
+
+
+class NGramIndex(object):
+    """
+    Inverted index of character n-grams of names, used to shortlist names similar
+    to a value before exact scoring.
+    """
+
+    def __init__(self, names, n=3):
+        self.n = n
+        self.names = list(names)
+        self.sizes = np.zeros(len(self.names), dtype=np.int64)
+
+        postings = collections.defaultdict(list)
+        for index, name in enumerate(self.names):
+            grams = self.get_ngrams(name)
+            self.sizes[index] = len(grams)
+            for gram in grams:
+                postings[gram].append(index)
+        self.postings = {gram: np.array(indexes, dtype=np.int64) for gram, indexes in postings.items()}
+
+    def get_ngrams(self, value):
+        value = ' {} '.format(value.lower())
+        return {value[i:i + self.n] for i in range(max(len(value) - self.n + 1, 1))}
+
+    def search(self, value, limit=ASSOCIATION_CANDIDATES_LIMIT):
+        """
+        Return indexes of at most `limit` names sharing most n-grams with `value`.
+        """
+        grams = self.get_ngrams(value)
+        postings = [self.postings[gram] for gram in grams if gram in self.postings]
+        if not postings:
+            return np.empty(0, dtype=np.int64)
+
+        common = np.bincount(np.concatenate(postings), minlength=len(self.names))
+        scores = 2.0 * common / (self.sizes + len(grams))
+        indexes = np.flatnonzero(common)
+        if len(indexes) > limit:
+            indexes = indexes[np.argpartition(-scores[indexes], limit - 1)[:limit]]
+        return np.sort(indexes)
+
+
+class AssociationIndex(object):
+    """
+    Areas and files of a project which tests can be associated with, indexed by name.
+    Building it once per project lets tests be associated in batches.
+    """
+
+    def __init__(self, project):
+        from applications.vcs.models import Area, File
+
+        self.project = project
+
+        self.areas = list(
+            Area.objects.filter(project=project).exclude(name='Default Area').exclude(name__in=stop_words)
+            .order_by('id').values_list('id', 'name')
+        )
+        self.areas_index = NGramIndex([name for _, name in self.areas])
+
+        files = collections.defaultdict(list)
+        for file_id, filename in File.objects.filter(project=project).exclude(sha='').exclude(
+                filename__in=stop_words).order_by('id').values_list('id', 'filename'):
+            files[filename].append(file_id)
+        self.files = list(files.items())
+        self.files_index = NGramIndex([filename for filename, _ in self.files])
+
+    @staticmethod
+    def get_similar(index, test_instance, names):
+        """
+        Scores of names similar to test name/class_name/testsuite_name by index of name.
+        Names outside of the shortlist of an arg get zero score for it.
+        """
+        scores = collections.defaultdict(lambda: {arg + '_similarity': 0 for arg in TEST_ARGS})
+        for arg in TEST_ARGS:
+            value = getattr(test_instance, arg)
+            if not value:
+                continue
+            for name_index in index.search(value).tolist():
+                scores[name_index][arg + '_similarity'] = similarity(value, names[name_index])
+        return scores
+
+    def get_similar_areas(self, test_instance):
+        scores = self.get_similar(self.areas_index, test_instance, self.areas_index.names)
+        return [dict(id=self.areas[name_index][0], name=self.areas[name_index][1], **scores[name_index])
+                for name_index in sorted(scores)]
+
+    def get_similar_files(self, test_instance):
+        scores = self.get_similar(self.files_index, test_instance, self.files_index.names)
+        return [dict(id=file_id, filename=self.files[name_index][0], **scores[name_index])
+                for name_index in sorted(scores) for file_id in self.files[name_index][1]]
+
+
+def associate_tests(tests):
+    """
+    Associate tests with similar areas and files, indexes are built once per project.
+    """
+    indexes = dict()
+    for test in tests:
+        if test.project_id not in indexes:
+            indexes[test.project_id] = AssociationIndex(test.project)
+        find_and_associate_areas(test, index=indexes[test.project_id])
+        find_and_association_files(test, index=indexes[test.project_id])
+    return True
 
-def find_and_associate_areas(test_instance):
-    from applications.vcs.models import Area
-    test_args = ['name', 'class_name', 'testsuite_name']
-
-    associated_areas = list(test_instance.associated_areas.all().values('id', 'name'))
 
-    project_areas = Area.objects.filter(
-        Q(project=test_instance.project) & ~Q(name='Default Area')
-    ).exclude(id__in=(x['id'] for x in associated_areas))
+def find_and_associate_areas(test_instance, index=None):
+    from applications.vcs.models import Area
 
-    project_areas = project_areas.exclude(name__in=stop_words)
-    project_areas = list(project_areas.values('id', 'name', ))
+    if index is None:
+        index = AssociationIndex(test_instance.project)
 
-    for area in project_areas:
-        for arg in test_args:
-            name = getattr(test_instance, arg)
-            area[arg + '_similarity'] = 0 if name is None else similarity(name, area['name'])
+    associated_areas = set(test_instance.associated_areas.values_list('id', flat=True))
+    project_areas = [area for area in index.get_similar_areas(test_instance) if area['id'] not in associated_areas]
 
     # Find 5 areas that most closely match the test's name/class_name/testsuite_name
     similar_areas = find_similarity_in_name(project_areas)
     matched_areas = list()
-    for arg in test_args:
+    for arg in TEST_ARGS:
         for area in similar_areas[arg]:
             if area['id'] not in matched_areas:
                 matched_areas.append(area['id'])
@@ -44,48 +146,20 @@ def find_and_associate_areas(test_instance):
     return True
 
 
-def find_and_association_files(test_instance):
+def find_and_association_files(test_instance, index=None):
     from applications.vcs.models import File
-    test_args = ['name', 'class_name', 'testsuite_name']
-    associated_files = list(test_instance.associated_files.exclude(sha='').values('id', 'filename', 'full_filename'))
-    query = Q(project=test_instance.project) & ~Q(sha='') & ~Q(id__in=(x['id'] for x in associated_files))
-    project_files = File.objects.exclude(filename__in=stop_words)
-    project_files = list(project_files.filter(query).values('id', 'filename', 'full_filename', ))
-    project_folders = list()
-
-    for file in project_files:
-        for arg in test_args:
-            name = getattr(test_instance, arg)
-            file[arg + '_similarity'] = 0 if name is None else similarity(name, file['filename'])
-        folder_path = file['full_filename'].replace('/' + file['filename'], '') if '/' in file['full_filename'] else ''
-        folders = folder_path.split('/')
-        file['parent_folder'] = None
-        if len(folders) > 0:
-            file['parent_folder'] = folders[len(folders) - 1]
-        for folder in folders:
-            project_folders.append({
-                'file_id': file['id'],
-                'folder_name': folder,
-            })
-
-    for folder in project_folders:
-        for arg in test_args:
-            name = getattr(test_instance, arg)
-            folder[arg + '_similarity'] = 0 if name is None else similarity(name, folder['folder_name'])
-
-    # Find 5 files/folders that most closely match the test's name/class_name/testsuite_name
+
+    if index is None:
+        index = AssociationIndex(test_instance.project)
+
+    associated_files = set(test_instance.associated_files.exclude(sha='').values_list('id', flat=True))
+    project_files = [file for file in index.get_similar_files(test_instance) if file['id'] not in associated_files]
+
+    # Find 5 files that most closely match the test's name/class_name/testsuite_name
     similar_files = find_similarity_in_name(project_files)
-    similar_folders = find_similarity_in_name(project_folders)
     matched_files = list()
-
-    # For the similar_files check which is the parent folder for these files and add those to similar_folders
-    for arg in test_args:
+    for arg in TEST_ARGS:
         for file in similar_files[arg]:
-            if file['parent_folder'] is not None:
-                similar_folders[arg].append({
-                    'file_id': file['id'],
-                    'folder_name': file['parent_folder']
-                })
             if file['id'] not in matched_files:
                 matched_files.append(file['id'])
 
@@ -8,14 +8,22 @@ Google and it embed a command-line interface.
 """
 from __future__ import division, unicode_literals
 
-import subprocess
-import itertools
-import collections
-import os
-import math
-import operator
-import time
-from applications.vcs.models import File as ProjectFile
+from hashlib import md5
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.db import models
+
+from applications.vcs.models import File as FileModel, FileChange
+
+
+BUGSPOTS_CACHE_TIMEOUT = getattr(settings, 'VCS_BUGSPOTS_CACHE_TIMEOUT', 24 * 60 * 60)
+# Number of changes per cache item, 4 int64 arrays of them stay below the memcached item size limit.
+BUGSPOTS_CACHE_SEGMENT_SIZE = getattr(settings, 'VCS_BUGSPOTS_CACHE_SEGMENT_SIZE', 16 * 1024)
+# File changes with ids this far below the newest cached one are fetched again, rows committed by
+# concurrent ingestion after ones with higher ids are not skipped.
+BUGSPOTS_RESCAN_MARGIN = getattr(settings, 'VCS_BUGSPOTS_RESCAN_MARGIN', 10000)
 
 
 DEFAULT_REGEX = r'^.*([b|B]ug)s?|([p|P]roblem)s?|([i|I]ssue)s?|([d|D]efect)s?|[w|W]rong|[f|F]ix(es|ed|ing)?|[c|C]lose(s|d)?|([r|R]epair)s?|([e|E]rror)s?|([r|R]ectify)s?|([c|C]orrect)(s|ing)?|([b|B]roke)s?|([s|S]olv)(ed|ing)?.*$'
@@ -53,6 +61,73 @@ class File(Bunch):
     pass
 
 
+CHANGE_FIELDS = ('ids', 'commit_ids', 'timestamps', 'file_ids')
+
+
+def get_fix_changes(project, grep=DEFAULT_REGEX):
+    """
+    Changed files of project commits matching `grep` as arrays of file change ids, commit ids, timestamps and file ids.
+
+    Arrays are cached per project and regular expression in segments of BUGSPOTS_CACHE_SEGMENT_SIZE changes, so
+    every cache item stays small. Every call fetches file changes added since the previous one and re-scans the last
+    BUGSPOTS_RESCAN_MARGIN ids for changes committed after ones with higher ids, so it's also used to update the
+    cache after ingestion.
+
+    :param project: project
+    :param grep: case insensitive regular expression used to match commits
+    :return: dict with `ids`, `commit_ids`, `timestamps` and `file_ids` arrays and `last_id`
+    """
+    key = 'bugspots:{}:{}'.format(project.id, md5(grep.encode('utf-8')).hexdigest())
+    segments = None
+    last_id = cache.get(key)
+    if last_id is not None:
+        segments_count = cache.get('{}:count'.format(key), 0)
+        segment_keys = ['{}:{}'.format(key, index) for index in range(segments_count)]
+        cached = cache.get_many(segment_keys)
+        if len(cached) == len(segment_keys):
+            segments = [cached[segment] for segment in segment_keys]
+
+    if segments is None:
+        last_id = 0
+        segments = list()
+
+    data = {field: np.concatenate([np.empty(0, dtype=np.int64)] + [segment[field] for segment in segments])
+            for field in CHANGE_FIELDS}
+    data['last_id'] = last_id
+    changed_from = None if segments else 0
+
+    rows = list(FileChange.objects.filter(
+        id__gt=last_id - BUGSPOTS_RESCAN_MARGIN,
+        commit__project=project,
+        commit__message__iregex=grep,
+        file__project=project,
+    ).order_by('id').values_list('id', 'commit_id', 'commit__timestamp', 'file_id'))
+
+    if rows:
+        ids, commit_ids, timestamps, file_ids = zip(*rows)
+        new = ~np.isin(np.array(ids, dtype=np.int64), data['ids'])
+        if new.any():
+            changed_from = len(data['ids']) if changed_from is None else changed_from
+            timestamps = [int(timestamp.timestamp()) for timestamp in timestamps]
+            for field, values in zip(CHANGE_FIELDS, (ids, commit_ids, timestamps, file_ids)):
+                data[field] = np.concatenate([data[field], np.array(values, dtype=np.int64)[new]])
+            data['last_id'] = max(last_id, ids[-1])
+
+    if changed_from is not None:
+        # Only the segments with new changes are written.
+        first_segment = changed_from // BUGSPOTS_CACHE_SEGMENT_SIZE
+        segments_count = -(-len(data['ids']) // BUGSPOTS_CACHE_SEGMENT_SIZE)
+        cache.set_many({
+            '{}:{}'.format(key, index): {
+                field: data[field][index * BUGSPOTS_CACHE_SEGMENT_SIZE:(index + 1) * BUGSPOTS_CACHE_SEGMENT_SIZE]
+                for field in CHANGE_FIELDS
+            } for index in range(first_segment, segments_count)
+        }, BUGSPOTS_CACHE_TIMEOUT)
+        cache.set('{}:count'.format(key), segments_count, BUGSPOTS_CACHE_TIMEOUT)
+        cache.set(key, data['last_id'], BUGSPOTS_CACHE_TIMEOUT)
+    return data
+
+
 class Bugspots(object):
     """Implementation of the bug prediction algorithm used at Google."""
 
@@ -70,14 +145,12 @@ class Bugspots(object):
 
         self._project = project
         self._commits = queryset.order_by('-timestamp')
-        self._commits_matched = queryset.filter(message__iregex=grep).order_by('-timestamp')
 
-        self._get_files_cache = None
         self._get_hotspots_cache = None
 
     @property
     def _get_red_slice(self):
-        _count_hotspots = len(self._get_files())
+        _count_hotspots = len(self.get_hotspots())
         if _count_hotspots >= 10:
             _count_red_hotspots = 10 * _count_hotspots / 100
         else:
@@ -86,7 +159,7 @@ class Bugspots(object):
 
     @property
     def _get_orange_slice(self):
-        _count_hotspots = len(self._get_files())
+        _count_hotspots = len(self.get_hotspots())
         if _count_hotspots >= 10:
             _count_orange_hotspots = 20 * _count_hotspots / 100
         else:
@@ -97,56 +170,23 @@ class Bugspots(object):
     def _get_green_slice(self):
         raise NotImplemented('Don\'t needed value. Use <list>[self._get_red_slice+self._get_orange_slice:]')
 
-    def _get_files(self):
+    def _get_scores(self, timestamps, repo_start, repo_age):
         """
-        Return a list of matching files.
-
-        :rtype: list of :py:obj:`File` objects
+        Return scores of commit dates of files.
 
-        """
-
-        if self._get_files_cache is not None:
-            return self._get_files_cache
-
-        # project_ids = set(list(self._commits.values_list('project_id', flat=True)))
-        # head_filenames = set(ProjectFile.objects.filter(
-        #     project_id__in=project_ids).values_list('full_filename', flat=True))
-        head_filenames = set(ProjectFile.objects.filter(project=self._project).values_list('full_filename', flat=True))
-
-        files = collections.defaultdict(list)
-
-        for commit in self._commits_matched.values_list('timestamp', 'files__full_filename'):
-            data = commit
-
-            commit_date, filenames = int(time.mktime(data[0].timetuple())), set(data[1:])
-
-            for filename in filter(lambda s: s in head_filenames, filenames):
-                files[filename].append(int(commit_date))
-                # print 'COMMIT: {} \t{}'.format(commit_date, filename)
-
-        self._get_files_cache = [File(name=k, commit_dates=v) for k, v in files.items()]
-        return self._get_files_cache
-
-    def _get_score(self, f, repo_start, repo_age):
-        """
-        Return the score of a given file.
-
-        :param :py:obj:`File` f: A :py:obj:`File` object.
+        :param timestamps: Array of commit timestamps.
         :param integer repo_start: Timestamp of the first matching commit.
         :param integer repo_age: Timespan of the matching commits in seconds.
 
-        :rtype: float
+        :rtype: array of floats
 
         """
-
-        def normalize_timestamp(timestamp):
-            return (timestamp - repo_start) / repo_age
-
-        return sum(1 / (1 + math.exp(-12 * normalize_timestamp(t) + 12)) for t in f.commit_dates)
+        normalized = (timestamps - repo_start) / repo_age
+        return 1 / (1 + np.exp(-12 * normalized + 12))
 
     def get_hotspots(self):
         """
-        Return the top 10% hot spots.
+        Return hot spots ordered by score.
 
         :rtype: list of :py:obj:`Hotspot` objects
 
@@ -157,20 +197,37 @@ class Bugspots(object):
 
         results = list()
 
-        commits = self._commits
+        commits = self._commits.order_by().aggregate(repo_start=models.Max('timestamp'),
+                                                     repo_end=models.Min('timestamp'))
 
-        if commits:
-            repo_start = int(time.mktime(commits.first().timestamp.timetuple()) or -1)
-            repo_end = int(time.mktime(commits.last().timestamp.timetuple()) or -1)
+        if commits['repo_start'] is not None:
+            repo_start = int(commits['repo_start'].timestamp())
+            repo_end = int(commits['repo_end'].timestamp())
 
             repo_age = repo_end - repo_start
 
             if repo_age == 0:
                 repo_age = 1
 
-            files = self._get_files()
-
-            results = sorted([Hotspot(filename=f.name, score=self._get_score(f, repo_start, repo_age)) for f in files], key=operator.attrgetter("score"), reverse=True)  # [:len(files) // 10]
+            changes = get_fix_changes(self._project, self._grep)
+            commit_ids = np.fromiter(self._commits.order_by().values_list('id', flat=True), dtype=np.int64)
+            mask = np.isin(changes['commit_ids'], commit_ids)
+
+            # Files are ordered by their newest commit to keep order of equal scores.
+            order = np.argsort(-changes['timestamps'][mask], kind='stable')
+            timestamps = changes['timestamps'][mask][order]
+            file_ids, first_index, inverse = np.unique(changes['file_ids'][mask][order],
+                                                       return_index=True, return_inverse=True)
+            scores = np.bincount(inverse, weights=self._get_scores(timestamps, repo_start, repo_age),
+                                 minlength=len(file_ids))
+
+            files = np.argsort(first_index, kind='stable')
+            files = files[np.argsort(-scores[files], kind='stable')]
+
+            filenames = dict(FileModel.objects.filter(
+                id__in=file_ids.tolist()).values_list('id', 'full_filename'))
+            results = [Hotspot(filename=filenames[file_id], score=float(score))
+                       for file_id, score in zip(file_ids[files].tolist(), scores[files].tolist())]
 
         self._get_hotspots_cache = results
 
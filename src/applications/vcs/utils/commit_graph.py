@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""
+Commit graph queries based on generation numbers.
+
+Generation of a commit is greater than generations of all its parents (roots have generation 1), so the walk
+from a commit to its ancestors can stop at the generation of the commit searched for.
+"""
+from __future__ import unicode_literals
+
+from django.db import connection
+
+from applications.vcs.models import Commit
+
+
+def update_commit_generations(commit_ids):
+    """
+    Raises generations of the commits and of their descendants after parents of the commits are added.
+
+    :param commit_ids: ids of commits with new parents
+    :return: number of updated commits
+    """
+    commit_ids = list(set(commit_ids))
+    if not commit_ids:
+        return 0
+
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            WITH RECURSIVE descendants(id) AS (
+                SELECT id FROM vcs_commit WHERE id = ANY(%(commit_ids)s)
+                UNION
+                SELECT pc.to_commit_id
+                FROM vcs_parentcommit pc
+                INNER JOIN descendants d ON pc.from_commit_id = d.id
+            )
+            SELECT c.id, c.generation, pc.from_commit_id, p.generation
+            FROM descendants d
+            INNER JOIN vcs_commit c ON c.id = d.id
+            LEFT OUTER JOIN vcs_parentcommit pc ON pc.to_commit_id = c.id
+            LEFT OUTER JOIN vcs_commit p ON p.id = pc.from_commit_id
+        """, {'commit_ids': commit_ids})
+        rows = cursor.fetchall()
+
+    generations = dict()
+    parents = dict()
+    for commit_id, generation, parent_id, parent_generation in rows:
+        generations[commit_id] = generation
+        parents.setdefault(commit_id, dict())
+        if parent_id is not None:
+            parents[commit_id][parent_id] = parent_generation
+
+    # Parents are calculated before children, parents outside of the descendants keep stored generations.
+    calculated = dict()
+    expanded = set()
+    for commit_id in generations:
+        stack = [commit_id]
+        while stack:
+            current_id = stack[-1]
+            if current_id in calculated:
+                stack.pop()
+                continue
+            pending = [parent_id for parent_id in parents[current_id]
+                       if parent_id in generations and parent_id not in calculated]
+            if pending and current_id not in expanded:
+                expanded.add(current_id)
+                stack.extend(pending)
+                continue
+            stack.pop()
+            parent_generations = [calculated.get(parent_id, parent_generation) + 1
+                                  for parent_id, parent_generation in parents[current_id].items()]
+            calculated[current_id] = max([generations[current_id]] + parent_generations)
+
+    updated_commits = [Commit(id=commit_id, generation=generation) for commit_id, generation in calculated.items()
+                       if generation != generations[commit_id]]
+    Commit.objects.bulk_update(updated_commits, ['generation'], batch_size=1000)
+    return len(updated_commits)
+
+
+def is_ancestor(ancestor, descendant):
+    """
+    Checks that `ancestor` is reachable from `descendant` through parents, a commit is an ancestor of itself.
+
+    :param ancestor: py:obj:`Commit` object
+    :param descendant: py:obj:`Commit` object
+    :return: boolean
+    """
+    if ancestor.id == descendant.id:
+        return True
+    if ancestor.generation >= descendant.generation:
+        return False
+
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            WITH RECURSIVE ancestors(id) AS (
+                SELECT id FROM vcs_commit WHERE id = %(descendant_id)s
+                UNION
+                SELECT pc.from_commit_id
+                FROM vcs_parentcommit pc
+                INNER JOIN ancestors a ON pc.to_commit_id = a.id
+                INNER JOIN vcs_commit c ON c.id = pc.from_commit_id
+                WHERE c.generation >= %(generation)s
+            )
+            SELECT EXISTS (SELECT 1 FROM ancestors WHERE id = %(ancestor_id)s)
+        """, {'descendant_id': descendant.id, 'ancestor_id': ancestor.id, 'generation': ancestor.generation})
+        return cursor.fetchone()[0]
+
+
+def get_commit_range(from_commit, to_commit):
+    """
+    Returns ids of commits reachable from `to_commit` but not from `from_commit` as `git rev-list from..to`.
+
+    Ancestors of `from_commit` are walked down to a generation only, a commit of the generation or above is
+    reachable from `from_commit` only through commits of the generation or above. The walk from `to_commit`
+    stops at commits below the generation, if some of them are not excluded the range is calculated again with
+    a lower generation, as git paints down to common ancestors. The generation is lowered by a doubled step
+    every time, so a side branch forked far below `from_commit` costs a logarithmic number of walks.
+
+    :param from_commit: py:obj:`Commit` object
+    :param to_commit: py:obj:`Commit` object
+    :return: list of commit ids
+    """
+    generation = min(from_commit.generation, to_commit.generation)
+    step = 1
+    while True:
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                WITH RECURSIVE excluded(id) AS (
+                    SELECT id FROM vcs_commit WHERE id = %(from_commit_id)s
+                    UNION
+                    SELECT pc.from_commit_id
+                    FROM vcs_parentcommit pc
+                    INNER JOIN excluded e ON pc.to_commit_id = e.id
+                    INNER JOIN vcs_commit c ON c.id = pc.from_commit_id
+                    WHERE c.generation >= %(generation)s
+                ), included(id, generation) AS (
+                    SELECT id, generation FROM vcs_commit WHERE id = %(to_commit_id)s
+                    UNION
+                    SELECT c.id, c.generation
+                    FROM vcs_parentcommit pc
+                    INNER JOIN included i ON pc.to_commit_id = i.id
+                    INNER JOIN vcs_commit c ON c.id = pc.from_commit_id
+                    WHERE i.generation >= %(generation)s AND NOT EXISTS (SELECT 1 FROM excluded e WHERE e.id = i.id)
+                )
+                SELECT i.id, i.generation
+                FROM included i
+                WHERE NOT EXISTS (SELECT 1 FROM excluded e WHERE e.id = i.id)
+            """, {'from_commit_id': from_commit.id, 'to_commit_id': to_commit.id, 'generation': generation})
+            rows = cursor.fetchall()
+
+        # Commits below the generation are not known to be excluded yet.
+        lower_generations = [commit_generation for _, commit_generation in rows if commit_generation < generation]
+        if not lower_generations:
+            return [commit_id for commit_id, _ in rows]
+        step *= 2
+        generation = max(min(min(lower_generations), generation - step), 1)
@@ -44,6 +44,7 @@ CELERY_TASK_QUEUES = (
     Queue('analyze', Exchange('analyze'), routing_key='analyze', queue_arguments={'x-max-priority': 100}),
     Queue('common', Exchange('common'), routing_key='common', queue_arguments={'x-max-priority': 100}),
     Queue('build', Exchange('build'), routing_key='build', queue_arguments={'x-max-priority': 100}),
+    Queue('import', Exchange('import'), routing_key='import', queue_arguments={'x-max-priority': 100}),
 )
 
 CELERY_TASK_ROUTES = {
@@ -76,6 +77,10 @@ CELERY_TASK_ROUTES = {
     'applications.integration.tasks.analyze_output_task': {'queue': 'analyze', 'priority': 60},
     'applications.integration.ssh_v2.tasks.output_analyse_task': {'queue': 'analyze', 'priority': 60},
     'applications.testing.tasks.add_association_for_test': {'queue': 'analyze', 'priority': 50},
+    'applications.testing.tasks.add_association_for_tests': {'queue': 'analyze', 'priority': 50},
+
+    # import
+    'applications.testing.tasks.import_test_report_task': {'queue': 'import', 'priority': 100},
 
     # common
     'applications.testing.tasks.add_caused_by_commits_task': {'queue': 'common', 'priority': 50},
@@ -83,6 +88,8 @@ CELERY_TASK_ROUTES = {
 
     # default
     'applications.testing.tasks.periodic_add_association': {'queue': 'default', 'priority': 50},
+    'applications.notification.tasks.send_immediate_notifications_task': {'queue': 'default', 'priority': 50},
+    'applications.notification.tasks.send_notification_emails_task': {'queue': 'default', 'priority': 50},
     'applications.vcs.tasks.create_area_from_folders_task': {'queue': 'default', 'priority': 50},
     'applications.api.payments.tasks.update_organization_plan_task': {'queue': 'default', 'priority': 50},
 